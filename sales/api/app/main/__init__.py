@@ -1,7 +1,8 @@
 """Application Factory."""
+import math
 import os
 
-from flask import Flask
+from flask import Flask, g, jsonify, request
 
 
 def create_app():
@@ -9,6 +10,11 @@ def create_app():
     app = Flask(__name__)
 
     register_configuration(app)
+    register_sessions(app)
+    register_shared_cache(app)
+    register_tracing(app)
+    register_admission(app)
+    register_blueprints(app)
 
     @app.route("/ping")
     def _ping():
@@ -20,3 +26,155 @@ def create_app():
 def register_configuration(app):
     """Register configuration."""
     app.config.from_object(os.getenv("APP_CONFIG"))
+
+
+def register_sessions(app):
+    """
+    Register client sessions, read from and written back to the session
+    cookie. The cookie expires with the pin of reads to the primary.
+    """
+    from app.main.helper import session
+
+    cookie = app.config["SESSION_COOKIE"]
+
+    @app.before_request
+    def _start_session():
+        g.session = session.start(request.cookies.get(cookie))
+
+    @app.after_request
+    def _save_session(response):
+        current = g.get("session")
+        if current is not None and current.changed:
+            response.set_cookie(
+                cookie,
+                current.token,
+                max_age=math.ceil(app.config["DB_REPLICA_PIN_SECONDS"]),
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
+
+    @app.teardown_request
+    def _finish_session(error):
+        current = g.pop("session", None)
+        if current is not None:
+            session.finish(current)
+
+
+def register_shared_cache(app):
+    """
+    Register sale cache in shared memory. It is created with the app,
+    so that workers forked after the app was loaded, such as gunicorn
+    workers with "--preload", share it.
+    """
+    if not app.config["SHARED_CACHE_ENABLED"]:
+        return
+    from app.main.helper.shared_cache import SharedCache
+
+    app.extensions["sale_cache"] = SharedCache(
+        slots=app.config["SHARED_CACHE_SLOTS"],
+        slot_size=app.config["SHARED_CACHE_SLOT_BYTES"],
+    )
+
+
+def register_tracing(app):
+    """
+    Register request tracing. Registered before admission control, so
+    that time spent queued for admission is part of the request.
+    """
+    if not app.config["TRACING_ENABLED"]:
+        return
+    from app.main.helper.tracing import FileExporter, Tracer
+
+    tracer = Tracer(
+        sample_rate=app.config["TRACE_SAMPLE_RATE"],
+        slow_threshold=app.config["TRACE_SLOW_REQUEST_MS"] / 1000,
+        slow_statement_threshold=app.config["TRACE_SLOW_STATEMENT_MS"] / 1000,
+        buffer_size=app.config["TRACE_BUFFER_SIZE"],
+        exporters=(
+            [FileExporter(app.config["TRACE_FILE"])]
+            if app.config["TRACE_FILE"]
+            else []
+        ),
+    )
+    app.extensions["tracer"] = tracer
+
+    @app.before_request
+    def _start_trace():
+        g.trace = tracer.start(
+            "request",
+            method=request.method,
+            path=request.path,
+            endpoint=request.endpoint,
+        )
+
+    @app.after_request
+    def _record_status(response):
+        trace = g.get("trace")
+        if trace is not None:
+            trace.attributes["status"] = response.status_code
+        return response
+
+    @app.teardown_request
+    def _finish_trace(error):
+        trace = g.pop("trace", None)
+        if trace is not None:
+            if error is not None:
+                trace.attributes["error"] = type(error).__name__
+            tracer.finish(trace)
+
+
+def register_admission(app):
+    """
+    Register admission control. Requests to endpoints without a lane,
+    such as metrics, are never queued or shed.
+    """
+    from app.main.helper.admission import (
+        AdmissionController,
+        Lane,
+        OverloadedErr,
+    )
+
+    admission = AdmissionController(
+        capacity=app.config["ADMISSION_CAPACITY"],
+        lanes=[Lane(**lane) for lane in app.config["ADMISSION_LANES"]],
+    )
+    app.extensions["admission"] = admission
+    endpoints = app.config["ADMISSION_ENDPOINTS"]
+
+    @app.before_request
+    def _admit():
+        lane = endpoints.get(request.endpoint)
+        if lane is not None:
+            admission.acquire(lane)
+            g.admission_lane = lane
+
+    @app.after_request
+    def _release_streamed(response):
+        # Streamed responses are read after the request is torn down, so
+        # their slot is held until the response is closed.
+        if response.is_streamed and "admission_lane" in g:
+            lane = g.pop("admission_lane")
+            response.call_on_close(lambda: admission.release(lane))
+        return response
+
+    @app.teardown_request
+    def _release(error):
+        lane = g.pop("admission_lane", None)
+        if lane is not None:
+            admission.release(lane)
+
+    @app.errorhandler(OverloadedErr)
+    def _overloaded(error):
+        response = jsonify({"message": "Service overloaded."})
+        response.headers["Retry-After"] = str(error.retry_after)
+        return response, 503
+
+
+def register_blueprints(app):
+    """Register blueprints."""
+    from app.main.controller.metrics_controller import metrics
+    from app.main.controller.sale_controller import sales
+
+    app.register_blueprint(metrics)
+    app.register_blueprint(sales)
@@ -1,4 +1,5 @@
 """Application configuration."""
+import json
 import os
 
 
@@ -11,6 +12,101 @@ class BaseConfig:
     DB_PASSWORD = os.getenv("DB_PASSWORD")
     DB_HOST = os.getenv("DB_HOST")
     DB_PORT = os.getenv("DB_PORT")
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+    DB_REPLICA_DSNS = [
+        dsn for dsn in os.getenv("DB_REPLICA_DSNS", "").split(",") if dsn
+    ]
+    DB_REPLICA_PIN_SECONDS = float(os.getenv("DB_REPLICA_PIN_SECONDS", "1"))
+    DB_REPLICA_RETRY_SECONDS = float(
+        os.getenv("DB_REPLICA_RETRY_SECONDS", "5")
+    )
+    # Cookie carrying the client's last write, so that its reads stay on
+    # the primary for the pin time on any worker.
+    SESSION_COOKIE = os.getenv("SESSION_COOKIE", "sales_session")
+    DB_SHARDS = json.loads(os.getenv("DB_SHARDS", "{}"))
+    OPERATION_TIMEOUTS = {
+        operation: float(os.getenv(f"TIMEOUT_{operation.upper()}", default))
+        for operation, default in (
+            ("find_by_id", "0.5"),
+            ("create", "1"),
+            ("delete_by_id", "1"),
+            ("update", "1"),
+            ("find", "2"),
+            ("find_version", "1"),
+            ("count", "2"),
+            ("search", "2"),
+            ("execute_batch", "5"),
+            ("upsert", "5"),
+        )
+    }
+    # Every admitted request needs a connection to itself, so no more
+    # are admitted than there are connections to the primary and replicas.
+    ADMISSION_CAPACITY = int(
+        os.getenv(
+            "ADMISSION_CAPACITY",
+            str(DB_POOL_SIZE * (1 + len(DB_REPLICA_DSNS))),
+        )
+    )
+    ADMISSION_LANES = [
+        {
+            "name": "cheap",
+            "queue_size": int(os.getenv("ADMISSION_CHEAP_QUEUE", "64")),
+            "max_wait": float(os.getenv("ADMISSION_CHEAP_WAIT", "0.25")),
+        },
+        {
+            "name": "expensive",
+            "queue_size": int(os.getenv("ADMISSION_EXPENSIVE_QUEUE", "8")),
+            "max_wait": float(os.getenv("ADMISSION_EXPENSIVE_WAIT", "1")),
+        },
+    ]
+    ADMISSION_ENDPOINTS = {
+        "sales.find_by_id": "cheap",
+        "sales.find": "expensive",
+        "sales.count": "expensive",
+        "sales.search": "expensive",
+        "sales.stream": "expensive",
+        "sales.batch": "expensive",
+        "sales.upsert": "expensive",
+    }
+    COALESCE_READS = os.getenv("COALESCE_READS", "true").lower() == "true"
+    ID_FILTER_ENABLED = (
+        os.getenv("ID_FILTER_ENABLED", "false").lower() == "true"
+    )
+    ID_FILTER_FP_RATE = float(os.getenv("ID_FILTER_FP_RATE", "0.01"))
+    ID_FILTER_MEMORY_BYTES = int(
+        os.getenv("ID_FILTER_MEMORY_BYTES", str(8 * 1024 * 1024))
+    )
+    ID_FILTER_REBUILD_SECONDS = float(
+        os.getenv("ID_FILTER_REBUILD_SECONDS", "300")
+    )
+    FEED_CACHE_SIZE = int(os.getenv("FEED_CACHE_SIZE", "100"))
+    FEED_CACHE_TTL = float(os.getenv("FEED_CACHE_TTL", "1"))
+    COUNT_CACHE_TTL = float(os.getenv("COUNT_CACHE_TTL", "5"))
+    STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "1000"))
+    # Sales written by other hosts are only seen once cached ones expire,
+    # so the shared cache is only enabled where that staleness is fine.
+    SHARED_CACHE_ENABLED = (
+        os.getenv("SHARED_CACHE_ENABLED", "false").lower() == "true"
+    )
+    SHARED_CACHE_SLOTS = int(os.getenv("SHARED_CACHE_SLOTS", "32768"))
+    SHARED_CACHE_SLOT_BYTES = int(os.getenv("SHARED_CACHE_SLOT_BYTES", "256"))
+    SHARED_CACHE_TTL = float(os.getenv("SHARED_CACHE_TTL", "30"))
+    TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+    TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+    TRACE_SLOW_REQUEST_MS = float(os.getenv("TRACE_SLOW_REQUEST_MS", "500"))
+    TRACE_SLOW_STATEMENT_MS = float(
+        os.getenv("TRACE_SLOW_STATEMENT_MS", "100")
+    )
+    TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "1000"))
+    TRACE_FILE = os.getenv("TRACE_FILE")
+    ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "true").lower() == "true"
+    ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "365"))
+    ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "5000"))
+    ARCHIVE_HORIZON_SECONDS = float(os.getenv("ARCHIVE_HORIZON_SECONDS", "30"))
+    PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+    PARTITION_RETENTION_MONTHS = int(
+        os.getenv("PARTITION_RETENTION_MONTHS", "24")
+    )
 
 
 class DevelopmentConfig(BaseConfig):
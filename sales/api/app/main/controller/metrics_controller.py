@@ -0,0 +1,27 @@
+"""Metrics controller."""
+from flask import Blueprint, current_app, jsonify
+
+metrics = Blueprint("metrics", __name__)
+
+
+@metrics.route("/metrics", methods=["GET"])
+def get_metrics():
+    """
+    Get admission queue depths and shed counts, and cache hit rates once
+    the sale service is in use.
+    """
+    result = {"admission": current_app.extensions["admission"].metrics()}
+    tracer = current_app.extensions.get("tracer")
+    if tracer is not None:
+        result["tracing"] = tracer.metrics()
+    service = current_app.extensions.get("sale_service")
+    if service is not None:
+        result.update(service.metrics())
+    return jsonify(result)
+
+
+@metrics.route("/traces", methods=["GET"])
+def get_traces():
+    """Get recent sampled and slow traces, oldest first."""
+    tracer = current_app.extensions.get("tracer")
+    return jsonify(tracer.traces() if tracer is not None else [])
@@ -0,0 +1,361 @@
+"""Sale controller."""
+from datetime import datetime, timezone
+
+from flask import Blueprint, Response, current_app, jsonify, request
+
+from app.main import service as srv
+from app.main import provider
+from app.main.service import utils
+
+sales = Blueprint("sales", __name__)
+
+FILTER_ARGS = ("sku", "order_id")
+
+SALE_ARGS = (
+    "date_time",
+    "order_id",
+    "sku",
+    "quantity",
+    "subtotal",
+    "fee",
+    "tax",
+)
+
+
+@sales.route("/sales/<id>", methods=["GET"])
+def find_by_id(id):
+    """
+    Get single sale. Given "fields", only those and "id" are returned,
+    and "updated_at" is read as well to validate cached copies.
+    """
+    fields = request_fields()
+    sale = provider.get_sale_service().find_by_id(
+        id, None if fields is None else fields + ["updated_at"]
+    )
+    version = srv.VersionModel(
+        etag=utils.generate_etag(sale.id, sale.updated_at, *fields or ()),
+        last_modified=sale.updated_at,
+    )
+    if not_modified(version):
+        return not_modified_response(version)
+    return with_version(jsonify(sale.to_json_dict(fields)), version)
+
+
+@sales.route("/sales", methods=["GET"])
+def find():
+    """
+    Get page of sales before or after sale with id. Serializing the
+    page is skipped when the client already holds its current version.
+    The entity tag of a page read is computed from the page itself, so
+    it never describes a newer page than the one returned.
+    """
+    id = request.args.get("id")
+    if id is None:
+        raise srv.InvalidArgsErr()
+    limit = request.args.get("limit", 10, type=int)
+    after = request.args.get("after", "true").lower() != "false"
+    filters = request_filters()
+    fields = request_fields()
+    service = provider.get_sale_service()
+    version = page_version(
+        service.find_version(id, limit, after, filters), fields
+    )
+    if not_modified(version):
+        return not_modified_response(version)
+    results, version = service.find_with_version(
+        id, limit, after, filters, fields
+    )
+    return with_version(
+        jsonify([s.to_json_dict(fields) for s in results]),
+        page_version(version, fields),
+    )
+
+
+@sales.route("/sales:count", methods=["GET"])
+def count():
+    """Count sales matching filters, estimated unless exact requested."""
+    exact = request.args.get("exact", "false").lower() == "true"
+    result = provider.get_sale_service().count(request_filters(), exact)
+    return jsonify({"count": result, "exact": exact})
+
+
+@sales.route("/sales:search", methods=["GET"])
+def search():
+    """Search sales by partial sku or order id."""
+    query = request.args.get("q", "")
+    fields = tuple(request.args.get("fields", "sku,order_id").split(","))
+    limit = request.args.get("limit", 10, type=int)
+    cursor = request.args.get("cursor")
+    page = provider.get_sale_service().search(query, fields, limit, cursor)
+    return jsonify(
+        {
+            "sales": [s.to_json_dict() for s in page.sales],
+            "cursor": page.cursor,
+        }
+    )
+
+
+@sales.route("/sales:stream", methods=["GET"])
+def stream():
+    """
+    Stream all sales matching filters, newest first, as newline
+    delimited JSON. Sales are flushed every "STREAM_BATCH_SIZE" of them,
+    so the first arrive before the rest are read and memory stays flat.
+    Once the client disconnects, reading stops and its connection is
+    closed.
+    """
+    batch_size = current_app.config["STREAM_BATCH_SIZE"]
+    fields = request_fields()
+    sales = provider.get_sale_service().stream(
+        request_filters(), fields, batch_size
+    )
+    return Response(
+        ndjson_chunks(sales, fields, batch_size, current_app.json.dumps),
+        mimetype="application/x-ndjson",
+    )
+
+
+@sales.route("/sales:batch", methods=["POST"])
+def batch():
+    """
+    Create, update and delete sales in one transaction. Unless "atomic"
+    is false, no operation is applied when any of them fails.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(
+        body.get("operations"), list
+    ):
+        raise srv.InvalidArgsErr()
+    operations = [request_operation(o) for o in body["operations"]]
+    atomic = body.get("atomic", True) is not False
+    results = provider.get_sale_service().execute_batch(operations, atomic)
+    return jsonify({"results": [operation_result(r) for r in results]})
+
+
+@sales.route("/sales:upsert", methods=["POST"])
+def upsert():
+    """
+    Create sales, or update those with the same order id, sku and date
+    and time, in one transaction. Sales that would not change are left
+    as they are, so delivering the same sales again is harmless.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get("sales"), list):
+        raise srv.InvalidArgsErr()
+    result = provider.get_sale_service().upsert(
+        [request_sale(s) for s in body["sales"]]
+    )
+    return jsonify(result.to_json_dict())
+
+
+@sales.errorhandler(srv.ResourceNotFoundErr)
+def _resource_not_found(error):
+    return jsonify({"message": "Resource not found."}), 404
+
+
+@sales.errorhandler(srv.ResourceConflictErr)
+def _resource_conflict(error):
+    return jsonify({"message": "Resource was modified."}), 409
+
+
+@sales.errorhandler(srv.ResourceArchivedErr)
+def _resource_archived(error):
+    return jsonify({"message": "Resource is archived."}), 409
+
+
+@sales.errorhandler(srv.ResourceFieldDuplicateErr)
+def _duplicate_field(error):
+    return (
+        jsonify({"message": "Resource already exists.", "field": error.field}),
+        409,
+    )
+
+
+@sales.errorhandler(srv.ResourceFieldsInvalidErr)
+def _invalid_fields(error):
+    return jsonify({"message": "Invalid fields.", "errors": error.errors}), 400
+
+
+@sales.errorhandler(srv.InvalidArgsErr)
+def _invalid_args(error):
+    return jsonify({"message": "Invalid arguments."}), 400
+
+
+@sales.errorhandler(srv.TimeoutErr)
+def _timeout(error):
+    return jsonify({"message": "Request timed out."}), 504
+
+
+@sales.errorhandler(srv.ServiceErr)
+def _service_error(error):
+    return jsonify({"message": "Internal server error."}), 500
+
+
+def request_filters():
+    """Extract sale filters from query string."""
+    filters = {f: request.args[f] for f in FILTER_ARGS if f in request.args}
+    start = request.args.get("date_time_from")
+    end = request.args.get("date_time_to")
+    if start is not None or end is not None:
+        try:
+            filters["date_time"] = (
+                parse_datetime(start) if start else None,
+                parse_datetime(end) if end else None,
+            )
+        except ValueError:
+            raise srv.InvalidArgsErr()
+    return filters
+
+
+def request_fields():
+    """
+    Extract fields to return from query string, sorted so that the
+    same projection always has the same entity tag.
+    """
+    if "fields" not in request.args:
+        return None
+    return sorted({f for f in request.args["fields"].split(",") if f})
+
+
+def request_operation(data) -> srv.OperationModel:
+    """
+    Parse batch operation. Creates and updates carry sale fields, and
+    updates change only the fields given.
+    """
+    if not isinstance(data, dict):
+        raise srv.InvalidArgsErr()
+    kind = data.get("op")
+    if kind == "delete":
+        return srv.OperationModel(kind, srv.SaleModel(id=data.get("id")))
+    values = data.get("sale")
+    if kind not in ("create", "update"):
+        raise srv.InvalidArgsErr()
+    sale = request_sale(values, data.get("id"))
+    fields = list(values) if kind == "update" else None
+    return srv.OperationModel(kind, sale, fields)
+
+
+def request_sale(values, id=None) -> srv.SaleModel:
+    """Parse sale fields, with date and time in ISO format."""
+    if not isinstance(values, dict) or not set(values) <= set(SALE_ARGS):
+        raise srv.InvalidArgsErr()
+    sale = srv.SaleModel(id=id, **values)
+    if isinstance(sale.date_time, str):
+        try:
+            sale.date_time = parse_datetime(sale.date_time)
+        except ValueError:
+            raise srv.InvalidArgsErr()
+    return sale
+
+
+def parse_datetime(value: str) -> datetime:
+    """
+    Parse date and time in ISO format. Sales are kept in UTC without a
+    time zone, so times given with one are converted to UTC without it.
+    """
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def operation_result(result: srv.OperationResultModel) -> dict:
+    """
+    Convert batch operation result to JSON serializable dict, with the
+    status the operation would have had as a request of its own.
+    """
+    error = result.error
+    if result.applied:
+        if result.sale is None:
+            return {"status": 204}
+        return {"status": 201, "sale": result.sale.to_json_dict()}
+    if error is None:
+        return {"status": 424, "message": "Batch rolled back."}
+    if isinstance(error, srv.ResourceNotFoundErr):
+        return {"status": 404, "message": "Resource not found."}
+    if isinstance(error, srv.ResourceConflictErr):
+        return {"status": 409, "message": "Resource was modified."}
+    if isinstance(error, srv.ResourceArchivedErr):
+        return {"status": 409, "message": "Resource is archived."}
+    if isinstance(error, srv.ResourceFieldNullErr):
+        return {
+            "status": 400,
+            "message": "Field cannot be null.",
+            "field": error.field,
+        }
+    if isinstance(error, srv.ResourceFieldDuplicateErr):
+        return {
+            "status": 409,
+            "message": "Resource already exists.",
+            "field": error.field,
+        }
+    if isinstance(error, srv.ResourceFieldsInvalidErr):
+        return {
+            "status": 400,
+            "message": "Invalid fields.",
+            "errors": error.errors,
+        }
+    if isinstance(error, srv.InvalidArgsErr):
+        return {"status": 400, "message": "Invalid arguments."}
+    return {"status": 500, "message": "Internal server error."}
+
+
+def ndjson_chunks(sales, fields, batch_size, dumps):
+    """
+    Chunks of newline delimited JSON sales, batch_size sales each. A
+    stream failing midway ends with an error message in place of a sale.
+    """
+    lines = []
+    try:
+        for sale in sales:
+            lines.append(dumps(sale.to_json_dict(fields)))
+            if len(lines) == batch_size:
+                yield "\n".join(lines) + "\n"
+                lines = []
+    except srv.TimeoutErr:
+        lines.append(dumps({"message": "Request timed out."}))
+    except srv.ServiceErr:
+        lines.append(dumps({"message": "Internal server error."}))
+    finally:
+        sales.close()
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def page_version(version: srv.VersionModel, fields=None) -> srv.VersionModel:
+    """
+    Validators of page of sales, with an entity tag of its own for each
+    projection. Deleting a sale from a page leaves the newest update
+    time of the page as it was, so pages are validated by entity tag
+    alone, and "Last-Modified" is not sent.
+    """
+    if fields is not None:
+        version.etag = utils.generate_etag(version.etag, *fields)
+    version.last_modified = None
+    return version
+
+
+def not_modified(version: srv.VersionModel) -> bool:
+    """Check conditional request headers against resource version."""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(version.etag)
+    since = request.if_modified_since
+    if since is None or version.last_modified is None:
+        return False
+    last_modified = version.last_modified.replace(microsecond=0)
+    if last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+    return last_modified <= since
+
+
+def not_modified_response(version: srv.VersionModel) -> Response:
+    """Build "304 Not Modified" response."""
+    return with_version(Response(status=304), version)
+
+
+def with_version(response: Response, version: srv.VersionModel) -> Response:
+    """Add validator headers to response."""
+    response.set_etag(version.etag)
+    if version.last_modified is not None:
+        response.last_modified = version.last_modified
+    return response
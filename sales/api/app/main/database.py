@@ -1,9 +1,10 @@
 """Database."""
-import psycopg2
 
 
 def get_connection(config):
     """Set up and return database connection."""
+    import psycopg2
+
     DB_NAME = "DB_NAME" if not config["TESTING"] else "DB_NAME_TEST"
     return psycopg2.connect(
         dbname=config[DB_NAME],
@@ -12,3 +13,17 @@ def get_connection(config):
         host=config["DB_HOST"],
         port=config["DB_PORT"],
     )
+
+
+def get_dsn_connection(dsn):
+    """Set up and return database connection from connection string."""
+    import psycopg2
+
+    return psycopg2.connect(dsn)
+
+
+def get_replica_connection(dsn):
+    """Set up and return read replica connection."""
+    conn = get_dsn_connection(dsn)
+    conn.set_session(readonly=True)
+    return conn
@@ -0,0 +1,108 @@
+"""Admission control for concurrent requests."""
+import math
+import threading
+from typing import Any, Dict, Sequence
+
+
+class OverloadedErr(Exception):
+    """Request shed to keep latency of admitted requests predictable."""
+
+    def __init__(self, lane: str, retry_after: int):
+        self.lane = lane
+        self.retry_after = retry_after
+
+
+class Lane:
+    """Priority lane with its own bounded wait queue."""
+
+    def __init__(self, name: str, queue_size: int, max_wait: float):
+        self.name = name
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = 0
+
+
+class AdmissionController:
+    """
+    Limit concurrent requests to capacity. Requests over capacity wait
+    in their lane's queue, and lanes listed first are admitted first. A
+    request is shed once its lane's queue is full or its wait times out.
+    """
+
+    def __init__(self, capacity: int, lanes: Sequence[Lane]):
+        if capacity < 1:
+            raise ValueError('"capacity" argument must be positive.')
+        self._capacity = capacity
+        self._lanes = {lane.name: lane for lane in lanes}
+        self._priority = list(lanes)
+        self._active = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, name: str) -> None:
+        """Admit request to lane, waiting for a free slot if needed."""
+        lane = self._lanes[name]
+        with self._cond:
+            if lane.waiting == 0 and self._admissible(lane):
+                self._admit(lane)
+                return
+            if lane.waiting >= lane.queue_size:
+                self._shed(lane)
+            lane.waiting += 1
+            try:
+                admitted = self._cond.wait_for(
+                    lambda: self._admissible(lane), lane.max_wait
+                )
+            finally:
+                lane.waiting -= 1
+                # Lanes behind this one may be admissible now.
+                self._cond.notify_all()
+            if not admitted:
+                self._shed(lane)
+            self._admit(lane)
+
+    def release(self, name: str) -> None:
+        """Free slot taken by request admitted to lane."""
+        lane = self._lanes[name]
+        with self._cond:
+            lane.active -= 1
+            self._active -= 1
+            self._cond.notify_all()
+
+    def metrics(self) -> Dict[str, Any]:
+        """Snapshot of active, queued, admitted and shed requests."""
+        with self._cond:
+            return {
+                "capacity": self._capacity,
+                "active": self._active,
+                "lanes": {
+                    lane.name: {
+                        "active": lane.active,
+                        "queued": lane.waiting,
+                        "admitted": lane.admitted,
+                        "shed": lane.shed,
+                    }
+                    for lane in self._priority
+                },
+            }
+
+    def _admissible(self, lane):
+        if self._active >= self._capacity:
+            return False
+        for other in self._priority:
+            if other is lane:
+                return True
+            if other.waiting:
+                return False
+        return True
+
+    def _admit(self, lane):
+        lane.active += 1
+        lane.admitted += 1
+        self._active += 1
+
+    def _shed(self, lane):
+        lane.shed += 1
+        raise OverloadedErr(lane.name, max(math.ceil(lane.max_wait), 1))
@@ -0,0 +1,105 @@
+"""Cuckoo filter."""
+import hashlib
+import math
+import random
+from array import array
+
+BUCKET_SIZE = 4
+
+MAX_KICKS = 500
+
+
+class CuckooFilter:
+    """
+    Set membership test over strings, with false positives at about
+    fp_rate and no false negatives, that supports removing added items.
+    Once an insert fails the filter is saturated and reports every item
+    as present, so it never gives a false negative.
+    """
+
+    def __init__(self, memory_bytes: int, fp_rate: float = 0.01, seed=0):
+        bits = max(math.ceil(math.log2(2 * BUCKET_SIZE / fp_rate)), 1)
+        if bits > 16:
+            raise ValueError('"fp_rate" argument is too small.')
+        typecode = "B" if bits <= 8 else "H"
+        bucket_bytes = BUCKET_SIZE * array(typecode).itemsize
+        if memory_bytes < bucket_bytes:
+            raise ValueError('"memory_bytes" argument is too small.')
+        buckets = 1
+        while buckets * 2 * bucket_bytes <= memory_bytes:
+            buckets *= 2
+        self._mask = buckets - 1
+        self._fingerprint_mask = (1 << bits) - 1
+        self._slots = array(typecode, bytes(buckets * bucket_bytes))
+        self._random = random.Random(seed)
+        self.capacity = buckets * BUCKET_SIZE
+        self.memory_bytes = buckets * bucket_bytes
+        self.count = 0
+        self.saturated = False
+
+    def add(self, item: str) -> bool:
+        """Add item, returning False when the filter is saturated."""
+        if self.saturated:
+            return False
+        fingerprint, first, second = self._locate(item)
+        if self._insert(first, fingerprint) or self._insert(
+            second, fingerprint
+        ):
+            self.count += 1
+            return True
+        index = self._random.choice((first, second))
+        for _ in range(MAX_KICKS):
+            slot = index * BUCKET_SIZE + self._random.randrange(BUCKET_SIZE)
+            fingerprint, self._slots[slot] = self._slots[slot], fingerprint
+            index = self._alternate(index, fingerprint)
+            if self._insert(index, fingerprint):
+                self.count += 1
+                return True
+        # The fingerprint kicked out last is lost.
+        self.saturated = True
+        return False
+
+    def remove(self, item: str) -> bool:
+        """Remove item, which must have been added."""
+        fingerprint, first, second = self._locate(item)
+        for index in (first, second):
+            start = index * BUCKET_SIZE
+            for slot in range(start, start + BUCKET_SIZE):
+                if self._slots[slot] == fingerprint:
+                    self._slots[slot] = 0
+                    self.count -= 1
+                    return True
+        return False
+
+    def __contains__(self, item: str) -> bool:
+        if self.saturated:
+            return True
+        fingerprint, first, second = self._locate(item)
+        return self._find(first, fingerprint) or self._find(
+            second, fingerprint
+        )
+
+    def _locate(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=8).digest()
+        value = int.from_bytes(digest, "big")
+        fingerprint = (value >> 32) & self._fingerprint_mask or 1
+        first = value & self._mask
+        return fingerprint, first, self._alternate(first, fingerprint)
+
+    def _alternate(self, index, fingerprint):
+        return (index ^ (fingerprint * 0x5BD1E995)) & self._mask
+
+    def _insert(self, index, fingerprint):
+        start = index * BUCKET_SIZE
+        for slot in range(start, start + BUCKET_SIZE):
+            if self._slots[slot] == 0:
+                self._slots[slot] = fingerprint
+                return True
+        return False
+
+    def _find(self, index, fingerprint):
+        start = index * BUCKET_SIZE
+        for slot in range(start, start + BUCKET_SIZE):
+            if self._slots[slot] == fingerprint:
+                return True
+        return False
@@ -0,0 +1,35 @@
+"""Deadlines propagated through the call stack."""
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+
+@contextmanager
+def budget(timeout: Optional[float]):
+    """
+    Run block with a deadline of timeout seconds from now, unless the
+    enclosing deadline is earlier. No timeout keeps enclosing deadline.
+    """
+    if timeout is None:
+        yield
+        return
+    deadline = time.monotonic() + timeout
+    current = _deadline.get()
+    if current is not None and current < deadline:
+        deadline = current
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left until current deadline, None without deadline."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
@@ -0,0 +1,65 @@
+"""Client sessions carried from request to request in a token."""
+import contextvars
+from typing import Optional
+
+_session = contextvars.ContextVar("session", default=None)
+
+
+class Session:
+    """
+    State of a client kept in a token it sends back with each request,
+    so that any worker serving the client knows when it last wrote. The
+    token is the wall clock time of its last write, in seconds.
+    """
+
+    def __init__(self, token: Optional[str] = None):
+        self.last_write = _parse(token)
+        self.changed = False
+        self.context = None
+
+    @property
+    def token(self) -> Optional[str]:
+        """Token of session, None until the client wrote."""
+        if self.last_write is None:
+            return None
+        return f"{self.last_write:.6f}"
+
+    def wrote(self, at: float) -> None:
+        """Record write of client at time."""
+        if self.last_write is None or at > self.last_write:
+            self.last_write = at
+        self.changed = True
+
+
+def start(token: Optional[str] = None) -> Session:
+    """Start session from token, which becomes the current session."""
+    session = Session(token)
+    session.context = _session.set(session)
+    return session
+
+
+def finish(session: Session) -> None:
+    """End session started with start."""
+    _session.reset(session.context)
+
+
+def current() -> Session:
+    """
+    Current session. Outside a started session, such as in commands, a
+    session is started for the current context and kept with it.
+    """
+    session = _session.get()
+    if session is None:
+        session = Session()
+        _session.set(session)
+    return session
+
+
+def _parse(token: Optional[str]) -> Optional[float]:
+    """Time of last write in token, None for missing or invalid ones."""
+    if not token:
+        return None
+    try:
+        return float(token)
+    except ValueError:
+        return None
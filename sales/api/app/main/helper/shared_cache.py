@@ -0,0 +1,224 @@
+"""Cache in shared memory across forked processes."""
+import hashlib
+import mmap
+import multiprocessing
+import struct
+import time
+from typing import Any, Callable, Dict, Optional
+
+WAYS = 8
+
+# Sequence number, key hash, expiry, key length and value length of a
+# slot. Odd sequence numbers mark slots being written.
+_HEADER = struct.Struct("<IQdHH")
+
+_SEQUENCE = struct.Struct("<I")
+
+READ_RETRIES = 4
+
+
+class SharedCache:
+    """
+    Fixed-size cache of byte strings in an anonymous shared memory map.
+    The map and its locks are created up front, so processes forked
+    afterwards share the same entries.
+
+    Keys hash to a set of slots, in which entries are placed and evicted
+    by the clock algorithm: hits set a reference bit, and eviction
+    passes over referenced slots, clearing their bit, until it finds an
+    unreferenced one. Writes take the lock of the set's stripe. Reads
+    take no lock: each slot has a sequence number that writers make odd
+    while writing, and readers retry, then miss, when it was odd or
+    changed while they copied the slot.
+    """
+
+    def __init__(
+        self,
+        slots: int,
+        slot_size: int = 256,
+        stripes: int = 64,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if slot_size <= _HEADER.size:
+            raise ValueError('"slot_size" argument is too small.')
+        sets = 1
+        while sets * 2 * WAYS <= slots:
+            sets *= 2
+        self._sets = sets
+        self._slot_size = slot_size
+        self._capacity = slot_size - _HEADER.size
+        # Reference bits and set clock hands, followed by the slots.
+        self._hands = sets * WAYS
+        self._offset = self._hands + sets
+        self.slots = sets * WAYS
+        self.memory_bytes = self._offset + self.slots * slot_size
+        self._map = mmap.mmap(-1, self.memory_bytes)
+        self._locks = [
+            multiprocessing.Lock() for _ in range(min(stripes, sets))
+        ]
+        self._clock = clock
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._rejected = 0
+
+    def get(self, key: bytes) -> Optional[bytes]:
+        """Get value of key, or None when it is missing or expired."""
+        digest = _hash(key)
+        first = (digest & (self._sets - 1)) * WAYS
+        for slot in range(first, first + WAYS):
+            value = self._read(slot, digest, key)
+            if value is not None:
+                self._map[slot] = 1
+                self._hits += 1
+                return value
+        self._misses += 1
+        return None
+
+    def put(self, key: bytes, value: bytes, ttl: float) -> bool:
+        """Set value of key, returning False when it does not fit."""
+        return self._write(key, value, ttl, replace=True)
+
+    def add(self, key: bytes, value: bytes, ttl: float) -> bool:
+        """
+        Set value of key unless it has a live value, returning whether
+        it was set.
+        """
+        return self._write(key, value, ttl, replace=False)
+
+    def delete(self, key: bytes) -> None:
+        """Remove key."""
+        digest = _hash(key)
+        index = digest & (self._sets - 1)
+        with self._locks[index % len(self._locks)]:
+            slot = self._find(index * WAYS, digest, key)
+            if slot is not None:
+                self._store(slot, 0, 0.0, b"", b"")
+
+    def clear(self) -> None:
+        """Remove all keys."""
+        for index in range(self._sets):
+            with self._locks[index % len(self._locks)]:
+                for slot in range(index * WAYS, (index + 1) * WAYS):
+                    self._store(slot, 0, 0.0, b"", b"")
+
+    def metrics(self) -> Dict[str, Any]:
+        """Size of cache, and hits and misses of this process."""
+        lookups = self._hits + self._misses
+        return {
+            "slots": self.slots,
+            "memory_bytes": self.memory_bytes,
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": self._hits / lookups if lookups else 0.0,
+            "evictions": self._evictions,
+            "rejected": self._rejected,
+        }
+
+    def _write(self, key, value, ttl, replace):
+        if len(key) + len(value) > self._capacity:
+            self._rejected += 1
+            return False
+        digest = _hash(key)
+        index = digest & (self._sets - 1)
+        first = index * WAYS
+        with self._locks[index % len(self._locks)]:
+            slot = self._find(first, digest, key)
+            if slot is not None and not replace:
+                _, _, expires, _, _ = _HEADER.unpack_from(
+                    self._map, self._slot_offset(slot)
+                )
+                if expires > self._clock():
+                    return False
+            if slot is None:
+                slot = self._victim(index)
+            self._store(slot, digest, self._clock() + ttl, key, value)
+            self._map[slot] = 0
+        return True
+
+    def _find(self, first, digest, key):
+        """Slot of set holding key, called with the set's lock held."""
+        for slot in range(first, first + WAYS):
+            offset = self._slot_offset(slot)
+            _, slot_digest, _, key_size, _ = _HEADER.unpack_from(
+                self._map, offset
+            )
+            start = offset + _HEADER.size
+            end = start + key_size
+            if slot_digest == digest and self._map[start:end] == key:
+                return slot
+        return None
+
+    def _victim(self, index):
+        """Slot of set to replace, advancing the set's clock hand."""
+        first = index * WAYS
+        now = self._clock()
+        for slot in range(first, first + WAYS):
+            _, digest, expires, _, _ = _HEADER.unpack_from(
+                self._map, self._slot_offset(slot)
+            )
+            if not digest or expires <= now:
+                return slot
+        hand = self._map[self._hands + index]
+        while True:
+            slot = first + hand
+            hand = (hand + 1) % WAYS
+            if self._map[slot]:
+                self._map[slot] = 0
+                continue
+            self._map[self._hands + index] = hand
+            self._evictions += 1
+            return slot
+
+    def _store(self, slot, digest, expires, key, value):
+        offset = self._slot_offset(slot)
+        (sequence,) = _SEQUENCE.unpack_from(self._map, offset)
+        _SEQUENCE.pack_into(self._map, offset, (sequence + 1) & 0xFFFFFFFF)
+        _HEADER.pack_into(
+            self._map,
+            offset,
+            (sequence + 1) & 0xFFFFFFFF,
+            digest,
+            expires,
+            len(key),
+            len(value),
+        )
+        start = offset + _HEADER.size
+        end = start + len(key) + len(value)
+        self._map[start:end] = key + value
+        _SEQUENCE.pack_into(self._map, offset, (sequence + 2) & 0xFFFFFFFF)
+
+    def _read(self, slot, digest, key):
+        offset = self._slot_offset(slot)
+        start = offset + _HEADER.size
+        for _ in range(READ_RETRIES):
+            (
+                sequence,
+                slot_digest,
+                expires,
+                key_size,
+                value_size,
+            ) = _HEADER.unpack_from(self._map, offset)
+            if sequence & 1:
+                continue
+            if slot_digest != digest:
+                return None
+            end = start + key_size + value_size
+            data = self._map[start:end]
+            if _SEQUENCE.unpack_from(self._map, offset)[0] != sequence:
+                continue
+            if data[:key_size] != key or expires <= self._clock():
+                return None
+            return data[key_size:]
+        return None
+
+    def _slot_offset(self, slot):
+        return self._offset + slot * self._slot_size
+
+
+def _hash(key):
+    """Hash of key, the same in every process, never 0."""
+    digest = int.from_bytes(
+        hashlib.blake2b(key, digest_size=8).digest(), "little"
+    )
+    return digest or 1
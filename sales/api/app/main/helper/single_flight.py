@@ -0,0 +1,104 @@
+"""Coalescing of concurrent identical calls."""
+import asyncio
+import contextvars
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+from app.main import repository as repo
+from app.main.helper import deadline
+
+
+class _Call:
+    """Call in flight, shared by callers with the same key."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+    def result(self):
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class SingleFlight:
+    """
+    Share one in-flight call, and its result or exception, between
+    concurrent callers asking for the same key. Threads wait for the
+    call to finish, asyncio tasks await it without blocking their loop,
+    until their own deadline. Results are not kept once the call
+    finishes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._futures = {}
+        self._calls_count = 0
+        self._coalesced = 0
+
+    def do(self, key: Hashable, fn: Callable, *args) -> Any:
+        """Call fn with args, unless a call for key is in flight."""
+        with self._lock:
+            self._calls_count += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self._coalesced += 1
+        if not leader:
+            if not call.done.wait(deadline.remaining()):
+                raise repo.TimeoutErr()
+            return call.result()
+        try:
+            call.value = fn(*args)
+        except Exception as error:
+            call.error = error
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result()
+
+    async def do_async(self, key: Hashable, fn: Callable, *args) -> Any:
+        """
+        Call blocking fn with args in the loop's default executor, unless
+        a call for key is in flight, for this loop or for other threads.
+        The call runs in a copy of the caller's context, so that it keeps
+        the caller's deadline, trace and session.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            future = self._futures.get((loop, key))
+            if future is None:
+                context = contextvars.copy_context()
+                future = loop.run_in_executor(
+                    None, context.run, self.do, key, fn, *args
+                )
+                self._futures[(loop, key)] = future
+                future.add_done_callback(
+                    lambda _: self._forget(loop, key, future)
+                )
+            else:
+                self._calls_count += 1
+                self._coalesced += 1
+        # Cancelling one caller, or its deadline passing, must not cancel
+        # the call shared by others.
+        try:
+            return await asyncio.wait_for(
+                asyncio.shield(future), deadline.remaining()
+            )
+        except asyncio.TimeoutError:
+            raise repo.TimeoutErr()
+
+    def metrics(self) -> Dict[str, int]:
+        """Number of calls, and of calls that shared another's result."""
+        with self._lock:
+            return {"calls": self._calls_count, "coalesced": self._coalesced}
+
+    def _forget(self, loop, key, future):
+        with self._lock:
+            if self._futures.get((loop, key)) is future:
+                del self._futures[(loop, key)]
@@ -0,0 +1,206 @@
+"""Lightweight in-process tracing."""
+import collections
+import contextvars
+import functools
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+STATEMENT_SPAN = "sql"
+
+_span = contextvars.ContextVar("span", default=None)
+
+
+class Span:
+    """Timed operation of a trace, with the operations it made."""
+
+    __slots__ = ("name", "attributes", "start", "end", "children", "token")
+
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self.name = name
+        self.attributes = attributes
+        self.start = time.perf_counter()
+        self.end = None
+        self.children = []
+        self.token = None
+
+    @property
+    def duration(self) -> float:
+        """Seconds from start until end, or until now while running."""
+        end = self.end if self.end is not None else time.perf_counter()
+        return end - self.start
+
+    def walk(self) -> Iterator["Span"]:
+        """Iterate over span and all of its descendants."""
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+    def to_json_dict(self, origin: Optional[float] = None):
+        """
+        Convert to JSON serializable dict, with times in milliseconds
+        from origin. Self time is the time not spent in child spans.
+        """
+        origin = self.start if origin is None else origin
+        children = [c.to_json_dict(origin) for c in self.children]
+        duration = self.duration * 1000
+        return {
+            "name": self.name,
+            "attributes": self.attributes,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round(duration, 3),
+            "self_ms": round(
+                duration - sum(c["duration_ms"] for c in children), 3
+            ),
+            "children": children,
+        }
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Record block as child of current span. Outside a trace nothing is
+    recorded and None is yielded.
+    """
+    parent = _span.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(name, attributes)
+    parent.children.append(child)
+    token = _span.set(child)
+    try:
+        yield child
+    finally:
+        child.end = time.perf_counter()
+        _span.reset(token)
+
+
+def traced(name: str) -> Callable:
+    """Decorate function to record its calls as spans."""
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class FileExporter:
+    """Append traces to a JSON lines file."""
+
+    def __init__(self, path: str):
+        self._path = path
+        self._lock = threading.Lock()
+
+    def export(self, trace: Dict[str, Any]) -> None:
+        line = json.dumps(trace, default=str) + "\n"
+        with self._lock:
+            with open(self._path, "a") as file:
+                file.write(line)
+
+
+class Tracer:
+    """
+    Record spans of traces, keeping a sample of them in a ring buffer
+    and passing them to exporters. Every trace is recorded, but only
+    sampled ones are serialized, so fast requests pay for little more
+    than reading the clock. Traces over the slow threshold, or with a
+    statement over the slow statement threshold, are always kept and
+    logged with their full span tree.
+    """
+
+    def __init__(
+        self,
+        sample_rate: float = 0.01,
+        slow_threshold: float = 0.5,
+        slow_statement_threshold: float = 0.1,
+        buffer_size: int = 1000,
+        exporters: Sequence[Any] = (),
+        sample: Callable[[], float] = random.random,
+    ):
+        self._sample_rate = sample_rate
+        self._slow_threshold = slow_threshold
+        self._slow_statement_threshold = slow_statement_threshold
+        self._buffer = collections.deque(maxlen=buffer_size)
+        self._exporters = list(exporters)
+        self._sample = sample
+        self._lock = threading.Lock()
+        self._traces = 0
+        self._kept = 0
+        self._slow = 0
+
+    def start(self, name: str, **attributes) -> Span:
+        """Start trace with root span, which becomes the current span."""
+        root = Span(name, attributes)
+        root.token = _span.set(root)
+        return root
+
+    def finish(self, root: Span) -> None:
+        """End trace started with root span, keeping it if sampled."""
+        root.end = time.perf_counter()
+        _span.reset(root.token)
+        slow = self._is_slow(root)
+        with self._lock:
+            self._traces += 1
+            if slow:
+                self._slow += 1
+        if not slow and self._sample() >= self._sample_rate:
+            return
+        trace = root.to_json_dict()
+        trace["slow"] = slow
+        with self._lock:
+            self._kept += 1
+            self._buffer.append(trace)
+        if slow:
+            logger.warning(
+                "Slow %s: %s", root.name, json.dumps(trace, default=str)
+            )
+        for exporter in self._exporters:
+            try:
+                exporter.export(trace)
+            except Exception:
+                logger.exception("Failed to export trace.")
+
+    @contextmanager
+    def trace(self, name: str, **attributes):
+        """Record block as trace."""
+        root = self.start(name, **attributes)
+        try:
+            yield root
+        finally:
+            self.finish(root)
+
+    def traces(self) -> List[Dict[str, Any]]:
+        """Kept traces, oldest first."""
+        with self._lock:
+            return list(self._buffer)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Counts of recorded, kept and slow traces."""
+        with self._lock:
+            return {
+                "traces": self._traces,
+                "kept": self._kept,
+                "slow": self._slow,
+                "buffered": len(self._buffer),
+            }
+
+    def _is_slow(self, root):
+        if root.duration >= self._slow_threshold:
+            return True
+        return any(
+            s.name == STATEMENT_SPAN
+            and s.duration >= self._slow_statement_threshold
+            for s in root.walk()
+        )
@@ -0,0 +1,118 @@
+"""Dependency providers."""
+import functools
+import threading
+
+from flask import current_app
+
+from app.main import database
+from app.main import repository as repo
+from app.main import service as srv
+from app.main.repository.archived import sale_repository as archived
+from app.main.repository.cached import sale_repository as cached
+from app.main.repository.coalescing import sale_repository as coalescing
+from app.main.repository.membership import sale_repository as membership
+from app.main.repository.postgres.routing import ConnectionRouter
+from app.main.repository.postgres.sale_repository import (
+    provide_sale_repository,
+)
+from app.main.repository.sharded import sale_repository as sharded
+from app.main.repository.traced import sale_repository as traced
+from app.main.service.count_cache import CountCache
+from app.main.service.feed_cache import FeedCache
+from app.main.service.sale_service import provide_sale_service
+
+_lock = threading.Lock()
+
+
+def get_sale_service() -> srv.SaleService:
+    """Return application sale service, creating it on first use."""
+    extensions = current_app.extensions
+    if "sale_service" not in extensions:
+        with _lock:
+            if "sale_service" not in extensions:
+                extensions["sale_service"] = create_sale_service(
+                    current_app.config, extensions.get("sale_cache")
+                )
+    return extensions["sale_service"]
+
+
+def create_sale_service(config, sale_cache=None) -> srv.SaleService:
+    """
+    Wire up sale service from configuration, reading sales by id
+    through the shared sale cache, if given.
+    """
+    if config["DB_SHARDS"]:
+        repository = create_sharded_sale_repository(config)
+    else:
+        repository = create_sale_repository(config)
+    if config["COALESCE_READS"]:
+        repository = coalescing.provide_sale_repository(repository)
+    if sale_cache is not None:
+        repository = cached.provide_sale_repository(
+            repository, sale_cache, ttl=config["SHARED_CACHE_TTL"]
+        )
+    if config["ID_FILTER_ENABLED"]:
+        repository = membership.provide_sale_repository(
+            repository,
+            memory_bytes=config["ID_FILTER_MEMORY_BYTES"],
+            fp_rate=config["ID_FILTER_FP_RATE"],
+            rebuild_seconds=config["ID_FILTER_REBUILD_SECONDS"],
+        )
+    if config["TRACING_ENABLED"]:
+        repository = traced.provide_sale_repository(repository)
+    return provide_sale_service(
+        repository=repository,
+        count_cache=CountCache(ttl=config["COUNT_CACHE_TTL"]),
+        timeouts=config["OPERATION_TIMEOUTS"],
+        feed_cache=(
+            FeedCache(
+                size=config["FEED_CACHE_SIZE"], ttl=config["FEED_CACHE_TTL"]
+            )
+            if config["FEED_CACHE_SIZE"]
+            else None
+        ),
+    )
+
+
+def create_sale_repository(config) -> repo.SaleRepository:
+    """
+    Wire up Postgres sale repository from configuration, reading through
+    to archived sales if enabled.
+    """
+    conn = database.get_connection(config)
+    router = ConnectionRouter(
+        primary=conn,
+        replicas=[
+            functools.partial(database.get_replica_connection, dsn)
+            for dsn in config["DB_REPLICA_DSNS"]
+        ],
+        pin_seconds=config["DB_REPLICA_PIN_SECONDS"],
+        retry_seconds=config["DB_REPLICA_RETRY_SECONDS"],
+        connect=functools.partial(database.get_connection, config),
+        pool_size=config["DB_POOL_SIZE"],
+    )
+    repository = provide_sale_repository(conn=conn, router=router)
+    if config["ARCHIVE_ENABLED"]:
+        repository = archived.provide_sale_repository(
+            repository, horizon_seconds=config["ARCHIVE_HORIZON_SECONDS"]
+        )
+    return repository
+
+
+def create_shard_repositories(config):
+    """Wire up Postgres sale repository for each configured shard."""
+    return {
+        name: provide_sale_repository(
+            conn=database.get_dsn_connection(dsn),
+            connect=functools.partial(database.get_dsn_connection, dsn),
+            pool_size=config["DB_POOL_SIZE"],
+        )
+        for name, dsn in config["DB_SHARDS"].items()
+    }
+
+
+def create_sharded_sale_repository(config) -> repo.SaleRepository:
+    """Wire up sharded sale repository from configuration."""
+    return sharded.provide_sale_repository(
+        shards=create_shard_repositories(config)
+    )
@@ -1,6 +1,6 @@
 """Repository."""
 from datetime import datetime
-from typing import Optional, List
+from typing import Any, Dict, Iterator, Optional, List, Sequence
 from abc import ABC, abstractmethod
 
 
@@ -32,19 +32,100 @@ class SaleModel:
         self.updated_at = updated_at
 
 
+class VersionModel:
+    """Version of a page of sales."""
+
+    def __init__(
+        self,
+        count: int = 0,
+        updated_at: Optional[datetime] = None,
+        digest: Optional[str] = None,
+    ):
+        self.count = count
+        self.updated_at = updated_at
+        self.digest = digest
+
+
+class SalePageModel:
+    """Page of sales with cursor for the next page."""
+
+    def __init__(
+        self,
+        sales: Optional[List[SaleModel]] = None,
+        cursor: Optional[str] = None,
+        scores: Optional[List[float]] = None,
+    ):
+        self.sales = sales if sales is not None else []
+        self.cursor = cursor
+        self.scores = scores if scores is not None else []
+
+
+class OperationModel:
+    """Create, update or delete operation of a batch."""
+
+    def __init__(
+        self,
+        kind: str,
+        sale: SaleModel,
+        fields: Optional[List[str]] = None,
+    ):
+        self.kind = kind
+        self.sale = sale
+        self.fields = fields
+
+
+class OperationResultModel:
+    """Outcome of a batch operation."""
+
+    def __init__(
+        self, applied: bool = False, error: Optional[Exception] = None
+    ):
+        self.applied = applied
+        self.error = error
+
+
+class UpsertResultModel:
+    """
+    Outcome of an upsert, with the sales it inserted and updated, as
+    given but with the ids they are stored with, and the numbers of
+    sales it left unchanged and of sales given again with the same key.
+    """
+
+    def __init__(
+        self,
+        inserted: Optional[List[SaleModel]] = None,
+        updated: Optional[List[SaleModel]] = None,
+        unchanged: int = 0,
+        duplicates: int = 0,
+    ):
+        self.inserted = inserted if inserted is not None else []
+        self.updated = updated if updated is not None else []
+        self.unchanged = unchanged
+        self.duplicates = duplicates
+
+
+NATURAL_KEY = ("order_id", "sku", "date_time")
+
+
 class SaleRepository(ABC):
     """Sale repository interface."""
 
+    def metrics(self) -> Dict[str, Any]:
+        """Repository metrics, none unless overridden."""
+        return {}
+
     @abstractmethod
     def close(self) -> None:
         pass
 
     @abstractmethod
-    def find_by_id(self, id: str) -> SaleModel:
+    def find_by_id(
+        self, id: str, fields: Optional[Sequence[str]] = None
+    ) -> SaleModel:
         pass
 
     @abstractmethod
-    def create(self, sale: SaleModel) -> None:
+    def create(self, sale: SaleModel) -> SaleModel:
         pass
 
     @abstractmethod
@@ -52,7 +133,12 @@ class SaleRepository(ABC):
         pass
 
     @abstractmethod
-    def update(self, sale: SaleModel, fields: List[str]) -> None:
+    def update(
+        self,
+        sale: SaleModel,
+        fields: List[str],
+        expected_updated_at: Optional[datetime] = None,
+    ) -> SaleModel:
         pass
 
     @abstractmethod
@@ -61,9 +147,68 @@ class SaleRepository(ABC):
         id: str,
         limit: int = 10,
         after: bool = True,
+        filters: Optional[Dict[str, Any]] = None,
+        fields: Optional[Sequence[str]] = None,
     ) -> List[SaleModel]:
         pass
 
+    @abstractmethod
+    def find_latest(self, limit: int = 10) -> List[SaleModel]:
+        pass
+
+    @abstractmethod
+    def find_version(
+        self,
+        id: str,
+        limit: int = 10,
+        after: bool = True,
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> VersionModel:
+        pass
+
+    @abstractmethod
+    def count(
+        self,
+        filters: Optional[Dict[str, Any]] = None,
+        exact: bool = False,
+    ) -> int:
+        pass
+
+    @abstractmethod
+    def search(
+        self,
+        query: str,
+        fields: Sequence[str] = ("sku", "order_id"),
+        limit: int = 10,
+        cursor: Optional[str] = None,
+    ) -> SalePageModel:
+        pass
+
+    @abstractmethod
+    def iter_ids(self, batch_size: int = 10000) -> Iterator[str]:
+        pass
+
+    @abstractmethod
+    def stream(
+        self,
+        filters: Optional[Dict[str, Any]] = None,
+        fields: Optional[Sequence[str]] = None,
+        batch_size: int = 1000,
+    ) -> Iterator[SaleModel]:
+        pass
+
+    @abstractmethod
+    def upsert(
+        self, sales: List[SaleModel], key: Sequence[str] = NATURAL_KEY
+    ) -> UpsertResultModel:
+        pass
+
+    @abstractmethod
+    def execute_batch(
+        self, operations: List[OperationModel], atomic: bool = True
+    ) -> List[OperationResultModel]:
+        pass
+
 
 class RepositoryErr(Exception):
     """Generic repository error."""
@@ -73,6 +218,18 @@ class RecordNotFoundErr(RepositoryErr):
     """Record not found."""
 
 
+class TimeoutErr(RepositoryErr):
+    """Operation did not finish before its deadline."""
+
+
+class RecordConflictErr(RepositoryErr):
+    """Record was modified since the version expected."""
+
+
+class RecordArchivedErr(RepositoryErr):
+    """Record is archived, and can no longer be written."""
+
+
 class RecordFieldNullErr(Exception):
     """Record field cannot be null."""
 
@@ -0,0 +1,260 @@
+"""Sale Repository reading through to archived sales."""
+import itertools
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from app.main import repository as repo
+
+
+def provide_sale_repository(
+    repository: repo.SaleRepository, horizon_seconds: float = 30
+):
+    """Initialize and return repository."""
+    return SaleRepository(
+        repository=repository, horizon_seconds=horizon_seconds
+    )
+
+
+class SaleRepository(repo.SaleRepository):
+    """
+    Sale repository falling back to the archive of old sales. Sales
+    missing from the sale table are looked up in the archive by id, and
+    pages are merged with archived sales, unless every archived sale was
+    created before the page. The newest creation time of archived sales
+    is re-read every horizon_seconds, so sales archived meanwhile can be
+    missing from pages until then. Archived sales are read-only, so
+    writes of them fail with "RecordArchivedErr" rather than as missing,
+    and they are not counted, searched or streamed.
+    """
+
+    def __init__(
+        self,
+        repository: repo.SaleRepository,
+        horizon_seconds: float,
+        clock=time.monotonic,
+    ):
+        """Inject Postgres repository."""
+        self._repository = repository
+        self._horizon_seconds = horizon_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._horizon = None
+        self._horizon_expires = None
+        self._archive_reads = 0
+
+    def close(self) -> None:
+        """Close repository."""
+        self._repository.close()
+
+    def metrics(self) -> Dict[str, Any]:
+        """Reads that fell back to the archive."""
+        with self._lock:
+            return {
+                **self._repository.metrics(),
+                "archive": {"reads": self._archive_reads},
+            }
+
+    def find_by_id(
+        self, id: str, fields: Optional[Sequence[str]] = None
+    ) -> repo.SaleModel:
+        """Find a single sale by id, archived or not."""
+        try:
+            return self._repository.find_by_id(id, fields)
+        except repo.RecordNotFoundErr:
+            self._archive_read()
+            return self._repository.find_archived_by_id(id, fields)
+
+    def create(self, sale: repo.SaleModel) -> repo.SaleModel:
+        """Create a sale."""
+        return self._repository.create(sale)
+
+    def delete_by_id(self, id: str) -> None:
+        """Delete a sale by id."""
+        try:
+            self._repository.delete_by_id(id)
+        except repo.RecordNotFoundErr:
+            self._check_not_archived(id)
+            raise
+
+    def update(
+        self,
+        sale: repo.SaleModel,
+        fields: List[str],
+        expected_updated_at: Optional[datetime] = None,
+    ) -> repo.SaleModel:
+        """Update a sale."""
+        try:
+            return self._repository.update(sale, fields, expected_updated_at)
+        except repo.RecordNotFoundErr:
+            self._check_not_archived(sale.id)
+            raise
+
+    def find(
+        self,
+        id: str,
+        limit: int = 10,
+        after: bool = True,
+        filters: Optional[Dict[str, Any]] = None,
+        fields: Optional[Sequence[str]] = None,
+    ) -> List[repo.SaleModel]:
+        """
+        Get sales before or after sale with id, archived or not. Pages
+        are read with "created_at", which the archive is compared with,
+        and projected to fields afterwards. Unless the page ends before
+        the newest archived sale, the anchor sale is looked up to find
+        archived sales nearer to it than those of the page.
+        """
+        read = None if fields is None else list(fields) + ["created_at"]
+        sales = self._repository.find(id, limit, after, filters, read)
+        horizon = self._archive_horizon()
+        if horizon is None:
+            return _project(sales, fields)
+        if after and len(sales) == limit and sales[-1].created_at > horizon:
+            return _project(sales, fields)
+        try:
+            anchor = self._repository.find_by_id(id, ["created_at"])
+        except repo.RecordNotFoundErr:
+            try:
+                anchor = self._repository.find_archived_by_id(
+                    id, ["created_at"]
+                )
+            except repo.RecordNotFoundErr:
+                return _project(sales, fields)
+            # The page is anchored on an archived sale, so sales that are
+            # not archived are listed from its key instead.
+            sales = self._repository.find_from(
+                anchor.created_at, id, limit, after, filters, read
+            )
+        if not after and anchor.created_at > horizon:
+            return _project(sales, fields)
+        self._archive_read()
+        archived = self._repository.find_archived(
+            anchor.created_at, id, limit, after, filters, read
+        )
+        merged = sorted(
+            sales + archived, key=lambda s: (s.created_at, s.id), reverse=True
+        )
+        merged = merged[:limit] if after else merged[-limit:]
+        return _project(merged, fields)
+
+    def find_latest(self, limit: int = 10) -> List[repo.SaleModel]:
+        """Get newest sales."""
+        return self._repository.find_latest(limit)
+
+    def find_version(
+        self,
+        id: str,
+        limit: int = 10,
+        after: bool = True,
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> repo.VersionModel:
+        """
+        Get version of the page of sales that "find" returns. Archived
+        sales never change, so only sales not archived are versioned.
+        """
+        return self._repository.find_version(id, limit, after, filters)
+
+    def count(
+        self, filters: Optional[Dict[str, Any]] = None, exact: bool = False
+    ) -> int:
+        """Count sales matching filters."""
+        return self._repository.count(filters, exact)
+
+    def search(
+        self,
+        query: str,
+        fields: Sequence[str] = ("sku", "order_id"),
+        limit: int = 10,
+        cursor: Optional[str] = None,
+    ) -> repo.SalePageModel:
+        """Search sales by prefix or similarity of fields to query."""
+        return self._repository.search(query, fields, limit, cursor)
+
+    def iter_ids(self, batch_size: int = 10000) -> Iterator[str]:
+        """
+        Iterate over all sale ids, archived or not. Sales are only ever
+        moved from the table to the archive, so reading the table first
+        yields every sale that exists throughout, even if it is archived
+        meanwhile.
+        """
+        return itertools.chain(
+            self._repository.iter_ids(batch_size),
+            self._repository.iter_archived_ids(batch_size),
+        )
+
+    def stream(
+        self,
+        filters: Optional[Dict[str, Any]] = None,
+        fields: Optional[Sequence[str]] = None,
+        batch_size: int = 1000,
+    ) -> Iterator[repo.SaleModel]:
+        """
+        Iterate over sales matching filters, newest first. Archived
+        sales are not streamed.
+        """
+        return self._repository.stream(filters, fields, batch_size)
+
+    def upsert(
+        self,
+        sales: List[repo.SaleModel],
+        key: Sequence[str] = repo.NATURAL_KEY,
+    ) -> repo.UpsertResultModel:
+        """
+        Insert or update sales by key. Archived sales are not matched, so
+        sales with the key of an archived one are inserted.
+        """
+        return self._repository.upsert(sales, key)
+
+    def execute_batch(
+        self, operations: List[repo.OperationModel], atomic: bool = True
+    ) -> List[repo.OperationResultModel]:
+        """
+        Execute create, update and delete operations. Updates and deletes
+        of archived sales fail with "RecordArchivedErr".
+        """
+        results = self._repository.execute_batch(operations, atomic)
+        for operation, result in zip(operations, results):
+            if operation.kind != "create" and isinstance(
+                result.error, repo.RecordNotFoundErr
+            ):
+                try:
+                    self._check_not_archived(operation.sale.id)
+                except repo.RecordArchivedErr as error:
+                    result.error = error
+        return results
+
+    def _archive_horizon(self):
+        """Newest creation time of archived sales, read at most so often."""
+        with self._lock:
+            now = self._clock()
+            if (
+                self._horizon_expires is not None
+                and now < self._horizon_expires
+            ):
+                return self._horizon
+        horizon = self._repository.archive_horizon()
+        with self._lock:
+            self._horizon = horizon
+            self._horizon_expires = now + self._horizon_seconds
+        return horizon
+
+    def _check_not_archived(self, id):
+        """Raise "RecordArchivedErr" if sale with id is archived."""
+        try:
+            self._repository.find_archived_by_id(id, ["created_at"])
+        except repo.RecordNotFoundErr:
+            return
+        raise repo.RecordArchivedErr()
+
+    def _archive_read(self):
+        with self._lock:
+            self._archive_reads += 1
+
+
+def _project(sales, fields):
+    """Sales with only fields and id set, as read by a projected read."""
+    if fields is None or "created_at" in fields:
+        return sales
+    return [repo.SaleModel(**{**vars(s), "created_at": None}) for s in sales]
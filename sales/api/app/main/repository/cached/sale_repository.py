@@ -0,0 +1,266 @@
+"""Sale Repository with a cache of sales shared by worker processes."""
+import struct
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from app.main import repository as repo
+from app.main.helper.shared_cache import SharedCache
+
+# Quantity, subtotal, fee and tax, then date_time, created_at and
+# updated_at in microseconds since the epoch.
+_NUMBERS = struct.Struct("<7q")
+
+_LENGTH = struct.Struct("<H")
+
+_EPOCH = datetime(1970, 1, 1)
+
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def provide_sale_repository(
+    repository: repo.SaleRepository, cache: SharedCache, ttl: float = 30
+):
+    """Initialize and return repository."""
+    return SaleRepository(repository=repository, cache=cache, ttl=ttl)
+
+
+class SaleRepository(repo.SaleRepository):
+    """
+    Sale repository serving sales by id from a cache in shared memory,
+    so that worker processes forked from the same parent share one copy
+    of hot sales. Writes through any worker replace or remove the
+    cached sale. A read that misses only fills the cache if no newer
+    sale was cached meanwhile, but can still cache a sale deleted while
+    it was read, so entries expire after ttl seconds.
+    """
+
+    def __init__(
+        self, repository: repo.SaleRepository, cache: SharedCache, ttl: float
+    ):
+        """Inject repository and cache."""
+        self._repository = repository
+        self._cache = cache
+        self._ttl = ttl
+
+    def close(self) -> None:
+        """Close repository."""
+        self._repository.close()
+
+    def metrics(self) -> Dict[str, Any]:
+        """Hits and misses of sales by id."""
+        return {
+            **self._repository.metrics(),
+            "shared_cache": self._cache.metrics(),
+        }
+
+    def find_by_id(
+        self, id: str, fields: Optional[Sequence[str]] = None
+    ) -> repo.SaleModel:
+        """
+        Find a single sale by id. Projected reads are served from cached
+        sales, but only reads of whole sales fill the cache.
+        """
+        value = self._cache.get(id.encode())
+        if value is not None:
+            return _project(decode_sale(id, value), fields)
+        sale = self._repository.find_by_id(id, fields)
+        if fields is None:
+            value = encode_sale(sale)
+            if value is not None:
+                self._cache.add(id.encode(), value, self._ttl)
+        return sale
+
+    def create(self, sale: repo.SaleModel) -> repo.SaleModel:
+        """Create a sale."""
+        created = self._repository.create(sale)
+        self._replace(sale.id, created)
+        return created
+
+    def delete_by_id(self, id: str) -> None:
+        """Delete a sale by id."""
+        try:
+            self._repository.delete_by_id(id)
+        finally:
+            self._cache.delete(id.encode())
+
+    def update(
+        self,
+        sale: repo.SaleModel,
+        fields: List[str],
+        expected_updated_at: Optional[datetime] = None,
+    ) -> repo.SaleModel:
+        """Update a sale."""
+        try:
+            updated = self._repository.update(
+                sale, fields, expected_updated_at
+            )
+        except Exception:
+            self._cache.delete(sale.id.encode())
+            raise
+        self._replace(sale.id, updated)
+        return updated
+
+    def find(
+        self,
+        id: str,
+        limit: int = 10,
+        after: bool = True,
+        filters: Optional[Dict[str, Any]] = None,
+        fields: Optional[Sequence[str]] = None,
+    ) -> List[repo.SaleModel]:
+        """Get sales before or after sale with id."""
+        return self._repository.find(id, limit, after, filters, fields)
+
+    def find_latest(self, limit: int = 10) -> List[repo.SaleModel]:
+        """Get newest sales."""
+        return self._repository.find_latest(limit)
+
+    def find_version(
+        self,
+        id: str,
+        limit: int = 10,
+        after: bool = True,
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> repo.VersionModel:
+        """Get version of the page of sales that "find" returns."""
+        return self._repository.find_version(id, limit, after, filters)
+
+    def count(
+        self, filters: Optional[Dict[str, Any]] = None, exact: bool = False
+    ) -> int:
+        """Count sales matching filters."""
+        return self._repository.count(filters, exact)
+
+    def search(
+        self,
+        query: str,
+        fields: Sequence[str] = ("sku", "order_id"),
+        limit: int = 10,
+        cursor: Optional[str] = None,
+    ) -> repo.SalePageModel:
+        """Search sales by prefix or similarity of fields to query."""
+        return self._repository.search(query, fields, limit, cursor)
+
+    def iter_ids(self, batch_size: int = 10000) -> Iterator[str]:
+        """Iterate over all sale ids."""
+        return self._repository.iter_ids(batch_size)
+
+    def stream(
+        self,
+        filters: Optional[Dict[str, Any]] = None,
+        fields: Optional[Sequence[str]] = None,
+        batch_size: int = 1000,
+    ) -> Iterator[repo.SaleModel]:
+        """Iterate over sales matching filters, newest first."""
+        return self._repository.stream(filters, fields, batch_size)
+
+    def upsert(
+        self,
+        sales: List[repo.SaleModel],
+        key: Sequence[str] = repo.NATURAL_KEY,
+    ) -> repo.UpsertResultModel:
+        """Insert or update sales by key, removing them from the cache."""
+        result = self._repository.upsert(sales, key)
+        for sale in result.inserted + result.updated:
+            self._cache.delete(sale.id.encode())
+        return result
+
+    def execute_batch(
+        self, operations: List[repo.OperationModel], atomic: bool = True
+    ) -> List[repo.OperationResultModel]:
+        """
+        Execute create, update and delete operations, removing every
+        sale they touched from the cache.
+        """
+        try:
+            return self._repository.execute_batch(operations, atomic)
+        finally:
+            for operation in operations:
+                if operation.sale.id is not None:
+                    self._cache.delete(operation.sale.id.encode())
+
+    def _replace(self, id, sale):
+        value = encode_sale(sale) if sale is not None else None
+        if value is None:
+            self._cache.delete(id.encode())
+        else:
+            self._cache.put(id.encode(), value, self._ttl)
+
+
+def encode_sale(sale: repo.SaleModel) -> Optional[bytes]:
+    """
+    Encode sale, without its id, as fixed-width numbers and times
+    followed by length-prefixed order id and sku. Sales with missing or
+    timezone-aware values are not encoded and None is returned.
+    """
+    try:
+        numbers = _NUMBERS.pack(
+            sale.quantity,
+            sale.subtotal,
+            sale.fee,
+            sale.tax,
+            (sale.date_time - _EPOCH) // _MICROSECOND,
+            (sale.created_at - _EPOCH) // _MICROSECOND,
+            (sale.updated_at - _EPOCH) // _MICROSECOND,
+        )
+        order_id = sale.order_id.encode()
+        sku = sale.sku.encode()
+        return b"".join(
+            (
+                numbers,
+                _LENGTH.pack(len(order_id)),
+                order_id,
+                _LENGTH.pack(len(sku)),
+                sku,
+            )
+        )
+    except (AttributeError, TypeError, struct.error):
+        return None
+
+
+def decode_sale(id: str, value: bytes) -> repo.SaleModel:
+    """Decode sale with id from "encode_sale" output."""
+    (
+        quantity,
+        subtotal,
+        fee,
+        tax,
+        date_time,
+        created_at,
+        updated_at,
+    ) = _NUMBERS.unpack_from(value)
+    offset = _NUMBERS.size
+    (length,) = _LENGTH.unpack_from(value, offset)
+    offset += _LENGTH.size
+    end = offset + length
+    order_id = value[offset:end].decode()
+    offset = end
+    (length,) = _LENGTH.unpack_from(value, offset)
+    offset += _LENGTH.size
+    end = offset + length
+    sku = value[offset:end].decode()
+    return repo.SaleModel(
+        id=id,
+        date_time=_EPOCH + date_time * _MICROSECOND,
+        order_id=order_id,
+        sku=sku,
+        quantity=quantity,
+        subtotal=subtotal,
+        fee=fee,
+        tax=tax,
+        created_at=_EPOCH + created_at * _MICROSECOND,
+        updated_at=_EPOCH + updated_at * _MICROSECOND,
+    )
+
+
+def _project(sale, fields):
+    """Sale with only fields and id set, as read by a projected read."""
+    if fields is None:
+        return sale
+    values = vars(sale)
+    for f in fields:
+        if f not in values:
+            raise ValueError(f'"{f}" not valid field.')
+    return repo.SaleModel(
+        **{k: v for k, v in values.items() if k == "id" or k in fields}
+    )
@@ -0,0 +1,213 @@
+"""Coalescing Sale Repository."""
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from app.main import repository as repo
+from app.main.helper import session
+from app.main.helper.single_flight import SingleFlight
+
+
+def provide_sale_repository(repository: repo.SaleRepository):
+    """Initialize and return repository."""
+    return SaleRepository(repository=repository, flight=SingleFlight())
+
+
+class SaleRepository(repo.SaleRepository):
+    """
+    Sale repository sharing one query between concurrent identical
+    reads. Callers of a coalesced read share the returned models, so
+    they must not modify them. Reads are only shared between sessions
+    that last wrote at the same time, or never, so that sessions whose
+    reads are pinned to the primary do not share replica reads of
+    others. Writes are passed through.
+    """
+
+    def __init__(self, repository: repo.SaleRepository, flight: SingleFlight):
+        """Inject repository and single-flight group."""
+        self._repository = repository
+        self._flight = flight
+
+    def close(self) -> None:
+        """Close repository."""
+        self._repository.close()
+
+    def metrics(self) -> Dict[str, Any]:
+        """Calls and coalesced calls of reads."""
+        return {
+            **self._repository.metrics(),
+            "single_flight": self._flight.metrics(),
+        }
+
+    def find_by_id(
+        self, id: str, fields: Optional[Sequence[str]] = None
+    ) -> repo.SaleModel:
+        """Find a single sale by id."""
+        return self._flight.do(
+            _key("find_by_id", id, _fields_key(fields)),
+            self._repository.find_by_id,
+            id,
+            fields,
+        )
+
+    async def find_by_id_async(
+        self, id: str, fields: Optional[Sequence[str]] = None
+    ) -> repo.SaleModel:
+        """Find a single sale by id, for asyncio callers."""
+        return await self._flight.do_async(
+            _key("find_by_id", id, _fields_key(fields)),
+            self._repository.find_by_id,
+            id,
+            fields,
+        )
+
+    def create(self, sale: repo.SaleModel) -> repo.SaleModel:
+        """Create a sale."""
+        return self._repository.create(sale)
+
+    def delete_by_id(self, id: str) -> None:
+        """Delete a sale by id."""
+        self._repository.delete_by_id(id)
+
+    def update(
+        self,
+        sale: repo.SaleModel,
+        fields: List[str],
+        expected_updated_at: Optional[datetime] = None,
+    ) -> repo.SaleModel:
+        """Update a sale."""
+        return self._repository.update(sale, fields, expected_updated_at)
+
+    def find(
+        self,
+        id: str,
+        limit: int = 10,
+        after: bool = True,
+        filters: Optional[Dict[str, Any]] = None,
+        fields: Optional[Sequence[str]] = None,
+    ) -> List[repo.SaleModel]:
+        """Get sales before or after sale with id."""
+        return self._flight.do(
+            _key(
+                "find",
+                id,
+                limit,
+                after,
+                _filters_key(filters),
+                _fields_key(fields),
+            ),
+            self._repository.find,
+            id,
+            limit,
+            after,
+            filters,
+            fields,
+        )
+
+    async def find_async(
+        self,
+        id: str,
+        limit: int = 10,
+        after: bool = True,
+        filters: Optional[Dict[str, Any]] = None,
+        fields: Optional[Sequence[str]] = None,
+    ) -> List[repo.SaleModel]:
+        """Get sales before or after sale with id, for asyncio callers."""
+        return await self._flight.do_async(
+            _key(
+                "find",
+                id,
+                limit,
+                after,
+                _filters_key(filters),
+                _fields_key(fields),
+            ),
+            self._repository.find,
+            id,
+            limit,
+            after,
+            filters,
+            fields,
+        )
+
+    def find_latest(self, limit: int = 10) -> List[repo.SaleModel]:
+        """Get newest sales."""
+        return self._flight.do(
+            _key("find_latest", limit), self._repository.find_latest, limit
+        )
+
+    def find_version(
+        self,
+        id: str,
+        limit: int = 10,
+        after: bool = True,
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> repo.VersionModel:
+        """Get version of the page of sales that "find" returns."""
+        return self._flight.do(
+            _key("find_version", id, limit, after, _filters_key(filters)),
+            self._repository.find_version,
+            id,
+            limit,
+            after,
+            filters,
+        )
+
+    def count(
+        self, filters: Optional[Dict[str, Any]] = None, exact: bool = False
+    ) -> int:
+        """Count sales matching filters."""
+        return self._repository.count(filters, exact)
+
+    def search(
+        self,
+        query: str,
+        fields: Sequence[str] = ("sku", "order_id"),
+        limit: int = 10,
+        cursor: Optional[str] = None,
+    ) -> repo.SalePageModel:
+        """Search sales by prefix or similarity of fields to query."""
+        return self._repository.search(query, fields, limit, cursor)
+
+    def iter_ids(self, batch_size: int = 10000) -> Iterator[str]:
+        """Iterate over all sale ids."""
+        return self._repository.iter_ids(batch_size)
+
+    def stream(
+        self,
+        filters: Optional[Dict[str, Any]] = None,
+        fields: Optional[Sequence[str]] = None,
+        batch_size: int = 1000,
+    ) -> Iterator[repo.SaleModel]:
+        """Iterate over sales matching filters, newest first."""
+        return self._repository.stream(filters, fields, batch_size)
+
+    def upsert(
+        self,
+        sales: List[repo.SaleModel],
+        key: Sequence[str] = repo.NATURAL_KEY,
+    ) -> repo.UpsertResultModel:
+        """Insert or update sales by key."""
+        return self._repository.upsert(sales, key)
+
+    def execute_batch(
+        self, operations: List[repo.OperationModel], atomic: bool = True
+    ) -> List[repo.OperationResultModel]:
+        """Execute create, update and delete operations."""
+        return self._repository.execute_batch(operations, atomic)
+
+
+def _key(*parts):
+    return parts + (session.current().last_write,)
+
+
+def _filters_key(filters):
+    return tuple(
+        sorted(
+            (f, tuple(v) if isinstance(v, list) else v)
+            for f, v in (filters or {}).items()
+        )
+    )
+
+
+def _fields_key(fields):
+    return None if fields is None else tuple(sorted(fields))
@@ -0,0 +1,288 @@
+"""Sale Repository with membership filter of sale ids."""
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from app.main import repository as repo
+from app.main.helper.cuckoo import CuckooFilter
+
+
+def provide_sale_repository(
+    repository: repo.SaleRepository,
+    memory_bytes: int = 8 * 1024 * 1024,
+    fp_rate: float = 0.01,
+    rebuild_seconds: float = 300,
+):
+    """Initialize and return repository, building its filter."""
+    repository = SaleRepository(
+        repository=repository,
+        new_filter=lambda: CuckooFilter(memory_bytes, fp_rate),
+        rebuild_seconds=rebuild_seconds,
+    )
+    repository.refresh()
+    return repository
+
+
+class SaleRepository(repo.SaleRepository):
+    """
+    Sale repository answering lookups of ids that are definitely not in
+    the database without querying it. The filter of known ids is built
+    by streaming ids in the background and kept up to date by writes
+    through this repository. Sales written by other processes are only
+    picked up by the periodic rebuild, which bounds how long they can be
+    reported missing here, so the filter is only enabled where a single
+    process writes sales. Ids of deleted sales are left in the filter
+    until the next rebuild, since removing them could remove another
+    id's fingerprint; lookups of them only query the database.
+    """
+
+    def __init__(
+        self,
+        repository: repo.SaleRepository,
+        new_filter,
+        rebuild_seconds: float,
+        clock=time.monotonic,
+    ):
+        """Inject repository and filter factory."""
+        self._repository = repository
+        self._new_filter = new_filter
+        self._rebuild_seconds = rebuild_seconds
+        self._clock = clock
+        self._filter = None
+        self._journal = None
+        self._next_rebuild = 0.0
+        self._rebuilding = False
+        self._lock = threading.Lock()
+        self._short_circuited = 0
+        self._false_positives = 0
+        self._rebuilds = 0
+
+    def refresh(self) -> None:
+        """Rebuild filter in the background, if due."""
+        with self._lock:
+            if self._rebuilding or self._clock() < self._next_rebuild:
+                return
+            self._rebuilding = True
+        threading.Thread(
+            target=self._rebuild_in_background, daemon=True
+        ).start()
+
+    def rebuild(self) -> None:
+        """
+        Build a new filter from ids in the database. Writes made while
+        ids are streamed are recorded and replayed on the new filter.
+        """
+        with self._lock:
+            self._journal = []
+        try:
+            ids = self._new_filter()
+            for id in self._repository.iter_ids():
+                if not ids.add(id):
+                    break
+        except Exception:
+            with self._lock:
+                self._journal = None
+            raise
+        with self._lock:
+            for added, id in self._journal:
+                if added:
+                    ids.add(id)
+                elif id in ids:
+                    ids.remove(id)
+            self._journal = None
+            self._filter = ids
+            self._rebuilds += 1
+
+    def close(self) -> None:
+        """Close repository."""
+        self._repository.close()
+
+    def metrics(self) -> Dict[str, Any]:
+        """State of filter, and lookups it answered."""
+        with self._lock:
+            ids = self._filter
+            return {
+                **self._repository.metrics(),
+                "id_filter": {
+                    "ready": ids is not None,
+                    "saturated": ids is not None and ids.saturated,
+                    "items": ids.count if ids is not None else 0,
+                    "memory_bytes": (
+                        ids.memory_bytes if ids is not None else 0
+                    ),
+                    "short_circuited": self._short_circuited,
+                    "false_positives": self._false_positives,
+                    "rebuilds": self._rebuilds,
+                },
+            }
+
+    def find_by_id(
+        self, id: str, fields: Optional[Sequence[str]] = None
+    ) -> repo.SaleModel:
+        """Find a single sale by id."""
+        self.refresh()
+        with self._lock:
+            known = self._filter is None or id in self._filter
+            if not known:
+                self._short_circuited += 1
+        if not known:
+            raise repo.RecordNotFoundErr()
+        try:
+            return self._repository.find_by_id(id, fields)
+        except repo.RecordNotFoundErr:
+            with self._lock:
+                self._false_positives += 1
+            raise
+
+    def create(self, sale: repo.SaleModel) -> repo.SaleModel:
+        """
+        Create a sale. Its id is added first, so that it is never
+        reported missing while being inserted.
+        """
+        self._added(sale.id)
+        try:
+            return self._repository.create(sale)
+        except Exception:
+            self._removed(sale.id)
+            raise
+
+    def delete_by_id(self, id: str) -> None:
+        """Delete a sale by id. Its id is dropped by the next rebuild."""
+        self._repository.delete_by_id(id)
+
+    def update(
+        self,
+        sale: repo.SaleModel,
+        fields: List[str],
+        expected_updated_at: Optional[datetime] = None,
+    ) -> repo.SaleModel:
+        """Update a sale."""
+        return self._repository.update(sale, fields, expected_updated_at)
+
+    def find(
+        self,
+        id: str,
+        limit: int = 10,
+        after: bool = True,
+        filters: Optional[Dict[str, Any]] = None,
+        fields: Optional[Sequence[str]] = None,
+    ) -> List[repo.SaleModel]:
+        """Get sales before or after sale with id."""
+        return self._repository.find(id, limit, after, filters, fields)
+
+    def find_latest(self, limit: int = 10) -> List[repo.SaleModel]:
+        """Get newest sales."""
+        return self._repository.find_latest(limit)
+
+    def find_version(
+        self,
+        id: str,
+        limit: int = 10,
+        after: bool = True,
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> repo.VersionModel:
+        """Get version of the page of sales that "find" returns."""
+        return self._repository.find_version(id, limit, after, filters)
+
+    def count(
+        self, filters: Optional[Dict[str, Any]] = None, exact: bool = False
+    ) -> int:
+        """Count sales matching filters."""
+        return self._repository.count(filters, exact)
+
+    def search(
+        self,
+        query: str,
+        fields: Sequence[str] = ("sku", "order_id"),
+        limit: int = 10,
+        cursor: Optional[str] = None,
+    ) -> repo.SalePageModel:
+        """Search sales by prefix or similarity of fields to query."""
+        return self._repository.search(query, fields, limit, cursor)
+
+    def upsert(
+        self,
+        sales: List[repo.SaleModel],
+        key: Sequence[str] = repo.NATURAL_KEY,
+    ) -> repo.UpsertResultModel:
+        """
+        Insert or update sales by key. Ids are added first, like those
+        of created sales, and removed again unless inserted.
+        """
+        for sale in sales:
+            self._added(sale.id)
+        try:
+            result = self._repository.upsert(sales, key)
+        except Exception:
+            for sale in sales:
+                self._removed(sale.id)
+            raise
+        inserted = {sale.id for sale in result.inserted}
+        for sale in sales:
+            if sale.id not in inserted:
+                self._removed(sale.id)
+        return result
+
+    def execute_batch(
+        self, operations: List[repo.OperationModel], atomic: bool = True
+    ) -> List[repo.OperationResultModel]:
+        """
+        Execute create, update and delete operations. Ids of created
+        sales are added first, and removed again unless created.
+        """
+        created = [o.sale.id for o in operations if o.kind == "create"]
+        for id in created:
+            self._added(id)
+        try:
+            results = self._repository.execute_batch(operations, atomic)
+        except Exception:
+            for id in created:
+                self._removed(id)
+            raise
+        for operation, result in zip(operations, results):
+            if operation.kind == "create" and not result.applied:
+                self._removed(operation.sale.id)
+        return results
+
+    def iter_ids(self, batch_size: int = 10000) -> Iterator[str]:
+        """Iterate over all sale ids."""
+        return self._repository.iter_ids(batch_size)
+
+    def stream(
+        self,
+        filters: Optional[Dict[str, Any]] = None,
+        fields: Optional[Sequence[str]] = None,
+        batch_size: int = 1000,
+    ) -> Iterator[repo.SaleModel]:
+        """Iterate over sales matching filters, newest first."""
+        return self._repository.stream(filters, fields, batch_size)
+
+    def _rebuild_in_background(self):
+        try:
+            self.rebuild()
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                self._rebuilding = False
+                self._next_rebuild = self._clock() + self._rebuild_seconds
+
+    def _added(self, id):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((True, id))
+            if self._filter is not None:
+                self._filter.add(id)
+
+    def _removed(self, id):
+        """
+        Remove id added by this repository for a write that did not
+        insert it. Removing an id that was never added could remove
+        another id's fingerprint.
+        """
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((False, id))
+            if self._filter is not None and id in self._filter:
+                self._filter.remove(id)
@@ -0,0 +1,142 @@
+"""Cold archive of old sales."""
+import json
+import zlib
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional
+
+from app.main.repository.postgres import sale_sql as sql
+from app.main.repository import utils
+
+FORMAT_VERSION = 1
+
+TIME_COLUMNS = ("date_time", "created_at", "updated_at")
+
+_EPOCH = datetime(1970, 1, 1)
+
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def encode_batch(rows: List[Dict[str, Any]]) -> bytes:
+    """
+    Encode rows of sales column by column and compress them. Times are
+    stored as differences in microseconds from the previous row, which
+    are small for rows in date_time order and compress well.
+    """
+    columns = {}
+    for column in sql.COLUMNS:
+        values = [row[column] for row in rows]
+        if column in TIME_COLUMNS:
+            micros = [(v - _EPOCH) // _MICROSECOND for v in values]
+            values = [m - p for m, p in zip(micros, [0] + micros[:-1])]
+        columns[column] = values
+    payload = json.dumps(columns, separators=(",", ":")).encode()
+    return bytes([FORMAT_VERSION]) + zlib.compress(payload, 9)
+
+
+def decode_batch(data: bytes) -> Dict[str, List[Any]]:
+    """Decode columns of batch from "encode_batch" output."""
+    if data[0] != FORMAT_VERSION:
+        raise ValueError(f"Unknown archive format {data[0]}.")
+    columns = json.loads(zlib.decompress(data[1:]))
+    for column in TIME_COLUMNS:
+        total = 0
+        times = []
+        for delta in columns[column]:
+            total += delta
+            times.append(_EPOCH + total * _MICROSECOND)
+        columns[column] = times
+    return columns
+
+
+def batch_rows(columns: Dict[str, List[Any]]) -> Iterator[Dict[str, Any]]:
+    """Iterate over rows of decoded batch."""
+    for values in zip(*(columns[c] for c in sql.COLUMNS)):
+        yield utils.row_to_dict(sql.COLUMNS, values)
+
+
+def find_in_batch(data: bytes, id: str) -> Optional[Dict[str, Any]]:
+    """Row of sale with id in batch, None when it is not there."""
+    columns = decode_batch(data)
+    try:
+        index = columns["id"].index(id)
+    except ValueError:
+        return None
+    return {c: columns[c][index] for c in sql.COLUMNS}
+
+
+def matches(row: Dict[str, Any], filters: Dict[str, Any]) -> bool:
+    """Check row against filters of "sale_sql.generate_filter_conditions"."""
+    for f, value in filters.items():
+        if f in sql.RANGE_FILTER_FIELDS:
+            start, end = value
+            if start is not None and row[f] < start:
+                return False
+            if end is not None and row[f] > end:
+                return False
+        elif row[f] != value:
+            return False
+    return True
+
+
+def archive_sales(conn, cutoff: datetime, batch_size: int = 5000) -> int:
+    """
+    Move sales with date_time before cutoff out of the sale table into
+    compressed archive batches, oldest first, committing batch by batch.
+    Batches never span months, and every archived id is indexed with
+    its batch, which keeps the skus and order ids of its sales. Returns
+    the number of sales archived.
+    """
+    archived = 0
+    cur = conn.cursor()
+    try:
+        while True:
+            cur.execute(
+                sql.SELECT_ARCHIVABLE_SALES_STATEMENT,
+                {"cutoff": cutoff, "limit": batch_size},
+            )
+            rows = [utils.row_to_dict(sql.COLUMNS, r) for r in cur.fetchall()]
+            if not rows:
+                break
+            for month, group in _by_month(rows):
+                cur.execute(
+                    sql.INSERT_ARCHIVED_BATCH_STATEMENT,
+                    {
+                        "month": month,
+                        "first_date_time": group[0]["date_time"],
+                        "last_date_time": group[-1]["date_time"],
+                        "first_created_at": min(
+                            r["created_at"] for r in group
+                        ),
+                        "last_created_at": max(r["created_at"] for r in group),
+                        "row_count": len(group),
+                        "skus": sorted({r["sku"] for r in group}),
+                        "order_ids": sorted({r["order_id"] for r in group}),
+                        "data": encode_batch(group),
+                    },
+                )
+                (batch_id,) = cur.fetchone()
+                ids = [r["id"] for r in group]
+                cur.execute(
+                    sql.INSERT_ARCHIVED_IDS_STATEMENT,
+                    {"ids": ids, "batch_id": batch_id},
+                )
+                cur.execute(sql.DELETE_SALES_BY_IDS_STATEMENT, (ids,))
+            conn.commit()
+            archived += len(rows)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return archived
+
+
+def _by_month(rows):
+    """Split rows in date_time order into groups of the same month."""
+    groups = []
+    for row in rows:
+        month = date(row["date_time"].year, row["date_time"].month, 1)
+        if not groups or groups[-1][0] != month:
+            groups.append((month, []))
+        groups[-1][1].append(row)
+    return groups
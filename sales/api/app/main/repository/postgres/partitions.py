@@ -0,0 +1,77 @@
+"""Sale table partition maintenance."""
+import re
+from datetime import date
+from typing import List, Tuple
+
+from app.main.repository.postgres import sale_ddl as ddl
+
+_NAME = re.compile(r"^sale_y(\d{4})m(\d{2})$")
+
+
+def partition_name(month: date) -> str:
+    """Name of monthly partition."""
+    return f"sale_y{month.year:04d}m{month.month:02d}"
+
+
+def partition_month(name: str):
+    """Month of partition with name, None for other partitions."""
+    match = _NAME.match(name)
+    if match is None:
+        return None
+    return date(int(match.group(1)), int(match.group(2)), 1)
+
+
+def add_months(month: date, count: int) -> date:
+    """First day of month count months after month."""
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def maintain_partitions(
+    conn, today: date, ahead: int = 3, retention: int = 24
+) -> Tuple[List[str], List[str]]:
+    """
+    Create monthly partitions from the current month to "ahead" months
+    in the future, and detach and drop partitions ending "retention"
+    months or more before the current month. Partitions are also created
+    for past months with sales in the default partition, such as loaded
+    or backfilled ones, so that they are dropped once expired rather
+    than kept in the default partition forever. Returns names of created
+    and dropped partitions.
+    """
+    current = date(today.year, today.month, 1)
+    horizon = add_months(current, -retention)
+    created = []
+    dropped = []
+    cur = conn.cursor()
+    try:
+        cur.execute(ddl.SELECT_SALE_PARTITIONS_STATEMENT)
+        existing = {row[0] for row in cur.fetchall()}
+        cur.execute(ddl.SELECT_DEFAULT_PARTITION_START_STATEMENT)
+        (oldest,) = cur.fetchone()
+        month = current
+        if oldest is not None:
+            month = min(month, date(oldest.year, oldest.month, 1))
+        while month <= add_months(current, ahead):
+            name = partition_name(month)
+            params = {"start": month, "end": add_months(month, 1)}
+            month = params["end"]
+            if name in existing:
+                continue
+            for stmt in ddl.generate_create_partition_statements(name):
+                cur.execute(stmt, params)
+            created.append(name)
+        for name in sorted(existing.union(created)):
+            month = partition_month(name)
+            if month is None or add_months(month, 1) > horizon:
+                continue
+            for stmt in ddl.generate_drop_partition_statements(name):
+                cur.execute(stmt)
+            dropped.append(name)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return created, dropped
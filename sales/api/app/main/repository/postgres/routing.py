@@ -0,0 +1,175 @@
+"""Connection routing between primary and read replicas."""
+import itertools
+import threading
+import time
+from typing import Callable, Optional, Sequence
+
+from app.main import repository as repo
+from app.main.helper import deadline, session
+
+
+class ConnectionPool:
+    """
+    Connections lent to one caller at a time, so that statements and
+    transactions of concurrent requests never share a connection. More
+    connections are opened on demand, up to size, and callers wait for
+    one to be returned once all are lent, until their deadline. Without
+    a connection factory, only the given connections are lent.
+    """
+
+    def __init__(
+        self,
+        conns: Sequence = (),
+        connect: Optional[Callable] = None,
+        size: int = 1,
+    ):
+        if size < 1:
+            raise ValueError('"size" argument must be positive.')
+        self._connect = connect
+        self._size = max(size, len(conns)) if connect else len(conns)
+        self._conns = list(conns)
+        self._idle = list(conns)
+        self._opening = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Lend a connection, waiting for one if all are lent."""
+        with self._cond:
+            if not self._cond.wait_for(
+                lambda: self._idle or self._openable(), deadline.remaining()
+            ):
+                raise repo.TimeoutErr()
+            if self._idle:
+                return self._idle.pop()
+            self._opening += 1
+        try:
+            conn = self._connect()
+        except Exception:
+            raise repo.RepositoryErr()
+        finally:
+            with self._cond:
+                self._opening -= 1
+                self._cond.notify()
+        with self._cond:
+            self._conns.append(conn)
+        return conn
+
+    def release(self, conn) -> None:
+        """
+        Take back lent connection. Broken connections are dropped, so
+        that another is opened in their place, if a factory is given.
+        """
+        with self._cond:
+            if conn.closed and self._connect is not None:
+                self._conns.remove(conn)
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    def owns(self, conn) -> bool:
+        """Whether connection was opened by this pool."""
+        with self._cond:
+            return any(c is conn for c in self._conns)
+
+    def close(self) -> None:
+        """Close all connections."""
+        with self._cond:
+            for conn in self._conns:
+                conn.close()
+
+    def _openable(self):
+        return len(self._conns) + self._opening < self._size
+
+
+class ConnectionRouter:
+    """
+    Route writes to the primary and reads to healthy replicas in round
+    robin. A replica whose connection broke is left out until
+    "retry_seconds" have passed, then reconnected. After a write, reads
+    of the same client session stay on the primary for "pin_seconds",
+    so that clients read their own writes despite replication lag, on
+    any worker. The clock is wall time, since sessions carry the time
+    of their last write from process to process. Connections
+    of the primary and of each replica are lent from pools of
+    "pool_size", and must be released once their transaction is done.
+    """
+
+    def __init__(
+        self,
+        primary,
+        replicas: Sequence[Callable] = (),
+        pin_seconds: float = 1.0,
+        retry_seconds: float = 5.0,
+        clock=time.time,
+        connect: Optional[Callable] = None,
+        pool_size: int = 1,
+    ):
+        """
+        Inject primary connection, replica connection factories, and
+        factory of further primary connections.
+        """
+        self._primary = ConnectionPool([primary], connect, pool_size)
+        self._replicas = [
+            ConnectionPool((), factory, pool_size) for factory in replicas
+        ]
+        self._down_until = [0.0] * len(self._replicas)
+        self._pin_seconds = pin_seconds
+        self._retry_seconds = retry_seconds
+        self._clock = clock
+        self._next = itertools.count()
+
+    def writer(self):
+        """Connection for writes."""
+        return self._primary.acquire()
+
+    def reader(self):
+        """Connection for reads."""
+        if not self._replicas or self._pinned():
+            return self._primary.acquire()
+        now = self._clock()
+        for _ in range(len(self._replicas)):
+            i = next(self._next) % len(self._replicas)
+            if self._down_until[i] > now:
+                continue
+            try:
+                return self._replicas[i].acquire()
+            except repo.TimeoutErr:
+                raise
+            except repo.RepositoryErr:
+                self._down_until[i] = self._clock() + self._retry_seconds
+        return self._primary.acquire()
+
+    def release(self, conn) -> None:
+        """
+        End transaction of connection taken for a read or write, and
+        return it to the pool it came from.
+        """
+        try:
+            conn.commit()
+        finally:
+            for pool in [self._primary] + self._replicas:
+                if pool.owns(conn):
+                    pool.release(conn)
+                    break
+
+    def wrote(self) -> None:
+        """Pin reads of current session to primary after a write."""
+        session.current().wrote(self._clock())
+
+    def failed(self, conn) -> None:
+        """Take replica out of rotation if its connection broke."""
+        for i, pool in enumerate(self._replicas):
+            if pool.owns(conn) and conn.closed:
+                self._down_until[i] = self._clock() + self._retry_seconds
+
+    def close(self) -> None:
+        """Close all connections."""
+        self._primary.close()
+        for pool in self._replicas:
+            pool.close()
+
+    def _pinned(self):
+        last_write = session.current().last_write
+        if last_write is None:
+            return False
+        return last_write + self._pin_seconds > self._clock()
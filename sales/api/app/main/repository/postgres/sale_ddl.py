@@ -0,0 +1,130 @@
+"""Sales DDL Statements."""
+
+CREATE_TRGM_EXTENSION_STATEMENT = "CREATE EXTENSION IF NOT EXISTS pg_trgm"
+
+CREATE_SALE_TABLE_STATEMENT = (
+    'CREATE TABLE IF NOT EXISTS "sale" ('
+    "id TEXT NOT NULL, "
+    "date_time TIMESTAMP NOT NULL, "
+    "order_id TEXT NOT NULL, "
+    "sku TEXT NOT NULL, "
+    "quantity INTEGER NOT NULL, "
+    "subtotal INTEGER NOT NULL, "
+    "fee INTEGER NOT NULL, "
+    "tax INTEGER NOT NULL, "
+    "created_at TIMESTAMP NOT NULL, "
+    "updated_at TIMESTAMP NOT NULL, "
+    "CONSTRAINT sale_pkey PRIMARY KEY (id, date_time)) "
+    "PARTITION BY RANGE (date_time)"
+)
+
+CREATE_SALE_DEFAULT_PARTITION_STATEMENT = (
+    'CREATE TABLE IF NOT EXISTS "sale_default" PARTITION OF "sale" DEFAULT'
+)
+
+SELECT_SALE_PARTITIONS_STATEMENT = (
+    "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON "
+    "c.oid = i.inhrelid WHERE i.inhparent = 'sale'::regclass"
+)
+
+SELECT_DEFAULT_PARTITION_START_STATEMENT = (
+    'SELECT MIN(date_time) FROM "sale_default"'
+)
+
+
+def generate_create_partition_statements(name):
+    """
+    Generate statements creating partition for a date_time range, moving
+    matching rows out of the default partition before attaching it.
+    Partition name must come from "partitions.partition_name".
+    """
+    return (
+        f'CREATE TABLE "{name}" (LIKE "sale" INCLUDING DEFAULTS '
+        "INCLUDING CONSTRAINTS)",
+        f'WITH "moved" AS (DELETE FROM "sale_default" WHERE date_time >= '
+        "%(start)s AND date_time < %(end)s RETURNING *) "
+        f'INSERT INTO "{name}" SELECT * FROM "moved"',
+        f'ALTER TABLE "sale" ATTACH PARTITION "{name}" FOR VALUES FROM '
+        "(%(start)s) TO (%(end)s)",
+    )
+
+
+def generate_drop_partition_statements(name):
+    """Generate statements detaching and dropping partition."""
+    return (
+        f'ALTER TABLE "sale" DETACH PARTITION "{name}"',
+        f'DROP TABLE "{name}"',
+    )
+
+
+CREATE_INDEX_STATEMENTS = (
+    'CREATE INDEX IF NOT EXISTS sale_created_at_idx ON "sale" (created_at)',
+    "CREATE INDEX IF NOT EXISTS sale_sku_created_at_idx ON "
+    '"sale" (sku, created_at)',
+    "CREATE INDEX IF NOT EXISTS sale_order_id_created_at_idx ON "
+    '"sale" (order_id, created_at)',
+    'CREATE INDEX IF NOT EXISTS sale_date_time_idx ON "sale" (date_time)',
+    "CREATE INDEX IF NOT EXISTS sale_sku_date_time_idx ON "
+    '"sale" (sku, date_time)',
+    'CREATE INDEX IF NOT EXISTS sale_sku_trgm_idx ON "sale" '
+    "USING GIN (sku gin_trgm_ops)",
+    'CREATE INDEX IF NOT EXISTS sale_order_id_trgm_idx ON "sale" '
+    "USING GIN (order_id gin_trgm_ops)",
+    'CREATE INDEX IF NOT EXISTS sale_sku_pattern_idx ON "sale" '
+    "(sku text_pattern_ops)",
+    'CREATE INDEX IF NOT EXISTS sale_order_id_pattern_idx ON "sale" '
+    "(order_id text_pattern_ops)",
+    # Covers reads projected to reconciliation fields, by id or in id
+    # order, so they can be index-only scans.
+    'CREATE INDEX IF NOT EXISTS sale_id_covering_idx ON "sale" (id) '
+    "INCLUDE (sku, subtotal)",
+    # Natural key of line items, which upserts conflict on. Unique
+    # indexes of a partitioned table must include its partition key, so
+    # date_time is part of the key.
+    "CREATE UNIQUE INDEX IF NOT EXISTS sale_order_id_sku_date_time_idx "
+    'ON "sale" (order_id, sku, date_time)',
+)
+
+# Archived sales are stored in compressed batches of columns, indexed by
+# sale id. Batches are compressed before they are stored, so Postgres is
+# told not to compress them again. Batches keep the skus and order ids of
+# their sales, so that pages filtered by them only read batches holding
+# matching sales.
+ARCHIVE_SCHEMA_STATEMENTS = (
+    'CREATE TABLE IF NOT EXISTS "archived_sale_batch" ('
+    "id BIGSERIAL PRIMARY KEY, "
+    "month DATE NOT NULL, "
+    "first_date_time TIMESTAMP NOT NULL, "
+    "last_date_time TIMESTAMP NOT NULL, "
+    "first_created_at TIMESTAMP NOT NULL, "
+    "last_created_at TIMESTAMP NOT NULL, "
+    "row_count INTEGER NOT NULL, "
+    "skus TEXT[] NOT NULL, "
+    "order_ids TEXT[] NOT NULL, "
+    "data BYTEA NOT NULL)",
+    'ALTER TABLE "archived_sale_batch" ALTER COLUMN data SET STORAGE '
+    "EXTERNAL",
+    "CREATE INDEX IF NOT EXISTS archived_sale_batch_month_idx ON "
+    '"archived_sale_batch" (month)',
+    "CREATE INDEX IF NOT EXISTS archived_sale_batch_first_created_at_idx "
+    'ON "archived_sale_batch" (first_created_at)',
+    "CREATE INDEX IF NOT EXISTS archived_sale_batch_last_created_at_idx "
+    'ON "archived_sale_batch" (last_created_at)',
+    "CREATE INDEX IF NOT EXISTS archived_sale_batch_skus_idx ON "
+    '"archived_sale_batch" USING GIN (skus)',
+    "CREATE INDEX IF NOT EXISTS archived_sale_batch_order_ids_idx ON "
+    '"archived_sale_batch" USING GIN (order_ids)',
+    'CREATE TABLE IF NOT EXISTS "archived_sale_id" ('
+    "id TEXT PRIMARY KEY, "
+    "batch_id BIGINT NOT NULL REFERENCES archived_sale_batch (id))",
+)
+
+SCHEMA_STATEMENTS = (
+    (
+        CREATE_TRGM_EXTENSION_STATEMENT,
+        CREATE_SALE_TABLE_STATEMENT,
+        CREATE_SALE_DEFAULT_PARTITION_STATEMENT,
+    )
+    + CREATE_INDEX_STATEMENTS
+    + ARCHIVE_SCHEMA_STATEMENTS
+)
@@ -1,23 +1,47 @@
 """Postgres Sale Repository."""
-from typing import List
-
-import psycopg2
+import json
+import re
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
 
 from app.main import repository as repo
+from app.main.helper import deadline, tracing
+from app.main.repository.postgres import archive
 from app.main.repository.postgres import sale_sql as sql
+from app.main.repository.postgres.routing import ConnectionRouter
 from app.main.repository import utils
 
 
 def provide_sale_repository(
     conn,
-    null_err=psycopg2.errors.NotNullViolation,
-    duplicate_err=psycopg2.errors.UniqueViolation,
+    null_err=None,
+    duplicate_err=None,
+    timeout_err=None,
+    router: Optional[ConnectionRouter] = None,
+    connect: Optional[Callable] = None,
+    pool_size: int = 1,
 ):
-    """Initialize and return repository."""
+    """
+    Initialize and return repository. Default errors are imported on
+    first use so that importing this module does not load psycopg2.
+    Without a connection factory, every statement, streams included,
+    runs on the one connection given, one at a time.
+    """
+    if null_err is None or duplicate_err is None or timeout_err is None:
+        from psycopg2 import errors
+
+        null_err = null_err or errors.NotNullViolation
+        duplicate_err = duplicate_err or errors.UniqueViolation
+        timeout_err = timeout_err or errors.QueryCanceled
     return SaleRepository(
-        conn=conn,
+        router=(
+            router
+            if router is not None
+            else ConnectionRouter(conn, connect=connect, pool_size=pool_size)
+        ),
         null_err=null_err,
         duplicate_err=duplicate_err,
+        timeout_err=timeout_err,
     )
 
 
@@ -37,41 +61,56 @@ class SaleRepository(repo.SaleRepository):
         "updated_at",
     )
 
-    def __init__(self, conn, null_err, duplicate_err):
-        """Inject connection."""
-        self._conn = conn
+    def __init__(self, router, null_err, duplicate_err, timeout_err):
+        """Inject connection router."""
+        self._router = router
         self._null_err = null_err
         self._duplicate_err = duplicate_err
+        self._timeout_err = timeout_err
 
     def close(self) -> None:
-        """Close connection."""
-        self._conn.close()
+        """Close connections."""
+        self._router.close()
 
-    def find_by_id(self, id: str) -> repo.SaleModel:
-        """Find a single sale by id."""
+    def find_by_id(
+        self, id: str, fields: Optional[Sequence[str]] = None
+    ) -> repo.SaleModel:
+        """
+        Find a single sale by id. Given fields, only those and "id" are
+        read, and the other attributes of the sale are None.
+        """
+        columns = sql.generate_projection(fields)
+        conn = self._router.reader()
         cur = None
         try:
-            cur = self._conn.cursor()
-            cur.execute(sql.SELECT_SALE_BY_ID_STATEMENT, (id,))
+            cur = conn.cursor()
+            self._execute(
+                cur, sql.generate_select_sale_by_id_statement(columns), (id,)
+            )
             row = cur.fetchone()
+        except (repo.TimeoutErr, self._timeout_err):
+            raise repo.TimeoutErr()
         except Exception:
+            self._router.failed(conn)
             raise repo.RepositoryErr()
         else:
             if row is None:
                 raise repo.RecordNotFoundErr()
-            return repo.SaleModel(**utils.row_to_dict(self._cols, row))
+            return repo.SaleModel(**utils.row_to_dict(columns, row))
         finally:
-            self._conn.commit()
             if cur is not None:
                 cur.close()
+            self._router.release(conn)
 
-    def create(self, sale: repo.SaleModel) -> None:
-        """Create a sale."""
+    def create(self, sale: repo.SaleModel) -> repo.SaleModel:
+        """Create a sale and return it as stored."""
+        conn = self._router.writer()
         cur = None
         try:
-            cur = self._conn.cursor()
-            cur.execute(
-                sql.INSERT_SALE_STATEMENT,
+            cur = conn.cursor()
+            self._execute(
+                cur,
+                sql.INSERT_SALE_RETURNING_STATEMENT,
                 (
                     sale.id,
                     sale.date_time,
@@ -85,6 +124,8 @@ class SaleRepository(repo.SaleRepository):
                     sale.updated_at,
                 ),
             )
+            row = cur.fetchone()
+            self._router.wrote()
         except self._null_err as error:
             column = error.diag.column_name
             raise repo.RecordFieldNullErr(field=column)
@@ -92,72 +133,378 @@ class SaleRepository(repo.SaleRepository):
             constraint = error.diag.constraint_name
             field = utils.field_from_constraint(constraint)
             raise repo.RecordFieldDuplicateErr(field=field)
+        except (repo.TimeoutErr, self._timeout_err):
+            raise repo.TimeoutErr()
+        except Exception:
+            raise repo.RepositoryErr()
+        else:
+            return repo.SaleModel(**utils.row_to_dict(self._cols, row))
+        finally:
+            if cur is not None:
+                cur.close()
+            self._router.release(conn)
+
+    def upsert(
+        self,
+        sales: List[repo.SaleModel],
+        key: Sequence[str] = repo.NATURAL_KEY,
+    ) -> repo.UpsertResultModel:
+        """
+        Insert sales, or update quantities, amounts and "updated_at" of
+        the sale with the same key, in a single statement. Sales whose
+        values would not change are left as they are, so redelivered
+        sales are only counted as unchanged. Of sales given more than
+        once, the last one is written, and the others are counted as
+        duplicates. Sales read back with the creation time they were given
+        are counted as inserted, so sales must be given a creation time of
+        their own, as the service does.
+        """
+        if tuple(key) != repo.NATURAL_KEY:
+            raise ValueError('"key" must be the natural key of sales.')
+        utils.check_batch_size(len(sales))
+        by_key = {tuple(getattr(s, f) for f in key): s for s in sales}
+        conn = self._router.writer()
+        cur = None
+        try:
+            cur = conn.cursor()
+            self._execute(
+                cur,
+                sql.generate_upsert_sales_statement(len(by_key), key),
+                [getattr(s, c) for s in by_key.values() for c in self._cols],
+            )
+            rows = cur.fetchall()
+            self._router.wrote()
+        except self._null_err as error:
+            raise repo.RecordFieldNullErr(field=error.diag.column_name)
+        except (repo.TimeoutErr, self._timeout_err):
+            raise repo.TimeoutErr()
         except Exception:
             raise repo.RepositoryErr()
+        else:
+            result = repo.UpsertResultModel(
+                unchanged=len(by_key) - len(rows),
+                duplicates=len(sales) - len(by_key),
+            )
+            for id, *values, created_at in rows:
+                # Keys read back differ from those given when Postgres
+                # converted them, such as times with a time zone.
+                given = by_key.get(tuple(values))
+                sale = repo.SaleModel(
+                    **(vars(given) if given else dict(zip(key, values)))
+                )
+                sale.id = id
+                if given is not None and given.created_at == created_at:
+                    result.inserted.append(sale)
+                else:
+                    result.updated.append(sale)
+            return result
         finally:
-            self._conn.commit()
             if cur is not None:
                 cur.close()
+            self._router.release(conn)
 
     def delete_by_id(self, id: str) -> None:
         """Delete a sale by id."""
+        conn = self._router.writer()
         cur = None
         try:
-            cur = self._conn.cursor()
-            cur.execute(sql.DELETE_SALE_BY_ID_STATEMENT, (id,))
+            cur = conn.cursor()
+            self._execute(cur, sql.DELETE_SALE_BY_ID_STATEMENT, (id,))
+            self._router.wrote()
+        except (repo.TimeoutErr, self._timeout_err):
+            raise repo.TimeoutErr()
         except Exception:
             raise repo.RepositoryErr()
         else:
             if cur.rowcount != 1:
                 raise repo.RecordNotFoundErr()
         finally:
-            self._conn.commit()
             if cur is not None:
                 cur.close()
+            self._router.release(conn)
 
-    def update(self, sale: repo.SaleModel, fields: List[str]) -> None:
-        """Update a sale."""
-        cur = None
+    def update(
+        self,
+        sale: repo.SaleModel,
+        fields: List[str],
+        expected_updated_at: Optional[datetime] = None,
+    ) -> repo.SaleModel:
+        """
+        Update a sale and return it as updated. Given the "updated_at"
+        the caller last read, the sale is only updated if unchanged
+        since, and 'RecordConflictErr' is raised otherwise.
+        """
         values = utils.extract_update_values(sale, fields)
+        versioned = expected_updated_at is not None
+        if versioned:
+            values += (expected_updated_at,)
+        conn = self._router.writer()
+        cur = None
+        exists = False
         try:
-            cur = self._conn.cursor()
-            stmt = sql.generate_update_sale_statement(fields)
-            cur.execute(
+            cur = conn.cursor()
+            stmt = sql.generate_update_sale_statement(fields, versioned)
+            self._execute(
+                cur,
                 stmt,
                 values,
             )
+            row = cur.fetchone()
+            if row is None and versioned:
+                self._execute(cur, sql.SALE_EXISTS_STATEMENT, (sale.id,))
+                exists = cur.fetchone() is not None
+            self._router.wrote()
         except self._null_err as error:
             column = error.diag.column_name
             raise repo.RecordFieldNullErr(field=column)
+        except (repo.TimeoutErr, self._timeout_err):
+            raise repo.TimeoutErr()
         except Exception:
             raise repo.RepositoryErr()
+        else:
+            if row is None:
+                if exists:
+                    raise repo.RecordConflictErr()
+                raise repo.RecordNotFoundErr()
+            return repo.SaleModel(**utils.row_to_dict(self._cols, row))
         finally:
-            self._conn.commit()
             if cur is not None:
                 cur.close()
+            self._router.release(conn)
 
     def find(
-        self, id: str, limit: int = 10, after: bool = True
+        self,
+        id: str,
+        limit: int = 10,
+        after: bool = True,
+        filters: Optional[Dict[str, Any]] = None,
+        fields: Optional[Sequence[str]] = None,
     ) -> List[repo.SaleModel]:
         """
-        Get sales before or after sale with id, where sales
-        listed in descending order by column created_at
+        Get sales strictly before or after sale with id, listed in
+        descending order by (created_at, id). Given fields, only those
+        and "id" are read.
         """
-        if limit > 100 or limit < 1:
-            raise ValueError(
-                '"limit" argument must be between 1 and 100 inclusive.'
+        utils.check_limit(limit)
+        columns = sql.generate_projection(fields)
+        stmt, params = sql.generate_select_sales_statement(
+            filters or {}, after, columns
+        )
+        conn = self._router.reader()
+        cur = None
+        try:
+            cur = conn.cursor()
+            self._execute(cur, stmt, {**params, "id": id, "limit": limit})
+            rows = cur.fetchall()
+        except (repo.TimeoutErr, self._timeout_err):
+            raise repo.TimeoutErr()
+        except Exception:
+            self._router.failed(conn)
+            raise repo.RepositoryErr()
+        else:
+            return [
+                repo.SaleModel(**utils.row_to_dict(columns, row))
+                for row in rows
+            ]
+        finally:
+            if cur is not None:
+                cur.close()
+            self._router.release(conn)
+
+    def find_from(
+        self,
+        created_at: datetime,
+        id: str,
+        limit: int = 10,
+        after: bool = True,
+        filters: Optional[Dict[str, Any]] = None,
+        fields: Optional[Sequence[str]] = None,
+    ) -> List[repo.SaleModel]:
+        """
+        Get sales strictly before or after (created_at, id) key, listed
+        in descending order by key. Unlike "find", the anchor sale does
+        not need to exist in this database.
+        """
+        utils.check_limit(limit)
+        columns = sql.generate_projection(fields)
+        stmt, params = sql.generate_select_sales_from_key_statement(
+            filters or {}, after, columns
+        )
+        conn = self._router.reader()
+        cur = None
+        try:
+            cur = conn.cursor()
+            self._execute(
+                cur,
+                stmt,
+                {**params, "created_at": created_at, "id": id, "limit": limit},
             )
+            rows = cur.fetchall()
+        except (repo.TimeoutErr, self._timeout_err):
+            raise repo.TimeoutErr()
+        except Exception:
+            self._router.failed(conn)
+            raise repo.RepositoryErr()
+        else:
+            return [
+                repo.SaleModel(**utils.row_to_dict(columns, row))
+                for row in rows
+            ]
+        finally:
+            if cur is not None:
+                cur.close()
+            self._router.release(conn)
+
+    def find_archived_by_id(
+        self, id: str, fields: Optional[Sequence[str]] = None
+    ) -> repo.SaleModel:
+        """
+        Find a single archived sale by id, reading only the archive batch
+        that the id index points to.
+        """
+        columns = sql.generate_projection(fields)
+        conn = self._router.reader()
         cur = None
-        stmt = (
-            sql.SELECT_SALES_AFTER_STATEMENT
-            if after
-            else sql.SELECT_SALES_BEFORE_STATEMENT
+        try:
+            cur = conn.cursor()
+            self._execute(
+                cur, sql.SELECT_ARCHIVED_BATCH_BY_SALE_ID_STATEMENT, (id,)
+            )
+            row = cur.fetchone()
+        except (repo.TimeoutErr, self._timeout_err):
+            raise repo.TimeoutErr()
+        except Exception:
+            self._router.failed(conn)
+            raise repo.RepositoryErr()
+        else:
+            found = None
+            if row is not None:
+                found = archive.find_in_batch(bytes(row[0]), id)
+            if found is None:
+                raise repo.RecordNotFoundErr()
+            return repo.SaleModel(**{c: found[c] for c in columns})
+        finally:
+            if cur is not None:
+                cur.close()
+            self._router.release(conn)
+
+    def find_archived(
+        self,
+        created_at: datetime,
+        id: str,
+        limit: int = 10,
+        after: bool = True,
+        filters: Optional[Dict[str, Any]] = None,
+        fields: Optional[Sequence[str]] = None,
+    ) -> List[repo.SaleModel]:
+        """
+        Get archived sales before or after the sale with id created at
+        created_at, as "find" would if they were not archived, listed in
+        descending order by (created_at, id). Batches that can hold
+        matching sales are read nearest first, until no further batch can
+        hold a nearer sale, or "sale_sql.MAX_ARCHIVED_BATCHES" were read.
+        """
+        utils.check_limit(limit)
+        columns = sql.generate_projection(fields)
+        filters = filters or {}
+        stmt, params = sql.generate_select_archived_batches_statement(
+            filters, after
         )
+        params["created_at"] = created_at
+        params["max_batches"] = sql.MAX_ARCHIVED_BATCHES
+        start, end = filters.get("date_time", (None, None))
+        conn = self._router.reader()
+        cur = None
+        found = []
+        try:
+            cur = conn.cursor()
+            self._execute(cur, stmt, params)
+            batches = cur.fetchall()
+            for batch, first, last, first_created, last_created in batches:
+                if len(found) >= limit:
+                    bound = found[limit - 1]["created_at"]
+                    if (
+                        last_created < bound
+                        if after
+                        else first_created > bound
+                    ):
+                        break
+                if (start is not None and last < start) or (
+                    end is not None and first > end
+                ):
+                    continue
+                self._execute(
+                    cur, sql.SELECT_ARCHIVED_BATCH_STATEMENT, (batch,)
+                )
+                (data,) = cur.fetchone()
+                for row in archive.batch_rows(
+                    archive.decode_batch(bytes(data))
+                ):
+                    if (
+                        (row["created_at"], row["id"]) < (created_at, id)
+                        if after
+                        else (row["created_at"], row["id"]) > (created_at, id)
+                    ) and archive.matches(row, filters):
+                        found.append(row)
+                found.sort(
+                    key=lambda r: (r["created_at"], r["id"]), reverse=after
+                )
+                del found[limit:]
+        except (repo.TimeoutErr, self._timeout_err):
+            raise repo.TimeoutErr()
+        except Exception:
+            self._router.failed(conn)
+            raise repo.RepositoryErr()
+        else:
+            if not after:
+                found.reverse()
+            return [
+                repo.SaleModel(**{c: row[c] for c in columns}) for row in found
+            ]
+        finally:
+            if cur is not None:
+                cur.close()
+            self._router.release(conn)
+
+    def archive_horizon(self) -> Optional[datetime]:
+        """Newest creation time of archived sales, None without any."""
+        conn = self._router.reader()
+        cur = None
+        try:
+            cur = conn.cursor()
+            self._execute(cur, sql.SELECT_ARCHIVE_HORIZON_STATEMENT)
+            (horizon,) = cur.fetchone()
+        except (repo.TimeoutErr, self._timeout_err):
+            raise repo.TimeoutErr()
+        except Exception:
+            self._router.failed(conn)
+            raise repo.RepositoryErr()
+        else:
+            return horizon
+        finally:
+            if cur is not None:
+                cur.close()
+            self._router.release(conn)
+
+    def find_latest(self, limit: int = 10) -> List[repo.SaleModel]:
+        """
+        Get newest sales, listed in descending order by (created_at, id).
+        Limit is not capped, so the whole head of the feed can be read.
+        """
+        if limit < 1:
+            raise ValueError('"limit" argument must be positive.')
+        conn = self._router.reader()
+        cur = None
         try:
-            cur = self._conn.cursor()
-            cur.execute(stmt, {"id": id, "limit": limit})
+            cur = conn.cursor()
+            self._execute(
+                cur, sql.SELECT_LATEST_SALES_STATEMENT, {"limit": limit}
+            )
             rows = cur.fetchall()
+        except (repo.TimeoutErr, self._timeout_err):
+            raise repo.TimeoutErr()
         except Exception:
+            self._router.failed(conn)
             raise repo.RepositoryErr()
         else:
             return [
@@ -165,6 +512,551 @@ class SaleRepository(repo.SaleRepository):
                 for row in rows
             ]
         finally:
-            self._conn.commit()
             if cur is not None:
                 cur.close()
+            self._router.release(conn)
+
+    def scan(
+        self,
+        after: Optional[str] = None,
+        limit: int = 1000,
+        fields: Optional[Sequence[str]] = None,
+    ) -> List[repo.SaleModel]:
+        """
+        Get batch of sales in id order, starting after id. Given fields,
+        only those and "id" are read.
+        """
+        columns = sql.generate_projection(fields)
+        stmt = sql.generate_scan_sales_statement(columns, after is not None)
+        conn = self._router.writer()
+        cur = None
+        try:
+            cur = conn.cursor()
+            self._execute(cur, stmt, {"id": after, "limit": limit})
+            rows = cur.fetchall()
+        except (repo.TimeoutErr, self._timeout_err):
+            raise repo.TimeoutErr()
+        except Exception:
+            raise repo.RepositoryErr()
+        else:
+            return [
+                repo.SaleModel(**utils.row_to_dict(columns, row))
+                for row in rows
+            ]
+        finally:
+            if cur is not None:
+                cur.close()
+            self._router.release(conn)
+
+    def iter_ids(self, batch_size: int = 10000) -> Iterator[str]:
+        """
+        Iterate over all sale ids in order. Ids are read in batches, so
+        that no transaction is held open while iterating, from the
+        primary, so that none written before are missed by lag of a
+        replica.
+        """
+        return self._iter_ids(
+            sql.SCAN_SALE_IDS_STATEMENT,
+            sql.SCAN_SALE_IDS_AFTER_STATEMENT,
+            batch_size,
+        )
+
+    def iter_archived_ids(self, batch_size: int = 10000) -> Iterator[str]:
+        """Iterate over all archived sale ids in order, in batches."""
+        return self._iter_ids(
+            sql.SCAN_ARCHIVED_SALE_IDS_STATEMENT,
+            sql.SCAN_ARCHIVED_SALE_IDS_AFTER_STATEMENT,
+            batch_size,
+        )
+
+    def _iter_ids(self, first_stmt, after_stmt, batch_size):
+        after = None
+        while True:
+            ids = self._scan_ids(
+                first_stmt if after is None else after_stmt, after, batch_size
+            )
+            yield from ids
+            if len(ids) < batch_size:
+                return
+            after = ids[-1]
+
+    def _scan_ids(self, stmt, after, limit):
+        """Get batch of ids selected by statement, starting after id."""
+        conn = self._router.writer()
+        cur = None
+        try:
+            cur = conn.cursor()
+            self._execute(cur, stmt, {"id": after, "limit": limit})
+            rows = cur.fetchall()
+        except (repo.TimeoutErr, self._timeout_err):
+            raise repo.TimeoutErr()
+        except Exception:
+            self._router.failed(conn)
+            raise repo.RepositoryErr()
+        else:
+            return [row[0] for row in rows]
+        finally:
+            if cur is not None:
+                cur.close()
+            self._router.release(conn)
+
+    def stream(
+        self,
+        filters: Optional[Dict[str, Any]] = None,
+        fields: Optional[Sequence[str]] = None,
+        batch_size: int = 1000,
+    ) -> Iterator[repo.SaleModel]:
+        """
+        Iterate over sales matching filters, newest first. Sales are
+        fetched batch_size at a time from a server-side cursor, on a
+        connection lent by the pools of the router for as long as the
+        stream is read, so that streams count against the pool size like
+        any other statement. The connection is released once the iterator
+        is exhausted or closed. Arguments are checked before anything is
+        read.
+        """
+        columns = sql.generate_projection(fields)
+        stmt, params = sql.generate_stream_sales_statement(
+            filters or {}, columns
+        )
+        return self._stream(stmt, params, columns, batch_size)
+
+    def _stream(self, stmt, params, columns, batch_size):
+        """Iterate over sales selected by statement, in batches."""
+        conn = self._router.reader()
+        cur = None
+        try:
+            cur = conn.cursor(name="sale_stream")
+            cur.itersize = batch_size
+            self._execute(cur, stmt, params)
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    return
+                for row in rows:
+                    yield repo.SaleModel(**utils.row_to_dict(columns, row))
+        except (repo.TimeoutErr, self._timeout_err):
+            raise repo.TimeoutErr()
+        except Exception:
+            self._router.failed(conn)
+            raise repo.RepositoryErr()
+        finally:
+            if cur is not None:
+                cur.close()
+            self._router.release(conn)
+
+    def find_version(
+        self,
+        id: str,
+        limit: int = 10,
+        after: bool = True,
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> repo.VersionModel:
+        """
+        Get version of the page of sales that "find" returns for the
+        same arguments, without reading the sales themselves.
+        """
+        utils.check_limit(limit)
+        stmt, params = sql.generate_select_sales_version_statement(
+            filters or {}, after
+        )
+        conn = self._router.reader()
+        cur = None
+        try:
+            cur = conn.cursor()
+            self._execute(cur, stmt, {**params, "id": id, "limit": limit})
+            count, updated_at, digest = cur.fetchone()
+        except (repo.TimeoutErr, self._timeout_err):
+            raise repo.TimeoutErr()
+        except Exception:
+            self._router.failed(conn)
+            raise repo.RepositoryErr()
+        else:
+            return repo.VersionModel(
+                count=count, updated_at=updated_at, digest=digest
+            )
+        finally:
+            if cur is not None:
+                cur.close()
+            self._router.release(conn)
+
+    def find_version_from(
+        self,
+        created_at: datetime,
+        id: str,
+        end_created_at: datetime,
+        end_id: str,
+        after: bool = True,
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> repo.VersionModel:
+        """
+        Get version of sales strictly before or after (created_at, id)
+        key, up to and including (end_created_at, end_id) key, without
+        reading the sales themselves. Like "find_from", the keys do not
+        need to be those of sales in this database.
+        """
+        stmt, params = sql.generate_select_sales_version_from_key_statement(
+            filters or {}, after
+        )
+        conn = self._router.reader()
+        cur = None
+        try:
+            cur = conn.cursor()
+            self._execute(
+                cur,
+                stmt,
+                {
+                    **params,
+                    "created_at": created_at,
+                    "id": id,
+                    "end_created_at": end_created_at,
+                    "end_id": end_id,
+                },
+            )
+            count, updated_at, digest = cur.fetchone()
+        except (repo.TimeoutErr, self._timeout_err):
+            raise repo.TimeoutErr()
+        except Exception:
+            self._router.failed(conn)
+            raise repo.RepositoryErr()
+        else:
+            return repo.VersionModel(
+                count=count, updated_at=updated_at, digest=digest
+            )
+        finally:
+            if cur is not None:
+                cur.close()
+            self._router.release(conn)
+
+    def count(
+        self, filters: Optional[Dict[str, Any]] = None, exact: bool = False
+    ) -> int:
+        """
+        Count sales matching filters. Unless exact, the count is
+        estimated from planner statistics instead of scanning the table.
+        """
+        clause, params = sql.generate_filter_clause(filters or {})
+        conn = self._router.reader()
+        cur = None
+        try:
+            cur = conn.cursor()
+            if exact:
+                self._execute(cur, sql.COUNT_SALES_STATEMENT + clause, params)
+                return cur.fetchone()[0]
+            if not clause:
+                self._execute(cur, sql.ESTIMATE_SALES_STATEMENT)
+                return max(int(cur.fetchone()[0]), 0)
+            self._execute(cur, sql.EXPLAIN_SALES_STATEMENT + clause, params)
+            plan = cur.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return int(plan[0]["Plan"]["Plan Rows"])
+        except (repo.TimeoutErr, self._timeout_err):
+            raise repo.TimeoutErr()
+        except Exception:
+            self._router.failed(conn)
+            raise repo.RepositoryErr()
+        finally:
+            if cur is not None:
+                cur.close()
+            self._router.release(conn)
+
+    def search(
+        self,
+        query: str,
+        fields: Sequence[str] = ("sku", "order_id"),
+        limit: int = 10,
+        cursor: Optional[str] = None,
+    ) -> repo.SalePageModel:
+        """
+        Search sales by prefix or similarity of fields to query, ranked
+        by similarity. Cursor of the returned page continues the search.
+        """
+        utils.check_limit(limit)
+        if not query:
+            raise ValueError('"query" argument cannot be empty.')
+        stmt = sql.generate_search_statement(fields, cursor is not None)
+        params = {
+            "query": query,
+            "prefix": utils.escape_like(query) + "%",
+            "limit": limit,
+        }
+        if cursor is not None:
+            params["score"], params["id"] = utils.decode_cursor(cursor)
+        conn = self._router.reader()
+        cur = None
+        try:
+            cur = conn.cursor()
+            self._execute(cur, stmt, params)
+            rows = cur.fetchall()
+        except (repo.TimeoutErr, self._timeout_err):
+            raise repo.TimeoutErr()
+        except Exception:
+            self._router.failed(conn)
+            raise repo.RepositoryErr()
+        else:
+            next_cursor = None
+            if len(rows) == limit:
+                next_cursor = utils.encode_cursor(rows[-1][-1], rows[-1][0])
+            return repo.SalePageModel(
+                sales=[
+                    repo.SaleModel(**utils.row_to_dict(self._cols, row))
+                    for row in rows
+                ],
+                cursor=next_cursor,
+                scores=[row[-1] for row in rows],
+            )
+        finally:
+            if cur is not None:
+                cur.close()
+            self._router.release(conn)
+
+    def execute_batch(
+        self, operations: List[repo.OperationModel], atomic: bool = True
+    ) -> List[repo.OperationResultModel]:
+        """
+        Execute create, update and delete operations in one transaction.
+        Atomic batches roll back at the first failing operation, others
+        roll back only the failing operation, to a savepoint. Invalid
+        operations fail before anything is executed.
+        """
+        utils.check_batch_size(len(operations))
+        results = [repo.OperationResultModel() for _ in operations]
+        params = []
+        for result, operation in zip(results, operations):
+            try:
+                params.append(self._operation_params(operation))
+            except ValueError as error:
+                params.append(None)
+                result.error = error
+        if atomic and any(result.error for result in results):
+            return results
+        conn = self._router.writer()
+        cur = None
+        try:
+            cur = conn.cursor()
+            if atomic:
+                self._execute_atomic(conn, cur, operations, params, results)
+            else:
+                self._execute_savepoints(cur, operations, params, results)
+            self._router.wrote()
+        except (repo.TimeoutErr, self._timeout_err):
+            conn.rollback()
+            raise repo.TimeoutErr()
+        except Exception:
+            conn.rollback()
+            raise repo.RepositoryErr()
+        finally:
+            if cur is not None:
+                cur.close()
+            self._router.release(conn)
+        return results
+
+    def _execute_atomic(self, conn, cur, operations, params, results):
+        """
+        Execute operations grouped into as few statements as possible,
+        rolling back the transaction at the first failing operation.
+        Errors that cannot be told apart from the operation causing them
+        fail the whole batch.
+        """
+        for kind, indexes in _batch_groups(operations):
+            try:
+                missing = self._execute_group(
+                    cur, kind, indexes, operations, params
+                )
+            except (self._null_err, self._duplicate_err) as error:
+                culprit = self._culprit(
+                    error, [operations[i].sale for i in indexes]
+                )
+                if culprit is None:
+                    raise
+                results[indexes[culprit]].error = self._record_error(error)
+                conn.rollback()
+                return
+            if missing is not None:
+                results[missing].error = repo.RecordNotFoundErr()
+                conn.rollback()
+                return
+        for result in results:
+            result.applied = True
+
+    def _execute_group(self, cur, kind, indexes, operations, params):
+        """Execute group of operations, returning index of missing sale."""
+        if kind == "create":
+            self._execute(
+                cur,
+                sql.generate_insert_sales_statement(len(indexes)),
+                tuple(value for i in indexes for value in params[i]),
+            )
+            return None
+        if kind == "delete":
+            self._execute(
+                cur,
+                sql.DELETE_SALES_BY_IDS_STATEMENT,
+                ([params[i][0] for i in indexes],),
+            )
+            deleted = {row[0] for row in cur.fetchall()}
+            return next(
+                (i for i in indexes if params[i][0] not in deleted), None
+            )
+        (index,) = indexes
+        self._execute(
+            cur,
+            sql.generate_update_sale_statement(operations[index].fields),
+            params[index],
+        )
+        return index if cur.rowcount != 1 else None
+
+    def _execute_savepoints(self, cur, operations, params, results):
+        """
+        Execute each operation behind a savepoint, sent in the same
+        round trip as the operation, rolling back failing operations.
+        """
+        savepoint = sql.BATCH_SAVEPOINT_STATEMENT
+        for index, operation in enumerate(operations):
+            if params[index] is None:
+                continue
+            stmt = savepoint + self._operation_statement(operation)
+            savepoint = sql.BATCH_NEXT_SAVEPOINT_STATEMENT
+            try:
+                self._execute(cur, stmt, params[index])
+            except (self._null_err, self._duplicate_err) as error:
+                cur.execute(sql.BATCH_ROLLBACK_STATEMENT)
+                results[index].error = self._record_error(error)
+                continue
+            if operation.kind != "create" and cur.rowcount != 1:
+                results[index].error = repo.RecordNotFoundErr()
+            else:
+                results[index].applied = True
+
+    def _operation_params(self, operation):
+        """Statement parameters of operation, checking its arguments."""
+        sale = operation.sale
+        if operation.kind == "update":
+            return utils.extract_update_values(sale, operation.fields or [])
+        if operation.kind not in ("create", "delete"):
+            raise ValueError(f'"{operation.kind}" not valid operation.')
+        if sale.id is None:
+            raise ValueError('Instance attribute "id" cannot be None.')
+        if operation.kind == "delete":
+            return (sale.id,)
+        return tuple(getattr(sale, col) for col in self._cols)
+
+    @staticmethod
+    def _operation_statement(operation):
+        """Statement executing a single operation."""
+        if operation.kind == "create":
+            return sql.INSERT_SALE_STATEMENT
+        if operation.kind == "delete":
+            return sql.DELETE_SALE_BY_ID_STATEMENT
+        return sql.generate_update_sale_statement(operation.fields)
+
+    def _culprit(self, error, sales):
+        """
+        Position of sale in group that caused error, None if it cannot
+        be told. Duplicates are found by the key Postgres reports, and of
+        sales in the group sharing it, the second one conflicted with the
+        first.
+        """
+        if len(sales) == 1:
+            return 0
+        if isinstance(error, self._null_err):
+            column = error.diag.column_name
+            for position, sale in enumerate(sales):
+                if getattr(sale, column, None) is None:
+                    return position
+            return None
+        match = _DUPLICATE_KEY.match(error.diag.message_detail or "")
+        if match is None:
+            return None
+        columns = match.group(1).split(", ")
+        positions = [
+            position
+            for position, sale in enumerate(sales)
+            if ", ".join(_key_text(getattr(sale, c, None)) for c in columns)
+            == match.group(2)
+        ]
+        if not positions:
+            return None
+        return positions[min(1, len(positions) - 1)]
+
+    def _record_error(self, error):
+        """Repository error of failed operation."""
+        if isinstance(error, self._null_err):
+            return repo.RecordFieldNullErr(field=error.diag.column_name)
+        constraint = error.diag.constraint_name
+        return repo.RecordFieldDuplicateErr(
+            field=utils.field_from_constraint(constraint)
+        )
+
+    def _execute(self, cur, *args):
+        """
+        Execute statement, limiting it to the time left until current
+        deadline. Postgres cancels the statement once the time is up.
+        """
+        remaining = deadline.remaining()
+        if remaining is not None:
+            if remaining <= 0:
+                raise repo.TimeoutErr()
+            cur.execute(
+                sql.SET_STATEMENT_TIMEOUT_STATEMENT,
+                (max(int(remaining * 1000), 1),),
+            )
+        with tracing.span(
+            tracing.STATEMENT_SPAN, statement=_statement_name(args[0])
+        ) as span:
+            cur.execute(*args)
+            if span is not None:
+                span.attributes["rows"] = cur.rowcount
+
+
+_DUPLICATE_KEY = re.compile(r"^Key \((.+)\)=\((.*)\) already exists\.$")
+
+
+def _key_text(value):
+    """Value as Postgres writes it in the detail of key errors."""
+    if isinstance(value, datetime):
+        return utils.pg_timestamp(value)
+    return str(value)
+
+
+_STATEMENT_NAMES = {
+    value: name[: -len("_STATEMENT")].lower()
+    for name, value in vars(sql).items()
+    if name.endswith("_STATEMENT") and isinstance(value, str)
+}
+
+
+def _statement_name(stmt):
+    """
+    Name of statement constant, or first keyword of generated
+    statements.
+    """
+    name = _STATEMENT_NAMES.get(stmt)
+    if name is not None:
+        return name
+    return stmt.split(None, 1)[0].lower()
+
+
+def _batch_groups(operations):
+    """
+    Group consecutive creates, and consecutive deletes of distinct ids,
+    so that each group is executed with a single statement. Updates set
+    different fields, so each is a group of its own.
+    """
+    groups = []
+    ids = set()
+    for index, operation in enumerate(operations):
+        kind = operation.kind
+        if (
+            groups
+            and kind != "update"
+            and groups[-1][0] == kind
+            and operation.sale.id not in ids
+        ):
+            groups[-1][1].append(index)
+        else:
+            groups.append((kind, [index]))
+            ids = set()
+        ids.add(operation.sale.id)
+    return groups
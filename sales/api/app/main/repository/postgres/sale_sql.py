@@ -9,32 +9,486 @@ FIELDS = (
 
 PARAMETERS = ("%s, " * FIELD_COUNT)[:-2]
 
+COLUMNS = tuple(FIELDS.split(", "))
+
+SET_STATEMENT_TIMEOUT_STATEMENT = "SET LOCAL statement_timeout = %s"
+
 SELECT_SALE_BY_ID_STATEMENT = (
     f"SELECT {FIELDS} FROM sale WHERE id = %s LIMIT 1"
 )
 
+
+def generate_projection(fields=None):
+    """
+    Columns selected for fields, in table order. Only whitelisted
+    columns are allowed and "id" is always selected. No fields selects
+    all columns.
+    """
+    if fields is None:
+        return COLUMNS
+    for f in fields:
+        if f not in COLUMNS:
+            raise ValueError(f'"{f}" not valid field.')
+    return tuple(c for c in COLUMNS if c == "id" or c in fields)
+
+
+def generate_select_sale_by_id_statement(columns=COLUMNS):
+    """Generate statement selecting columns of sale by id."""
+    if columns == COLUMNS:
+        return SELECT_SALE_BY_ID_STATEMENT
+    return f"SELECT {', '.join(columns)} FROM sale WHERE id = %s LIMIT 1"
+
+
 INSERT_SALE_STATEMENT = f'INSERT INTO "sale" ({FIELDS}) VALUES ({PARAMETERS})'
 
+INSERT_SALE_RETURNING_STATEMENT = f"{INSERT_SALE_STATEMENT} RETURNING {FIELDS}"
+
+SALE_EXISTS_STATEMENT = 'SELECT 1 FROM "sale" WHERE id = %s'
+
 DELETE_SALE_BY_ID_STATEMENT = 'DELETE FROM "sale" WHERE id = %s'
 
+DELETE_SALES_BY_IDS_STATEMENT = (
+    'DELETE FROM "sale" WHERE id = ANY(%s) RETURNING id'
+)
+
+BATCH_SAVEPOINT_STATEMENT = "SAVEPOINT batch_operation; "
+
+BATCH_NEXT_SAVEPOINT_STATEMENT = (
+    "RELEASE SAVEPOINT batch_operation; SAVEPOINT batch_operation; "
+)
+
+BATCH_ROLLBACK_STATEMENT = "ROLLBACK TO SAVEPOINT batch_operation"
+
+# Pages are keyed by (created_at, id), like the feed and the archive, so
+# sales created at the same time are neither repeated nor skipped.
+ANCHOR_KEY = '((SELECT created_at FROM "sale" WHERE id = %(id)s), %(id)s)'
+
 SELECT_SALES_AFTER_STATEMENT = (
-    f'SELECT {FIELDS} FROM "sale" WHERE created_at <= (SELECT created_at '
-    'FROM "sale" WHERE id = %(id)s) AND id <> %(id)s ORDER BY created_at '
-    "DESC LIMIT %(limit)s"
+    f'SELECT {FIELDS} FROM "sale" WHERE (created_at, id) < {ANCHOR_KEY} '
+    "ORDER BY created_at DESC, id DESC LIMIT %(limit)s"
 )
 
 SELECT_SALES_BEFORE_STATEMENT = (
-    f'SELECT * FROM (SELECT {FIELDS} FROM "sale" WHERE created_at >= '
-    '(SELECT created_at FROM "sale" WHERE id = %(id)s) AND id <> %(id)s '
-    'ORDER BY created_at ASC LIMIT %(limit)s) AS "filtered_sales" ORDER '
-    "BY created_at DESC"
+    f'SELECT * FROM (SELECT {FIELDS} FROM "sale" WHERE (created_at, id) > '
+    f"{ANCHOR_KEY} ORDER BY created_at ASC, id ASC LIMIT %(limit)s) AS "
+    '"filtered_sales" ORDER BY created_at DESC, id DESC'
+)
+
+SELECT_LATEST_SALES_STATEMENT = (
+    f'SELECT {FIELDS} FROM "sale" ORDER BY created_at DESC, id DESC '
+    "LIMIT %(limit)s"
+)
+
+# Digest of a page is the sum of the leading 60 bits of the MD5 of each
+# sale's id and update time, so that digests of pages read from several
+# shards add up to that of the merged page.
+VERSION_FIELDS = (
+    "COUNT(*), MAX(updated_at), "
+    "SUM(('x' || LEFT(MD5(id || ':' || updated_at), 15))::bit(60)::bigint)"
+    "::text"
+)
+
+SELECT_SALES_AFTER_VERSION_STATEMENT = (
+    f'SELECT {VERSION_FIELDS} FROM (SELECT id, updated_at FROM "sale" '
+    f"WHERE (created_at, id) < {ANCHOR_KEY} ORDER BY created_at DESC, id "
+    'DESC LIMIT %(limit)s) AS "page"'
+)
+
+SELECT_SALES_BEFORE_VERSION_STATEMENT = (
+    f'SELECT {VERSION_FIELDS} FROM (SELECT id, updated_at FROM "sale" '
+    f"WHERE (created_at, id) > {ANCHOR_KEY} ORDER BY created_at ASC, id "
+    'ASC LIMIT %(limit)s) AS "page"'
 )
 
+COUNT_SALES_STATEMENT = 'SELECT COUNT(*) FROM "sale"'
+
+# Statistics of a partitioned table are those of its partitions, since
+# the table itself holds no rows and is never analyzed. Partitions not
+# analyzed yet have -1 tuples, counted as none.
+ESTIMATE_SALES_STATEMENT = (
+    "SELECT COALESCE(SUM(GREATEST(c.reltuples, 0)), 0)::bigint FROM "
+    "pg_inherits AS i JOIN pg_class AS c ON c.oid = i.inhrelid WHERE "
+    "i.inhparent = 'sale'::regclass"
+)
+
+EXPLAIN_SALES_STATEMENT = 'EXPLAIN (FORMAT JSON) SELECT 1 FROM "sale"'
+
+FILTER_FIELDS = ("sku", "order_id")
+
+RANGE_FILTER_FIELDS = ("date_time",)
+
+PARTITION_KEY = "date_time"
+
+
+def generate_filter_conditions(filters):
+    """
+    Generate conditions and parameters for filters, only allowing
+    whitelisted fields. Range filters take a (start, end) pair of
+    inclusive bounds, either of which may be None.
+    """
+    conditions = []
+    params = {}
+    for f in sorted(filters):
+        if f in FILTER_FIELDS:
+            conditions.append(f"{f} = %({f})s")
+            params[f] = filters[f]
+        elif f in RANGE_FILTER_FIELDS:
+            try:
+                start, end = filters[f]
+            except (TypeError, ValueError):
+                raise ValueError(f'"{f}" filter must be (start, end) pair.')
+            if start is not None:
+                conditions.append(f"{f} >= %({f}_from)s")
+                params[f"{f}_from"] = start
+            if end is not None:
+                conditions.append(f"{f} <= %({f}_to)s")
+                params[f"{f}_to"] = end
+        else:
+            raise ValueError(f'"{f}" not valid filter.')
+    return conditions, params
+
+
+def generate_filter_clause(filters):
+    """Generate WHERE clause and parameters for filters."""
+    conditions, params = generate_filter_conditions(filters)
+    if not conditions:
+        return "", params
+    return " WHERE " + " AND ".join(conditions), params
+
+
+def generate_select_sales_statement(filters, after=True, columns=COLUMNS):
+    """
+    Generate statement and parameters for page of filtered sales,
+    selecting columns.
+    """
+    conditions, params = generate_filter_conditions(filters)
+    if not conditions and columns == COLUMNS:
+        if after:
+            return SELECT_SALES_AFTER_STATEMENT, params
+        return SELECT_SALES_BEFORE_STATEMENT, params
+    selected, outer = _ordered_projection(columns, after)
+    page = _generate_page_query(selected, conditions, filters, after)
+    if after:
+        return page, params
+    return (
+        f'SELECT {outer} FROM ({page}) AS "filtered_sales" ORDER BY '
+        "created_at DESC, id DESC",
+        params,
+    )
+
+
+def _ordered_projection(columns, after):
+    # Pages read in ascending order are re-sorted by an outer query,
+    # which needs the sort key even when it was not asked for.
+    if after or "created_at" in columns:
+        return ", ".join(columns), "*"
+    return ", ".join(columns + ("created_at",)), ", ".join(columns)
+
+
+def generate_select_sales_version_statement(filters, after=True):
+    """
+    Generate statement and parameters for version of page of filtered
+    sales.
+    """
+    conditions, params = generate_filter_conditions(filters)
+    if not conditions:
+        if after:
+            return SELECT_SALES_AFTER_VERSION_STATEMENT, params
+        return SELECT_SALES_BEFORE_VERSION_STATEMENT, params
+    page = _generate_page_query("id, updated_at", conditions, filters, after)
+    return f'SELECT {VERSION_FIELDS} FROM ({page}) AS "page"', params
+
+
+def _generate_page_query(columns, conditions, filters, after):
+    # Anchor of a page filtered by partition key comes from a previous
+    # page of the same listing, so the anchor lookup can be pruned too.
+    anchor, _ = generate_filter_conditions(
+        {f: v for f, v in filters.items() if f == PARTITION_KEY}
+    )
+    anchor = " AND ".join(["id = %(id)s"] + anchor)
+    op, order = ("<", "DESC") if after else (">", "ASC")
+    conditions = conditions + [
+        f"(created_at, id) {op} "
+        f'((SELECT created_at FROM "sale" WHERE {anchor}), %(id)s)'
+    ]
+    return (
+        f'SELECT {columns} FROM "sale" WHERE {" AND ".join(conditions)} '
+        f"ORDER BY created_at {order}, id {order} LIMIT %(limit)s"
+    )
+
+
+def generate_select_sales_from_key_statement(
+    filters, after=True, columns=COLUMNS
+):
+    """
+    Generate statement and parameters for page of filtered sales
+    strictly before or after (created_at, id) key, in descending order
+    by key, selecting columns.
+    """
+    conditions, params = generate_filter_conditions(filters)
+    op, order = ("<", "DESC") if after else (">", "ASC")
+    conditions = conditions + [
+        f"(created_at, id) {op} (%(created_at)s, %(id)s)"
+    ]
+    selected, outer = _ordered_projection(columns, after)
+    page = (
+        f'SELECT {selected} FROM "sale" WHERE {" AND ".join(conditions)} '
+        f"ORDER BY created_at {order}, id {order} LIMIT %(limit)s"
+    )
+    if after:
+        return page, params
+    return (
+        f'SELECT {outer} FROM ({page}) AS "filtered_sales" ORDER BY '
+        "created_at DESC, id DESC",
+        params,
+    )
+
+
+def generate_select_sales_version_from_key_statement(filters, after=True):
+    """
+    Generate statement and parameters for version of filtered sales
+    strictly before or after (created_at, id) key, up to and including
+    (end_created_at, end_id) key.
+    """
+    conditions, params = generate_filter_conditions(filters)
+    op, end = ("<", ">=") if after else (">", "<=")
+    conditions = conditions + [
+        f"(created_at, id) {op} (%(created_at)s, %(id)s)",
+        f"(created_at, id) {end} (%(end_created_at)s, %(end_id)s)",
+    ]
+    return (
+        f'SELECT {VERSION_FIELDS} FROM "sale" WHERE '
+        f'{" AND ".join(conditions)}',
+        params,
+    )
+
+
+SCAN_SALES_STATEMENT = (
+    f'SELECT {FIELDS} FROM "sale" ORDER BY id LIMIT %(limit)s'
+)
 
-def generate_update_sale_statement(fields):
-    """Generate statement for updating sale."""
+SCAN_SALES_AFTER_STATEMENT = (
+    f'SELECT {FIELDS} FROM "sale" WHERE id > %(id)s ORDER BY id '
+    "LIMIT %(limit)s"
+)
+
+
+def generate_scan_sales_statement(columns=COLUMNS, paginated=False):
+    """Generate statement for batch of sales in id order."""
+    if columns == COLUMNS:
+        return (
+            SCAN_SALES_AFTER_STATEMENT if paginated else SCAN_SALES_STATEMENT
+        )
+    where = " WHERE id > %(id)s" if paginated else ""
+    return (
+        f'SELECT {", ".join(columns)} FROM "sale"{where} ORDER BY id '
+        "LIMIT %(limit)s"
+    )
+
+
+def generate_stream_sales_statement(filters, columns=COLUMNS):
+    """
+    Generate statement and parameters for all filtered sales, newest
+    first. Sales are ordered like pages, by created_at, then id, so
+    that streams of shards merge into one order and the first rows are
+    read from indexes without reading the rest.
+    """
+    where, params = generate_filter_clause(filters)
+    return (
+        f'SELECT {", ".join(columns)} FROM "sale"{where} '
+        "ORDER BY created_at DESC, id DESC",
+        params,
+    )
+
+
+SCAN_SALE_IDS_STATEMENT = 'SELECT id FROM "sale" ORDER BY id LIMIT %(limit)s'
+
+SCAN_SALE_IDS_AFTER_STATEMENT = (
+    'SELECT id FROM "sale" WHERE id > %(id)s ORDER BY id LIMIT %(limit)s'
+)
+
+SCAN_ARCHIVED_SALE_IDS_STATEMENT = (
+    'SELECT id FROM "archived_sale_id" ORDER BY id LIMIT %(limit)s'
+)
+
+SCAN_ARCHIVED_SALE_IDS_AFTER_STATEMENT = (
+    'SELECT id FROM "archived_sale_id" WHERE id > %(id)s ORDER BY id '
+    "LIMIT %(limit)s"
+)
+
+SEARCH_FIELDS = ("sku", "order_id")
+
+
+def generate_search_statement(fields, paginated):
+    """
+    Generate statement searching fields by prefix and trigram
+    similarity. Prefix matches score highest and results are ordered
+    by score, then id, so pages can continue from last (score, id).
+    """
+    if not fields:
+        raise ValueError('"fields" argument cannot be empty.')
+    scores = []
+    conditions = []
+    for f in fields:
+        if f not in SEARCH_FIELDS:
+            raise ValueError(f'"{f}" not valid search field.')
+        scores.append(
+            f"CASE WHEN {f} LIKE %(prefix)s THEN 1::real "
+            f"ELSE similarity({f}, %(query)s) END"
+        )
+        conditions.append(f"{f} LIKE %(prefix)s OR {f} %% %(query)s")
+    score = scores[0] if len(scores) == 1 else f"GREATEST({', '.join(scores)})"
+    query = (
+        f"SELECT {FIELDS}, score FROM (SELECT {FIELDS}, {score} AS score "
+        f'FROM "sale" WHERE {" OR ".join(conditions)}) AS "matches"'
+    )
+    if paginated:
+        query += " WHERE (score, id) < (%(score)s::real, %(id)s)"
+    return query + " ORDER BY score DESC, id DESC LIMIT %(limit)s"
+
+
+def generate_insert_sales_statement(count):
+    """Generate statement for inserting count sales at once."""
+    return f'INSERT INTO "sale" ({FIELDS}) VALUES ' + ", ".join(
+        [f"({PARAMETERS})"] * count
+    )
+
+
+UPSERT_FIELDS = ("quantity", "subtotal", "fee", "tax")
+
+
+def generate_upsert_sales_statement(count, key):
+    """
+    Generate statement inserting count sales, or updating the sale with
+    the same key instead, unless none of its values would change. Only
+    sales inserted or updated are returned, with their key and creation
+    time, which updates leave as it was. System columns such as "xmax"
+    cannot be returned from the partitioned sale table. The key must have
+    a unique index.
+    """
+    key_columns = ", ".join(key)
+    assignments = ", ".join(
+        f"{f} = EXCLUDED.{f}" for f in UPSERT_FIELDS + ("updated_at",)
+    )
+    current = ", ".join(f'"sale".{f}' for f in UPSERT_FIELDS)
+    excluded = ", ".join(f"EXCLUDED.{f}" for f in UPSERT_FIELDS)
+    return (
+        f"{generate_insert_sales_statement(count)} "
+        f"ON CONFLICT ({key_columns}) DO UPDATE SET {assignments} "
+        f"WHERE ({current}) IS DISTINCT FROM ({excluded}) "
+        f"RETURNING id, {key_columns}, created_at"
+    )
+
+
+def generate_update_sale_statement(fields, versioned=False):
+    """
+    Generate statement for updating sale and returning it as updated.
+    Versioned statements only update the sale if "updated_at" matches.
+    """
     query = 'UPDATE "sale" SET '
     for f in fields:
         query += f + " = (%s), "
     query = query[:-2] + " WHERE id = (%s)"
-    return query
+    if versioned:
+        query += " AND updated_at = (%s)"
+    return query + f" RETURNING {FIELDS}"
+
+
+SELECT_ARCHIVABLE_SALES_STATEMENT = (
+    f'SELECT {FIELDS} FROM "sale" WHERE date_time < %(cutoff)s ORDER BY '
+    "date_time, id LIMIT %(limit)s FOR UPDATE"
+)
+
+INSERT_ARCHIVED_BATCH_STATEMENT = (
+    'INSERT INTO "archived_sale_batch" (month, first_date_time, '
+    "last_date_time, first_created_at, last_created_at, row_count, skus, "
+    "order_ids, data) VALUES (%(month)s, %(first_date_time)s, "
+    "%(last_date_time)s, %(first_created_at)s, %(last_created_at)s, "
+    "%(row_count)s, %(skus)s, %(order_ids)s, %(data)s) RETURNING id"
+)
+
+INSERT_ARCHIVED_IDS_STATEMENT = (
+    'INSERT INTO "archived_sale_id" (id, batch_id) SELECT '
+    "UNNEST(%(ids)s::text[]), %(batch_id)s ON CONFLICT (id) DO UPDATE SET "
+    "batch_id = EXCLUDED.batch_id"
+)
+
+SELECT_ARCHIVED_BATCH_BY_SALE_ID_STATEMENT = (
+    'SELECT b.data FROM "archived_sale_id" AS i JOIN "archived_sale_batch" '
+    "AS b ON b.id = i.batch_id WHERE i.id = %s"
+)
+
+ARCHIVED_BATCH_FIELDS = (
+    "id, first_date_time, last_date_time, first_created_at, last_created_at"
+)
+
+# Most archived batches read for a page. Pages of filters that few
+# archived sales match could otherwise read every batch, so they can miss
+# archived sales further away than this.
+MAX_ARCHIVED_BATCHES = 64
+
+ARCHIVED_KEY_COLUMNS = {"sku": "skus", "order_id": "order_ids"}
+
+SELECT_ARCHIVED_BATCHES_BEFORE_STATEMENT = (
+    f'SELECT {ARCHIVED_BATCH_FIELDS} FROM "archived_sale_batch" WHERE '
+    "first_created_at <= %(created_at)s ORDER BY last_created_at DESC "
+    "LIMIT %(max_batches)s"
+)
+
+SELECT_ARCHIVED_BATCHES_AFTER_STATEMENT = (
+    f'SELECT {ARCHIVED_BATCH_FIELDS} FROM "archived_sale_batch" WHERE '
+    "last_created_at >= %(created_at)s ORDER BY first_created_at ASC "
+    "LIMIT %(max_batches)s"
+)
+
+
+def generate_select_archived_batches_statement(filters, after=True):
+    """
+    Generate statement and parameters for bounds of archived batches
+    before or after a creation time, leaving out batches that hold no
+    sales with the filtered keys or no sales in the date_time range.
+    """
+    generate_filter_conditions(filters)
+    conditions = []
+    params = {}
+    for f in sorted(filters):
+        if f in ARCHIVED_KEY_COLUMNS:
+            conditions.append(
+                f"{ARCHIVED_KEY_COLUMNS[f]} @> ARRAY[%({f})s]::text[]"
+            )
+            params[f] = filters[f]
+        else:
+            start, end = filters[f]
+            if start is not None:
+                conditions.append(f"last_{f} >= %({f}_from)s")
+                params[f"{f}_from"] = start
+            if end is not None:
+                conditions.append(f"first_{f} <= %({f}_to)s")
+                params[f"{f}_to"] = end
+    if not conditions:
+        if after:
+            return SELECT_ARCHIVED_BATCHES_BEFORE_STATEMENT, params
+        return SELECT_ARCHIVED_BATCHES_AFTER_STATEMENT, params
+    where = " AND ".join(conditions)
+    if after:
+        return (
+            f'SELECT {ARCHIVED_BATCH_FIELDS} FROM "archived_sale_batch" '
+            f"WHERE first_created_at <= %(created_at)s AND {where} "
+            "ORDER BY last_created_at DESC LIMIT %(max_batches)s",
+            params,
+        )
+    return (
+        f'SELECT {ARCHIVED_BATCH_FIELDS} FROM "archived_sale_batch" '
+        f"WHERE last_created_at >= %(created_at)s AND {where} "
+        "ORDER BY first_created_at ASC LIMIT %(max_batches)s",
+        params,
+    )
+
+
+SELECT_ARCHIVED_BATCH_STATEMENT = (
+    'SELECT data FROM "archived_sale_batch" WHERE id = %s'
+)
+
+SELECT_ARCHIVE_HORIZON_STATEMENT = (
+    'SELECT MAX(last_created_at) FROM "archived_sale_batch"'
+)
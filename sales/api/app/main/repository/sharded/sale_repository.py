@@ -0,0 +1,356 @@
+"""Sharded Sale Repository."""
+import contextvars
+from datetime import datetime
+import hashlib
+import heapq
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from app.main import repository as repo
+from app.main.repository import utils
+from app.main.repository.postgres import sale_repository as pg
+
+
+def provide_sale_repository(shards: Dict[str, pg.SaleRepository]):
+    """Initialize and return repository."""
+    return SaleRepository(shards=shards)
+
+
+def owner(names: Sequence[str], id: str) -> str:
+    """
+    Name of shard owning id, by rendezvous hashing, so that adding a
+    shard only moves the ids the new shard wins.
+    """
+    return max(names, key=lambda name: _weight(name, id))
+
+
+def _weight(name, id):
+    digest = hashlib.blake2b(f"{name}:{id}".encode(), digest_size=8)
+    return int.from_bytes(digest.digest(), "big")
+
+
+class SaleRepository(repo.SaleRepository):
+    """
+    Sale repository sharded across Postgres repositories by hash of id.
+    Listings are gathered from all shards in parallel and merged on
+    (created_at, id), so ties on created_at are ordered by id.
+    """
+
+    def __init__(self, shards: Dict[str, pg.SaleRepository]):
+        """Inject shard repositories by shard name."""
+        if not shards:
+            raise ValueError('"shards" argument cannot be empty.')
+        self._shards = shards
+        self._names = sorted(shards)
+        self._executor = ThreadPoolExecutor(max_workers=len(shards))
+
+    def close(self) -> None:
+        """Close all shards."""
+        self._executor.shutdown()
+        for shard in self._shards.values():
+            shard.close()
+
+    def shard(self, id: str) -> pg.SaleRepository:
+        """Shard owning id."""
+        return self._shards[owner(self._names, id)]
+
+    def find_by_id(
+        self, id: str, fields: Optional[Sequence[str]] = None
+    ) -> repo.SaleModel:
+        """Find a single sale by id."""
+        return self.shard(id).find_by_id(id, fields)
+
+    def create(self, sale: repo.SaleModel) -> repo.SaleModel:
+        """Create a sale."""
+        if sale.id is None:
+            raise ValueError('Instance attribute "id" cannot be None.')
+        return self.shard(sale.id).create(sale)
+
+    def delete_by_id(self, id: str) -> None:
+        """Delete a sale by id."""
+        self.shard(id).delete_by_id(id)
+
+    def update(
+        self,
+        sale: repo.SaleModel,
+        fields: List[str],
+        expected_updated_at: Optional[datetime] = None,
+    ) -> repo.SaleModel:
+        """Update a sale."""
+        if sale.id is None:
+            raise ValueError('Instance attribute "id" cannot be None.')
+        return self.shard(sale.id).update(sale, fields, expected_updated_at)
+
+    def find(
+        self,
+        id: str,
+        limit: int = 10,
+        after: bool = True,
+        filters: Optional[Dict[str, Any]] = None,
+        fields: Optional[Sequence[str]] = None,
+    ) -> List[repo.SaleModel]:
+        """
+        Get sales strictly before or after sale with id, listed in
+        descending order by (created_at, id). Given fields,
+        "created_at" is read as well, to merge pages on.
+        """
+        utils.check_limit(limit)
+        try:
+            anchor = self.find_by_id(id, ("created_at",))
+        except repo.RecordNotFoundErr:
+            return []
+        if fields is not None:
+            fields = list(fields) + ["created_at"]
+        pages = self._gather(
+            lambda shard: shard.find_from(
+                anchor.created_at, anchor.id, limit, after, filters, fields
+            )
+        )
+        merged = list(
+            heapq.merge(
+                *pages, key=lambda s: (s.created_at, s.id), reverse=True
+            )
+        )
+        return merged[:limit] if after else merged[-limit:]
+
+    def find_latest(self, limit: int = 10) -> List[repo.SaleModel]:
+        """Get newest sales from all shards."""
+        pages = self._gather(lambda shard: shard.find_latest(limit))
+        merged = heapq.merge(
+            *pages, key=lambda s: (s.created_at, s.id), reverse=True
+        )
+        return list(merged)[:limit]
+
+    def find_version(
+        self,
+        id: str,
+        limit: int = 10,
+        after: bool = True,
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> repo.VersionModel:
+        """
+        Get version of the page of sales that "find" returns. Only keys
+        of sales are read to find where the merged page ends, then each
+        shard versions its sales up to there.
+        """
+        utils.check_limit(limit)
+        try:
+            anchor = self.find_by_id(id, ("created_at",))
+        except repo.RecordNotFoundErr:
+            return repo.VersionModel()
+        keys = self._gather(
+            lambda shard: shard.find_from(
+                anchor.created_at,
+                anchor.id,
+                limit,
+                after,
+                filters,
+                ["created_at"],
+            )
+        )
+        merged = list(
+            heapq.merge(
+                *keys, key=lambda s: (s.created_at, s.id), reverse=True
+            )
+        )
+        page = merged[:limit] if after else merged[-limit:]
+        if not page:
+            return repo.VersionModel()
+        end = page[-1] if after else page[0]
+        versions = self._gather(
+            lambda shard: shard.find_version_from(
+                anchor.created_at,
+                anchor.id,
+                end.created_at,
+                end.id,
+                after,
+                filters,
+            )
+        )
+        return repo.VersionModel(
+            count=sum(v.count for v in versions),
+            updated_at=max(
+                (v.updated_at for v in versions if v.updated_at), default=None
+            ),
+            digest=utils.combine_digests(v.digest for v in versions),
+        )
+
+    def count(
+        self, filters: Optional[Dict[str, Any]] = None, exact: bool = False
+    ) -> int:
+        """Count sales matching filters across all shards."""
+        return sum(self._gather(lambda shard: shard.count(filters, exact)))
+
+    def search(
+        self,
+        query: str,
+        fields: Sequence[str] = ("sku", "order_id"),
+        limit: int = 10,
+        cursor: Optional[str] = None,
+    ) -> repo.SalePageModel:
+        """Search sales on all shards, merged by score."""
+        pages = self._gather(
+            lambda shard: shard.search(query, fields, limit, cursor)
+        )
+        merged = heapq.merge(
+            *[zip(p.scores, p.sales) for p in pages],
+            key=lambda r: (r[0], r[1].id),
+            reverse=True,
+        )
+        results = list(merged)[:limit]
+        next_cursor = None
+        if len(results) == limit:
+            score, sale = results[-1]
+            next_cursor = utils.encode_cursor(score, sale.id)
+        return repo.SalePageModel(
+            sales=[s for _, s in results],
+            cursor=next_cursor,
+            scores=[score for score, _ in results],
+        )
+
+    def iter_ids(self, batch_size: int = 10000) -> Iterator[str]:
+        """Iterate over sale ids of each shard in turn."""
+        return itertools.chain.from_iterable(
+            self._shards[name].iter_ids(batch_size) for name in self._names
+        )
+
+    def stream(
+        self,
+        filters: Optional[Dict[str, Any]] = None,
+        fields: Optional[Sequence[str]] = None,
+        batch_size: int = 1000,
+    ) -> Iterator[repo.SaleModel]:
+        """
+        Iterate over sales matching filters of all shards, merged newest
+        first. Given fields, "created_at" is read as well, to merge on.
+        """
+        if fields is not None:
+            fields = list(fields) + ["created_at"]
+        streams = [
+            self._shards[name].stream(filters, fields, batch_size)
+            for name in self._names
+        ]
+        return _merged(streams)
+
+    def execute_batch(
+        self, operations: List[repo.OperationModel], atomic: bool = True
+    ) -> List[repo.OperationResultModel]:
+        """
+        Execute operations on the shards owning their sales, in parallel.
+        Shards do not share transactions, so an atomic batch must have
+        all of its sales owned by a single shard.
+        """
+        utils.check_batch_size(len(operations))
+        results = [repo.OperationResultModel() for _ in operations]
+        by_shard = {}
+        for index, operation in enumerate(operations):
+            if operation.sale.id is None:
+                results[index].error = ValueError(
+                    'Instance attribute "id" cannot be None.'
+                )
+                continue
+            name = owner(self._names, operation.sale.id)
+            by_shard.setdefault(name, []).append(index)
+        if atomic and len(by_shard) > 1:
+            raise ValueError("Atomic batch cannot span shards.")
+        if atomic and any(result.error for result in results):
+            return results
+        futures = {
+            name: self._executor.submit(
+                contextvars.copy_context().run,
+                self._shards[name].execute_batch,
+                [operations[i] for i in indexes],
+                atomic,
+            )
+            for name, indexes in by_shard.items()
+        }
+        for name, indexes in by_shard.items():
+            for index, result in zip(indexes, futures[name].result()):
+                results[index] = result
+        return results
+
+    def upsert(
+        self,
+        sales: List[repo.SaleModel],
+        key: Sequence[str] = repo.NATURAL_KEY,
+    ) -> repo.UpsertResultModel:
+        """
+        Insert or update sales by key on the shards owning their ids, in
+        parallel. Keys are only unique within a shard, so sales must be
+        given ids derived from their key to be upserted idempotently.
+        """
+        utils.check_batch_size(len(sales))
+        by_shard = {}
+        for sale in sales:
+            if sale.id is None:
+                raise ValueError('Instance attribute "id" cannot be None.')
+            by_shard.setdefault(owner(self._names, sale.id), []).append(sale)
+        futures = [
+            self._executor.submit(
+                contextvars.copy_context().run,
+                self._shards[name].upsert,
+                shard_sales,
+                key,
+            )
+            for name, shard_sales in by_shard.items()
+        ]
+        result = repo.UpsertResultModel()
+        for future in futures:
+            shard_result = future.result()
+            result.inserted += shard_result.inserted
+            result.updated += shard_result.updated
+            result.unchanged += shard_result.unchanged
+            result.duplicates += shard_result.duplicates
+        return result
+
+    def _gather(self, call):
+        futures = [
+            self._executor.submit(
+                contextvars.copy_context().run, call, self._shards[name]
+            )
+            for name in self._names
+        ]
+        return [f.result() for f in futures]
+
+
+def rebalance(
+    shards: Dict[str, pg.SaleRepository], batch_size: int = 1000
+) -> int:
+    """
+    Move every sale to the shard owning its id, after shards were added
+    or removed. Sales are copied before they are deleted from their old
+    shard, so rerunning after an interruption completes the move.
+    Returns number of sales moved.
+    """
+    names = sorted(shards)
+    moved = 0
+    for name, shard in shards.items():
+        after = None
+        while True:
+            batch = shard.scan(after, batch_size)
+            if not batch:
+                break
+            after = batch[-1].id
+            for sale in batch:
+                target = owner(names, sale.id)
+                if target == name:
+                    continue
+                try:
+                    shards[target].create(sale)
+                except repo.RecordFieldDuplicateErr:
+                    pass
+                shard.delete_by_id(sale.id)
+                moved += 1
+    return moved
+
+
+def _merged(streams):
+    """Merge streams newest first, closing all of them when done."""
+    try:
+        yield from heapq.merge(
+            *streams, key=lambda s: (s.created_at, s.id), reverse=True
+        )
+    finally:
+        for stream in streams:
+            stream.close()
@@ -0,0 +1,138 @@
+"""Traced Sale Repository."""
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from app.main import repository as repo
+from app.main.helper import tracing
+
+
+def provide_sale_repository(repository: repo.SaleRepository):
+    """Initialize and return repository."""
+    return SaleRepository(repository=repository)
+
+
+class SaleRepository(repo.SaleRepository):
+    """
+    Sale repository recording each call as a span of the current trace,
+    so time spent in the repository can be told apart from time spent
+    by its callers.
+    """
+
+    def __init__(self, repository: repo.SaleRepository):
+        """Inject repository."""
+        self._repository = repository
+
+    def close(self) -> None:
+        """Close repository."""
+        self._repository.close()
+
+    def metrics(self) -> Dict[str, Any]:
+        """Metrics of repository."""
+        return self._repository.metrics()
+
+    def find_by_id(
+        self, id: str, fields: Optional[Sequence[str]] = None
+    ) -> repo.SaleModel:
+        """Find a single sale by id."""
+        with tracing.span("repository.find_by_id"):
+            return self._repository.find_by_id(id, fields)
+
+    def create(self, sale: repo.SaleModel) -> repo.SaleModel:
+        """Create a sale."""
+        with tracing.span("repository.create"):
+            return self._repository.create(sale)
+
+    def delete_by_id(self, id: str) -> None:
+        """Delete a sale by id."""
+        with tracing.span("repository.delete_by_id"):
+            self._repository.delete_by_id(id)
+
+    def update(
+        self,
+        sale: repo.SaleModel,
+        fields: List[str],
+        expected_updated_at: Optional[datetime] = None,
+    ) -> repo.SaleModel:
+        """Update a sale."""
+        with tracing.span("repository.update"):
+            return self._repository.update(sale, fields, expected_updated_at)
+
+    def find(
+        self,
+        id: str,
+        limit: int = 10,
+        after: bool = True,
+        filters: Optional[Dict[str, Any]] = None,
+        fields: Optional[Sequence[str]] = None,
+    ) -> List[repo.SaleModel]:
+        """Get sales before or after sale with id."""
+        with tracing.span("repository.find", limit=limit) as span:
+            sales = self._repository.find(id, limit, after, filters, fields)
+            if span is not None:
+                span.attributes["rows"] = len(sales)
+            return sales
+
+    def find_latest(self, limit: int = 10) -> List[repo.SaleModel]:
+        """Get newest sales."""
+        with tracing.span("repository.find_latest", limit=limit):
+            return self._repository.find_latest(limit)
+
+    def find_version(
+        self,
+        id: str,
+        limit: int = 10,
+        after: bool = True,
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> repo.VersionModel:
+        """Get version of the page of sales that "find" returns."""
+        with tracing.span("repository.find_version", limit=limit):
+            return self._repository.find_version(id, limit, after, filters)
+
+    def count(
+        self, filters: Optional[Dict[str, Any]] = None, exact: bool = False
+    ) -> int:
+        """Count sales matching filters."""
+        with tracing.span("repository.count", exact=exact):
+            return self._repository.count(filters, exact)
+
+    def search(
+        self,
+        query: str,
+        fields: Sequence[str] = ("sku", "order_id"),
+        limit: int = 10,
+        cursor: Optional[str] = None,
+    ) -> repo.SalePageModel:
+        """Search sales by prefix or similarity of fields to query."""
+        with tracing.span("repository.search", limit=limit):
+            return self._repository.search(query, fields, limit, cursor)
+
+    def iter_ids(self, batch_size: int = 10000) -> Iterator[str]:
+        """Iterate over all sale ids."""
+        return self._repository.iter_ids(batch_size)
+
+    def stream(
+        self,
+        filters: Optional[Dict[str, Any]] = None,
+        fields: Optional[Sequence[str]] = None,
+        batch_size: int = 1000,
+    ) -> Iterator[repo.SaleModel]:
+        """Iterate over sales matching filters, newest first."""
+        return self._repository.stream(filters, fields, batch_size)
+
+    def upsert(
+        self,
+        sales: List[repo.SaleModel],
+        key: Sequence[str] = repo.NATURAL_KEY,
+    ) -> repo.UpsertResultModel:
+        """Insert or update sales by key."""
+        with tracing.span("repository.upsert", sales=len(sales)):
+            return self._repository.upsert(sales, key)
+
+    def execute_batch(
+        self, operations: List[repo.OperationModel], atomic: bool = True
+    ) -> List[repo.OperationResultModel]:
+        """Execute create, update and delete operations."""
+        with tracing.span(
+            "repository.execute_batch", operations=len(operations)
+        ):
+            return self._repository.execute_batch(operations, atomic)
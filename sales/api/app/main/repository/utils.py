@@ -1,4 +1,7 @@
 """Utility functions."""
+import base64
+import hashlib
+import json
 
 
 def row_to_dict(cols, row):
@@ -6,10 +9,88 @@ def row_to_dict(cols, row):
     return dict(zip(cols, row))
 
 
+def check_limit(limit):
+    """Check page size argument."""
+    if limit > 100 or limit < 1:
+        raise ValueError(
+            '"limit" argument must be between 1 and 100 inclusive.'
+        )
+
+
+def check_batch_size(size):
+    """Check number of operations in batch."""
+    if size > 100 or size < 1:
+        raise ValueError(
+            "Batch must have between 1 and 100 operations inclusive."
+        )
+
+
+def escape_like(value):
+    """Escape LIKE pattern wildcards in value."""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def encode_cursor(*key):
+    """Encode pagination key as opaque cursor."""
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Decode pagination key from cursor."""
+    try:
+        return tuple(json.loads(base64.urlsafe_b64decode(cursor.encode())))
+    except Exception:
+        raise ValueError("Malformed cursor")
+
+
+def page_digest(sales):
+    """
+    Digest of ids and update times of a page of sales, equal to the one
+    that Postgres computes for the same page. The digest is the sum of
+    digests of each sale, so that digests of parts of a page add up to
+    that of the page.
+    """
+    if not sales:
+        return None
+    return str(
+        sum(
+            int(
+                hashlib.md5(
+                    f"{s.id}:{pg_timestamp(s.updated_at)}".encode()
+                ).hexdigest()[:15],
+                16,
+            )
+            for s in sales
+        )
+    )
+
+
+def combine_digests(digests):
+    """Digest of a page from digests of its parts, None for none."""
+    digests = [int(d) for d in digests if d is not None]
+    if not digests:
+        return None
+    return str(sum(digests))
+
+
+def pg_timestamp(value):
+    """Timestamp as Postgres casts it to text, without trailing zeros."""
+    text = value.strftime("%Y-%m-%d %H:%M:%S")
+    if value.microsecond:
+        text += f".{value.microsecond:06d}".rstrip("0")
+    return text
+
+
 def field_from_constraint(constraint):
-    """Extract field name from constraint name."""
+    """
+    Extract field name from constraint name. Duplicates of the natural
+    key, whose index partitions name after its columns, are reported as
+    duplicates of its first column.
+    """
     if constraint.endswith("pkey"):
         return "id"
+    if constraint.endswith("order_id_sku_date_time_idx"):
+        return "order_id"
     raise ValueError("Malformed constraint name")
 
 
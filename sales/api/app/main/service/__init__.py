@@ -1,6 +1,6 @@
 """Service."""
 from datetime import datetime
-from typing import Optional, List
+from typing import Any, Dict, Iterator, Optional, List, Sequence, Tuple
 from abc import ABC, abstractmethod
 
 
@@ -31,9 +31,12 @@ class SaleModel:
         self.created_at = created_at
         self.updated_at = updated_at
 
-    def to_json_dict(self):
-        """Convert to JSON serializable dict."""
-        return {
+    def to_json_dict(self, fields: Optional[Sequence[str]] = None):
+        """
+        Convert to JSON serializable dict. Given fields, only those and
+        "id" are included.
+        """
+        data = {
             "id": self.id,
             "date_time": self.date_time,
             "order_id": self.order_id,
@@ -45,6 +48,92 @@ class SaleModel:
             "created_at": self.created_at,
             "updated_at": self.updated_at,
         }
+        if fields is None:
+            return data
+        return {k: v for k, v in data.items() if k == "id" or k in fields}
+
+
+class VersionModel:
+    """Version of a resource, used to validate cached representations."""
+
+    def __init__(
+        self,
+        etag: Optional[str] = None,
+        last_modified: Optional[datetime] = None,
+    ):
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+class SalePageModel:
+    """Page of sales with cursor for the next page."""
+
+    def __init__(
+        self,
+        sales: Optional[List[SaleModel]] = None,
+        cursor: Optional[str] = None,
+    ):
+        self.sales = sales if sales is not None else []
+        self.cursor = cursor
+
+
+class OperationModel:
+    """Create, update or delete operation of a batch."""
+
+    def __init__(
+        self,
+        kind: str,
+        sale: SaleModel,
+        fields: Optional[List[str]] = None,
+    ):
+        self.kind = kind
+        self.sale = sale
+        self.fields = fields
+
+
+class OperationResultModel:
+    """Outcome of a batch operation, with the sale it created."""
+
+    def __init__(
+        self,
+        applied: bool = False,
+        error: Optional["ServiceErr"] = None,
+        sale: Optional[SaleModel] = None,
+    ):
+        self.applied = applied
+        self.error = error
+        self.sale = sale
+
+
+class UpsertResultModel:
+    """
+    Numbers of sales an upsert inserted, updated and left unchanged, and
+    of sales given again with the key of an earlier one in the batch.
+    """
+
+    def __init__(
+        self,
+        inserted: int = 0,
+        updated: int = 0,
+        unchanged: int = 0,
+        duplicates: int = 0,
+    ):
+        self.inserted = inserted
+        self.updated = updated
+        self.unchanged = unchanged
+        self.duplicates = duplicates
+
+    def to_json_dict(self):
+        """Convert to JSON serializable dict."""
+        return {
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "unchanged": self.unchanged,
+            "duplicates": self.duplicates,
+        }
+
+
+NATURAL_KEY = ("order_id", "sku", "date_time")
 
 
 class SaleService(ABC):
@@ -55,19 +144,32 @@ class SaleService(ABC):
         pass
 
     @abstractmethod
-    def find_by_id(self, id: str) -> SaleModel:
+    def find_by_id(
+        self,
+        id: str,
+        fields: Optional[Sequence[str]] = None,
+        timeout: Optional[float] = None,
+    ) -> SaleModel:
         pass
 
     @abstractmethod
-    def create(self, sale: SaleModel) -> SaleModel:
+    def create(
+        self, sale: SaleModel, timeout: Optional[float] = None
+    ) -> SaleModel:
         pass
 
     @abstractmethod
-    def delete_by_id(self, id: str) -> None:
+    def delete_by_id(self, id: str, timeout: Optional[float] = None) -> None:
         pass
 
     @abstractmethod
-    def update(self, sale: SaleModel, fields: List[str]) -> None:
+    def update(
+        self,
+        sale: SaleModel,
+        fields: List[str],
+        expected_updated_at: Optional[datetime] = None,
+        timeout: Optional[float] = None,
+    ) -> SaleModel:
         pass
 
     @abstractmethod
@@ -76,9 +178,86 @@ class SaleService(ABC):
         id: str,
         limit: int = 10,
         after: bool = True,
+        filters: Optional[Dict[str, Any]] = None,
+        fields: Optional[Sequence[str]] = None,
+        timeout: Optional[float] = None,
     ) -> List[SaleModel]:
         pass
 
+    @abstractmethod
+    def find_version(
+        self,
+        id: str,
+        limit: int = 10,
+        after: bool = True,
+        filters: Optional[Dict[str, Any]] = None,
+        timeout: Optional[float] = None,
+    ) -> VersionModel:
+        pass
+
+    @abstractmethod
+    def find_with_version(
+        self,
+        id: str,
+        limit: int = 10,
+        after: bool = True,
+        filters: Optional[Dict[str, Any]] = None,
+        fields: Optional[Sequence[str]] = None,
+        timeout: Optional[float] = None,
+    ) -> Tuple[List[SaleModel], VersionModel]:
+        pass
+
+    @abstractmethod
+    def count(
+        self,
+        filters: Optional[Dict[str, Any]] = None,
+        exact: bool = False,
+        timeout: Optional[float] = None,
+    ) -> int:
+        pass
+
+    @abstractmethod
+    def search(
+        self,
+        query: str,
+        fields: Sequence[str] = ("sku", "order_id"),
+        limit: int = 10,
+        cursor: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> SalePageModel:
+        pass
+
+    @abstractmethod
+    def upsert(
+        self,
+        sales: List[SaleModel],
+        key: Sequence[str] = NATURAL_KEY,
+        timeout: Optional[float] = None,
+    ) -> UpsertResultModel:
+        pass
+
+    @abstractmethod
+    def stream(
+        self,
+        filters: Optional[Dict[str, Any]] = None,
+        fields: Optional[Sequence[str]] = None,
+        batch_size: int = 1000,
+    ) -> Iterator[SaleModel]:
+        pass
+
+    @abstractmethod
+    def metrics(self) -> Dict[str, Any]:
+        pass
+
+    @abstractmethod
+    def execute_batch(
+        self,
+        operations: List[OperationModel],
+        atomic: bool = True,
+        timeout: Optional[float] = None,
+    ) -> List[OperationResultModel]:
+        pass
+
 
 class ServiceErr(Exception):
     """Generic service error."""
@@ -88,6 +267,18 @@ class ResourceNotFoundErr(ServiceErr):
     """Resource not found."""
 
 
+class TimeoutErr(ServiceErr):
+    """Operation did not finish within its time budget."""
+
+
+class ResourceConflictErr(ServiceErr):
+    """Resource was modified since the version expected."""
+
+
+class ResourceArchivedErr(ServiceErr):
+    """Resource is archived, and can no longer be changed."""
+
+
 class ResourceFieldNullErr(ServiceErr):
     """Resource field cannot be null."""
 
@@ -95,5 +286,19 @@ class ResourceFieldNullErr(ServiceErr):
         self.field = field
 
 
+class ResourceFieldDuplicateErr(ServiceErr):
+    """Resource field duplicates that of another resource."""
+
+    def __init__(self, field):
+        self.field = field
+
+
 class InvalidArgsErr(ServiceErr):
     """Invalid argments."""
+
+
+class ResourceFieldsInvalidErr(InvalidArgsErr):
+    """Resource fields are invalid, mapped to what is wrong with them."""
+
+    def __init__(self, errors: Dict[str, str]):
+        self.errors = errors
@@ -0,0 +1,86 @@
+"""Sale count cache."""
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from app.main import service as srv
+
+
+class CountCache:
+    """
+    Exact sale counts kept for a short time. Counts are adjusted in
+    place when sales are created or deleted through the same service.
+    """
+
+    def __init__(self, ttl: float = 5.0, clock=time.monotonic):
+        self._ttl = ttl
+        self._clock = clock
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, filters: Optional[Dict[str, Any]]) -> Optional[int]:
+        """Get cached count, if still fresh."""
+        key = _key(filters)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            count, expires = entry
+            if expires <= self._clock():
+                del self._entries[key]
+                return None
+            return count
+
+    def put(self, filters: Optional[Dict[str, Any]], count: int) -> None:
+        """Cache count."""
+        with self._lock:
+            self._entries[_key(filters)] = (count, self._clock() + self._ttl)
+
+    def clear(self) -> None:
+        """Drop all counts."""
+        with self._lock:
+            self._entries.clear()
+
+    def created(self, sale: srv.SaleModel) -> None:
+        """Count new sale in every cached count it matches."""
+        with self._lock:
+            for key, (count, expires) in self._entries.items():
+                if _matches(sale, key):
+                    self._entries[key] = (count + 1, expires)
+
+    def deleted(self) -> None:
+        """
+        Discount deleted sale. Only the unfiltered count can be adjusted,
+        since fields of deleted sale are unknown.
+        """
+        with self._lock:
+            total = self._entries.get(())
+            self._entries.clear()
+            if total is not None:
+                count, expires = total
+                self._entries[()] = (max(count - 1, 0), expires)
+
+
+def _key(filters):
+    return tuple(
+        sorted(
+            (f, tuple(v) if isinstance(v, list) else v)
+            for f, v in (filters or {}).items()
+        )
+    )
+
+
+def _matches(sale, key):
+    for f, v in key:
+        value = getattr(sale, f)
+        if isinstance(v, tuple):
+            start, end = v
+            if value is None:
+                return False
+            if start is not None and value < start:
+                return False
+            if end is not None and value > end:
+                return False
+        elif value != v:
+            return False
+    return True
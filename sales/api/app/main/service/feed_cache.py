@@ -0,0 +1,147 @@
+"""Recent sales feed cache."""
+import bisect
+import copy
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from app.main import service as srv
+
+
+class FeedCache:
+    """
+    Newest sales kept in memory, ordered by (created_at, id), to serve
+    pages near the head of the feed without querying. Sales created,
+    updated or deleted through the same service are applied in place,
+    and the feed is reloaded once older than ttl, to pick up changes
+    made by other processes.
+    """
+
+    def __init__(
+        self, size: int = 100, ttl: float = 1.0, clock=time.monotonic
+    ):
+        if size < 1:
+            raise ValueError('"size" argument must be positive.')
+        self.size = size
+        self._ttl = ttl
+        self._clock = clock
+        self._keys = []
+        self._sales = []
+        self._complete = False
+        self._expires = None
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    def fresh(self) -> bool:
+        """Whether feed is loaded and not yet due for reload."""
+        with self._lock:
+            return self._expires is not None and self._expires > self._clock()
+
+    def load(self, sales: List[srv.SaleModel]) -> None:
+        """Replace feed with newest sales, in any order."""
+        newest = sorted(sales, key=_key)
+        del newest[: -self.size]
+        with self._lock:
+            self._sales = newest
+            self._keys = [_key(s) for s in newest]
+            self._complete = len(sales) < self.size
+            self._expires = self._clock() + self._ttl
+
+    def clear(self) -> None:
+        """Drop feed, so that it is reloaded on next use."""
+        with self._lock:
+            self._expires = None
+
+    def page(
+        self, id: str, limit: int, after: bool
+    ) -> Optional[List[srv.SaleModel]]:
+        """
+        Page of sales before or after sale with id, listed newest first,
+        or None when the feed cannot serve it.
+        """
+        with self._lock:
+            page = self._page(id, limit, after)
+            if page is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            return [copy.copy(s) for s in reversed(page)]
+
+    def created(self, sale: srv.SaleModel) -> None:
+        """Add new sale, if it belongs to the feed."""
+        key = _key(sale)
+        with self._lock:
+            if self._expires is None:
+                return
+            if not self._complete and (not self._keys or key < self._keys[0]):
+                return
+            index = bisect.bisect(self._keys, key)
+            self._keys.insert(index, key)
+            self._sales.insert(index, copy.copy(sale))
+            if len(self._sales) > self.size:
+                del self._keys[0]
+                del self._sales[0]
+                self._complete = False
+
+    def updated(self, sale: srv.SaleModel, fields: List[str]) -> None:
+        """
+        Patch fields of updated sale. Changing creation time moves the
+        sale within the feed, or in or out of it, so the feed is dropped.
+        """
+        with self._lock:
+            if "created_at" in fields:
+                self._expires = None
+                return
+            index = self._index(sale.id)
+            if index is None:
+                return
+            patched = copy.copy(self._sales[index])
+            for f in fields:
+                setattr(patched, f, getattr(sale, f))
+            self._sales[index] = patched
+
+    def deleted(self, id: str) -> None:
+        """Remove deleted sale."""
+        with self._lock:
+            index = self._index(id)
+            if index is not None:
+                del self._keys[index]
+                del self._sales[index]
+
+    def metrics(self) -> Dict[str, Any]:
+        """Hits, misses and hit rate of pages requested from the feed."""
+        with self._lock:
+            requests = self._hits + self._misses
+            return {
+                "size": len(self._sales),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / requests if requests else None,
+            }
+
+    def _page(self, id, limit, after):
+        if self._expires is None or self._expires <= self._clock():
+            return None
+        if limit < 1 or limit > self.size:
+            return None
+        index = self._index(id)
+        if index is None:
+            return None
+        if not after:
+            start, end = index + 1, index + 1 + limit
+        elif index >= limit or self._complete:
+            start, end = max(index - limit, 0), index
+        else:
+            return None
+        return self._sales[start:end]
+
+    def _index(self, id):
+        for index in range(len(self._sales) - 1, -1, -1):
+            if self._sales[index].id == id:
+                return index
+        return None
+
+
+def _key(sale):
+    return (sale.created_at, sale.id)
@@ -1,88 +1,624 @@
 """Sale service."""
 import copy
+import logging
 from datetime import datetime
-from typing import List
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
 
 from app.main import service as srv
 from app.main import repository as repo
+from app.main.helper import deadline
 from app.main.helper import mapper
+from app.main.helper import tracing
+from app.main.repository import utils as repo_utils
 from app.main.service import utils
+from app.main.service import validation
+from app.main.service.count_cache import CountCache
+from app.main.service.feed_cache import FeedCache
+from app.main.service.validation import SaleValidator
 
+logger = logging.getLogger(__name__)
 
-def provide_sale_service(repository: repo.SaleRepository):
-    """Initialize and return service."""
-    return SaleService(repository=repository)
+# Fields of existing sales that upserts update.
+UPSERT_FIELDS = ("quantity", "subtotal", "fee", "tax", "updated_at")
+
+
+def provide_sale_service(
+    repository: repo.SaleRepository,
+    count_cache: Optional[CountCache] = None,
+    timeouts: Optional[Dict[str, float]] = None,
+    feed_cache: Optional[FeedCache] = None,
+    validator: Optional[SaleValidator] = None,
+):
+    """Initialize and return service. No feed cache disables it."""
+    return SaleService(
+        repository=repository,
+        count_cache=count_cache if count_cache is not None else CountCache(),
+        timeouts=timeouts if timeouts is not None else {},
+        feed_cache=feed_cache,
+        validator=validator if validator is not None else SaleValidator(),
+    )
 
 
 class SaleService(srv.SaleService):
-    """Sale service implementation."""
+    """
+    Sale service implementation. Every operation runs within a time
+    budget, given per call or defaulting to the operation's configured
+    timeout, which bounds the repository's statements. Sales are
+    validated before they are written, so invalid ones never reach the
+    repository. Writes are applied to caches once committed, outside
+    of the error mapping, so that a committed write is never reported
+    as failed.
+    """
 
-    def __init__(self, repository: repo.SaleRepository):
+    def __init__(
+        self,
+        repository: repo.SaleRepository,
+        count_cache: CountCache,
+        timeouts: Dict[str, float],
+        feed_cache: Optional[FeedCache] = None,
+        validator: Optional[SaleValidator] = None,
+    ):
         """Inject repository."""
         self._repository = repository
+        self._count_cache = count_cache
+        self._timeouts = timeouts
+        self._feed_cache = feed_cache
+        self._validator = (
+            validator if validator is not None else SaleValidator()
+        )
 
     def close(self) -> None:
         self._repository.close()
 
-    def find_by_id(self, id: str) -> srv.SaleModel:
-        """Find single sale by id."""
+    @tracing.traced("service.find_by_id")
+    def find_by_id(
+        self,
+        id: str,
+        fields: Optional[Sequence[str]] = None,
+        timeout: Optional[float] = None,
+    ) -> srv.SaleModel:
+        """
+        Find single sale by id. Given fields, only those and "id" are
+        read, and the other attributes of the sale are None.
+        """
         try:
-            s = self._repository.find_by_id(id)
-            sale = mapper.to_sale_service_model(s)
-            return sale
+            with deadline.budget(self._timeout("find_by_id", timeout)):
+                s = self._repository.find_by_id(id, fields)
+                sale = mapper.to_sale_service_model(s)
+                return sale
         except repo.RecordNotFoundErr:
             raise srv.ResourceNotFoundErr()
+        except ValueError:
+            raise srv.InvalidArgsErr()
+        except repo.TimeoutErr:
+            raise srv.TimeoutErr()
         except Exception:
             raise srv.ServiceErr()
 
-    def create(self, sale: srv.SaleModel) -> srv.SaleModel:
+    @tracing.traced("service.create")
+    def create(
+        self, sale: srv.SaleModel, timeout: Optional[float] = None
+    ) -> srv.SaleModel:
         """Create a sale."""
+        errors = self._validator.validate(srv.OperationModel("create", sale))
+        if errors:
+            raise _validation_error(errors)
         try:
-            new_service_sale = copy.copy(sale)
-            new_service_sale.id = utils.generate_id()
-            new_service_sale.created_at = datetime.utcnow()
-            new_service_sale.updated_at = datetime.utcnow()
-            repo_sale = mapper.to_sale_repo_model(new_service_sale)
-            self._repository.create(repo_sale)
-            return new_service_sale
+            with deadline.budget(self._timeout("create", timeout)):
+                new_service_sale = copy.copy(sale)
+                new_service_sale.id = utils.generate_id()
+                new_service_sale.created_at = datetime.utcnow()
+                new_service_sale.updated_at = datetime.utcnow()
+                repo_sale = mapper.to_sale_repo_model(new_service_sale)
+                created = mapper.to_sale_service_model(
+                    self._repository.create(repo_sale)
+                )
         except repo.RecordFieldNullErr as error:
             raise srv.ResourceFieldNullErr(field=error.field)
+        except repo.RecordFieldDuplicateErr as error:
+            raise srv.ResourceFieldDuplicateErr(field=error.field)
+        except repo.TimeoutErr:
+            raise srv.TimeoutErr()
         except Exception:
             raise srv.ServiceErr()
+        self._applied("create", created, None)
+        return created
 
-    def delete_by_id(self, id: str) -> None:
+    @tracing.traced("service.delete_by_id")
+    def delete_by_id(self, id: str, timeout: Optional[float] = None) -> None:
         """Delete sale by id."""
         try:
-            self._repository.delete_by_id(id)
+            with deadline.budget(self._timeout("delete_by_id", timeout)):
+                self._repository.delete_by_id(id)
         except repo.RecordNotFoundErr:
             raise srv.ResourceNotFoundErr()
+        except repo.RecordArchivedErr:
+            raise srv.ResourceArchivedErr()
+        except repo.TimeoutErr:
+            raise srv.TimeoutErr()
         except Exception:
             raise srv.ServiceErr()
+        self._applied("delete", srv.SaleModel(id=id), None)
 
-    def update(self, sale: srv.SaleModel, fields: List[str]) -> None:
-        """Update sale."""
+    @tracing.traced("service.update")
+    def update(
+        self,
+        sale: srv.SaleModel,
+        fields: List[str],
+        expected_updated_at: Optional[datetime] = None,
+        timeout: Optional[float] = None,
+    ) -> srv.SaleModel:
+        """
+        Update sale and return it as updated. Given the "updated_at" the
+        caller last read, raise 'ResourceConflictErr' when the sale was
+        modified since, instead of overwriting the changes.
+        """
+        errors = self._validator.validate(
+            srv.OperationModel("update", sale, fields)
+        )
+        if errors:
+            raise _validation_error(errors)
         try:
-            repo_sale = mapper.to_sale_repo_model(sale)
-            self._repository.update(repo_sale, fields)
+            with deadline.budget(self._timeout("update", timeout)):
+                changed, fields = _touched(sale, fields, datetime.utcnow())
+                updated = mapper.to_sale_service_model(
+                    self._repository.update(
+                        mapper.to_sale_repo_model(changed),
+                        fields,
+                        expected_updated_at,
+                    )
+                )
         except repo.RecordNotFoundErr:
             raise srv.ResourceNotFoundErr()
+        except repo.RecordConflictErr:
+            raise srv.ResourceConflictErr()
+        except repo.RecordArchivedErr:
+            raise srv.ResourceArchivedErr()
         except repo.RecordFieldNullErr as error:
             raise srv.ResourceFieldNullErr(field=error.field)
         except ValueError:
             raise srv.InvalidArgsErr()
+        except repo.TimeoutErr:
+            raise srv.TimeoutErr()
         except Exception:
             raise srv.ServiceErr()
+        self._applied("update", updated, fields)
+        return updated
 
+    @tracing.traced("service.find")
     def find(
         self,
         id: str,
         limit: int = 10,
         after: bool = True,
+        filters: Optional[Dict[str, Any]] = None,
+        fields: Optional[Sequence[str]] = None,
+        timeout: Optional[float] = None,
     ) -> List[srv.SaleModel]:
+        """
+        Find page of sales matching filters before or after sale. Pages
+        near the head of the unfiltered feed are served from the feed
+        cache, when enabled. Given fields, only those and "id" are read.
+        """
+        try:
+            with deadline.budget(self._timeout("find", timeout)):
+                page = self._feed_page(id, limit, after, filters)
+                if page is not None:
+                    if fields is None:
+                        return page
+                    return [_projected(s, fields) for s in page]
+                results = self._repository.find(
+                    id, limit, after, filters, fields
+                )
+                return [mapper.to_sale_service_model(r) for r in results]
+        except ValueError:
+            raise srv.InvalidArgsErr()
+        except repo.TimeoutErr:
+            raise srv.TimeoutErr()
+        except Exception:
+            raise srv.ServiceErr()
+
+    @tracing.traced("service.find_version")
+    def find_version(
+        self,
+        id: str,
+        limit: int = 10,
+        after: bool = True,
+        filters: Optional[Dict[str, Any]] = None,
+        timeout: Optional[float] = None,
+    ) -> srv.VersionModel:
+        """Find version of the page of sales returned by "find"."""
+        try:
+            with deadline.budget(self._timeout("find_version", timeout)):
+                page = self._feed_page(id, limit, after, filters)
+                if page is not None:
+                    version = _page_version(page)
+                else:
+                    version = self._repository.find_version(
+                        id, limit, after, filters
+                    )
+                return _versioned(id, limit, after, filters, version)
+        except ValueError:
+            raise srv.InvalidArgsErr()
+        except repo.TimeoutErr:
+            raise srv.TimeoutErr()
+        except Exception:
+            raise srv.ServiceErr()
+
+    def find_with_version(
+        self,
+        id: str,
+        limit: int = 10,
+        after: bool = True,
+        filters: Optional[Dict[str, Any]] = None,
+        fields: Optional[Sequence[str]] = None,
+        timeout: Optional[float] = None,
+    ) -> Tuple[List[srv.SaleModel], srv.VersionModel]:
+        """
+        Find page of sales like "find", with its version computed from
+        the sales read, so that it always describes the page returned
+        even when the two are read from different replicas. Given fields,
+        "updated_at" is read as well, to compute the version.
+        """
+        read = fields
+        if fields is not None and "updated_at" not in fields:
+            read = list(fields) + ["updated_at"]
+        page = self.find(id, limit, after, filters, read, timeout)
+        return page, _versioned(id, limit, after, filters, _page_version(page))
+
+    @tracing.traced("service.count")
+    def count(
+        self,
+        filters: Optional[Dict[str, Any]] = None,
+        exact: bool = False,
+        timeout: Optional[float] = None,
+    ) -> int:
+        """
+        Count sales matching filters. Exact counts are cached for a short
+        time, approximate counts come from planner statistics.
+        """
+        try:
+            with deadline.budget(self._timeout("count", timeout)):
+                if not exact:
+                    return self._repository.count(filters, exact=False)
+                count = self._count_cache.get(filters)
+                if count is None:
+                    count = self._repository.count(filters, exact=True)
+                    self._count_cache.put(filters, count)
+                return count
+        except ValueError:
+            raise srv.InvalidArgsErr()
+        except repo.TimeoutErr:
+            raise srv.TimeoutErr()
+        except Exception:
+            raise srv.ServiceErr()
+
+    @tracing.traced("service.search")
+    def search(
+        self,
+        query: str,
+        fields: Sequence[str] = ("sku", "order_id"),
+        limit: int = 10,
+        cursor: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> srv.SalePageModel:
+        """Search sales by prefix or similarity of fields to query."""
+        try:
+            with deadline.budget(self._timeout("search", timeout)):
+                page = self._repository.search(query, fields, limit, cursor)
+                return srv.SalePageModel(
+                    sales=[
+                        mapper.to_sale_service_model(s) for s in page.sales
+                    ],
+                    cursor=page.cursor,
+                )
+        except ValueError:
+            raise srv.InvalidArgsErr()
+        except repo.TimeoutErr:
+            raise srv.TimeoutErr()
+        except Exception:
+            raise srv.ServiceErr()
+
+    @tracing.traced("service.execute_batch")
+    def execute_batch(
+        self,
+        operations: List[srv.OperationModel],
+        atomic: bool = True,
+        timeout: Optional[float] = None,
+    ) -> List[srv.OperationResultModel]:
+        """
+        Execute create, update and delete operations in one transaction,
+        all or nothing unless atomic is false. Every operation is
+        validated first: invalid ones fail with all their invalid fields,
+        and only valid ones reach the repository, none when the batch is
+        atomic.
+        """
+        invalid = self._validator.validate_batch(operations)
+        if any(invalid) and (atomic or all(invalid)):
+            return [_invalid_result(errors) for errors in invalid]
+        valid = [o for o, errors in zip(operations, invalid) if not errors]
         try:
-            results = self._repository.find(id, limit, after)
-            return [mapper.to_sale_service_model(r) for r in results]
+            with deadline.budget(self._timeout("execute_batch", timeout)):
+                now = datetime.utcnow()
+                sales = []
+                fields = []
+                for operation in valid:
+                    sale = operation.sale
+                    operation_fields = operation.fields
+                    if operation.kind == "create":
+                        sale = copy.copy(sale)
+                        sale.id = utils.generate_id()
+                        sale.created_at = now
+                        sale.updated_at = now
+                    elif operation.kind == "update" and operation_fields:
+                        sale, operation_fields = _touched(
+                            sale, operation_fields, now
+                        )
+                    sales.append(sale)
+                    fields.append(operation_fields)
+                results = self._repository.execute_batch(
+                    [
+                        repo.OperationModel(
+                            kind=operation.kind,
+                            sale=mapper.to_sale_repo_model(sale),
+                            fields=operation_fields,
+                        )
+                        for operation, sale, operation_fields in zip(
+                            valid, sales, fields
+                        )
+                    ],
+                    atomic,
+                )
         except ValueError:
             raise srv.InvalidArgsErr()
+        except repo.TimeoutErr:
+            raise srv.TimeoutErr()
         except Exception:
             raise srv.ServiceErr()
+        batch = []
+        executed = zip(valid, sales, fields, results)
+        for errors in invalid:
+            if errors:
+                batch.append(_invalid_result(errors))
+                continue
+            operation, sale, operation_fields, result = next(executed)
+            created = result.applied and operation.kind == "create"
+            if result.applied:
+                self._applied(operation.kind, sale, operation_fields)
+            batch.append(
+                srv.OperationResultModel(
+                    applied=result.applied,
+                    error=_operation_error(result.error),
+                    sale=sale if created else None,
+                )
+            )
+        return batch
+
+    @tracing.traced("service.upsert")
+    def upsert(
+        self,
+        sales: List[srv.SaleModel],
+        key: Sequence[str] = srv.NATURAL_KEY,
+        timeout: Optional[float] = None,
+    ) -> srv.UpsertResultModel:
+        """
+        Insert sales, or update quantities and amounts of the sales with
+        the same key, leaving sales that would not change as they are.
+        Sales are validated like created ones, all before any is written,
+        with invalid fields reported by index of sale. Inserted sales are
+        given ids derived from their key.
+        """
+        errors = {
+            f"{index}.{field}": error
+            for index, sale in enumerate(sales)
+            for field, error in self._validator.validate(
+                srv.OperationModel("create", sale)
+            ).items()
+        }
+        if errors:
+            raise srv.ResourceFieldsInvalidErr(errors)
+        try:
+            with deadline.budget(self._timeout("upsert", timeout)):
+                now = datetime.utcnow()
+                upserted = []
+                for sale in sales:
+                    sale = copy.copy(sale)
+                    sale.id = utils.generate_key_id(
+                        *(getattr(sale, f, None) for f in key)
+                    )
+                    sale.created_at = now
+                    sale.updated_at = now
+                    upserted.append(mapper.to_sale_repo_model(sale))
+                result = self._repository.upsert(upserted, key)
+        except repo.RecordFieldNullErr as error:
+            raise srv.ResourceFieldNullErr(field=error.field)
+        except ValueError:
+            raise srv.InvalidArgsErr()
+        except repo.TimeoutErr:
+            raise srv.TimeoutErr()
+        except Exception:
+            raise srv.ServiceErr()
+        for sale in result.inserted:
+            self._applied("create", mapper.to_sale_service_model(sale), None)
+        for sale in result.updated:
+            self._applied(
+                "update",
+                mapper.to_sale_service_model(sale),
+                list(UPSERT_FIELDS),
+            )
+        return srv.UpsertResultModel(
+            inserted=len(result.inserted),
+            updated=len(result.updated),
+            unchanged=result.unchanged,
+            duplicates=result.duplicates,
+        )
+
+    def stream(
+        self,
+        filters: Optional[Dict[str, Any]] = None,
+        fields: Optional[Sequence[str]] = None,
+        batch_size: int = 1000,
+    ) -> Iterator[srv.SaleModel]:
+        """
+        Iterate over sales matching filters, newest first, read in
+        batches of batch_size. Arguments are checked before the first
+        sale is read. Streams run for as long as they are read, so no
+        time budget applies, and closing the iterator stops the read.
+        """
+        try:
+            sales = self._repository.stream(filters, fields, batch_size)
+        except ValueError:
+            raise srv.InvalidArgsErr()
+        except Exception:
+            raise srv.ServiceErr()
+        return _streamed(sales)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Cache hit rates and repository metrics."""
+        result = dict(self._repository.metrics())
+        if self._feed_cache is not None:
+            result["feed_cache"] = self._feed_cache.metrics()
+        return result
+
+    def _applied(self, kind, sale, fields):
+        """
+        Apply committed write to caches. The write cannot be undone, so
+        caches that fail to apply it are dropped instead of failing the
+        call, to be refilled from the repository.
+        """
+        try:
+            self._apply(kind, sale, fields)
+        except Exception:
+            logger.exception("Failed to apply %s to caches.", kind)
+            self._count_cache.clear()
+            if self._feed_cache is not None:
+                self._feed_cache.clear()
+
+    def _apply(self, kind, sale, fields):
+        """Apply write to caches."""
+        if kind == "create":
+            self._count_cache.created(sale)
+        elif kind == "delete":
+            self._count_cache.deleted()
+        if self._feed_cache is None:
+            return
+        if kind == "create":
+            self._feed_cache.created(sale)
+        elif kind == "delete":
+            self._feed_cache.deleted(sale.id)
+        else:
+            self._feed_cache.updated(sale, fields)
+
+    def _feed_page(self, id, limit, after, filters):
+        """
+        Page served from feed cache, or None when it cannot be. The feed
+        is loaded on first use and reloaded once stale.
+        """
+        if self._feed_cache is None or filters:
+            return None
+        if not self._feed_cache.fresh():
+            latest = self._repository.find_latest(self._feed_cache.size)
+            self._feed_cache.load(
+                [mapper.to_sale_service_model(s) for s in latest]
+            )
+        return self._feed_cache.page(id, limit, after)
+
+    def _timeout(self, operation, timeout):
+        """Per-call timeout, otherwise the operation's default."""
+        return (
+            timeout if timeout is not None else self._timeouts.get(operation)
+        )
+
+
+def _page_version(page):
+    """Version of page of sales, as the repository computes it."""
+    return repo.VersionModel(
+        count=len(page),
+        updated_at=max((s.updated_at for s in page), default=None),
+        digest=repo_utils.page_digest(page),
+    )
+
+
+def _versioned(id, limit, after, filters, version):
+    """Validators of page of sales with version."""
+    return srv.VersionModel(
+        etag=utils.generate_etag(
+            id,
+            limit,
+            after,
+            sorted((filters or {}).items()),
+            version.count,
+            version.updated_at,
+            version.digest,
+        ),
+        last_modified=version.updated_at,
+    )
+
+
+def _touched(sale, fields, now):
+    """Sale and fields to update, with update time set to now."""
+    if not fields:
+        raise ValueError('"fields" argument cannot be empty list.')
+    touched = copy.copy(sale)
+    touched.updated_at = now
+    return touched, [f for f in fields if f != "updated_at"] + ["updated_at"]
+
+
+def _projected(sale, fields):
+    """Copy of sale with only fields and "id" set."""
+    projected = srv.SaleModel(id=sale.id)
+    for f in fields:
+        if f not in vars(sale):
+            raise ValueError(f'"{f}" not valid field.')
+        setattr(projected, f, getattr(sale, f))
+    return projected
+
+
+def _streamed(sales):
+    """Service models of streamed sales, closing the stream when done."""
+    try:
+        for sale in sales:
+            yield mapper.to_sale_service_model(sale)
+    except repo.TimeoutErr:
+        raise srv.TimeoutErr()
+    except Exception:
+        raise srv.ServiceErr()
+    finally:
+        sales.close()
+
+
+def _validation_error(errors):
+    """
+    Service error of invalid fields. Null fields other than "id" raise
+    the error writing them would have raised.
+    """
+    for f, error in errors.items():
+        if f != "id" and error == validation.NULL:
+            return srv.ResourceFieldNullErr(field=f)
+    return srv.ResourceFieldsInvalidErr(errors)
+
+
+def _invalid_result(errors):
+    """Result of batch operation that was not executed."""
+    if not errors:
+        return srv.OperationResultModel()
+    return srv.OperationResultModel(error=srv.ResourceFieldsInvalidErr(errors))
+
+
+def _operation_error(error):
+    """Service error of failed batch operation."""
+    if error is None:
+        return None
+    if isinstance(error, repo.RecordNotFoundErr):
+        return srv.ResourceNotFoundErr()
+    if isinstance(error, repo.RecordConflictErr):
+        return srv.ResourceConflictErr()
+    if isinstance(error, repo.RecordArchivedErr):
+        return srv.ResourceArchivedErr()
+    if isinstance(error, repo.RecordFieldNullErr):
+        return srv.ResourceFieldNullErr(field=error.field)
+    if isinstance(error, repo.RecordFieldDuplicateErr):
+        return srv.ResourceFieldDuplicateErr(field=error.field)
+    if isinstance(error, ValueError):
+        return srv.InvalidArgsErr()
+    return srv.ServiceErr()
@@ -1,7 +1,23 @@
 """Service utilities."""
+import hashlib
 from uuid import uuid4
 
 
 def generate_id() -> str:
     """Generate id."""
     return uuid4().hex
+
+
+def generate_key_id(*parts) -> str:
+    """
+    Generate id derived from the parts of a natural key, so that the
+    same sale is given the same id every time it is delivered.
+    """
+    value = "|".join(str(p) for p in parts)
+    return hashlib.blake2b(value.encode(), digest_size=16).hexdigest()
+
+
+def generate_etag(*parts) -> str:
+    """Generate entity tag from the parts identifying a representation."""
+    value = "|".join(str(p) for p in parts)
+    return hashlib.blake2b(value.encode(), digest_size=16).hexdigest()
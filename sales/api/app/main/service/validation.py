@@ -0,0 +1,115 @@
+"""Sale validation."""
+import typing
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from app.main import service as srv
+
+GENERATED_FIELDS = ("id", "created_at", "updated_at")
+
+NON_NEGATIVE_FIELDS = ("quantity", "subtotal", "fee", "tax")
+
+MAX_INTEGER = 2**31 - 1
+
+NULL = "cannot be null"
+
+Check = Callable[[object], Optional[str]]
+
+
+class SaleValidator:
+    """
+    Validator of sales before they are written. The checks of every
+    field are compiled once from the annotations of "SaleModel" and the
+    constraints of the sale table, so operations are validated without
+    a round trip to the database, reporting every invalid field.
+    """
+
+    def __init__(self, model: type = srv.SaleModel):
+        """Compile checks of the fields of model."""
+        hints = typing.get_type_hints(model.__init__)
+        hints.pop("return", None)
+        self._checks: Dict[str, Check] = {
+            f: self._compile(f, _value_type(t)) for f, t in hints.items()
+        }
+        self._required = tuple(
+            f for f in self._checks if f not in GENERATED_FIELDS
+        )
+
+    def validate(self, operation: srv.OperationModel) -> Dict[str, str]:
+        """
+        Invalid fields of operation's sale, mapped to what is wrong with
+        them. Creates must set every field the service does not generate,
+        updates only the fields they change, and deletes only "id".
+        """
+        sale = operation.sale
+        if operation.kind == "delete":
+            return self._check(sale, ["id"])
+        if operation.kind != "update":
+            return self._check(sale, self._required)
+        fields = [f for f in operation.fields or [] if f != "updated_at"]
+        errors = self._check(sale, ["id"])
+        for f in fields:
+            if f == "id":
+                errors[f] = "cannot be changed"
+            elif f not in self._checks:
+                errors[f] = "not valid field"
+        errors.update(self._check(sale, [f for f in fields if f != "id"]))
+        return errors
+
+    def validate_batch(
+        self, operations: List[srv.OperationModel]
+    ) -> List[Dict[str, str]]:
+        """Invalid fields of every operation, empty for valid ones."""
+        return [self.validate(o) for o in operations]
+
+    def _check(self, sale, fields):
+        errors = {}
+        for f in fields:
+            check = self._checks.get(f)
+            if check is None:
+                continue
+            error = check(getattr(sale, f, None))
+            if error is not None:
+                errors[f] = error
+        return errors
+
+    def _compile(self, field, value_type) -> Check:
+        """Check of field's values, returning what is wrong or None."""
+        non_negative = field in NON_NEGATIVE_FIELDS
+
+        def check_int(value):
+            if not isinstance(value, int) or isinstance(value, bool):
+                return "must be integer"
+            if non_negative and value < 0:
+                return "cannot be negative"
+            if not -MAX_INTEGER - 1 <= value <= MAX_INTEGER:
+                return "out of range"
+            return None
+
+        def check_str(value):
+            if not isinstance(value, str):
+                return "must be string"
+            return None
+
+        def check_datetime(value):
+            if not isinstance(value, datetime):
+                return "must be date and time"
+            if value.tzinfo is not None:
+                return "cannot have time zone"
+            return None
+
+        checks = {int: check_int, str: check_str, datetime: check_datetime}
+        check_value = checks[value_type]
+
+        def check(value):
+            if value is None:
+                return NULL
+            return check_value(value)
+
+        return check
+
+
+def _value_type(annotation):
+    """Type of values of an optional annotation."""
+    args = [a for a in typing.get_args(annotation) if a is not type(None)]
+    return args[0] if args else annotation
@@ -59,9 +59,35 @@ def sale_rows(count):
     ]
 
 
+@pytest.fixture(autouse=True)
+def client_session():
+    """Client session of each test, so pins of writes never leak."""
+    from app.main.helper import session
+
+    current = session.start()
+    yield current
+    session.finish(current)
+
+
 @pytest.fixture
 def config(env, monkeypatch):
     """Set app configuration."""
     monkeypatch.setenv(
         "APP_CONFIG", f"app.main.config.{env.capitalize()}Config"
     )
+
+
+@pytest.fixture
+def service(mocker):
+    """Mock sale service used by the application."""
+    return mocker.Mock()
+
+
+@pytest.fixture
+def client(config, service):
+    """Test client for application backed by mock sale service."""
+    from app.main import create_app
+
+    app = create_app()
+    app.extensions["sale_service"] = service
+    return app.test_client()
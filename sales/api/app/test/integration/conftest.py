@@ -0,0 +1,94 @@
+"""Fixtures of tests against the Postgres test database."""
+import uuid
+
+import pytest
+
+from app.main import database
+from app.main.config import TestingConfig
+from app.main.repository.postgres import sale_ddl as ddl
+
+
+class Database:
+    """
+    Schema of the test database holding the sale tables, standing in for
+    a database of its own. Connections only see tables of the schema,
+    and extensions of the public schema.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.schema = f"test_{uuid.uuid4().hex}"
+
+    def connect(self):
+        """Open connection to the schema."""
+        conn = database.get_connection(self.config)
+        with conn.cursor() as cur:
+            cur.execute(f'SET search_path TO "{self.schema}", public')
+        conn.commit()
+        return conn
+
+    def create(self):
+        """Create schema and sale tables."""
+        conn = database.get_connection(self.config)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f'CREATE SCHEMA "{self.schema}"')
+                cur.execute(f'SET search_path TO "{self.schema}", public')
+                for stmt in ddl.SCHEMA_STATEMENTS:
+                    cur.execute(stmt)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def drop(self):
+        """Drop schema and everything in it."""
+        conn = database.get_connection(self.config)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f'DROP SCHEMA "{self.schema}" CASCADE')
+            conn.commit()
+        finally:
+            conn.close()
+
+
+@pytest.fixture
+def pg_databases():
+    """
+    Factory of databases in the test database, dropped after the test.
+    Tests are skipped when the test database cannot be reached.
+    """
+    import psycopg2
+
+    config = {
+        k: getattr(TestingConfig, k) for k in dir(TestingConfig) if k.isupper()
+    }
+    config["DB_NAME_TEST"] = TestingConfig.DB_NAME
+    try:
+        database.get_connection(config).close()
+    except psycopg2.OperationalError:
+        pytest.skip("Postgres test database not reachable.")
+    created = []
+
+    def create():
+        db = Database(config)
+        db.create()
+        created.append(db)
+        return db
+
+    yield create
+    for db in created:
+        db.drop()
+
+
+@pytest.fixture
+def pg_database(pg_databases):
+    """Database in the test database, dropped after the test."""
+    return pg_databases()
+
+
+@pytest.fixture
+def pg_conn(pg_database):
+    """Connection to a database in the test database."""
+    conn = pg_database.connect()
+    yield conn
+    conn.close()
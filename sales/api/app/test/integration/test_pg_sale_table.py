@@ -0,0 +1,169 @@
+"""Sale table tests against Postgres."""
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from app.main.repository import (
+    OperationModel,
+    RecordFieldDuplicateErr,
+    SaleModel,
+)
+from app.main.repository.postgres import archive, partitions
+from app.main.repository.postgres import sale_ddl as ddl
+from app.main.repository.postgres.sale_repository import (
+    provide_sale_repository,
+)
+from app.tools import seed
+
+
+def test_count_estimate_partitioned(pg_conn):
+    """Estimate count of all sales from statistics of the partitions."""
+    partitions.maintain_partitions(pg_conn, today=date(2021, 1, 1), ahead=1)
+    seed.copy_chunk(pg_conn, 0, 2000, start=datetime(2021, 1, 1), days=45)
+    # Autovacuum analyzes partitions, never the partitioned table.
+    with pg_conn.cursor() as cur:
+        cur.execute(ddl.SELECT_SALE_PARTITIONS_STATEMENT)
+        for (name,) in cur.fetchall():
+            cur.execute(f'ANALYZE "{name}"')
+    pg_conn.commit()
+    repo = provide_sale_repository(conn=pg_conn)
+    assert repo.count() == repo.count(exact=True) == 2000
+
+
+def test_maintain_partitions_default_rows(pg_conn):
+    """Move old sales out of default partition and drop expired ones."""
+    seed.copy_chunk(pg_conn, 0, 1000, start=datetime(2021, 1, 1), days=90)
+    created, dropped = partitions.maintain_partitions(
+        pg_conn, today=date(2023, 2, 1), ahead=0, retention=24
+    )
+    assert created[:4] == [
+        "sale_y2021m01",
+        "sale_y2021m02",
+        "sale_y2021m03",
+        "sale_y2021m04",
+    ]
+    assert created[-1] == "sale_y2023m02"
+    assert dropped == ["sale_y2021m01"]
+    with pg_conn.cursor() as cur:
+        cur.execute('SELECT COUNT(*) FROM "sale_default"')
+        assert cur.fetchone() == (0,)
+        cur.execute(
+            'SELECT COUNT(*) FROM "sale" WHERE date_time < %s',
+            (datetime(2021, 2, 1),),
+        )
+        assert cur.fetchone() == (0,)
+
+
+def test_find_archived_by_sku(pg_conn):
+    """Page archived sales of a sku, reading only batches holding it."""
+    seed.copy_chunk(pg_conn, 0, 3000, start=datetime(2021, 1, 1), days=90)
+    archive.archive_sales(pg_conn, datetime(2022, 1, 1), batch_size=500)
+    repo = provide_sale_repository(conn=pg_conn)
+    rows = []
+    with pg_conn.cursor() as cur:
+        cur.execute(
+            'SELECT data FROM "archived_sale_batch" ORDER BY first_created_at'
+        )
+        for (data,) in cur.fetchall():
+            rows.extend(archive.batch_rows(archive.decode_batch(bytes(data))))
+    pg_conn.commit()
+    sku = rows[-1]["sku"]
+    expected = sorted(
+        (r for r in rows if r["sku"] == sku),
+        key=lambda r: (r["created_at"], r["id"]),
+        reverse=True,
+    )
+    sales = repo.find_archived(
+        datetime(2022, 1, 1), "", 100, True, {"sku": sku}
+    )
+    assert [s.id for s in sales] == [r["id"] for r in expected][:100]
+
+
+def _sale(n, **values):
+    return SaleModel(
+        **{
+            "id": f"sale-{n}",
+            "date_time": datetime(2021, 1, 1, n, 0, 0, 250000),
+            "order_id": "order",
+            "sku": f"sku-{n}",
+            "quantity": 1,
+            "subtotal": 100,
+            "fee": 10,
+            "tax": 5,
+            "created_at": datetime(2021, 1, 2),
+            "updated_at": datetime(2021, 1, 2),
+            **values,
+        }
+    )
+
+
+@pytest.mark.parametrize(
+    "sale,field",
+    [
+        (_sale(0), "id"),
+        (_sale(2, sku="sku-1", date_time=_sale(1).date_time), "order_id"),
+    ],
+)
+def test_execute_batch_duplicate(pg_conn, sale, field):
+    """Report duplicates of a batch on the create that caused them."""
+    repo = provide_sale_repository(conn=pg_conn)
+    repo.create(_sale(0))
+    results = repo.execute_batch(
+        [
+            OperationModel("create", _sale(1)),
+            OperationModel("create", sale),
+            OperationModel("create", _sale(3)),
+        ]
+    )
+    assert results[0].error is None
+    assert isinstance(results[1].error, RecordFieldDuplicateErr)
+    assert results[1].error.field == field
+    assert results[2].error is None
+    assert not any(r.applied for r in results)
+
+
+def test_upsert_partitioned(pg_conn):
+    """Upsert sales into the partitioned table, telling inserted ones."""
+    partitions.maintain_partitions(pg_conn, today=date(2021, 1, 1), ahead=1)
+    repo = provide_sale_repository(conn=pg_conn)
+    now = datetime(2021, 1, 2)
+    sales = [
+        SaleModel(
+            id=f"sale-{n}",
+            date_time=datetime(2021, 1, 1, n),
+            order_id="order",
+            sku=f"sku-{n}",
+            quantity=1,
+            subtotal=100,
+            fee=10,
+            tax=5,
+            created_at=now,
+            updated_at=now,
+        )
+        for n in range(3)
+    ]
+    result = repo.upsert(sales + sales[:1])
+    assert sorted(s.id for s in result.inserted) == [
+        "sale-0",
+        "sale-1",
+        "sale-2",
+    ]
+    assert (result.unchanged, result.duplicates) == (0, 1)
+    later = now + timedelta(hours=1)
+    changed = SaleModel(
+        **{**vars(sales[0]), "id": "new", "quantity": 2, "created_at": later}
+    )
+    again = SaleModel(**{**vars(sales[1]), "created_at": later})
+    result = repo.upsert([changed, again])
+    assert result.inserted == []
+    assert [(s.id, s.quantity) for s in result.updated] == [("sale-0", 2)]
+    assert result.unchanged == 1
+
+
+def test_stream_pooled(pg_conn):
+    """Stream sales on the pooled connection, then read on it again."""
+    seed.copy_chunk(pg_conn, 0, 50, start=datetime(2021, 1, 1), days=1)
+    repo = provide_sale_repository(conn=pg_conn)
+    ids = [s.id for s in repo.stream(fields=["id"], batch_size=20)]
+    assert len(ids) == 50
+    assert repo.count(exact=True) == 50
@@ -0,0 +1,63 @@
+"""Sharded sale repository tests against several Postgres databases."""
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.main.repository import SaleModel, utils
+from app.main.repository.postgres.sale_repository import (
+    provide_sale_repository,
+)
+from app.main.repository.sharded import sale_repository as sharded
+
+
+def make_sales(count):
+    start = datetime(2021, 1, 1)
+    return [
+        SaleModel(
+            id=f"{i:04x}",
+            date_time=start,
+            order_id=f"order-{i}",
+            sku=f"sku-{i % 7}",
+            quantity=1,
+            subtotal=100,
+            fee=10,
+            tax=5,
+            created_at=start + timedelta(minutes=i // 3),
+            updated_at=start + timedelta(microseconds=i * 1500),
+        )
+        for i in range(count)
+    ]
+
+
+@pytest.fixture
+def repos(pg_databases):
+    """Sharded repository over three databases, and one holding all."""
+    shards = {
+        name: provide_sale_repository(conn=pg_databases().connect())
+        for name in ("s0", "s1", "s2")
+    }
+    repository = sharded.provide_sale_repository(shards=shards)
+    single = provide_sale_repository(conn=pg_databases().connect())
+    for sale in make_sales(60):
+        repository.create(sale)
+        single.create(sale)
+    yield repository, single
+    repository.close()
+    single.close()
+
+
+@pytest.mark.parametrize("after", [True, False])
+@pytest.mark.parametrize("filters", [None, {"sku": "sku-3"}])
+def test_find_version(repos, after, filters):
+    """
+    Version pages merged from shards like the page read from a single
+    database, and like the page "find" returns.
+    """
+    repository, single = repos
+    for id in ("0000", "001e", "003b"):
+        version = repository.find_version(id, 7, after, filters)
+        expected = single.find_version(id, 7, after, filters)
+        page = repository.find(id, 7, after, filters)
+        assert version.count == expected.count == len(page)
+        assert version.updated_at == expected.updated_at
+        assert version.digest == expected.digest == utils.page_digest(page)
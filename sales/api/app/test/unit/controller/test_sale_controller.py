@@ -0,0 +1,481 @@
+"""Sale controller tests."""
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.main import service as srv
+from app.main.helper import session
+
+pytestmark = pytest.mark.parametrize("env", ["testing"])
+
+
+def test_find_by_id(client, service, sale):
+    """Get sale with validators."""
+    service.find_by_id.return_value = srv.SaleModel(**sale)
+    response = client.get(f"/sales/{sale['id']}")
+    assert response.status_code == 200
+    assert response.get_json()["id"] == sale["id"]
+    assert response.headers["ETag"]
+    assert response.headers["Last-Modified"]
+    service.find_by_id.assert_called_with(sale["id"], None)
+
+
+def test_find_by_id_projected(client, service, sale):
+    """Return only requested fields, with a validator of their own."""
+    service.find_by_id.return_value = srv.SaleModel(**sale)
+    full = client.get(f"/sales/{sale['id']}")
+    response = client.get(f"/sales/{sale['id']}?fields=subtotal,sku")
+    assert response.status_code == 200
+    assert response.get_json() == {
+        "id": sale["id"],
+        "sku": sale["sku"],
+        "subtotal": sale["subtotal"],
+    }
+    assert response.headers["ETag"] != full.headers["ETag"]
+    service.find_by_id.assert_called_with(
+        sale["id"], ["sku", "subtotal", "updated_at"]
+    )
+
+
+def test_find_by_id_if_none_match(client, service, sale):
+    """Respond "304 Not Modified" when entity tag matches."""
+    service.find_by_id.return_value = srv.SaleModel(**sale)
+    etag = client.get(f"/sales/{sale['id']}").headers["ETag"]
+    response = client.get(
+        f"/sales/{sale['id']}", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    assert response.data == b""
+    assert response.headers["ETag"] == etag
+
+
+def test_find_by_id_if_none_match_changed(client, service, sale):
+    """Respond with sale when entity tag no longer matches."""
+    service.find_by_id.return_value = srv.SaleModel(**sale)
+    etag = client.get(f"/sales/{sale['id']}").headers["ETag"]
+    sale["updated_at"] = sale["updated_at"] + timedelta(seconds=1)
+    service.find_by_id.return_value = srv.SaleModel(**sale)
+    response = client.get(
+        f"/sales/{sale['id']}", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+@pytest.mark.parametrize("delta,status", [(0, 304), (-60, 200)])
+def test_find_by_id_if_modified_since(client, service, sale, delta, status):
+    """Respond "304 Not Modified" when not modified since given date."""
+    service.find_by_id.return_value = srv.SaleModel(**sale)
+    since = sale["updated_at"] + timedelta(seconds=delta)
+    response = client.get(
+        f"/sales/{sale['id']}",
+        headers={
+            "If-Modified-Since": since.strftime("%a, %d %b %Y %H:%M:%S GMT")
+        },
+    )
+    assert response.status_code == status
+
+
+def test_find_by_id_not_found(client, service):
+    """Respond "404 Not Found" when sale not found."""
+    service.find_by_id.side_effect = [srv.ResourceNotFoundErr()]
+    response = client.get("/sales/foo")
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize("count", [10])
+def test_find(client, service, sales):
+    """Get page of sales with validators."""
+    service.find_version.return_value = srv.VersionModel(
+        etag="abc", last_modified=datetime.utcnow()
+    )
+    service.find_with_version.return_value = (
+        [srv.SaleModel(**s) for s in sales],
+        srv.VersionModel(etag="def", last_modified=datetime.utcnow()),
+    )
+    response = client.get("/sales?id=foo&limit=10&after=false")
+    assert response.status_code == 200
+    assert len(response.get_json()) == 10
+    assert response.headers["ETag"] == '"def"'
+    assert "Last-Modified" not in response.headers
+    service.find_version.assert_called_with("foo", 10, False, {})
+    service.find_with_version.assert_called_with("foo", 10, False, {}, None)
+
+
+def test_find_not_modified(client, service):
+    """Skip reading page of sales when version matches."""
+    service.find_version.return_value = srv.VersionModel(
+        etag="abc", last_modified=datetime.utcnow()
+    )
+    response = client.get("/sales?id=foo", headers={"If-None-Match": '"abc"'})
+    assert response.status_code == 304
+    service.find_version.assert_called_with("foo", 10, True, {})
+    service.find.assert_not_called()
+
+
+@pytest.mark.parametrize("count", [2])
+def test_find_if_modified_since_ignored(client, service, sales):
+    """
+    Read page despite "If-Modified-Since", which deleting a sale from
+    the page would not invalidate.
+    """
+    now = datetime.utcnow()
+    service.find_version.return_value = srv.VersionModel(
+        etag="abc", last_modified=now
+    )
+    service.find_with_version.return_value = (
+        [srv.SaleModel(**s) for s in sales],
+        srv.VersionModel(etag="abc", last_modified=now),
+    )
+    since = now + timedelta(days=1)
+    response = client.get(
+        "/sales?id=foo",
+        headers={
+            "If-Modified-Since": since.strftime("%a, %d %b %Y %H:%M:%S GMT")
+        },
+    )
+    assert response.status_code == 200
+    assert len(response.get_json()) == 2
+
+
+def test_find_no_id(client, service):
+    """Respond "400 Bad Request" when anchor id missing."""
+    response = client.get("/sales")
+    assert response.status_code == 400
+
+
+def test_find_invalid_args(client, service):
+    """Respond "400 Bad Request" for invalid arguments."""
+    service.find_version.side_effect = [srv.InvalidArgsErr()]
+    response = client.get("/sales?id=foo&limit=1000")
+    assert response.status_code == 400
+
+
+def test_find_service_error(client, service):
+    """Respond "500 Internal Server Error" for generic errors."""
+    service.find_version.side_effect = [srv.ServiceErr()]
+    response = client.get("/sales?id=foo")
+    assert response.status_code == 500
+
+
+@pytest.mark.parametrize(
+    "query,filters,exact",
+    [
+        ("", {}, False),
+        ("?sku=ff-11&exact=true", {"sku": "ff-11"}, True),
+        (
+            "?order_id=FFX&sku=ff-11",
+            {"order_id": "FFX", "sku": "ff-11"},
+            False,
+        ),
+    ],
+)
+def test_count(client, service, query, filters, exact):
+    """Count sales matching filters."""
+    service.count.return_value = 42
+    response = client.get(f"/sales:count{query}")
+    assert response.status_code == 200
+    assert response.get_json() == {"count": 42, "exact": exact}
+    service.count.assert_called_with(filters, exact)
+
+
+@pytest.mark.parametrize("count", [2])
+def test_search(client, service, sales):
+    """Search sales by partial sku or order id."""
+    service.search.return_value = srv.SalePageModel(
+        sales=[srv.SaleModel(**s) for s in sales], cursor="abc"
+    )
+    response = client.get("/sales:search?q=ff&fields=sku&limit=2")
+    assert response.status_code == 200
+    assert len(response.get_json()["sales"]) == 2
+    assert response.get_json()["cursor"] == "abc"
+    service.search.assert_called_with("ff", ("sku",), 2, None)
+
+
+def test_find_filtered(client, service):
+    """Get page of sales matching filters."""
+    service.find_version.return_value = srv.VersionModel(etag="abc")
+    service.find_with_version.return_value = (
+        [],
+        srv.VersionModel(etag="abc"),
+    )
+    response = client.get(
+        "/sales?id=foo&sku=ff-11&date_time_from=2020-01-01T00:00:00"
+    )
+    assert response.status_code == 200
+    filters = {"sku": "ff-11", "date_time": (datetime(2020, 1, 1), None)}
+    service.find_version.assert_called_with("foo", 10, True, filters)
+    service.find_with_version.assert_called_with(
+        "foo", 10, True, filters, None
+    )
+
+
+def test_count_date_time_with_time_zone(client, service):
+    """Filter by times with a time zone converted to UTC without it."""
+    service.count.return_value = 42
+    response = client.get(
+        "/sales:count?date_time_from=2020-01-01T02:00:00%2B02:00"
+        "&date_time_to=2020-01-02T00:00:00Z"
+    )
+    assert response.status_code == 200
+    service.count.assert_called_with(
+        {"date_time": (datetime(2020, 1, 1), datetime(2020, 1, 2))}, False
+    )
+
+
+def test_find_invalid_date_time(client, service):
+    """Respond "400 Bad Request" for malformed date_time filter."""
+    response = client.get("/sales?id=foo&date_time_to=yesterday")
+    assert response.status_code == 400
+    service.find.assert_not_called()
+
+
+@pytest.mark.parametrize("count", [3])
+def test_find_projected(client, service, sales):
+    """Return page of only requested fields."""
+    service.find_version.return_value = srv.VersionModel(etag="abc")
+    service.find_with_version.return_value = (
+        [srv.SaleModel(**s) for s in sales],
+        srv.VersionModel(etag="abc"),
+    )
+    response = client.get("/sales?id=foo&fields=sku")
+    assert response.status_code == 200
+    assert response.get_json() == [
+        {"id": s["id"], "sku": s["sku"]} for s in sales
+    ]
+    assert response.headers["ETag"] != '"abc"'
+    service.find_with_version.assert_called_with("foo", 10, True, {}, ["sku"])
+
+
+def test_find_by_id_timeout(client, service):
+    """Respond "504 Gateway Timeout" when sale lookup times out."""
+    service.find_by_id.side_effect = [srv.TimeoutErr()]
+    response = client.get("/sales/foo")
+    assert response.status_code == 504
+
+
+def test_batch(client, service, sale):
+    """Execute batch and respond with status of each operation."""
+    created = srv.SaleModel(**sale)
+    service.execute_batch.return_value = [
+        srv.OperationResultModel(applied=True, sale=created),
+        srv.OperationResultModel(applied=True),
+        srv.OperationResultModel(error=srv.ResourceNotFoundErr()),
+        srv.OperationResultModel(error=srv.ResourceFieldNullErr("sku")),
+        srv.OperationResultModel(),
+        srv.OperationResultModel(error=srv.ResourceConflictErr()),
+        srv.OperationResultModel(error=srv.ResourceArchivedErr()),
+        srv.OperationResultModel(error=srv.ResourceFieldDuplicateErr("id")),
+    ]
+    response = client.post(
+        "/sales:batch",
+        json={
+            "atomic": False,
+            "operations": [
+                {
+                    "op": "create",
+                    "sale": {"sku": "a", "date_time": "2021-05-01T10:00:00"},
+                },
+                {"op": "update", "id": "b", "sale": {"quantity": 2}},
+                {"op": "delete", "id": "c"},
+                {"op": "update", "id": "d", "sale": {"sku": None}},
+                {"op": "delete", "id": "e"},
+            ],
+        },
+    )
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert [r["status"] for r in results] == [
+        201,
+        204,
+        404,
+        400,
+        424,
+        409,
+        409,
+        409,
+    ]
+    assert results[6]["message"] == "Resource is archived."
+    assert results[7]["message"] == "Resource already exists."
+    assert results[7]["field"] == "id"
+    assert results[0]["sale"]["id"] == sale["id"]
+    assert results[3]["field"] == "sku"
+    operations, atomic = service.execute_batch.call_args[0]
+    assert atomic is False
+    assert operations[0].sale.date_time == datetime(2021, 5, 1, 10)
+    assert operations[1].sale.id == "b"
+    assert operations[1].fields == ["quantity"]
+    assert operations[2].kind == "delete"
+
+
+def test_batch_invalid_fields(client, service):
+    """Respond with every invalid field of failed operations."""
+    errors = {"sku": "cannot be null", "fee": "cannot be negative"}
+    service.execute_batch.return_value = [
+        srv.OperationResultModel(error=srv.ResourceFieldsInvalidErr(errors))
+    ]
+    response = client.post(
+        "/sales:batch",
+        json={
+            "operations": [
+                {"op": "update", "id": "a", "sale": {"sku": None, "fee": -1}}
+            ]
+        },
+    )
+    assert response.get_json()["results"] == [
+        {"status": 400, "message": "Invalid fields.", "errors": errors}
+    ]
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        None,
+        {"operations": "foo"},
+        {"operations": [{"op": "upsert", "sale": {}}]},
+        {"operations": [{"op": "create", "sale": {"color": "red"}}]},
+        {"operations": [{"op": "create", "sale": {"date_time": "foo"}}]},
+    ],
+)
+def test_batch_invalid(client, service, body):
+    """Respond "400 Bad Request" when batch is malformed."""
+    response = client.post("/sales:batch", json=body)
+    assert response.status_code == 400
+    service.execute_batch.assert_not_called()
+
+
+def test_request_traced(client, service, sale):
+    """Record every request, and list kept traces."""
+    service.find_by_id.return_value = srv.SaleModel(**sale)
+    service.metrics.return_value = {}
+    client.get(f"/sales/{sale['id']}")
+    assert client.get("/metrics").get_json()["tracing"]["traces"] == 1
+    assert isinstance(client.get("/traces").get_json(), list)
+
+
+def test_session_cookie(client, service, sale):
+    """Carry last write of client to its later requests in a cookie."""
+    service.upsert.side_effect = lambda sales: (
+        session.current().wrote(100.0) or srv.UpsertResultModel(0, 0, 0)
+    )
+    service.find_by_id.side_effect = lambda id, fields: srv.SaleModel(
+        **{**sale, "quantity": session.current().last_write}
+    )
+    assert client.get(f"/sales/{sale['id']}").get_json()["quantity"] is None
+    response = client.post("/sales:upsert", json={"sales": []})
+    assert "sales_session=100.000000" in response.headers["Set-Cookie"]
+    assert "Max-Age=1" in response.headers["Set-Cookie"]
+    response = client.get(f"/sales/{sale['id']}")
+    assert response.get_json()["quantity"] == 100
+    assert "Set-Cookie" not in response.headers
+
+
+@pytest.mark.parametrize("count", [5])
+def test_stream(client, service, sales):
+    """Stream sales as newline delimited JSON, flushed in batches."""
+    client.application.config["STREAM_BATCH_SIZE"] = 2
+    service.stream.return_value = (srv.SaleModel(**s) for s in sales)
+    response = client.get("/sales:stream?sku=ff&fields=sku")
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    assert [json.loads(line) for line in response.data.splitlines()] == [
+        {"id": s["id"], "sku": s["sku"]} for s in sales
+    ]
+    service.stream.assert_called_once_with({"sku": "ff"}, ["sku"], 2)
+
+
+def test_stream_error(client, service):
+    """End stream failing midway with an error in place of a sale."""
+
+    def failing():
+        yield srv.SaleModel(id="a")
+        yield srv.SaleModel(id="b")
+        yield srv.SaleModel(id="c")
+        raise srv.TimeoutErr()
+
+    client.application.config["STREAM_BATCH_SIZE"] = 2
+    service.stream.return_value = failing()
+    response = client.get("/sales:stream?fields=id", buffered=False)
+    assert list(response.response) == [
+        b'{"id": "a"}\n{"id": "b"}\n',
+        b'{"id": "c"}\n{"message": "Request timed out."}\n',
+    ]
+
+
+def test_stream_closed(client, service):
+    """Close stream of sales once the client is gone."""
+    closed = []
+
+    def stream():
+        try:
+            while True:
+                yield srv.SaleModel(id="a")
+        finally:
+            closed.append(True)
+
+    service.stream.return_value = stream()
+    response = client.get("/sales:stream", buffered=False)
+    next(iter(response.response))
+    response.close()
+    assert closed == [True]
+
+
+def test_upsert(client, service, sale):
+    """Upsert sales, responding with how many were written."""
+    service.upsert.return_value = srv.UpsertResultModel(1, 0, 1, 0)
+    response = client.post(
+        "/sales:upsert",
+        json={
+            "sales": [
+                {"order_id": "a", "date_time": "2021-05-01T10:00:00"},
+                {
+                    "order_id": "b",
+                    "sku": "c",
+                    "date_time": "2021-05-01T12:00:00+02:00",
+                },
+            ]
+        },
+    )
+    assert response.status_code == 200
+    assert response.get_json() == {
+        "inserted": 1,
+        "updated": 0,
+        "unchanged": 1,
+        "duplicates": 0,
+    }
+    (sales,) = service.upsert.call_args[0]
+    assert sales[0].date_time == datetime(2021, 5, 1, 10)
+    assert sales[1].sku == "c"
+    assert sales[1].date_time == datetime(2021, 5, 1, 10)
+
+
+@pytest.mark.parametrize(
+    "body",
+    [None, {"sales": {}}, {"sales": [{"color": "red"}]}, {"sales": [1]}],
+)
+def test_upsert_malformed(client, service, body):
+    """Respond "400 Bad Request" when sales are malformed."""
+    response = client.post("/sales:upsert", json=body)
+    assert response.status_code == 400
+    service.upsert.assert_not_called()
+
+
+def test_upsert_invalid_fields(client, service):
+    """Respond with every invalid field of upserted sales."""
+    errors = {"0.sku": "cannot be null"}
+    service.upsert.side_effect = [srv.ResourceFieldsInvalidErr(errors)]
+    response = client.post("/sales:upsert", json={"sales": [{}]})
+    assert response.status_code == 400
+    assert response.get_json()["errors"] == errors
+
+
+def test_duplicate_field(client, service):
+    """Respond "409 Conflict" with the field of duplicate sales."""
+    service.upsert.side_effect = [srv.ResourceFieldDuplicateErr("id")]
+    response = client.post("/sales:upsert", json={"sales": [{}]})
+    assert response.status_code == 409
+    assert response.get_json() == {
+        "message": "Resource already exists.",
+        "field": "id",
+    }
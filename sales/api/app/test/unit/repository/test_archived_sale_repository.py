@@ -0,0 +1,229 @@
+"""Archive fallback sale repository tests."""
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.main.repository import (
+    OperationModel,
+    OperationResultModel,
+    RecordArchivedErr,
+    RecordNotFoundErr,
+    SaleModel,
+)
+from app.main.repository.archived import sale_repository as archived
+from app.main.repository.membership import sale_repository as membership
+
+START = datetime(2020, 1, 1)
+
+
+def sale(i):
+    return SaleModel(
+        id=f"id-{i:02d}",
+        sku=f"SKU-{i % 2}",
+        created_at=START + timedelta(days=i),
+    )
+
+
+class MemoryRepository:
+    """
+    In-memory sale repository with sales 0 to 9 archived and 10 to 19
+    not, recording calls.
+    """
+
+    def __init__(self):
+        self.hot = {s.id: s for s in map(sale, range(10, 20))}
+        self.archive = {s.id: s for s in map(sale, range(10))}
+        self.calls = []
+
+    def metrics(self):
+        return {}
+
+    def find_by_id(self, id, fields=None):
+        self.calls.append("find_by_id")
+        if id not in self.hot:
+            raise RecordNotFoundErr()
+        return self.hot[id]
+
+    def find_archived_by_id(self, id, fields=None):
+        self.calls.append("find_archived_by_id")
+        if id not in self.archive:
+            raise RecordNotFoundErr()
+        return self.archive[id]
+
+    def find(self, id, limit, after, filters, fields):
+        self.calls.append("find")
+        if id not in self.hot:
+            return []
+        return self._page(self.hot, self.hot[id].created_at, id, limit, after)
+
+    def find_from(self, created_at, id, limit, after, filters, fields):
+        self.calls.append("find_from")
+        return self._page(self.hot, created_at, id, limit, after)
+
+    def find_archived(self, created_at, id, limit, after, filters, fields):
+        self.calls.append("find_archived")
+        return self._page(self.archive, created_at, id, limit, after)
+
+    def delete_by_id(self, id):
+        if self.hot.pop(id, None) is None:
+            raise RecordNotFoundErr()
+
+    def update(self, sale, fields, expected_updated_at=None):
+        if sale.id not in self.hot:
+            raise RecordNotFoundErr()
+        return sale
+
+    def execute_batch(self, operations, atomic):
+        return [
+            OperationResultModel(
+                applied=o.sale.id in self.hot,
+                error=None if o.sale.id in self.hot else RecordNotFoundErr(),
+            )
+            for o in operations
+        ]
+
+    def iter_ids(self, batch_size=10000):
+        return iter(sorted(self.hot))
+
+    def iter_archived_ids(self, batch_size=10000):
+        return iter(sorted(self.archive))
+
+    def archive_horizon(self):
+        self.calls.append("archive_horizon")
+        if not self.archive:
+            return None
+        return max(s.created_at for s in self.archive.values())
+
+    @staticmethod
+    def _page(sales, created_at, id, limit, after):
+        ordered = sorted(sales.values(), key=lambda s: (s.created_at, s.id))
+        if after:
+            page = [
+                s for s in ordered if (s.created_at, s.id) < (created_at, id)
+            ]
+            return page[::-1][:limit]
+        page = [s for s in ordered if (s.created_at, s.id) > (created_at, id)]
+        return page[:limit][::-1]
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def memory():
+    return MemoryRepository()
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def repo(memory, clock):
+    return archived.SaleRepository(
+        repository=memory, horizon_seconds=30, clock=clock
+    )
+
+
+def ids(sales):
+    return [int(s.id[3:]) for s in sales]
+
+
+def test_find_by_id(repo, memory):
+    """Fall back to the archive for sales missing from the table."""
+    assert repo.find_by_id("id-15").id == "id-15"
+    assert repo.find_by_id("id-05").id == "id-05"
+    with pytest.raises(RecordNotFoundErr):
+        repo.find_by_id("id-25")
+    assert memory.calls == [
+        "find_by_id",
+        "find_by_id",
+        "find_archived_by_id",
+        "find_by_id",
+        "find_archived_by_id",
+    ]
+    assert repo.metrics()["archive"]["reads"] == 2
+
+
+def test_find_newer_than_archive(repo, memory):
+    """Skip the archive for pages ending after its newest sale."""
+    assert ids(repo.find("id-18", 3)) == [17, 16, 15]
+    assert memory.calls == ["find", "archive_horizon"]
+
+
+def test_find_into_archive(repo, memory):
+    """Continue pages reaching past the table into the archive."""
+    assert ids(repo.find("id-12", 4)) == [11, 10, 9, 8]
+    assert ids(repo.find("id-09", 3)) == [8, 7, 6]
+    assert ids(repo.find("id-08", 4, after=False)) == [12, 11, 10, 9]
+    assert memory.calls.count("archive_horizon") == 1
+    assert "find_from" in memory.calls
+
+
+def test_find_projected(repo, memory):
+    """Project pages after comparing them with the archive."""
+    sales = repo.find("id-11", 2, fields=["sku"])
+    assert ids(sales) == [10, 9]
+    assert [s.created_at for s in sales] == [None, None]
+    assert sales[0].sku == "SKU-0"
+    assert memory.hot["id-10"].created_at is not None
+
+
+def test_find_without_archive(repo, memory, clock):
+    """Re-read the archive's newest sale once it is due."""
+    memory.archive = {}
+    assert ids(repo.find("id-11", 3)) == [10]
+    memory.archive = {s.id: s for s in map(sale, range(10))}
+    assert ids(repo.find("id-11", 3)) == [10]
+    clock.now = 30
+    assert ids(repo.find("id-11", 3)) == [10, 9, 8]
+    assert memory.calls.count("archive_horizon") == 2
+
+
+def test_iter_ids(repo):
+    """Iterate over ids of sales in the table, then in the archive."""
+    assert list(repo.iter_ids()) == [f"id-{i:02d}" for i in range(10, 20)] + [
+        f"id-{i:02d}" for i in range(10)
+    ]
+
+
+def test_find_by_id_through_membership_filter(repo, memory):
+    """Find archived sales by id once the membership filter is rebuilt."""
+    filtered = membership.provide_sale_repository(repo, memory_bytes=4096)
+    filtered.rebuild()
+    assert filtered.find_by_id("id-03").id == "id-03"
+    assert filtered.find_by_id("id-13").id == "id-13"
+    with pytest.raises(RecordNotFoundErr):
+        filtered.find_by_id("id-99")
+
+
+def test_write_archived(repo):
+    """Fail writes of archived sales as archived, not as missing."""
+    with pytest.raises(RecordArchivedErr):
+        repo.delete_by_id("id-01")
+    with pytest.raises(RecordArchivedErr):
+        repo.update(SaleModel(id="id-02", sku="x"), ["sku"])
+    with pytest.raises(RecordNotFoundErr):
+        repo.delete_by_id("id-99")
+    repo.delete_by_id("id-12")
+
+
+def test_execute_batch_archived(repo):
+    """Fail batch operations on archived sales as archived."""
+    results = repo.execute_batch(
+        [
+            OperationModel("delete", SaleModel(id="id-01")),
+            OperationModel("update", SaleModel(id="id-99"), ["sku"]),
+            OperationModel("update", SaleModel(id="id-12"), ["sku"]),
+        ],
+        False,
+    )
+    assert isinstance(results[0].error, RecordArchivedErr)
+    assert isinstance(results[1].error, RecordNotFoundErr)
+    assert results[2].applied
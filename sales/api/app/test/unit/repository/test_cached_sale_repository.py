@@ -0,0 +1,181 @@
+"""Shared cache sale repository tests."""
+from datetime import datetime, timezone
+
+import pytest
+
+from app.main.helper.shared_cache import SharedCache
+from app.main.repository import (
+    OperationModel,
+    OperationResultModel,
+    RecordConflictErr,
+    RecordNotFoundErr,
+    SaleModel,
+    UpsertResultModel,
+)
+from app.main.repository.cached import sale_repository as cached
+
+
+def sale(id="id-1", **values):
+    return SaleModel(
+        **{
+            "id": id,
+            "date_time": datetime(2021, 5, 1, 12, 30, 15, 123456),
+            "order_id": "ORD-1",
+            "sku": "SKU-Ä1",
+            "quantity": 2,
+            "subtotal": 1998,
+            "fee": 58,
+            "tax": 160,
+            "created_at": datetime(2021, 5, 1, 12, 31),
+            "updated_at": datetime(2021, 5, 2),
+            **values,
+        }
+    )
+
+
+class MemoryRepository:
+    """In-memory sale repository recording lookups."""
+
+    def __init__(self, sales):
+        self.sales = {s.id: s for s in sales}
+        self.lookups = []
+
+    def metrics(self):
+        return {}
+
+    def find_by_id(self, id, fields=None):
+        self.lookups.append((id, fields))
+        if id not in self.sales:
+            raise RecordNotFoundErr()
+        return self.sales[id]
+
+    def create(self, sale):
+        self.sales[sale.id] = sale
+        return sale
+
+    def update(self, sale, fields, expected_updated_at=None):
+        if expected_updated_at is not None:
+            raise RecordConflictErr()
+        current = self.sales[sale.id]
+        updated = SaleModel(**vars(current))
+        for f in fields:
+            setattr(updated, f, getattr(sale, f))
+        self.sales[sale.id] = updated
+        return updated
+
+    def delete_by_id(self, id):
+        del self.sales[id]
+
+    def execute_batch(self, operations, atomic):
+        for operation in operations:
+            self.sales.pop(operation.sale.id, None)
+        return [OperationResultModel(applied=True) for _ in operations]
+
+    def upsert(self, sales, key):
+        for s in sales:
+            self.sales[s.id] = s
+        return UpsertResultModel(updated=sales)
+
+
+@pytest.fixture
+def memory():
+    return MemoryRepository([sale(), sale("id-2")])
+
+
+@pytest.fixture
+def cache():
+    return SharedCache(slots=64)
+
+
+@pytest.fixture
+def repo(memory, cache):
+    return cached.provide_sale_repository(memory, cache, ttl=60)
+
+
+def assert_same(found, expected):
+    assert vars(found) == vars(expected)
+
+
+def test_encoding():
+    """Round-trip complete sales, skip incomplete ones."""
+    value = cached.encode_sale(sale())
+    assert len(value) < 100
+    assert_same(cached.decode_sale("id-1", value), sale())
+    assert cached.encode_sale(sale(sku=None)) is None
+    aware = datetime(2021, 5, 1, tzinfo=timezone.utc)
+    assert cached.encode_sale(sale(date_time=aware)) is None
+
+
+def test_find_by_id(repo, memory):
+    """Read sales once, then serve them from the cache."""
+    assert_same(repo.find_by_id("id-1"), sale())
+    assert_same(repo.find_by_id("id-1"), sale())
+    assert memory.lookups == [("id-1", None)]
+    with pytest.raises(RecordNotFoundErr):
+        repo.find_by_id("id-3")
+    assert repo.metrics()["shared_cache"]["hits"] == 1
+
+
+def test_find_by_id_projected(repo, memory):
+    """Project cached sales, without filling the cache with projections."""
+    projected = SaleModel(id="id-1", sku="SKU-Ä1")
+    memory.sales["id-1"] = projected
+    assert repo.find_by_id("id-1", ["sku"]) is projected
+    memory.sales["id-1"] = sale()
+    repo.find_by_id("id-1")
+    assert_same(repo.find_by_id("id-1", ["sku"]), projected)
+    with pytest.raises(ValueError):
+        repo.find_by_id("id-1", ["password"])
+    assert memory.lookups == [("id-1", ["sku"]), ("id-1", None)]
+
+
+def test_writes(repo, memory):
+    """Replace sales written, remove deleted ones."""
+    repo.find_by_id("id-1")
+    repo.update(SaleModel(id="id-1", sku="SKU-2"), ["sku"])
+    assert repo.find_by_id("id-1").sku == "SKU-2"
+    with pytest.raises(RecordConflictErr):
+        repo.update(
+            SaleModel(id="id-1", sku="SKU-3"), ["sku"], datetime(2021, 1, 1)
+        )
+    repo.find_by_id("id-1")
+    repo.create(sale("id-3"))
+    repo.find_by_id("id-3")
+    repo.delete_by_id("id-3")
+    with pytest.raises(RecordNotFoundErr):
+        repo.find_by_id("id-3")
+    assert memory.lookups == [("id-1", None), ("id-1", None), ("id-3", None)]
+
+
+def test_execute_batch(repo, memory):
+    """Remove sales touched by batches."""
+    repo.find_by_id("id-1")
+    repo.find_by_id("id-2")
+    repo.execute_batch([OperationModel("delete", SaleModel(id="id-1"))])
+    with pytest.raises(RecordNotFoundErr):
+        repo.find_by_id("id-1")
+    repo.find_by_id("id-2")
+    assert memory.lookups == [
+        ("id-1", None),
+        ("id-2", None),
+        ("id-1", None),
+    ]
+
+
+def test_upsert(repo, memory):
+    """Remove sales updated by upserts."""
+    repo.find_by_id("id-1")
+    repo.upsert([sale("id-1", quantity=5)])
+    assert repo.find_by_id("id-1").quantity == 5
+    assert len(memory.lookups) == 2
+
+
+def test_shared(memory, cache):
+    """Serve sales read through one repository from another."""
+    first = cached.provide_sale_repository(memory, cache)
+    second = cached.provide_sale_repository(memory, cache)
+    first.find_by_id("id-1")
+    second.find_by_id("id-1")
+    second.update(SaleModel(id="id-1", sku="SKU-2"), ["sku"])
+    assert first.find_by_id("id-1").sku == "SKU-2"
+    assert memory.lookups == [("id-1", None)]
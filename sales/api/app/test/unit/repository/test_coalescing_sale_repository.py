@@ -0,0 +1,213 @@
+"""Coalescing sale repository tests."""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.main.helper import deadline, session
+from app.main.repository import RecordNotFoundErr, SaleModel, TimeoutErr
+from app.main.repository.coalescing import sale_repository as coalescing
+
+
+class SlowRepository:
+    """Repository blocking reads until released."""
+
+    def __init__(self, error=None):
+        self.release = threading.Event()
+        self.calls = []
+        self.error = error
+
+    def metrics(self):
+        return {}
+
+    def find_by_id(self, id, fields=None):
+        self.calls.append(("find_by_id", id))
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return SaleModel(id=id)
+
+    def find(self, id, limit, after, filters, fields=None):
+        self.calls.append(("find", id, limit, after, filters))
+        self.release.wait(5)
+        return [SaleModel(id=id)]
+
+    def delete_by_id(self, id):
+        self.calls.append(("delete_by_id", id))
+
+
+def wait_for_waiters(repo, count):
+    while repo.metrics()["single_flight"]["calls"] < count:
+        pass
+
+
+def test_find_by_id_coalesced():
+    """Share one query between concurrent callers for the same id."""
+    slow = SlowRepository()
+    repo = coalescing.provide_sale_repository(slow)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(repo.find_by_id, "a") for _ in range(4)]
+        wait_for_waiters(repo, 4)
+        slow.release.set()
+        sales = [f.result() for f in futures]
+    assert slow.calls == [("find_by_id", "a")]
+    assert all(s is sales[0] for s in sales)
+    assert repo.metrics()["single_flight"] == {"calls": 4, "coalesced": 3}
+
+
+def test_find_by_id_shares_exception():
+    """Raise exception of shared query in every caller."""
+    slow = SlowRepository(error=RecordNotFoundErr())
+    repo = coalescing.provide_sale_repository(slow)
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = [executor.submit(repo.find_by_id, "a") for _ in range(3)]
+        wait_for_waiters(repo, 3)
+        slow.release.set()
+        for future in futures:
+            with pytest.raises(RecordNotFoundErr):
+                future.result()
+    assert len(slow.calls) == 1
+
+
+def test_find_keyed_by_arguments():
+    """Query separately for different arguments."""
+    slow = SlowRepository()
+    slow.release.set()
+    repo = coalescing.provide_sale_repository(slow)
+    repo.find("a", 10, True, {"sku": ["x", "y"]})
+    repo.find("a", 10, False, {"sku": ["x", "y"]})
+    repo.find("a", 10, True, None)
+    assert len(slow.calls) == 3
+    assert repo.metrics()["single_flight"]["coalesced"] == 0
+
+
+def test_follower_deadline():
+    """Stop waiting for shared query once the caller's deadline passed."""
+    slow = SlowRepository()
+    repo = coalescing.provide_sale_repository(slow)
+
+    def find_by_id_within(timeout):
+        with deadline.budget(timeout):
+            return repo.find_by_id("a")
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(repo.find_by_id, "a")
+        wait_for_waiters(repo, 1)
+        follower = executor.submit(find_by_id_within, 0.01)
+        with pytest.raises(TimeoutErr):
+            follower.result()
+        slow.release.set()
+        assert leader.result().id == "a"
+    assert len(slow.calls) == 1
+
+
+def test_follower_deadline_async():
+    """Stop awaiting shared query once the task's deadline passed."""
+    slow = SlowRepository()
+    repo = coalescing.provide_sale_repository(slow)
+
+    async def main():
+        leader = asyncio.ensure_future(repo.find_by_id_async("a"))
+        await asyncio.sleep(0)
+        with deadline.budget(0.01):
+            with pytest.raises(TimeoutErr):
+                await repo.find_by_id_async("a")
+        slow.release.set()
+        return await leader
+
+    assert asyncio.run(main()).id == "a"
+    assert len(slow.calls) == 1
+
+
+def test_async_call_in_caller_context(mocker):
+    """Run shared query with the deadline of the calling task."""
+    repository = mocker.Mock()
+    repository.find_by_id.side_effect = lambda id, fields: deadline.remaining()
+    repo = coalescing.provide_sale_repository(repository)
+
+    async def main():
+        with deadline.budget(10):
+            return await repo.find_by_id_async("a")
+
+    assert 0 < asyncio.run(main()) <= 10
+
+
+def test_pinned_sessions_not_coalesced():
+    """Reads of a session that wrote do not share reads of others."""
+    slow = SlowRepository()
+    repo = coalescing.provide_sale_repository(slow)
+
+    def find_by_id_in_session(token):
+        current = session.start(token)
+        try:
+            return repo.find_by_id("a")
+        finally:
+            session.finish(current)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [
+            executor.submit(find_by_id_in_session, token)
+            for token in (None, "100.0", None, "100.0")
+        ]
+        wait_for_waiters(repo, 4)
+        slow.release.set()
+        for future in futures:
+            future.result()
+    assert len(slow.calls) == 2
+    assert repo.metrics()["single_flight"]["coalesced"] == 2
+
+
+def test_sequential_calls_not_cached():
+    """Query again once previous call finished."""
+    slow = SlowRepository()
+    slow.release.set()
+    repo = coalescing.provide_sale_repository(slow)
+    repo.find_by_id("a")
+    repo.find_by_id("a")
+    assert len(slow.calls) == 2
+
+
+def test_find_by_id_async_coalesced():
+    """Share one query between asyncio tasks and threads."""
+    slow = SlowRepository()
+    repo = coalescing.provide_sale_repository(slow)
+
+    async def main():
+        tasks = [
+            asyncio.ensure_future(repo.find_by_id_async("a")) for _ in range(5)
+        ]
+        thread = ThreadPoolExecutor(max_workers=1).submit(repo.find_by_id, "a")
+        await asyncio.sleep(0)
+        await asyncio.get_running_loop().run_in_executor(
+            None, wait_for_waiters, repo, 2
+        )
+        slow.release.set()
+        return await asyncio.gather(*tasks), thread.result()
+
+    sales, thread_sale = asyncio.run(main())
+    assert slow.calls == [("find_by_id", "a")]
+    assert all(s is thread_sale for s in sales)
+    assert repo.metrics()["single_flight"] == {"calls": 6, "coalesced": 5}
+
+
+def test_writes_passed_through():
+    """Pass writes to repository."""
+    slow = SlowRepository()
+    repo = coalescing.provide_sale_repository(slow)
+    repo.delete_by_id("a")
+    assert slow.calls == [("delete_by_id", "a")]
+
+
+def test_projections_not_coalesced(mocker):
+    """Reads of different fields do not share a query."""
+    repository = mocker.Mock()
+    repo = coalescing.provide_sale_repository(repository)
+    repo.find_by_id("a", ["sku"])
+    repo.find_by_id("a", ["subtotal"])
+    repo.find("a", 10, True, None, ["sku"])
+    assert repository.find_by_id.call_args_list == [
+        mocker.call("a", ["sku"]),
+        mocker.call("a", ["subtotal"]),
+    ]
+    repository.find.assert_called_once_with("a", 10, True, None, ["sku"])
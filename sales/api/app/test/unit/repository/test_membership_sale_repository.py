@@ -0,0 +1,252 @@
+"""Membership filter sale repository tests."""
+from datetime import datetime
+
+import pytest
+
+from app.main import provider
+from app.main import service as srv
+from app.main.config import BaseConfig
+from app.main.helper.cuckoo import CuckooFilter
+from app.main.repository import (
+    OperationModel,
+    OperationResultModel,
+    RecordNotFoundErr,
+    SaleModel,
+    UpsertResultModel,
+)
+from app.main.repository.membership import sale_repository as membership
+
+
+class MemoryRepository:
+    """In-memory sale repository recording lookups."""
+
+    def __init__(self, ids):
+        self.sales = {id: SaleModel(id=id) for id in ids}
+        self.lookups = []
+        self.during_scan = None
+
+    def metrics(self):
+        return {}
+
+    def find_by_id(self, id, fields=None):
+        self.lookups.append(id)
+        if id not in self.sales:
+            raise RecordNotFoundErr()
+        return self.sales[id]
+
+    def create(self, sale):
+        if sale.sku is None:
+            raise ValueError()
+        self.sales[sale.id] = sale
+        return sale
+
+    def delete_by_id(self, id):
+        if self.sales.pop(id, None) is None:
+            raise RecordNotFoundErr()
+
+    def execute_batch(self, operations, atomic):
+        results = []
+        for operation in operations:
+            if operation.kind == "create" and operation.sale.sku:
+                self.sales[operation.sale.id] = operation.sale
+                results.append(OperationResultModel(applied=True))
+            elif operation.kind == "delete":
+                self.sales.pop(operation.sale.id)
+                results.append(OperationResultModel(applied=True))
+            else:
+                results.append(OperationResultModel(error=ValueError()))
+        return results
+
+    def upsert(self, sales, key):
+        if any(s.sku is None for s in sales):
+            raise ValueError()
+        inserted = [s for s in sales if s.id not in self.sales]
+        for sale in inserted:
+            self.sales[sale.id] = sale
+        return UpsertResultModel(
+            inserted=inserted, unchanged=len(sales) - len(inserted)
+        )
+
+    def iter_ids(self, batch_size=10000):
+        ids = sorted(self.sales)
+        for index, id in enumerate(ids):
+            if index == 1 and self.during_scan is not None:
+                self.during_scan()
+            yield id
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def memory():
+    return MemoryRepository([f"id-{i}" for i in range(100)])
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def repo(memory, clock):
+    repository = membership.SaleRepository(
+        repository=memory,
+        new_filter=lambda: CuckooFilter(memory_bytes=4096),
+        rebuild_seconds=60,
+        clock=clock,
+    )
+    repository.rebuild()
+    return repository
+
+
+def test_find_by_id_known(repo, memory):
+    """Look up ids in the filter in the database."""
+    assert repo.find_by_id("id-5").id == "id-5"
+    assert memory.lookups == ["id-5"]
+
+
+def test_find_by_id_definite_miss(repo, memory):
+    """Answer definite misses without querying."""
+    for i in range(200):
+        with pytest.raises(RecordNotFoundErr):
+            repo.find_by_id(f"missing-{i}")
+    misses = len(memory.lookups)
+    metrics = repo.metrics()["id_filter"]
+    assert metrics["short_circuited"] == 200 - misses
+    assert metrics["false_positives"] == misses
+    assert misses < 20
+
+
+def test_find_by_id_before_build(memory, clock, mocker):
+    """Query database until filter is built."""
+    mocker.patch.object(membership.threading, "Thread")
+    repository = membership.SaleRepository(
+        repository=memory,
+        new_filter=lambda: CuckooFilter(memory_bytes=4096),
+        rebuild_seconds=60,
+        clock=clock,
+    )
+    with pytest.raises(RecordNotFoundErr):
+        repository.find_by_id("missing")
+    assert memory.lookups == ["missing"]
+
+
+def test_create_and_delete(repo):
+    """Add created ids, keeping deleted ids until the next rebuild."""
+    repo.create(SaleModel(id="new", sku="a"))
+    assert repo.find_by_id("new").id == "new"
+    repo.delete_by_id("new")
+    assert repo.metrics()["id_filter"]["items"] == 101
+    repo.rebuild()
+    assert repo.metrics()["id_filter"]["items"] == 100
+
+
+def test_delete_keeps_fingerprints(repo, mocker):
+    """
+    Never remove ids of deleted sales, whose fingerprints may be those of
+    other ids.
+    """
+    remove = mocker.spy(CuckooFilter, "remove")
+    repo.delete_by_id("id-1")
+    repo.execute_batch([OperationModel("delete", SaleModel(id="id-2"))])
+    remove.assert_not_called()
+
+
+def test_create_failed(repo):
+    """Remove id of sale that could not be created."""
+    with pytest.raises(ValueError):
+        repo.create(SaleModel(id="new"))
+    assert repo.metrics()["id_filter"]["items"] == 100
+
+
+def test_execute_batch(repo):
+    """Keep ids of applied creates only."""
+    repo.execute_batch(
+        [
+            OperationModel("create", SaleModel(id="a", sku="x")),
+            OperationModel("create", SaleModel(id="b")),
+            OperationModel("delete", SaleModel(id="id-1")),
+        ]
+    )
+    assert repo.metrics()["id_filter"]["items"] == 101
+    assert repo.find_by_id("a").id == "a"
+
+
+def test_upsert(repo):
+    """Keep ids of inserted sales only."""
+    repo.upsert([SaleModel(id="a", sku="x"), SaleModel(id="id-1", sku="x")])
+    assert repo.metrics()["id_filter"]["items"] == 101
+    assert repo.find_by_id("a").id == "a"
+    with pytest.raises(ValueError):
+        repo.upsert([SaleModel(id="b", sku="x"), SaleModel(id="c")])
+    assert repo.metrics()["id_filter"]["items"] == 101
+
+
+def test_rebuild_replays_writes(repo, memory, mocker):
+    """Apply writes made while ids are streamed to the new filter."""
+    mocker.patch.object(membership.threading, "Thread")
+
+    def write():
+        repo.create(SaleModel(id="zzz", sku="a"))
+        with pytest.raises(ValueError):
+            repo.create(SaleModel(id="yyy"))
+
+    memory.during_scan = write
+    repo.rebuild()
+    assert repo.metrics()["id_filter"]["items"] == 101
+    assert repo.find_by_id("zzz").id == "zzz"
+    assert repo.metrics()["id_filter"]["rebuilds"] == 2
+
+
+def test_refresh_when_due(repo, memory, clock, mocker):
+    """Rebuild filter in the background once rebuild is due."""
+    thread = mocker.patch.object(membership.threading, "Thread")
+    repo.find_by_id("id-1")
+    assert thread.call_count == 1
+    thread.return_value.start.assert_called_once()
+    thread.call_args[1]["target"]()
+    repo.find_by_id("id-1")
+    assert thread.call_count == 1
+    clock.now = 61
+    repo.find_by_id("id-1")
+    assert thread.call_count == 2
+
+
+def test_default_reads_writes_of_other_workers(memory, mocker):
+    """
+    Read sales created by another worker over the same database, which
+    a filter of the worker's own writes would report missing.
+    """
+    config = {k: v for k, v in vars(BaseConfig).items() if k.isupper()}
+    config["DB_SHARDS"] = {}
+    mocker.patch.object(
+        provider, "create_sale_repository", return_value=memory
+    )
+    # Filters, if enabled, are built as soon as workers start.
+    thread = mocker.patch.object(membership.threading, "Thread")
+
+    def start():
+        thread.call_args[1]["target"]()
+
+    thread.return_value.start.side_effect = start
+    writer = provider.create_sale_service(config)
+    reader = provider.create_sale_service(config)
+    reader.find_by_id("id-1")
+    sale = writer.create(
+        srv.SaleModel(
+            date_time=datetime(2021, 1, 1),
+            order_id="ORD-1",
+            sku="SKU-1",
+            quantity=1,
+            subtotal=1999,
+            fee=58,
+            tax=160,
+        )
+    )
+    assert reader.find_by_id(sale.id).id == sale.id
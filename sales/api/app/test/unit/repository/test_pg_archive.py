@@ -0,0 +1,200 @@
+"""Sale archive tests."""
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from app.main.repository import RecordNotFoundErr
+from app.main.repository.postgres import archive
+from app.main.repository.postgres import sale_sql as sql
+from app.main.repository.postgres.sale_repository import (
+    provide_sale_repository,
+)
+
+
+def rows(count, start=datetime(2020, 1, 31, 20), step=timedelta(hours=1)):
+    return [
+        {
+            "id": f"id-{i:04d}",
+            "date_time": start + i * step,
+            "order_id": f"ORD-{i // 2}",
+            "sku": f"SKU-{i % 7}",
+            "quantity": 1,
+            "subtotal": 1999,
+            "fee": 58,
+            "tax": 160,
+            "created_at": start + i * step + timedelta(minutes=5),
+            "updated_at": start + i * step + timedelta(minutes=5),
+        }
+        for i in range(count)
+    ]
+
+
+def row_tuple(row):
+    return tuple(row[c] for c in sql.COLUMNS)
+
+
+def test_encode_batch():
+    """Round-trip rows, compressed."""
+    batch = rows(1000)
+    data = archive.encode_batch(batch)
+    assert list(archive.batch_rows(archive.decode_batch(data))) == batch
+    assert len(data) < len(repr(batch)) / 10
+    assert archive.find_in_batch(data, "id-0500") == batch[500]
+    assert archive.find_in_batch(data, "id-5000") is None
+    with pytest.raises(ValueError):
+        archive.decode_batch(b"\x00" + data[1:])
+
+
+def test_matches():
+    """Match rows against equality and range filters."""
+    (row,) = rows(1)
+    day = row["date_time"]
+    assert archive.matches(row, {})
+    assert archive.matches(row, {"sku": "SKU-0", "date_time": (day, None)})
+    assert not archive.matches(row, {"sku": "SKU-1"})
+    assert not archive.matches(row, {"date_time": (None, day - timedelta(1))})
+
+
+def test_archive_sales(mocker):
+    """Move sales in batches split by month, indexing their ids."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    batch = rows(6)
+    mock_cursor.fetchall.side_effect = [
+        [row_tuple(r) for r in batch],
+        [],
+    ]
+    mock_cursor.fetchone.side_effect = [(1,), (2,)]
+    cutoff = datetime(2021, 1, 1)
+    assert archive.archive_sales(mock_conn, cutoff, batch_size=6) == 6
+    calls = mock_cursor.execute.call_args_list
+    assert calls[0] == mocker.call(
+        sql.SELECT_ARCHIVABLE_SALES_STATEMENT, {"cutoff": cutoff, "limit": 6}
+    )
+    stmt, params = calls[1][0]
+    assert stmt == sql.INSERT_ARCHIVED_BATCH_STATEMENT
+    assert params["month"] == date(2020, 1, 1)
+    assert params["row_count"] == 4
+    assert params["first_date_time"] == batch[0]["date_time"]
+    assert params["last_created_at"] == batch[3]["created_at"]
+    assert params["skus"] == sorted({r["sku"] for r in batch[:4]})
+    assert params["order_ids"] == sorted({r["order_id"] for r in batch[:4]})
+    assert calls[2] == mocker.call(
+        sql.INSERT_ARCHIVED_IDS_STATEMENT,
+        {"ids": [r["id"] for r in batch[:4]], "batch_id": 1},
+    )
+    assert calls[3] == mocker.call(
+        sql.DELETE_SALES_BY_IDS_STATEMENT, ([r["id"] for r in batch[:4]],)
+    )
+    assert calls[4][0][1]["month"] == date(2020, 2, 1)
+    assert calls[5][0][1]["batch_id"] == 2
+    assert len(calls) == 8
+    mock_conn.commit.assert_called_once()
+
+
+def test_archive_sales_error(mocker):
+    """Roll back batch that fails."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.fetchall.return_value = [row_tuple(r) for r in rows(1)]
+    mock_cursor.fetchone.side_effect = Exception()
+    with pytest.raises(Exception):
+        archive.archive_sales(mock_conn, datetime(2021, 1, 1))
+    mock_conn.rollback.assert_called_once()
+    mock_conn.commit.assert_not_called()
+
+
+def test_find_archived_by_id(mocker):
+    """Find sale in the batch its id is indexed with."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    batch = rows(10)
+    mock_cursor.fetchone.return_value = (
+        memoryview(archive.encode_batch(batch)),
+    )
+    repo = provide_sale_repository(conn=mock_conn)
+    sale = repo.find_archived_by_id("id-0003")
+    mock_cursor.execute.assert_called_with(
+        sql.SELECT_ARCHIVED_BATCH_BY_SALE_ID_STATEMENT, ("id-0003",)
+    )
+    assert vars(sale) == batch[3]
+    sale = repo.find_archived_by_id("id-0003", ["sku"])
+    assert (sale.id, sale.sku, sale.date_time) == ("id-0003", "SKU-3", None)
+    with pytest.raises(RecordNotFoundErr):
+        repo.find_archived_by_id("id-0010")
+    mock_cursor.fetchone.return_value = None
+    with pytest.raises(RecordNotFoundErr):
+        repo.find_archived_by_id("id-0003")
+
+
+def bounds(batch_id, batch):
+    return (
+        batch_id,
+        batch[0]["date_time"],
+        batch[-1]["date_time"],
+        batch[0]["created_at"],
+        batch[-1]["created_at"],
+    )
+
+
+@pytest.mark.parametrize(
+    "after,filters,expected,reads",
+    [
+        (True, {}, [12, 11, 10], 2),
+        (False, {}, [16, 15, 14], 2),
+        (True, {"sku": "SKU-2"}, [9, 2], 3),
+        (True, {"date_time": (None, datetime(2020, 1, 1))}, [], 0),
+    ],
+)
+def test_find_archived(mocker, after, filters, expected, reads):
+    """
+    Read nearest batches overlapping filters, until no other can hold
+    nearer sales.
+    """
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    batch = rows(30)
+    batches = [batch[0:10], batch[10:20], batch[20:30]]
+    ordered = list(enumerate(batches, 1))
+    if after:
+        ordered.reverse()
+    mock_cursor.fetchall.return_value = [bounds(i, b) for i, b in ordered]
+    data = {i: archive.encode_batch(b) for i, b in enumerate(batches, 1)}
+    mock_cursor.fetchone.side_effect = lambda: (
+        data[mock_cursor.execute.call_args[0][1][0]],
+    )
+    repo = provide_sale_repository(conn=mock_conn)
+    anchor = batch[13]
+    sales = repo.find_archived(
+        anchor["created_at"], anchor["id"], 3, after, filters
+    )
+    assert [s.id for s in sales] == [f"id-{i:04d}" for i in expected]
+    stmts = [c[0][0] for c in mock_cursor.execute.call_args_list]
+    stmt, params = sql.generate_select_archived_batches_statement(
+        filters, after
+    )
+    params.update(
+        created_at=anchor["created_at"], max_batches=sql.MAX_ARCHIVED_BATCHES
+    )
+    assert mock_cursor.execute.call_args_list[0] == mocker.call(stmt, params)
+    assert stmts.count(sql.SELECT_ARCHIVED_BATCH_STATEMENT) == reads
+
+
+def test_select_archived_batches_statement():
+    """Leave out batches without filtered keys or dates in range."""
+    stmt, params = sql.generate_select_archived_batches_statement(
+        {"sku": "SKU-2", "date_time": (None, datetime(2020, 2, 1))}, False
+    )
+    assert stmt == (
+        f'SELECT {sql.ARCHIVED_BATCH_FIELDS} FROM "archived_sale_batch" '
+        "WHERE last_created_at >= %(created_at)s AND first_date_time <= "
+        "%(date_time_to)s AND skus @> ARRAY[%(sku)s]::text[] ORDER BY "
+        "first_created_at ASC LIMIT %(max_batches)s"
+    )
+    assert params == {"sku": "SKU-2", "date_time_to": datetime(2020, 2, 1)}
+    assert sql.generate_select_archived_batches_statement({}) == (
+        sql.SELECT_ARCHIVED_BATCHES_BEFORE_STATEMENT,
+        {},
+    )
+    with pytest.raises(ValueError):
+        sql.generate_select_archived_batches_statement({"color": "red"})
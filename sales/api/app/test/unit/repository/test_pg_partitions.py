@@ -0,0 +1,92 @@
+"""Sale partition maintenance tests."""
+from datetime import date, datetime
+
+import pytest
+
+from app.main.repository.postgres import partitions
+
+
+@pytest.mark.parametrize(
+    "month,count,expected",
+    [
+        (date(2020, 1, 1), 1, date(2020, 2, 1)),
+        (date(2020, 12, 1), 1, date(2021, 1, 1)),
+        (date(2020, 1, 1), -1, date(2019, 12, 1)),
+        (date(2020, 3, 1), -27, date(2017, 12, 1)),
+    ],
+)
+def test_add_months(month, count, expected):
+    """Add months to first day of month."""
+    assert partitions.add_months(month, count) == expected
+
+
+def test_partition_name():
+    """Partition names round trip to months."""
+    name = partitions.partition_name(date(2020, 3, 1))
+    assert name == "sale_y2020m03"
+    assert partitions.partition_month(name) == date(2020, 3, 1)
+    assert partitions.partition_month("sale_default") is None
+
+
+def test_maintain_partitions(mocker):
+    """Create future partitions and drop expired ones."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.fetchall.return_value = [
+        ("sale_default",),
+        ("sale_y2018m02",),
+        ("sale_y2018m03",),
+        ("sale_y2020m03",),
+    ]
+    mock_cursor.fetchone.return_value = (None,)
+    created, dropped = partitions.maintain_partitions(
+        mock_conn, today=date(2020, 3, 17), ahead=2, retention=24
+    )
+    assert created == ["sale_y2020m04", "sale_y2020m05"]
+    assert dropped == ["sale_y2018m02"]
+    statements = [c[0][0] for c in mock_cursor.execute.call_args_list]
+    assert (
+        'ALTER TABLE "sale" ATTACH PARTITION "sale_y2020m04" FOR VALUES '
+        "FROM (%(start)s) TO (%(end)s)"
+    ) in statements
+    assert 'ALTER TABLE "sale" DETACH PARTITION "sale_y2018m02"' in statements
+    assert 'DROP TABLE "sale_y2018m02"' in statements
+    assert not any("sale_y2018m03" in s for s in statements)
+    mock_conn.commit.assert_called_once()
+    mock_cursor.close.assert_called_once()
+
+
+def test_maintain_partitions_default_rows(mocker):
+    """Create partitions back to the oldest sale in default partition."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.fetchall.return_value = [
+        ("sale_default",),
+        ("sale_y2020m02",),
+    ]
+    mock_cursor.fetchone.return_value = (datetime(2017, 12, 31, 23),)
+    created, dropped = partitions.maintain_partitions(
+        mock_conn, today=date(2020, 3, 17), ahead=0, retention=26
+    )
+    assert created == [
+        partitions.partition_name(partitions.add_months(date(2017, 12, 1), i))
+        for i in range(28)
+        if i != 26
+    ]
+    assert dropped == ["sale_y2017m12"]
+    statements = [c[0][0] for c in mock_cursor.execute.call_args_list]
+    assert 'SELECT MIN(date_time) FROM "sale_default"' in statements
+    assert 'DROP TABLE "sale_y2017m12"' in statements
+
+
+def test_maintain_partitions_error(mocker):
+    """Roll back partition changes on error."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.fetchall.return_value = []
+    mock_cursor.execute.side_effect = [None, Exception()]
+    with pytest.raises(Exception):
+        partitions.maintain_partitions(mock_conn, today=date(2020, 3, 17))
+    mock_conn.rollback.assert_called_once()
+    mock_conn.commit.assert_not_called()
+    mock_cursor.close.assert_called_once()
@@ -0,0 +1,240 @@
+"""Connection routing tests."""
+import threading
+
+import pytest
+
+from app.main.helper import deadline, session
+from app.main.repository import OperationModel, SaleModel, TimeoutErr
+from app.main.repository.postgres.routing import (
+    ConnectionPool,
+    ConnectionRouter,
+)
+from app.main.repository.postgres.sale_repository import (
+    provide_sale_repository,
+)
+
+
+class Clock:
+    """Manually advanced clock."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def replica_factories(mocker, count):
+    conns = [mocker.Mock(closed=0) for _ in range(count)]
+    return conns, [lambda i=i: conns[i] for i in range(count)]
+
+
+def read(router):
+    """Connection a read was routed to, released like the repository."""
+    conn = router.reader()
+    router.release(conn)
+    return conn
+
+
+def test_reader_without_replicas(mocker):
+    """Read from primary when there are no replicas."""
+    primary = mocker.Mock()
+    router = ConnectionRouter(primary)
+    assert read(router) is primary
+    assert router.writer() is primary
+
+
+def test_reader_round_robin(mocker):
+    """Balance reads across replicas."""
+    primary = mocker.Mock()
+    conns, factories = replica_factories(mocker, 2)
+    router = ConnectionRouter(primary, factories)
+    assert [read(router) for _ in range(4)] == conns + conns
+    assert router.writer() is primary
+
+
+def test_reader_pinned_after_write(mocker):
+    """Read from primary for a while after a write."""
+    clock = Clock()
+    primary = mocker.Mock()
+    conns, factories = replica_factories(mocker, 1)
+    router = ConnectionRouter(primary, factories, pin_seconds=1, clock=clock)
+    router.wrote()
+    assert read(router) is primary
+    clock.now = 1.0
+    assert read(router) is conns[0]
+
+
+def test_reader_pinned_per_session(mocker):
+    """Pin reads of the session that wrote, wherever it continues."""
+    clock = Clock()
+    primary = mocker.Mock()
+    conns, factories = replica_factories(mocker, 1)
+    router = ConnectionRouter(primary, factories, pin_seconds=1, clock=clock)
+    writer = session.start()
+    try:
+        router.wrote()
+        token = writer.token
+    finally:
+        session.finish(writer)
+    assert read(router) is conns[0]
+    other = session.start(token)
+    try:
+        clock.now = 0.5
+        assert read(router) is primary
+    finally:
+        session.finish(other)
+
+
+def test_session_token():
+    """Keep latest write in token, ignoring invalid tokens."""
+    current = session.Session("12.5")
+    current.wrote(10.0)
+    assert current.token == "12.500000"
+    assert current.changed
+    assert session.Session("x").token is None
+    assert session.Session().token is None
+
+
+def test_reader_skips_failed_replica(mocker):
+    """Take broken replica out of rotation until retry time passes."""
+    clock = Clock()
+    primary = mocker.Mock()
+    conns, factories = replica_factories(mocker, 2)
+    router = ConnectionRouter(primary, factories, retry_seconds=5, clock=clock)
+    broken = router.reader()
+    broken.closed = 2
+    router.failed(broken)
+    router.release(broken)
+    assert [read(router) for _ in range(3)] == [conns[1]] * 3
+    reconnected = conns[0] = mocker.Mock(closed=0)
+    clock.now = 5.0
+    assert reconnected in [read(router) for _ in range(2)]
+
+
+def test_reader_ignores_query_errors(mocker):
+    """Keep replica in rotation when its connection is still open."""
+    primary = mocker.Mock()
+    conns, factories = replica_factories(mocker, 1)
+    router = ConnectionRouter(primary, factories)
+    conn = router.reader()
+    router.failed(conn)
+    router.release(conn)
+    assert read(router) is conns[0]
+
+
+def test_reader_falls_back_to_primary(mocker):
+    """Read from primary when no replica can be connected."""
+
+    def unreachable():
+        raise Exception()
+
+    primary = mocker.Mock()
+    router = ConnectionRouter(primary, [unreachable])
+    assert router.reader() is primary
+
+
+def test_repository_routing(mocker, sale):
+    """Repository reads from replicas and writes to primary."""
+    primary = mocker.Mock()
+    conns, factories = replica_factories(mocker, 1)
+    replica = conns[0]
+    replica.cursor.return_value.fetchone.return_value = tuple(sale.values())
+    primary.cursor.return_value.fetchone.return_value = tuple(sale.values())
+    primary.cursor.return_value.rowcount = 1
+    router = ConnectionRouter(primary, factories)
+    repo = provide_sale_repository(conn=primary, router=router)
+    repo.find_by_id(sale["id"])
+    replica.cursor.return_value.execute.assert_called_once()
+    primary.cursor.return_value.execute.assert_not_called()
+    repo.delete_by_id(sale["id"])
+    primary.cursor.return_value.execute.assert_called_once()
+    repo.find_by_id(sale["id"])
+    assert primary.cursor.return_value.execute.call_count == 2
+    repo.close()
+    primary.close.assert_called_once()
+    replica.close.assert_called_once()
+
+
+def test_iter_ids_from_primary(mocker):
+    """Scan ids on the primary, which replicas may lag behind."""
+    primary = mocker.Mock()
+    primary.cursor.return_value.fetchall.return_value = [("a",)]
+    conns, factories = replica_factories(mocker, 1)
+    router = ConnectionRouter(primary, factories)
+    repo = provide_sale_repository(conn=primary, router=router)
+    assert list(repo.iter_ids()) == ["a"]
+    assert list(repo.iter_archived_ids()) == ["a"]
+    conns[0].cursor.assert_not_called()
+
+
+def test_pool_lends_exclusively(mocker):
+    """Lend each connection to one caller, opening more up to size."""
+    primary = mocker.Mock(closed=0)
+    opened = []
+
+    def connect():
+        opened.append(mocker.Mock(closed=0))
+        return opened[-1]
+
+    pool = ConnectionPool([primary], connect, size=2)
+    first, second = pool.acquire(), pool.acquire()
+    assert {id(first), id(second)} == {id(primary), id(opened[0])}
+    with deadline.budget(0.01):
+        with pytest.raises(TimeoutErr):
+            pool.acquire()
+    pool.release(first)
+    assert pool.acquire() is first
+    assert len(opened) == 1
+
+
+def test_pool_waits_for_release(mocker):
+    """Wait for a lent connection to be returned."""
+    primary = mocker.Mock(closed=0)
+    pool = ConnectionPool([primary])
+    conn = pool.acquire()
+    timer = threading.Timer(0.01, pool.release, (conn,))
+    timer.start()
+    with deadline.budget(1):
+        assert pool.acquire() is primary
+    timer.join()
+
+
+def test_pool_replaces_broken(mocker):
+    """Open a new connection in place of a broken one."""
+    primary = mocker.Mock(closed=2)
+    replacement = mocker.Mock(closed=0)
+    pool = ConnectionPool([primary], lambda: replacement)
+    pool.release(pool.acquire())
+    assert pool.acquire() is replacement
+    assert not pool.owns(primary)
+
+
+def test_batch_rollback_isolated(mocker, sale):
+    """
+    Roll back a failing batch on its own connection, leaving the
+    transaction of a concurrent write untouched.
+    """
+    primary = mocker.Mock(closed=0)
+    batch_conn = mocker.Mock(closed=0)
+    batch_conn.cursor.return_value.execute.side_effect = Exception()
+    router = ConnectionRouter(primary, connect=lambda: batch_conn, pool_size=2)
+    repo = provide_sale_repository(conn=primary, router=router)
+    writing = router.writer()
+    with pytest.raises(Exception):
+        repo.execute_batch([OperationModel("create", SaleModel(**sale))])
+    batch_conn.rollback.assert_called_once()
+    primary.rollback.assert_not_called()
+    router.release(writing)
+    primary.commit.assert_called_once()
+
+
+def test_replica_lent_exclusively(mocker):
+    """Lend replica connections to one read at a time."""
+    primary = mocker.Mock(closed=0)
+    conns, factories = replica_factories(mocker, 1)
+    router = ConnectionRouter(primary, factories)
+    assert router.reader() is conns[0]
+    with deadline.budget(0.01):
+        with pytest.raises(TimeoutErr):
+            router.reader()
@@ -1,17 +1,31 @@
 """Sale repository tests."""
+from datetime import datetime, timedelta
+
 import pytest
 
 from app.main.repository import (
+    OperationModel,
     SaleModel,
     RepositoryErr,
+    RecordConflictErr,
     RecordNotFoundErr,
     RecordFieldNullErr,
     RecordFieldDuplicateErr,
+    TimeoutErr,
+    VersionModel,
 )
+from app.main.helper import deadline
+from app.main.helper.tracing import Tracer
 from app.main.repository.postgres.sale_repository import (
+    _batch_groups,
     provide_sale_repository,
 )
 
+RETURNING = (
+    " RETURNING id, date_time, order_id, sku, quantity, subtotal, fee, "
+    "tax, created_at, updated_at"
+)
+
 
 def test_find_by_id(mocker, sale):
     """Retrieves a sale by id."""
@@ -101,13 +115,17 @@ def test_create(mocker, sale):
     s = SaleModel(**sale)
     mock_conn = mocker.Mock()
     mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.fetchone.return_value = tuple(sale.values())
     repo = provide_sale_repository(conn=mock_conn)
-    repo.create(s)
+    created = repo.create(s)
+    assert created.__dict__ == sale
     mock_cursor.execute.assert_called_with(
         (
             'INSERT INTO "sale" (id, date_time, order_id, sku, quantity, '
             "subtotal, fee, tax, created_at, updated_at) VALUES "
-            "(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
+            "(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id, "
+            "date_time, order_id, sku, quantity, subtotal, fee, tax, "
+            "created_at, updated_at"
         ),
         (
             sale["id"],
@@ -171,6 +189,8 @@ def test_create_null_field_value(mocker, sale, field):
     "field,constraint",
     [
         ("id", "sale_pkey"),
+        ("id", "sale_2021_01_pkey"),
+        ("order_id", "sale_2021_01_order_id_sku_date_time_idx"),
     ],
 )
 def test_create_duplicate_field_value(mocker, sale, field, constraint):
@@ -299,14 +319,16 @@ def test_delete_by_id_execute_error(mocker, sale):
     ],
 )
 def test_update(mocker, sale, query, fields):
-    """Update sale."""
+    """Update sale, returning it as updated."""
     s = SaleModel(**sale)
     mock_conn = mocker.Mock()
     mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.fetchone.return_value = tuple(sale.values())
     repo = provide_sale_repository(conn=mock_conn)
-    repo.update(s, fields)
+    updated = repo.update(s, fields)
+    assert updated.__dict__ == sale
     mock_cursor.execute.assert_called_with(
-        query,
+        query + RETURNING,
         tuple(sale[f] for f in (fields + ["id"])),
     )
     mock_conn.commit.assert_called_once()
@@ -443,9 +465,9 @@ def test_find_after(mocker, sale_rows, count):
     mock_cursor.execute.assert_called_with(
         "SELECT id, date_time, order_id, sku, quantity, subtotal, "
         'fee, tax, created_at, updated_at FROM "sale" '
-        'WHERE created_at <= (SELECT created_at FROM "sale" '
-        "WHERE id = %(id)s) AND id <> %(id)s ORDER BY created_at "
-        "DESC LIMIT %(limit)s",
+        'WHERE (created_at, id) < ((SELECT created_at FROM "sale" '
+        "WHERE id = %(id)s), %(id)s) ORDER BY created_at DESC, id DESC "
+        "LIMIT %(limit)s",
         {"id": "1", "limit": count},
     )
     mock_cursor.close.assert_called_once()
@@ -469,9 +491,9 @@ def test_find_before(mocker, sale_rows, count):
     mock_cursor.execute.assert_called_with(
         "SELECT * FROM (SELECT id, date_time, order_id, sku, quantity, "
         'subtotal, fee, tax, created_at, updated_at FROM "sale" WHERE '
-        'created_at >= (SELECT created_at FROM "sale" WHERE id = %(id)s) '
-        "AND id <> %(id)s ORDER BY created_at ASC LIMIT %(limit)s) AS "
-        '"filtered_sales" ORDER BY created_at DESC',
+        '(created_at, id) > ((SELECT created_at FROM "sale" WHERE id = '
+        "%(id)s), %(id)s) ORDER BY created_at ASC, id ASC LIMIT %(limit)s) "
+        'AS "filtered_sales" ORDER BY created_at DESC, id DESC',
         {"id": "1", "limit": count},
     )
     mock_cursor.close.assert_called_once()
@@ -517,3 +539,1049 @@ def test_find_execute_error(mocker):
         repo.find("1")
     mock_conn.commit.assert_called_once()
     mock_cursor.close.assert_called_once()
+
+
+@pytest.mark.parametrize(
+    "after,query",
+    [
+        (
+            True,
+            "SELECT COUNT(*), MAX(updated_at), SUM(('x' || LEFT(MD5(id || "
+            "':' || updated_at), 15))::bit(60)::bigint)::text FROM (SELECT "
+            'id, updated_at FROM "'
+            'sale" WHERE (created_at, id) < ((SELECT created_at FROM '
+            '"sale" WHERE id = %(id)s), %(id)s) ORDER BY created_at DESC, '
+            'id DESC LIMIT %(limit)s) AS "page"',
+        ),
+        (
+            False,
+            "SELECT COUNT(*), MAX(updated_at), SUM(('x' || LEFT(MD5(id || "
+            "':' || updated_at), 15))::bit(60)::bigint)::text FROM (SELECT "
+            'id, updated_at FROM "'
+            'sale" WHERE (created_at, id) > ((SELECT created_at FROM '
+            '"sale" WHERE id = %(id)s), %(id)s) ORDER BY created_at ASC, '
+            'id ASC LIMIT %(limit)s) AS "page"',
+        ),
+    ],
+)
+def test_find_version(mocker, sale, after, query):
+    """Find version of a page of sales."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.fetchone.return_value = (10, sale["updated_at"], "abc")
+    repo = provide_sale_repository(conn=mock_conn)
+    version = repo.find_version(id="1", limit=10, after=after)
+    mock_cursor.execute.assert_called_with(query, {"id": "1", "limit": 10})
+    mock_conn.commit.assert_called_once()
+    mock_cursor.close.assert_called_once()
+    assert isinstance(version, VersionModel)
+    assert version.count == 10
+    assert version.updated_at == sale["updated_at"]
+    assert version.digest == "abc"
+
+
+@pytest.mark.parametrize("limit", [0, 101])
+def test_find_version_invalid_limit(mocker, limit):
+    """Raises ValueError exception when limit is out of range."""
+    mock_conn = mocker.Mock()
+    repo = provide_sale_repository(conn=mock_conn)
+    with pytest.raises(ValueError):
+        repo.find_version("1", limit=limit)
+
+
+def test_find_version_execute_error(mocker):
+    """Raise 'RepositoryErr' when query execution raises exception."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.execute.side_effect = [Exception()]
+    repo = provide_sale_repository(conn=mock_conn)
+    with pytest.raises(RepositoryErr):
+        repo.find_version("1")
+    mock_conn.commit.assert_called_once()
+    mock_cursor.close.assert_called_once()
+
+
+def test_count_estimate(mocker):
+    """
+    Estimate count of all sales from statistics of the partitions of the
+    sale table, which itself is never analyzed.
+    """
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.fetchone.return_value = (1200,)
+    repo = provide_sale_repository(conn=mock_conn)
+    assert repo.count() == 1200
+    mock_cursor.execute.assert_called_with(
+        "SELECT COALESCE(SUM(GREATEST(c.reltuples, 0)), 0)::bigint FROM "
+        "pg_inherits AS i JOIN pg_class AS c ON c.oid = i.inhrelid WHERE "
+        "i.inhparent = 'sale'::regclass"
+    )
+    mock_conn.commit.assert_called_once()
+    mock_cursor.close.assert_called_once()
+
+
+def test_count_estimate_filtered(mocker):
+    """Estimate count of filtered sales from query plan."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.fetchone.return_value = ([{"Plan": {"Plan Rows": 37}}],)
+    repo = provide_sale_repository(conn=mock_conn)
+    filters = {"sku": "ff-11", "order_id": "FFX"}
+    assert repo.count(filters) == 37
+    mock_cursor.execute.assert_called_with(
+        'EXPLAIN (FORMAT JSON) SELECT 1 FROM "sale" '
+        "WHERE order_id = %(order_id)s AND sku = %(sku)s",
+        filters,
+    )
+
+
+@pytest.mark.parametrize(
+    "filters,query",
+    [
+        (None, 'SELECT COUNT(*) FROM "sale"'),
+        ({"sku": "ff-11"}, 'SELECT COUNT(*) FROM "sale" WHERE sku = %(sku)s'),
+    ],
+)
+def test_count_exact(mocker, filters, query):
+    """Count sales exactly."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.fetchone.return_value = (12,)
+    repo = provide_sale_repository(conn=mock_conn)
+    assert repo.count(filters, exact=True) == 12
+    mock_cursor.execute.assert_called_with(query, filters or {})
+
+
+def test_count_invalid_filter(mocker):
+    """Raises 'ValueError' exception for filters not whitelisted."""
+    mock_conn = mocker.Mock()
+    repo = provide_sale_repository(conn=mock_conn)
+    with pytest.raises(ValueError) as excinfo:
+        repo.count({"1 = 1; DROP TABLE sale; --": "x"})
+    assert excinfo.value.args == (
+        '"1 = 1; DROP TABLE sale; --" not valid filter.',
+    )
+    mock_conn.cursor.assert_not_called()
+
+
+def test_count_execute_error(mocker):
+    """Raise 'RepositoryErr' when query execution raises exception."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.execute.side_effect = [Exception()]
+    repo = provide_sale_repository(conn=mock_conn)
+    with pytest.raises(RepositoryErr):
+        repo.count()
+    mock_conn.commit.assert_called_once()
+    mock_cursor.close.assert_called_once()
+
+
+@pytest.mark.parametrize("count", [3])
+def test_search(mocker, sale_rows, count):
+    """Search sales by prefix or similarity, ranked by score."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.fetchall.return_value = [
+        row + (1.0 - i / 10,) for i, row in enumerate(sale_rows)
+    ]
+    repo = provide_sale_repository(conn=mock_conn)
+    page = repo.search("ff_1%", fields=["sku"], limit=count)
+    mock_cursor.execute.assert_called_with(
+        "SELECT id, date_time, order_id, sku, quantity, subtotal, fee, tax, "
+        "created_at, updated_at, score FROM (SELECT id, date_time, order_id, "
+        "sku, quantity, subtotal, fee, tax, created_at, updated_at, CASE "
+        "WHEN sku LIKE %(prefix)s THEN 1::real ELSE similarity(sku, "
+        '%(query)s) END AS score FROM "sale" WHERE sku LIKE %(prefix)s OR '
+        'sku %% %(query)s) AS "matches" ORDER BY score DESC, id DESC '
+        "LIMIT %(limit)s",
+        {"query": "ff_1%", "prefix": "ff\\_1\\%%", "limit": count},
+    )
+    mock_conn.commit.assert_called_once()
+    mock_cursor.close.assert_called_once()
+    assert [s.id for s in page.sales] == ["0", "1", "2"]
+    assert isinstance(page.sales[0], SaleModel)
+    assert page.cursor is not None
+
+
+@pytest.mark.parametrize("count", [3])
+def test_search_next_page(mocker, sale_rows, count):
+    """Continue search from cursor of previous page."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.fetchall.side_effect = [
+        [row + (0.5,) for row in sale_rows],
+        [sale_rows[0] + (0.4,)],
+    ]
+    repo = provide_sale_repository(conn=mock_conn)
+    first = repo.search("ff", limit=count)
+    second = repo.search("ff", limit=count, cursor=first.cursor)
+    stmt, params = mock_cursor.execute.call_args[0]
+    assert stmt.endswith(
+        'AS "matches" WHERE (score, id) < (%(score)s::real, %(id)s) '
+        "ORDER BY score DESC, id DESC LIMIT %(limit)s"
+    )
+    assert "GREATEST(" in stmt
+    assert params["score"] == 0.5
+    assert params["id"] == sale_rows[-1][0]
+    assert len(second.sales) == 1
+    assert second.cursor is None
+
+
+@pytest.mark.parametrize(
+    "query,fields,cursor",
+    [
+        ("", ("sku",), None),
+        ("ff", (), None),
+        ("ff", ("sku", "tax"), None),
+        ("ff", ("sku",), "not a cursor"),
+    ],
+)
+def test_search_invalid_args(mocker, query, fields, cursor):
+    """Raises 'ValueError' exception for invalid search arguments."""
+    mock_conn = mocker.Mock()
+    repo = provide_sale_repository(conn=mock_conn)
+    with pytest.raises(ValueError):
+        repo.search(query, fields, cursor=cursor)
+    mock_conn.cursor.assert_not_called()
+
+
+def test_search_execute_error(mocker):
+    """Raise 'RepositoryErr' when query execution raises exception."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.execute.side_effect = [Exception()]
+    repo = provide_sale_repository(conn=mock_conn)
+    with pytest.raises(RepositoryErr):
+        repo.search("ff")
+    mock_conn.commit.assert_called_once()
+    mock_cursor.close.assert_called_once()
+
+
+@pytest.mark.parametrize("count", [2])
+def test_find_filtered_after(mocker, sale_rows, count):
+    """Find sales matching filters after a certain sale."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.fetchall.return_value = sale_rows
+    repo = provide_sale_repository(conn=mock_conn)
+    start, end = sale_rows[0][1], sale_rows[1][1]
+    sales = repo.find(
+        id="1",
+        limit=count,
+        filters={"sku": "ff", "order_id": "FFX", "date_time": (start, end)},
+    )
+    mock_cursor.execute.assert_called_with(
+        "SELECT id, date_time, order_id, sku, quantity, subtotal, "
+        'fee, tax, created_at, updated_at FROM "sale" WHERE '
+        "date_time >= %(date_time_from)s AND date_time <= %(date_time_to)s "
+        "AND order_id = %(order_id)s AND sku = %(sku)s AND (created_at, "
+        'id) < ((SELECT created_at FROM "sale" WHERE id = %(id)s AND '
+        "date_time >= %(date_time_from)s AND date_time <= "
+        "%(date_time_to)s), %(id)s) ORDER BY created_at DESC, id DESC "
+        "LIMIT %(limit)s",
+        {
+            "date_time_from": start,
+            "date_time_to": end,
+            "order_id": "FFX",
+            "sku": "ff",
+            "id": "1",
+            "limit": count,
+        },
+    )
+    assert len(sales) == count
+
+
+@pytest.mark.parametrize("count", [2])
+def test_find_filtered_before(mocker, sale_rows, count):
+    """Find sales matching filters before a certain sale."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.fetchall.return_value = sale_rows
+    repo = provide_sale_repository(conn=mock_conn)
+    repo.find(id="1", limit=count, after=False, filters={"sku": "ff"})
+    mock_cursor.execute.assert_called_with(
+        "SELECT * FROM (SELECT id, date_time, order_id, sku, quantity, "
+        'subtotal, fee, tax, created_at, updated_at FROM "sale" WHERE '
+        "sku = %(sku)s AND (created_at, id) > ((SELECT created_at FROM "
+        '"sale" WHERE id = %(id)s), %(id)s) ORDER BY created_at ASC, id '
+        'ASC LIMIT %(limit)s) AS "filtered_sales" ORDER BY created_at '
+        "DESC, id DESC",
+        {"sku": "ff", "id": "1", "limit": count},
+    )
+
+
+def test_find_version_filtered(mocker, sale):
+    """Find version of page of filtered sales."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.fetchone.return_value = (0, None, None)
+    repo = provide_sale_repository(conn=mock_conn)
+    repo.find_version(id="1", filters={"date_time": (None, sale["date_time"])})
+    mock_cursor.execute.assert_called_with(
+        "SELECT COUNT(*), MAX(updated_at), SUM(('x' || LEFT(MD5(id || ':' "
+        "|| updated_at), 15))::bit(60)::bigint)::text FROM (SELECT id, "
+        'updated_at FROM "sale" WHERE date_time <= %(date_time_to)s AND '
+        '(created_at, id) < ((SELECT created_at FROM "sale" WHERE id = '
+        "%(id)s AND date_time <= %(date_time_to)s), %(id)s) ORDER BY "
+        "created_at DESC, id DESC "
+        'LIMIT %(limit)s) AS "page"',
+        {"date_time_to": sale["date_time"], "id": "1", "limit": 10},
+    )
+
+
+@pytest.mark.parametrize(
+    "after,ops", [(True, ("<", ">=")), (False, (">", "<="))]
+)
+def test_find_version_from(mocker, sale, after, ops):
+    """Find version of sales between two keys."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.fetchone.return_value = (2, sale["updated_at"], "123")
+    repo = provide_sale_repository(conn=mock_conn)
+    start, end = datetime(2021, 1, 2), datetime(2021, 1, 1)
+    version = repo.find_version_from(start, "b", end, "a", after, {"sku": "s"})
+    stmt, params = mock_cursor.execute.call_args[0]
+    assert stmt.endswith(
+        'FROM "sale" WHERE sku = %(sku)s AND (created_at, id) '
+        f"{ops[0]} (%(created_at)s, %(id)s) AND (created_at, id) {ops[1]} "
+        "(%(end_created_at)s, %(end_id)s)"
+    )
+    assert params == {
+        "sku": "s",
+        "created_at": start,
+        "id": "b",
+        "end_created_at": end,
+        "end_id": "a",
+    }
+    assert (version.count, version.digest) == (2, "123")
+    mock_conn.commit.assert_called_once()
+
+
+@pytest.mark.parametrize(
+    "filters",
+    [{"tax": 1}, {"date_time": "2020-01-01"}, {"date_time": (1, 2, 3)}],
+)
+def test_find_invalid_filters(mocker, filters):
+    """Raises 'ValueError' exception for invalid filters."""
+    mock_conn = mocker.Mock()
+    repo = provide_sale_repository(conn=mock_conn)
+    with pytest.raises(ValueError):
+        repo.find("1", filters=filters)
+    mock_conn.cursor.assert_not_called()
+
+
+@pytest.mark.parametrize("count", [3])
+@pytest.mark.parametrize(
+    "after,query",
+    [
+        (
+            True,
+            "SELECT id, date_time, order_id, sku, quantity, subtotal, fee, "
+            'tax, created_at, updated_at FROM "sale" WHERE sku = %(sku)s AND '
+            "(created_at, id) < (%(created_at)s, %(id)s) ORDER BY created_at "
+            "DESC, id DESC LIMIT %(limit)s",
+        ),
+        (
+            False,
+            "SELECT * FROM (SELECT id, date_time, order_id, sku, quantity, "
+            'subtotal, fee, tax, created_at, updated_at FROM "sale" WHERE '
+            "sku = %(sku)s AND (created_at, id) > (%(created_at)s, %(id)s) "
+            "ORDER BY created_at ASC, id ASC LIMIT %(limit)s) AS "
+            '"filtered_sales" ORDER BY created_at DESC, id DESC',
+        ),
+    ],
+)
+def test_find_from(mocker, sale_rows, count, after, query):
+    """Find sales before or after (created_at, id) key."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.fetchall.return_value = sale_rows
+    repo = provide_sale_repository(conn=mock_conn)
+    created_at = sale_rows[0][8]
+    sales = repo.find_from(
+        created_at, "1", limit=count, after=after, filters={"sku": "ff"}
+    )
+    mock_cursor.execute.assert_called_with(
+        query,
+        {"sku": "ff", "created_at": created_at, "id": "1", "limit": count},
+    )
+    assert len(sales) == count
+
+
+@pytest.mark.parametrize("count", [3])
+@pytest.mark.parametrize(
+    "after,query",
+    [
+        (
+            None,
+            "SELECT id, date_time, order_id, sku, quantity, subtotal, fee, "
+            'tax, created_at, updated_at FROM "sale" ORDER BY id '
+            "LIMIT %(limit)s",
+        ),
+        (
+            "2",
+            "SELECT id, date_time, order_id, sku, quantity, subtotal, fee, "
+            'tax, created_at, updated_at FROM "sale" WHERE id > %(id)s '
+            "ORDER BY id LIMIT %(limit)s",
+        ),
+    ],
+)
+def test_scan(mocker, sale_rows, count, after, query):
+    """Scan sales in batches ordered by id."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.fetchall.return_value = sale_rows
+    repo = provide_sale_repository(conn=mock_conn)
+    sales = repo.scan(after, limit=count)
+    mock_cursor.execute.assert_called_with(
+        query, {"id": after, "limit": count}
+    )
+    assert [s.id for s in sales] == ["0", "1", "2"]
+
+
+def test_find_by_id_statement_timeout(mocker, sale):
+    """Limit statement to time left until deadline."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.fetchone.return_value = tuple(sale.values())
+    repo = provide_sale_repository(conn=mock_conn)
+    with deadline.budget(10):
+        repo.find_by_id(sale["id"])
+    (set_call, select_call) = mock_cursor.execute.call_args_list
+    stmt, (timeout,) = set_call[0]
+    assert stmt == "SET LOCAL statement_timeout = %s"
+    assert 9000 < timeout <= 10000
+    assert select_call[0][1] == (sale["id"],)
+
+
+def test_find_by_id_deadline_expired(mocker, sale):
+    """Raise 'TimeoutErr' without querying when deadline passed."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    repo = provide_sale_repository(conn=mock_conn)
+    with deadline.budget(0):
+        with pytest.raises(TimeoutErr):
+            repo.find_by_id(sale["id"])
+    mock_cursor.execute.assert_not_called()
+    mock_conn.commit.assert_called_once()
+
+
+@pytest.mark.parametrize(
+    "call",
+    [
+        lambda r, s: r.find_by_id(s.id),
+        lambda r, s: r.create(s),
+        lambda r, s: r.update(s, ["sku"]),
+        lambda r, s: r.delete_by_id(s.id),
+        lambda r, s: r.find(s.id),
+        lambda r, s: r.count(exact=True),
+    ],
+)
+def test_statement_canceled(mocker, sale, call):
+    """Raise 'TimeoutErr' when Postgres cancels statement."""
+
+    class StubQueryCanceled(Exception):
+        """Stub for psycopg2 QueryCanceled exception."""
+
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.execute.side_effect = [StubQueryCanceled()]
+    repo = provide_sale_repository(
+        conn=mock_conn, timeout_err=StubQueryCanceled
+    )
+    with pytest.raises(TimeoutErr):
+        call(repo, SaleModel(**sale))
+    mock_conn.commit.assert_called_once()
+    mock_cursor.close.assert_called_once()
+
+
+class StubNullViolation(Exception):
+    """Stub for psycopg2 NotNullViolation exception."""
+
+    class StubDiag:
+        def __init__(self, column_name):
+            self.column_name = column_name
+
+    def __init__(self, column):
+        self.diag = self.StubDiag(column_name=column)
+
+
+def batch_operations(sale):
+    return [
+        OperationModel("create", SaleModel(**{**sale, "id": "a"})),
+        OperationModel("create", SaleModel(**{**sale, "id": "b"})),
+        OperationModel("delete", SaleModel(id="x")),
+        OperationModel("delete", SaleModel(id="y")),
+        OperationModel("update", SaleModel(id="c", sku="s"), ["sku"]),
+    ]
+
+
+def test_execute_batch_atomic(mocker, sale):
+    """Execute grouped operations with one statement per group."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.fetchall.return_value = [("x",), ("y",)]
+    mock_cursor.rowcount = 1
+    repo = provide_sale_repository(conn=mock_conn)
+    results = repo.execute_batch(batch_operations(sale))
+    assert [r.applied for r in results] == [True] * 5
+    assert [r.error for r in results] == [None] * 5
+    insert, delete, update = mock_cursor.execute.call_args_list
+    assert insert[0][0].count("(%s, %s, %s, %s") == 2
+    assert insert[0][1][0] == "a"
+    assert insert[0][1][10] == "b"
+    assert delete[0] == (
+        'DELETE FROM "sale" WHERE id = ANY(%s) RETURNING id',
+        (["x", "y"],),
+    )
+    assert update[0] == (
+        'UPDATE "sale" SET sku = (%s) WHERE id = (%s)' + RETURNING,
+        ("s", "c"),
+    )
+    mock_conn.rollback.assert_not_called()
+    mock_conn.commit.assert_called_once()
+
+
+def test_execute_batch_atomic_not_found(mocker, sale):
+    """Roll back atomic batch when a sale to delete does not exist."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.fetchall.return_value = [("x",)]
+    repo = provide_sale_repository(conn=mock_conn)
+    results = repo.execute_batch(batch_operations(sale))
+    assert [r.applied for r in results] == [False] * 5
+    assert isinstance(results[3].error, RecordNotFoundErr)
+    assert [r.error for r in results[:3]] == [None] * 3
+    assert mock_cursor.execute.call_count == 2
+    mock_conn.rollback.assert_called_once()
+
+
+def test_execute_batch_atomic_null_field(mocker, sale):
+    """Report null field error on the create that caused it."""
+    operations = batch_operations(sale)
+    operations[1].sale.sku = None
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.execute.side_effect = [StubNullViolation(column="sku")]
+    repo = provide_sale_repository(conn=mock_conn, null_err=StubNullViolation)
+    results = repo.execute_batch(operations)
+    assert isinstance(results[1].error, RecordFieldNullErr)
+    assert results[1].error.field == "sku"
+    assert results[0].error is None
+    assert not any(r.applied for r in results)
+    mock_conn.rollback.assert_called_once()
+
+
+class StubBatchUniqueViolation(Exception):
+    """Stub for psycopg2 UniqueViolation exception of a batch."""
+
+    class StubDiag:
+        def __init__(self, constraint_name, message_detail):
+            self.constraint_name = constraint_name
+            self.message_detail = message_detail
+
+    def __init__(self, detail, constraint="sale_default_pkey"):
+        self.diag = self.StubDiag(constraint, detail)
+
+
+@pytest.mark.parametrize(
+    "ids,key,culprit",
+    [
+        (["a", "b"], "id", 1),
+        (["b", "a"], "id", 0),
+        (["a", "b"], "order_id", 1),
+    ],
+)
+def test_execute_batch_atomic_duplicate(mocker, sale, ids, key, culprit):
+    """
+    Report duplicate error on the create whose key Postgres reports, or
+    on the second of creates sharing it.
+    """
+    operations = batch_operations(sale)
+    for operation, id in zip(operations, ids):
+        operation.sale.id = id
+    sale_time = operations[0].sale.date_time
+    time_text = sale_time.strftime("%Y-%m-%d %H:%M:%S")
+    if sale_time.microsecond:
+        time_text += f".{sale_time.microsecond:06d}".rstrip("0")
+    detail = f"Key (id, date_time)=(b, {time_text}) already exists."
+    constraint = "sale_default_pkey"
+    if key == "order_id":
+        detail = (
+            f"Key (order_id, sku, date_time)=({sale['order_id']}, "
+            f"{sale['sku']}, {time_text}) already exists."
+        )
+        constraint = "sale_default_order_id_sku_date_time_idx"
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.execute.side_effect = [
+        StubBatchUniqueViolation(detail, constraint)
+    ]
+    repo = provide_sale_repository(
+        conn=mock_conn, duplicate_err=StubBatchUniqueViolation
+    )
+    results = repo.execute_batch(operations)
+    assert isinstance(results[culprit].error, RecordFieldDuplicateErr)
+    assert results[culprit].error.field == key
+    assert results[1 - culprit].error is None
+    assert not any(r.applied for r in results)
+    mock_conn.rollback.assert_called_once()
+
+
+@pytest.mark.parametrize(
+    "detail", [None, "Key (id, date_time)=(z, 2021-01-01) already exists."]
+)
+def test_execute_batch_atomic_duplicate_unknown(mocker, sale, detail):
+    """Fail the batch when no create has the key Postgres reports."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.execute.side_effect = [StubBatchUniqueViolation(detail)]
+    repo = provide_sale_repository(
+        conn=mock_conn, duplicate_err=StubBatchUniqueViolation
+    )
+    with pytest.raises(RepositoryErr):
+        repo.execute_batch(batch_operations(sale))
+    mock_conn.rollback.assert_called()
+
+
+def test_execute_batch_atomic_null_unknown(mocker, sale):
+    """Fail the batch when no create has the null field reported."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.execute.side_effect = [StubNullViolation(column="sku")]
+    repo = provide_sale_repository(conn=mock_conn, null_err=StubNullViolation)
+    with pytest.raises(RepositoryErr):
+        repo.execute_batch(batch_operations(sale))
+    mock_conn.rollback.assert_called()
+
+
+def test_execute_batch_atomic_invalid(mocker, sale):
+    """Execute nothing when an atomic batch has an invalid operation."""
+    operations = batch_operations(sale)
+    operations[4].fields = ["id"]
+    mock_conn = mocker.Mock()
+    repo = provide_sale_repository(conn=mock_conn)
+    results = repo.execute_batch(operations)
+    assert isinstance(results[4].error, ValueError)
+    assert not any(r.applied for r in results)
+    mock_conn.cursor.assert_not_called()
+
+
+def test_execute_batch_best_effort(mocker, sale):
+    """Roll back failing operations to a savepoint and apply the rest."""
+    operations = batch_operations(sale)
+    operations[1].sale.sku = None
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.execute.side_effect = [
+        None,
+        StubNullViolation(column="sku"),
+        None,
+        None,
+        None,
+        None,
+    ]
+    mock_cursor.rowcount = 1
+    repo = provide_sale_repository(conn=mock_conn, null_err=StubNullViolation)
+    results = repo.execute_batch(operations, atomic=False)
+    assert [r.applied for r in results] == [True, False, True, True, True]
+    assert results[1].error.field == "sku"
+    stmts = [c[0][0] for c in mock_cursor.execute.call_args_list]
+    assert stmts[0].startswith("SAVEPOINT batch_operation; INSERT")
+    assert stmts[1].startswith(
+        "RELEASE SAVEPOINT batch_operation; SAVEPOINT batch_operation; "
+        "INSERT"
+    )
+    assert stmts[2] == "ROLLBACK TO SAVEPOINT batch_operation"
+    assert stmts[3].endswith('DELETE FROM "sale" WHERE id = %s')
+    mock_conn.rollback.assert_not_called()
+    mock_conn.commit.assert_called_once()
+
+
+def test_execute_batch_best_effort_not_found(mocker, sale):
+    """Report sales that do not exist without failing the batch."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.rowcount = 0
+    repo = provide_sale_repository(conn=mock_conn)
+    results = repo.execute_batch(batch_operations(sale), atomic=False)
+    assert [r.applied for r in results] == [True, True, False, False, False]
+    assert all(isinstance(r.error, RecordNotFoundErr) for r in results[2:])
+
+
+def test_execute_batch_error(mocker, sale):
+    """Roll back and raise 'RepositoryErr' on unexpected errors."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.execute.side_effect = [Exception()]
+    repo = provide_sale_repository(conn=mock_conn)
+    with pytest.raises(RepositoryErr):
+        repo.execute_batch(batch_operations(sale), atomic=False)
+    mock_conn.rollback.assert_called_once()
+    mock_cursor.close.assert_called_once()
+
+
+@pytest.mark.parametrize("size", [0, 101])
+def test_execute_batch_size(mocker, sale, size):
+    """Raise 'ValueError' when batch is empty or too large."""
+    repo = provide_sale_repository(conn=mocker.Mock())
+    operations = [OperationModel("delete", SaleModel(id="x"))] * size
+    with pytest.raises(ValueError):
+        repo.execute_batch(operations)
+
+
+def test_batch_groups():
+    """Group consecutive creates and deletes of distinct ids."""
+    operations = [
+        OperationModel("create", SaleModel(id="a")),
+        OperationModel("create", SaleModel(id="b")),
+        OperationModel("update", SaleModel(id="a"), ["sku"]),
+        OperationModel("update", SaleModel(id="b"), ["sku"]),
+        OperationModel("delete", SaleModel(id="a")),
+        OperationModel("delete", SaleModel(id="a")),
+        OperationModel("delete", SaleModel(id="b")),
+    ]
+    assert _batch_groups(operations) == [
+        ("create", [0, 1]),
+        ("update", [2]),
+        ("update", [3]),
+        ("delete", [4]),
+        ("delete", [5, 6]),
+    ]
+
+
+@pytest.mark.parametrize("count", [3])
+def test_find_latest(mocker, sale_rows, count):
+    """Get newest sales in (created_at, id) order."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.fetchall.return_value = sale_rows
+    repo = provide_sale_repository(conn=mock_conn)
+    sales = repo.find_latest(500)
+    assert [s.id for s in sales] == ["0", "1", "2"]
+    mock_cursor.execute.assert_called_with(
+        "SELECT id, date_time, order_id, sku, quantity, subtotal, fee, tax, "
+        'created_at, updated_at FROM "sale" ORDER BY created_at DESC, id '
+        "DESC LIMIT %(limit)s",
+        {"limit": 500},
+    )
+    mock_conn.commit.assert_called_once()
+
+
+def test_find_latest_invalid_limit(mocker):
+    """Raise 'ValueError' when limit is not positive."""
+    repo = provide_sale_repository(conn=mocker.Mock())
+    with pytest.raises(ValueError):
+        repo.find_latest(0)
+
+
+def test_iter_ids(mocker):
+    """Iterate over ids in batches keyed by last id."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.fetchall.side_effect = [[("a",), ("b",)], [("c",)]]
+    repo = provide_sale_repository(conn=mock_conn)
+    assert list(repo.iter_ids(batch_size=2)) == ["a", "b", "c"]
+    first, second = mock_cursor.execute.call_args_list
+    assert first[0] == (
+        'SELECT id FROM "sale" ORDER BY id LIMIT %(limit)s',
+        {"id": None, "limit": 2},
+    )
+    assert second[0] == (
+        'SELECT id FROM "sale" WHERE id > %(id)s ORDER BY id LIMIT '
+        "%(limit)s",
+        {"id": "b", "limit": 2},
+    )
+    assert mock_conn.commit.call_count == 2
+
+
+def test_iter_archived_ids(mocker):
+    """Iterate over archived ids in batches keyed by last id."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.fetchall.side_effect = [[("a",)], []]
+    repo = provide_sale_repository(conn=mock_conn)
+    assert list(repo.iter_archived_ids(batch_size=1)) == ["a"]
+    first, second = mock_cursor.execute.call_args_list
+    assert first[0] == (
+        'SELECT id FROM "archived_sale_id" ORDER BY id LIMIT %(limit)s',
+        {"id": None, "limit": 1},
+    )
+    assert second[0] == (
+        'SELECT id FROM "archived_sale_id" WHERE id > %(id)s ORDER BY id '
+        "LIMIT %(limit)s",
+        {"id": "a", "limit": 1},
+    )
+
+
+def test_update_versioned(mocker, sale):
+    """Update sale only if unchanged since expected update time."""
+    s = SaleModel(**sale)
+    expected = sale["updated_at"]
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.fetchone.return_value = tuple(sale.values())
+    repo = provide_sale_repository(conn=mock_conn)
+    repo.update(s, ["sku"], expected_updated_at=expected)
+    mock_cursor.execute.assert_called_once_with(
+        'UPDATE "sale" SET sku = (%s) WHERE id = (%s) AND updated_at = (%s)'
+        + RETURNING,
+        (sale["sku"], sale["id"], expected),
+    )
+
+
+def test_update_versioned_conflict(mocker, sale):
+    """Raise 'RecordConflictErr' when sale changed since expected."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.fetchone.side_effect = [None, (1,)]
+    repo = provide_sale_repository(conn=mock_conn)
+    with pytest.raises(RecordConflictErr):
+        repo.update(
+            SaleModel(**sale),
+            ["sku"],
+            expected_updated_at=datetime(2020, 1, 1),
+        )
+    mock_cursor.execute.assert_called_with(
+        'SELECT 1 FROM "sale" WHERE id = %s', (sale["id"],)
+    )
+    mock_conn.commit.assert_called_once()
+
+
+@pytest.mark.parametrize("expected", [None, datetime(2020, 1, 1)])
+def test_update_not_found(mocker, sale, expected):
+    """Raise 'RecordNotFoundErr' when sale does not exist."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.fetchone.return_value = None
+    repo = provide_sale_repository(conn=mock_conn)
+    with pytest.raises(RecordNotFoundErr):
+        repo.update(SaleModel(**sale), ["sku"], expected_updated_at=expected)
+    mock_cursor.close.assert_called_once()
+
+
+def test_find_by_id_projected(mocker, sale):
+    """Read only requested fields and id of sale."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.fetchone.return_value = (
+        sale["id"],
+        sale["sku"],
+        sale["subtotal"],
+    )
+    repo = provide_sale_repository(conn=mock_conn)
+    s = repo.find_by_id(sale["id"], ["subtotal", "sku"])
+    mock_cursor.execute.assert_called_with(
+        "SELECT id, sku, subtotal FROM sale WHERE id = %s LIMIT 1",
+        (sale["id"],),
+    )
+    assert (s.id, s.sku, s.subtotal) == (
+        sale["id"],
+        sale["sku"],
+        sale["subtotal"],
+    )
+    assert s.order_id is None
+    assert s.updated_at is None
+
+
+@pytest.mark.parametrize(
+    "after,query",
+    [
+        (
+            True,
+            'SELECT id, sku FROM "sale" WHERE (created_at, id) < ((SELECT '
+            'created_at FROM "sale" WHERE id = %(id)s), %(id)s) ORDER BY '
+            "created_at DESC, id DESC LIMIT %(limit)s",
+        ),
+        (
+            False,
+            'SELECT id, sku FROM (SELECT id, sku, created_at FROM "sale" '
+            'WHERE (created_at, id) > ((SELECT created_at FROM "sale" WHERE '
+            "id = %(id)s), %(id)s) ORDER BY created_at ASC, id ASC LIMIT "
+            '%(limit)s) AS "filtered_sales" ORDER BY created_at DESC, id '
+            "DESC",
+        ),
+    ],
+)
+def test_find_projected(mocker, after, query):
+    """Select only requested fields, keeping the sort key of pages."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.fetchall.return_value = [("1", "a"), ("2", "b")]
+    repo = provide_sale_repository(conn=mock_conn)
+    sales = repo.find("0", 2, after, fields=["sku"])
+    mock_cursor.execute.assert_called_with(query, {"id": "0", "limit": 2})
+    assert [(s.id, s.sku, s.created_at) for s in sales] == [
+        ("1", "a", None),
+        ("2", "b", None),
+    ]
+
+
+def test_scan_projected(mocker):
+    """Scan only requested fields."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.fetchall.return_value = [("1", 100)]
+    repo = provide_sale_repository(conn=mock_conn)
+    sales = repo.scan("0", 10, fields=["subtotal"])
+    mock_cursor.execute.assert_called_with(
+        'SELECT id, subtotal FROM "sale" WHERE id > %(id)s ORDER BY id '
+        "LIMIT %(limit)s",
+        {"id": "0", "limit": 10},
+    )
+    assert (sales[0].id, sales[0].subtotal) == ("1", 100)
+
+
+@pytest.mark.parametrize(
+    "read",
+    [
+        lambda r: r.find_by_id("1", ["sku", "password"]),
+        lambda r: r.find("1", fields=["sku;DROP TABLE sale"]),
+        lambda r: r.scan(fields=["*"]),
+    ],
+)
+def test_projection_invalid_field(mocker, read):
+    """Raise 'ValueError' for fields not in column whitelist."""
+    mock_conn = mocker.Mock()
+    repo = provide_sale_repository(conn=mock_conn)
+    with pytest.raises(ValueError):
+        read(repo)
+    mock_conn.cursor.assert_not_called()
+
+
+def test_statement_traced(mocker, sale):
+    """Record statement name, row count and duration in current trace."""
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    mock_cursor.fetchall.return_value = []
+    mock_cursor.rowcount = 0
+    repo = provide_sale_repository(conn=mock_conn)
+    tracer = Tracer(sample_rate=1)
+    with tracer.trace("request"):
+        repo.find("1", fields=["sku"])
+        repo.find_latest(5)
+    statements = [
+        (s["name"], s["attributes"]) for s in tracer.traces()[0]["children"]
+    ]
+    assert statements == [
+        ("sql", {"statement": "select", "rows": 0}),
+        ("sql", {"statement": "select_latest_sales", "rows": 0}),
+    ]
+
+
+@pytest.mark.parametrize("count", [5])
+def test_stream(mocker, sale_rows):
+    """
+    Stream sales in batches from a server-side cursor on a connection
+    lent by the pool, released once the stream is exhausted.
+    """
+    mock_conn = mocker.Mock()
+    stream_cursor = mock_conn.cursor.return_value
+    stream_cursor.fetchmany.side_effect = [sale_rows[:2], sale_rows[2:], []]
+    repo = provide_sale_repository(conn=mock_conn)
+    sales = repo.stream({"sku": "a"}, ["sku"], batch_size=2)
+    mock_conn.cursor.assert_not_called()
+    assert [s.id for s in sales] == ["0", "1", "2", "3", "4"]
+    mock_conn.cursor.assert_called_once_with(name="sale_stream")
+    stream_cursor.execute.assert_called_once_with(
+        'SELECT id, sku FROM "sale" WHERE sku = %(sku)s '
+        "ORDER BY created_at DESC, id DESC",
+        {"sku": "a"},
+    )
+    stream_cursor.fetchmany.assert_called_with(2)
+    stream_cursor.close.assert_called_once()
+    mock_conn.commit.assert_called_once()
+    mock_conn.close.assert_not_called()
+
+
+@pytest.mark.parametrize("count", [5])
+def test_stream_closed(mocker, sale_rows):
+    """Release connection of stream closed midway to the pool."""
+    mock_conn = mocker.Mock()
+    stream_cursor = mock_conn.cursor.return_value
+    stream_cursor.fetchmany.return_value = sale_rows
+    repo = provide_sale_repository(conn=mock_conn)
+    sales = repo.stream()
+    assert next(sales).id == "0"
+    sales.close()
+    stream_cursor.close.assert_called_once()
+    mock_conn.commit.assert_called_once()
+
+
+def test_stream_pool(mocker):
+    """Streams wait for a connection of the pool like other reads."""
+    mock_conn = mocker.Mock()
+    mock_conn.cursor.return_value.fetchmany.return_value = [("0",)]
+    repo = provide_sale_repository(conn=mock_conn)
+    sales = repo.stream(fields=["id"])
+    next(sales)
+    with deadline.budget(0.01):
+        with pytest.raises(TimeoutErr):
+            next(repo.stream(fields=["id"]))
+    sales.close()
+    next(repo.stream(fields=["id"]))
+
+
+def test_stream_error(mocker):
+    """Check arguments up front, and raise errors of reads midway."""
+    mock_conn = mocker.Mock()
+    mock_conn.cursor.return_value.fetchmany.side_effect = Exception()
+    repo = provide_sale_repository(conn=mock_conn)
+    with pytest.raises(ValueError):
+        repo.stream({"color": "red"})
+    with pytest.raises(RepositoryErr):
+        list(repo.stream())
+    mock_conn.commit.assert_called_once()
+
+
+def test_upsert(mocker, sale):
+    """
+    Upsert sales in one statement, writing the last of sales with the
+    same key, and sort out inserted, updated and unchanged sales, and
+    duplicates of the same key. Sales read back with the creation time
+    they were given were inserted.
+    """
+    mock_conn = mocker.Mock()
+    mock_cursor = mock_conn.cursor.return_value
+    first = SaleModel(**sale)
+    again = SaleModel(**{**sale, "id": "again", "quantity": 1})
+    other = SaleModel(**{**sale, "id": "other", "sku": "other"})
+    unchanged = SaleModel(**{**sale, "id": "same", "sku": "same"})
+    created = sale["created_at"]
+    past = created - timedelta(days=1)
+    mock_cursor.fetchall.return_value = [
+        ("stored", sale["order_id"], sale["sku"], sale["date_time"], past),
+        ("other", sale["order_id"], "other", sale["date_time"], created),
+    ]
+    repo = provide_sale_repository(conn=mock_conn)
+    result = repo.upsert([first, other, again, unchanged])
+    stmt, params = mock_cursor.execute.call_args[0]
+    assert stmt.startswith('INSERT INTO "sale" (id, date_time, ')
+    assert stmt.count("(%s, %s,") == 3
+    assert (
+        "ON CONFLICT (order_id, sku, date_time) DO UPDATE SET "
+        "quantity = EXCLUDED.quantity, subtotal = EXCLUDED.subtotal, "
+        "fee = EXCLUDED.fee, tax = EXCLUDED.tax, "
+        "updated_at = EXCLUDED.updated_at WHERE "
+        '("sale".quantity, "sale".subtotal, "sale".fee, "sale".tax) IS '
+        "DISTINCT FROM (EXCLUDED.quantity, EXCLUDED.subtotal, EXCLUDED.fee, "
+        "EXCLUDED.tax) RETURNING id, order_id, sku, date_time, created_at"
+    ) in stmt
+    assert params[:10] == list(vars(again).values())
+    assert len(params) == 30
+    assert [s.id for s in result.inserted] == ["other"]
+    assert [(s.id, s.quantity) for s in result.updated] == [("stored", 1)]
+    assert result.unchanged == 1
+    assert result.duplicates == 1
+    mock_conn.commit.assert_called_once()
+
+
+def test_upsert_invalid(mocker, sale):
+    """Upsert only on natural key, in batches of limited size."""
+    repo = provide_sale_repository(conn=mocker.Mock())
+    with pytest.raises(ValueError):
+        repo.upsert([SaleModel(**sale)], key=("order_id", "sku"))
+    with pytest.raises(ValueError):
+        repo.upsert([])
+    with pytest.raises(ValueError):
+        repo.upsert([SaleModel(**sale)] * 101)
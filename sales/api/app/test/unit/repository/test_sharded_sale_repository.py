@@ -0,0 +1,302 @@
+"""Sharded sale repository tests."""
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.main.repository import (
+    OperationModel,
+    OperationResultModel,
+    SaleModel,
+    SalePageModel,
+    UpsertResultModel,
+    VersionModel,
+    RecordNotFoundErr,
+    RecordFieldDuplicateErr,
+)
+from app.main.repository import utils
+from app.main.repository.sharded import sale_repository as sharded
+
+
+class FakeShard:
+    """In-memory stand-in for a Postgres sale repository."""
+
+    def __init__(self):
+        self.sales = {}
+        self.batches = []
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    def find_by_id(self, id, fields=None):
+        if id not in self.sales:
+            raise RecordNotFoundErr()
+        return self.sales[id]
+
+    def create(self, sale):
+        if sale.id in self.sales:
+            raise RecordFieldDuplicateErr(field="id")
+        self.sales[sale.id] = sale
+        return sale
+
+    def delete_by_id(self, id):
+        if self.sales.pop(id, None) is None:
+            raise RecordNotFoundErr()
+
+    def update(self, sale, fields):
+        for f in fields:
+            setattr(self.find_by_id(sale.id), f, getattr(sale, f))
+
+    def find_from(self, created_at, id, limit, after, filters, fields=None):
+        key = (created_at, id)
+        ordered = sorted(
+            self.sales.values(), key=lambda s: (s.created_at, s.id)
+        )
+        if after:
+            page = [s for s in ordered if (s.created_at, s.id) < key]
+            return page[::-1][:limit]
+        page = [s for s in ordered if (s.created_at, s.id) > key]
+        return page[:limit][::-1]
+
+    def find_version_from(
+        self, created_at, id, end_created_at, end_id, after, filters
+    ):
+        self.versioned = True
+        start, end = (created_at, id), (end_created_at, end_id)
+        if after:
+            start, end = end, start
+        sales = [
+            s
+            for s in self.sales.values()
+            if start <= (s.created_at, s.id) <= end
+            and (s.created_at, s.id) != (created_at, id)
+        ]
+        return VersionModel(
+            count=len(sales),
+            updated_at=max((s.updated_at for s in sales), default=None),
+            digest=utils.page_digest(sales),
+        )
+
+    def find_latest(self, limit):
+        ordered = sorted(
+            self.sales.values(), key=lambda s: (s.created_at, s.id)
+        )
+        return ordered[::-1][:limit]
+
+    def count(self, filters, exact):
+        return len(self.sales)
+
+    def search(self, query, fields, limit, cursor):
+        matches = sorted(
+            (s for s in self.sales.values() if query in s.sku),
+            key=lambda s: (s.quantity / 100, s.id),
+            reverse=True,
+        )[:limit]
+        return SalePageModel(
+            sales=matches, scores=[s.quantity / 100 for s in matches]
+        )
+
+    def execute_batch(self, operations, atomic):
+        self.batches.append(([o.sale.id for o in operations], atomic))
+        return [OperationResultModel(applied=True) for _ in operations]
+
+    def scan(self, after, limit):
+        ids = sorted(i for i in self.sales if after is None or i > after)
+        return [self.sales[i] for i in ids[:limit]]
+
+    def upsert(self, sales, key):
+        unique = {s.id: s for s in sales}
+        inserted = [s for s in unique.values() if s.id not in self.sales]
+        self.sales.update(unique)
+        return UpsertResultModel(
+            inserted=inserted,
+            unchanged=len(unique) - len(inserted),
+            duplicates=len(sales) - len(unique),
+        )
+
+    def stream(self, filters, fields, batch_size):
+        self.streamed = fields
+        try:
+            yield from self.find_latest(len(self.sales))
+        finally:
+            self.stream_closed = True
+
+
+def make_sales(count):
+    start = datetime(2020, 1, 1)
+    return [
+        SaleModel(
+            id=f"{i:04x}",
+            sku=f"ff-{i}",
+            quantity=i % 50,
+            created_at=start + timedelta(minutes=i // 3),
+            updated_at=start,
+        )
+        for i in range(count)
+    ]
+
+
+@pytest.fixture
+def shards():
+    return {name: FakeShard() for name in ("s0", "s1", "s2")}
+
+
+@pytest.fixture
+def repo(shards):
+    repository = sharded.provide_sale_repository(shards=shards)
+    for sale in make_sales(60):
+        repository.create(sale)
+    yield repository
+    repository.close()
+
+
+def test_routing(repo, shards):
+    """Route sales by id to a single owning shard."""
+    assert sum(len(s.sales) for s in shards.values()) == 60
+    for name, shard in shards.items():
+        assert shard.sales
+        for id in shard.sales:
+            assert sharded.owner(sorted(shards), id) == name
+            assert repo.find_by_id(id) is shard.sales[id]
+    repo.delete_by_id("0001")
+    with pytest.raises(RecordNotFoundErr):
+        repo.find_by_id("0001")
+
+
+@pytest.mark.parametrize("after", [True, False])
+def test_find_merges_shards(repo, after):
+    """Merge pages from all shards in (created_at, id) order."""
+    ordered = sorted(make_sales(60), key=lambda s: (s.created_at, s.id))
+    ordered.reverse()
+    anchor = [s.id for s in ordered].index("001e")
+    if after:
+        expected = ordered[anchor:][1:11]
+    else:
+        expected = ordered[:anchor][-10:]
+    page = repo.find("001e", limit=10, after=after)
+    assert [s.id for s in page] == [s.id for s in expected]
+
+
+def test_find_projected(mocker, repo, shards):
+    """Read requested fields from shards, with key to merge pages on."""
+    spies = [mocker.spy(shard, "find_from") for shard in shards.values()]
+    page = repo.find("001e", limit=10, fields=["sku"])
+    assert len(page) == 10
+    for spy in spies:
+        assert spy.call_args[0][-1] == ["sku", "created_at"]
+
+
+def test_find_missing_anchor(repo):
+    """Return no sales when anchor sale does not exist."""
+    assert repo.find("ffff") == []
+
+
+@pytest.mark.parametrize("after", [True, False])
+def test_find_version_merges_shards(repo, shards, after):
+    """Version merged page from versions of each shard up to its end."""
+    page = repo.find("0020", limit=7, after=after)
+    version = repo.find_version("0020", limit=7, after=after)
+    assert version.count == 7
+    assert version.updated_at == max(s.updated_at for s in page)
+    assert version.digest == utils.page_digest(page)
+    assert all(getattr(shard, "versioned", False) for shard in shards.values())
+
+
+def test_find_version_empty(repo):
+    """Version of pages past the end or of missing anchors is empty."""
+    for id in ("0000", "missing"):
+        version = repo.find_version(id, limit=5)
+        assert (version.count, version.digest) == (0, None)
+
+
+def test_find_latest_merges_shards(repo):
+    """Merge newest sales of all shards in (created_at, id) order."""
+    ordered = sorted(make_sales(60), key=lambda s: (s.created_at, s.id))
+    expected = [s.id for s in ordered[::-1][:12]]
+    assert [s.id for s in repo.find_latest(12)] == expected
+
+
+def test_stream_merges_shards(repo, shards):
+    """Merge streams of all shards newest first, closing all of them."""
+    ordered = sorted(make_sales(60), key=lambda s: (s.created_at, s.id))
+    stream = repo.stream(fields=["sku"])
+    assert [next(stream).id for _ in range(5)] == [
+        s.id for s in ordered[::-1][:5]
+    ]
+    stream.close()
+    for shard in shards.values():
+        assert shard.streamed == ["sku", "created_at"]
+        assert shard.stream_closed
+
+
+def test_upsert(repo, shards):
+    """Upsert sales on the shards owning their ids, summing results."""
+    sales = make_sales(70)[55:]
+    result = repo.upsert(sales + sales[:2])
+    assert sorted(s.id for s in result.inserted) == [s.id for s in sales[5:]]
+    assert result.unchanged == 5
+    assert result.duplicates == 2
+    for sale in sales:
+        assert repo.shard(sale.id).sales[sale.id] is sale
+    with pytest.raises(ValueError):
+        repo.upsert([SaleModel()])
+
+
+def test_count(repo):
+    """Sum counts of all shards."""
+    assert repo.count() == 60
+
+
+def test_search_merges_shards(repo):
+    """Merge search results from all shards by score."""
+    page = repo.search("ff", limit=5)
+    assert page.scores == sorted(page.scores, reverse=True)
+    assert page.scores[0] == 0.49
+    assert len(page.sales) == 5
+    assert page.cursor is not None
+
+
+def test_rebalance(repo, shards):
+    """Move sales to their owners after adding a shard."""
+    shards["s3"] = FakeShard()
+    moved = sharded.rebalance(shards, batch_size=7)
+    assert moved == len(shards["s3"].sales)
+    assert moved > 0
+    assert sum(len(s.sales) for s in shards.values()) == 60
+    for name, shard in shards.items():
+        for id in shard.sales:
+            assert sharded.owner(sorted(shards), id) == name
+    assert sharded.rebalance(shards, batch_size=7) == 0
+
+
+def test_close(repo, shards):
+    """Close all shards."""
+    repo.close()
+    assert all(s.closed for s in shards.values())
+
+
+def test_execute_batch_routes_to_owners(repo, shards):
+    """Split batch by owning shard and merge results in order."""
+    ids = [s.id for s in make_sales(9)]
+    operations = [OperationModel("delete", SaleModel(id=i)) for i in ids]
+    results = repo.execute_batch(operations, atomic=False)
+    assert all(r.applied for r in results)
+    for name, shard in shards.items():
+        for batch_ids, atomic in shard.batches:
+            assert atomic is False
+            assert all(
+                sharded.owner(sorted(shards), i) == name for i in batch_ids
+            )
+    assert (
+        sorted(i for s in shards.values() for b, _ in s.batches for i in b)
+        == ids
+    )
+
+
+def test_execute_batch_atomic_spanning_shards(repo):
+    """Raise 'ValueError' when atomic batch spans shards."""
+    operations = [
+        OperationModel("delete", SaleModel(id=s.id)) for s in make_sales(9)
+    ]
+    with pytest.raises(ValueError):
+        repo.execute_batch(operations)
@@ -0,0 +1,22 @@
+"""Traced sale repository tests."""
+from app.main.helper.tracing import Tracer
+from app.main.repository.traced import sale_repository as traced
+
+
+def test_calls_traced(mocker):
+    """Record repository calls as spans, passing them through."""
+    repository = mocker.Mock()
+    repository.find.return_value = [mocker.Mock()] * 3
+    repo = traced.provide_sale_repository(repository)
+    tracer = Tracer(sample_rate=1)
+    with tracer.trace("request"):
+        repo.find("1", 3, True, None, ["sku"])
+        repo.count({}, True)
+    find, count = tracer.traces()[0]["children"]
+    assert (find["name"], find["attributes"]) == (
+        "repository.find",
+        {"limit": 3, "rows": 3},
+    )
+    assert count["name"] == "repository.count"
+    repository.find.assert_called_once_with("1", 3, True, None, ["sku"])
+    repository.count.assert_called_once_with({}, True)
@@ -0,0 +1,295 @@
+"""Feed cache tests."""
+import copy
+import hashlib
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.main import repository as rp
+from app.main import service as srv
+from app.main.repository import utils
+from app.main.service.feed_cache import FeedCache
+from app.main.service.sale_service import provide_sale_service
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class MemoryRepository:
+    """In-memory sale repository paging by (created_at, id) like Postgres."""
+
+    def __init__(self):
+        self.sales = {}
+        self.queries = 0
+
+    def metrics(self):
+        return {}
+
+    def _ordered(self):
+        return sorted(self.sales.values(), key=lambda s: (s.created_at, s.id))
+
+    def create(self, sale):
+        self.sales[sale.id] = copy.copy(sale)
+        return copy.copy(sale)
+
+    def update(self, sale, fields, expected_updated_at=None):
+        if sale.id not in self.sales:
+            raise rp.RecordNotFoundErr()
+        for f in fields:
+            setattr(self.sales[sale.id], f, getattr(sale, f))
+        return copy.copy(self.sales[sale.id])
+
+    def delete_by_id(self, id):
+        if self.sales.pop(id, None) is None:
+            raise rp.RecordNotFoundErr()
+
+    def find(self, id, limit=10, after=True, filters=None, fields=None):
+        self.queries += 1
+        utils.check_limit(limit)
+        if id not in self.sales:
+            return []
+        key = (self.sales[id].created_at, id)
+        ordered = self._ordered()
+        if after:
+            page = [s for s in ordered if (s.created_at, s.id) < key]
+            return [copy.copy(s) for s in page[::-1][:limit]]
+        page = [s for s in ordered if (s.created_at, s.id) > key]
+        return [copy.copy(s) for s in page[:limit][::-1]]
+
+    def find_latest(self, limit=10):
+        self.queries += 1
+        return [copy.copy(s) for s in self._ordered()[::-1][:limit]]
+
+    def find_version(self, id, limit=10, after=True, filters=None):
+        sales = self.find(id, limit, after, filters)
+        return rp.VersionModel(
+            count=len(sales),
+            updated_at=max((s.updated_at for s in sales), default=None),
+            digest=utils.page_digest(sales),
+        )
+
+
+def feed_sales(count, per_minute=1):
+    start = datetime(2021, 1, 1)
+    return [
+        srv.SaleModel(
+            id=f"{i:03}",
+            sku=f"sku-{i}",
+            created_at=start + timedelta(minutes=i // per_minute),
+            updated_at=start,
+        )
+        for i in range(count)
+    ]
+
+
+def new_sale(sku):
+    return srv.SaleModel(
+        date_time=datetime(2021, 1, 1),
+        order_id="ORD",
+        sku=sku,
+        quantity=1,
+        subtotal=100,
+        fee=1,
+        tax=10,
+    )
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def feed(clock):
+    cache = FeedCache(size=10, ttl=1, clock=clock)
+    cache.load(feed_sales(30))
+    return cache
+
+
+def test_page_near_head(feed):
+    """Serve pages whose sales are all in the feed."""
+    assert [s.id for s in feed.page("029", 3, True)] == ["028", "027", "026"]
+    assert [s.id for s in feed.page("025", 3, False)] == ["028", "027", "026"]
+    assert feed.page("029", 5, False) == []
+
+
+def test_page_beyond_feed(feed):
+    """Miss pages reaching past the oldest sale in the feed."""
+    assert feed.page("022", 3, True) is None
+    assert feed.page("010", 3, True) is None
+    assert feed.page("029", 11, True) is None
+    assert feed.metrics() == {
+        "size": 10,
+        "hits": 0,
+        "misses": 3,
+        "hit_rate": 0.0,
+    }
+
+
+def test_page_complete_feed(clock):
+    """Serve pages down to the oldest sale when feed holds all sales."""
+    cache = FeedCache(size=10, clock=clock)
+    cache.load(feed_sales(5))
+    assert [s.id for s in cache.page("002", 5, True)] == ["001", "000"]
+
+
+def test_page_stale(feed, clock):
+    """Miss every page once feed is due for reload."""
+    clock.now = 1
+    assert not feed.fresh()
+    assert feed.page("029", 3, True) is None
+
+
+def test_created(feed):
+    """Prepend new sale, dropping the oldest."""
+    sale = srv.SaleModel(id="new", created_at=datetime(2022, 1, 1))
+    feed.created(sale)
+    assert [s.id for s in feed.page("new", 2, True)] == ["029", "028"]
+    assert feed.page("021", 1, True) is None
+    assert feed.metrics()["size"] == 10
+
+
+def test_updated(feed):
+    """Patch updated fields, dropping feed when creation time changes."""
+    feed.updated(srv.SaleModel(id="028", sku="patched"), ["sku"])
+    assert feed.page("029", 1, True)[0].sku == "patched"
+    feed.updated(srv.SaleModel(id="028", created_at=None), ["created_at"])
+    assert not feed.fresh()
+
+
+def test_deleted(feed):
+    """Evict deleted sale."""
+    feed.deleted("028")
+    assert [s.id for s in feed.page("029", 2, True)] == ["027", "026"]
+    assert feed.page("029", 9, True) is None
+
+
+def test_clear(feed):
+    """Drop feed until reloaded, ignoring writes meanwhile."""
+    feed.clear()
+    assert not feed.fresh()
+    feed.created(srv.SaleModel(id="new", created_at=datetime(2022, 1, 1)))
+    assert feed.page("new", 1, True) is None
+
+
+def test_service_serves_head_from_feed(clock):
+    """Query repository only to load feed, until it is stale."""
+    repository = MemoryRepository()
+    for sale in feed_sales(30):
+        repository.create(sale)
+    service = provide_sale_service(
+        repository=repository, feed_cache=FeedCache(size=10, clock=clock)
+    )
+    for _ in range(3):
+        service.find("029", 5)
+        service.find_version("029", 5)
+    assert repository.queries == 1
+    service.find("005", 5)
+    assert repository.queries == 2
+    clock.now = 5
+    service.find("029", 5)
+    assert repository.queries == 3
+    assert service.metrics()["feed_cache"]["hits"] == 7
+
+
+def test_service_projects_feed_pages(clock):
+    """Serve projected pages from feed, rejecting unknown fields."""
+    repository = MemoryRepository()
+    for sale in feed_sales(30):
+        repository.create(sale)
+    service = provide_sale_service(
+        repository=repository, feed_cache=FeedCache(size=10, clock=clock)
+    )
+    page = service.find("029", 2, fields=["created_at"])
+    assert [(s.id, s.created_at) for s in page] == [
+        (s.id, s.created_at) for s in service.find("029", 2)
+    ]
+    assert all(s.sku is None and s.updated_at is None for s in page)
+    with pytest.raises(srv.InvalidArgsErr):
+        service.find("029", 2, fields=["password"])
+    assert repository.queries == 1
+
+
+def test_version_matches_postgres(mocker, clock):
+    """Version pages from the feed with the digest Postgres computes."""
+    sales = feed_sales(4)
+    sales[0].updated_at = datetime(2021, 1, 1, 0, 0, 0, 500000)
+    sales[1].updated_at = datetime(2021, 1, 1, 0, 0, 0, 123456)
+    sales[2].updated_at = datetime(2021, 1, 1)
+    # "id || ':' || updated_at" of each sale, as Postgres casts them.
+    digest = str(
+        sum(
+            int(hashlib.md5(row).hexdigest()[:15], 16)
+            for row in (
+                b"000:2021-01-01 00:00:00.5",
+                b"001:2021-01-01 00:00:00.123456",
+                b"002:2021-01-01 00:00:00",
+            )
+        )
+    )
+    mock_repo = mocker.Mock()
+    mock_repo.find_latest.return_value = sales
+    mock_repo.find_version.return_value = rp.VersionModel(
+        count=3, updated_at=sales[0].updated_at, digest=digest
+    )
+    cached = provide_sale_service(
+        repository=mock_repo,
+        feed_cache=FeedCache(size=10, ttl=1, clock=clock),
+    )
+    uncached = provide_sale_service(repository=mock_repo)
+    assert (
+        cached.find_version("003", 3, True).etag
+        == uncached.find_version("003", 3, True).etag
+    )
+    mock_repo.find_version.assert_called_once()
+
+
+def test_consistency_with_repository(clock):
+    """
+    Pages and versions from feed match those from the repository, with
+    sales created at the same time on both sides of the feed's end.
+    """
+    rand = random.Random(7)
+    repository = MemoryRepository()
+    for sale in feed_sales(15, per_minute=3):
+        repository.create(sale)
+    cached = provide_sale_service(
+        repository=repository,
+        feed_cache=FeedCache(size=10, ttl=3600, clock=clock),
+    )
+    uncached = provide_sale_service(repository=repository)
+    for step in range(60):
+        ids = sorted(repository.sales)
+        action = rand.random()
+        if action < 0.4 or not ids:
+            cached.create(new_sale(f"new-{step}"))
+        elif action < 0.6:
+            cached.delete_by_id(rand.choice(ids))
+        elif action < 0.95:
+            sale = srv.SaleModel(id=rand.choice(ids), sku=f"upd-{step}")
+            cached.update(sale, ["sku"])
+        else:
+            created_at = datetime(2021, 1, 1) + timedelta(
+                minutes=rand.randrange(5)
+            )
+            sale = srv.SaleModel(id=rand.choice(ids), created_at=created_at)
+            cached.update(sale, ["created_at"])
+        for id in repository.sales:
+            for limit in (1, 4, 10):
+                for after in (True, False):
+                    expected = uncached.find(id, limit, after)
+                    actual = cached.find(id, limit, after)
+                    assert [s.to_json_dict() for s in actual] == [
+                        s.to_json_dict() for s in expected
+                    ]
+                    assert (
+                        cached.find_version(id, limit, after).etag
+                        == uncached.find_version(id, limit, after).etag
+                    )
+    assert cached.metrics()["feed_cache"]["hits"] > 0
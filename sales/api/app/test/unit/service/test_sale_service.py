@@ -1,10 +1,14 @@
 """Sale service test."""
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import pytest
 
 from app.main import repository as rp
 from app.main import service as srv
+from app.main.helper import deadline
+from app.main.repository.utils import page_digest
+from app.main.service import sale_service as srv_sale_service
+from app.main.service.count_cache import CountCache
 from app.main.service.sale_service import provide_sale_service
 
 
@@ -26,7 +30,7 @@ def test_find_by_id(mocker, sale):
     assert service_sale.tax == repo_sale.tax
     assert service_sale.created_at == repo_sale.created_at
     assert service_sale.updated_at == repo_sale.updated_at
-    mock_repo.find_by_id.assert_called_with(sale["id"])
+    mock_repo.find_by_id.assert_called_with(sale["id"], None)
 
 
 def test_find_by_id_not_found(mocker, sale):
@@ -36,7 +40,7 @@ def test_find_by_id_not_found(mocker, sale):
     service = provide_sale_service(repository=mock_repo)
     with pytest.raises(srv.ServiceErr):
         service.find_by_id(id=sale["id"])
-    mock_repo.find_by_id.assert_called_with(sale["id"])
+    mock_repo.find_by_id.assert_called_with(sale["id"], None)
 
 
 @pytest.mark.parametrize("exception", [rp.RepositoryErr(), Exception()])
@@ -50,7 +54,7 @@ def test_find_by_generic_error(mocker, sale, exception):
     service = provide_sale_service(repository=mock_repo)
     with pytest.raises(srv.ServiceErr):
         service.find_by_id(id=sale["id"])
-    mock_repo.find_by_id.assert_called_with(sale["id"])
+    mock_repo.find_by_id.assert_called_with(sale["id"], None)
 
 
 def test_create(mocker, sale):
@@ -58,6 +62,7 @@ def test_create(mocker, sale):
     service_sale = srv.SaleModel(**sale)
     service_sale.id = None
     mock_repo = mocker.Mock()
+    mock_repo.create.side_effect = lambda s: s
     service = provide_sale_service(repository=mock_repo)
     service_sale_created = service.create(service_sale)
     assert isinstance(service_sale_created.id, str)
@@ -96,6 +101,16 @@ def test_create_null_field(mocker, sale, field):
     assert excinfo.value.field == field
 
 
+def test_create_duplicate_field(mocker, sale):
+    """Raise 'ResourceFieldDuplicateErr' exception for duplicate field."""
+    mock_repo = mocker.Mock()
+    mock_repo.create.side_effect = [rp.RecordFieldDuplicateErr(field="id")]
+    service = provide_sale_service(repository=mock_repo)
+    with pytest.raises(srv.ResourceFieldDuplicateErr) as excinfo:
+        service.create(srv.SaleModel(**sale))
+    assert excinfo.value.field == "id"
+
+
 @pytest.mark.parametrize("exception", [rp.RepositoryErr(), Exception()])
 def test_create_generic_error(mocker, sale, exception):
     """Raises 'ServiceErr' exception for all other types of errors."""
@@ -124,6 +139,18 @@ def test_delete_by_id_not_found(mocker, sale):
         service.delete_by_id(sale["id"])
 
 
+def test_write_archived(mocker, sale):
+    """Raise 'ResourceArchivedErr' when sale is archived."""
+    mock_repo = mocker.Mock()
+    mock_repo.delete_by_id.side_effect = [rp.RecordArchivedErr()]
+    mock_repo.update.side_effect = [rp.RecordArchivedErr()]
+    service = provide_sale_service(repository=mock_repo)
+    with pytest.raises(srv.ResourceArchivedErr):
+        service.delete_by_id(sale["id"])
+    with pytest.raises(srv.ResourceArchivedErr):
+        service.update(srv.SaleModel(**sale), ["sku"])
+
+
 @pytest.mark.parametrize("exception", [rp.RepositoryErr(), Exception()])
 def test_delete_by_id_generic_error(mocker, sale, exception):
     """Raises 'ServiceErr' exception for all other types of errors."""
@@ -229,7 +256,7 @@ def test_find(mocker, sales, limit, after):
     assert isinstance(service_sales, list)
     for s in service_sales:
         assert isinstance(s, srv.SaleModel)
-    mock_repo.find.assert_called_with("foo", limit, after)
+    mock_repo.find.assert_called_with("foo", limit, after, None, None)
 
 
 @pytest.mark.parametrize("limit,after", [(1000, True)])
@@ -251,3 +278,624 @@ def test_find_generic_error(mocker, limit, after, exception):
     service = provide_sale_service(repository=mock_repo)
     with pytest.raises(srv.ServiceErr):
         service.find("foo", limit, after)
+
+
+def test_find_version(mocker, sale):
+    """Find version of a page of sales."""
+    mock_repo = mocker.Mock()
+    mock_repo.find_version.return_value = rp.VersionModel(
+        count=10, updated_at=sale["updated_at"], digest="abc"
+    )
+    service = provide_sale_service(repository=mock_repo)
+    version = service.find_version("foo", limit=10, after=True)
+    assert isinstance(version, srv.VersionModel)
+    assert isinstance(version.etag, str)
+    assert version.last_modified == sale["updated_at"]
+    mock_repo.find_version.assert_called_with("foo", 10, True, None)
+
+
+def test_find_version_changes(mocker, sale):
+    """Version changes when page contents change."""
+    mock_repo = mocker.Mock()
+    mock_repo.find_version.side_effect = [
+        rp.VersionModel(count=10, updated_at=sale["updated_at"], digest="a"),
+        rp.VersionModel(count=10, updated_at=sale["updated_at"], digest="a"),
+        rp.VersionModel(count=10, updated_at=sale["updated_at"], digest="b"),
+    ]
+    service = provide_sale_service(repository=mock_repo)
+    first = service.find_version("foo")
+    second = service.find_version("foo")
+    third = service.find_version("foo")
+    assert first.etag == second.etag
+    assert first.etag != third.etag
+
+
+@pytest.mark.parametrize("count", [3])
+def test_find_with_version(mocker, sales):
+    """
+    Version page from the sales read, matching the version the
+    repository computes for the same page.
+    """
+    page = [rp.SaleModel(**s) for s in sales]
+    mock_repo = mocker.Mock()
+    mock_repo.find.return_value = page
+    mock_repo.find_version.return_value = rp.VersionModel(
+        count=3,
+        updated_at=max(s.updated_at for s in page),
+        digest=page_digest(page),
+    )
+    service = provide_sale_service(repository=mock_repo)
+    found, version = service.find_with_version("foo", fields=["sku"])
+    assert [s.id for s in found] == [s["id"] for s in sales]
+    assert version.etag == service.find_version("foo").etag
+    mock_repo.find.assert_called_with(
+        "foo", 10, True, None, ["sku", "updated_at"]
+    )
+
+
+def test_find_version_invalid_args(mocker):
+    """Raises 'InvalidArgsErr' exception for invalid arguments."""
+    mock_repo = mocker.Mock()
+    mock_repo.find_version.side_effect = [ValueError()]
+    service = provide_sale_service(repository=mock_repo)
+    with pytest.raises(srv.InvalidArgsErr):
+        service.find_version("foo", 1000)
+
+
+@pytest.mark.parametrize("exception", [rp.RepositoryErr(), Exception()])
+def test_find_version_generic_error(mocker, exception):
+    """Raises 'ServiceErr' exception for all other types of errors."""
+    mock_repo = mocker.Mock()
+    mock_repo.find_version.side_effect = [exception]
+    service = provide_sale_service(repository=mock_repo)
+    with pytest.raises(srv.ServiceErr):
+        service.find_version("foo")
+
+
+def test_count_estimate(mocker):
+    """Estimated counts are not cached."""
+    mock_repo = mocker.Mock()
+    mock_repo.count.return_value = 100
+    service = provide_sale_service(repository=mock_repo)
+    assert service.count() == 100
+    assert service.count() == 100
+    assert mock_repo.count.call_count == 2
+    mock_repo.count.assert_called_with(None, exact=False)
+
+
+def test_count_exact_cached(mocker):
+    """Exact counts are cached until they expire."""
+    now = [0.0]
+    mock_repo = mocker.Mock()
+    mock_repo.count.side_effect = [100, 200]
+    service = provide_sale_service(
+        repository=mock_repo,
+        count_cache=CountCache(ttl=5, clock=lambda: now[0]),
+    )
+    assert service.count({"sku": "a"}, exact=True) == 100
+    assert service.count({"sku": "a"}, exact=True) == 100
+    now[0] = 5.0
+    assert service.count({"sku": "a"}, exact=True) == 200
+    assert mock_repo.count.call_count == 2
+    mock_repo.count.assert_called_with({"sku": "a"}, exact=True)
+
+
+def test_count_exact_maintained(mocker, sale):
+    """Cached exact counts follow creates and deletes."""
+    mock_repo = mocker.Mock()
+    mock_repo.count.side_effect = [100, 10, 3]
+    mock_repo.create.side_effect = lambda s: s
+    service = provide_sale_service(repository=mock_repo)
+    assert service.count(exact=True) == 100
+    assert service.count({"sku": sale["sku"]}, exact=True) == 10
+    assert service.count({"sku": "other"}, exact=True) == 3
+    service.create(srv.SaleModel(**sale))
+    assert service.count(exact=True) == 101
+    assert service.count({"sku": sale["sku"]}, exact=True) == 11
+    assert service.count({"sku": "other"}, exact=True) == 3
+    service.delete_by_id(sale["id"])
+    assert service.count(exact=True) == 100
+    assert mock_repo.count.call_count == 3
+
+
+def test_count_invalid_args(mocker):
+    """Raises 'InvalidArgsErr' exception for invalid filters."""
+    mock_repo = mocker.Mock()
+    mock_repo.count.side_effect = [ValueError()]
+    service = provide_sale_service(repository=mock_repo)
+    with pytest.raises(srv.InvalidArgsErr):
+        service.count({"foo": "bar"})
+
+
+@pytest.mark.parametrize("exception", [rp.RepositoryErr(), Exception()])
+def test_count_generic_error(mocker, exception):
+    """Raises 'ServiceErr' exception for all other types of errors."""
+    mock_repo = mocker.Mock()
+    mock_repo.count.side_effect = [exception]
+    service = provide_sale_service(repository=mock_repo)
+    with pytest.raises(srv.ServiceErr):
+        service.count(exact=True)
+
+
+@pytest.mark.parametrize("count", [3])
+def test_search(mocker, sales):
+    """Search sales."""
+    mock_repo = mocker.Mock()
+    mock_repo.search.return_value = rp.SalePageModel(
+        sales=[rp.SaleModel(**s) for s in sales], cursor="abc"
+    )
+    service = provide_sale_service(repository=mock_repo)
+    page = service.search("ff", ("sku",), 3, None)
+    assert isinstance(page, srv.SalePageModel)
+    assert page.cursor == "abc"
+    for s in page.sales:
+        assert isinstance(s, srv.SaleModel)
+    mock_repo.search.assert_called_with("ff", ("sku",), 3, None)
+
+
+def test_search_invalid_args(mocker):
+    """Raises 'InvalidArgsErr' exception for invalid arguments."""
+    mock_repo = mocker.Mock()
+    mock_repo.search.side_effect = [ValueError()]
+    service = provide_sale_service(repository=mock_repo)
+    with pytest.raises(srv.InvalidArgsErr):
+        service.search("")
+
+
+@pytest.mark.parametrize("exception", [rp.RepositoryErr(), Exception()])
+def test_search_generic_error(mocker, exception):
+    """Raises 'ServiceErr' exception for all other types of errors."""
+    mock_repo = mocker.Mock()
+    mock_repo.search.side_effect = [exception]
+    service = provide_sale_service(repository=mock_repo)
+    with pytest.raises(srv.ServiceErr):
+        service.search("ff")
+
+
+def test_count_exact_maintained_date_time(mocker, sale):
+    """Cached counts for date_time ranges follow creates."""
+    mock_repo = mocker.Mock()
+    mock_repo.count.side_effect = [5, 7]
+    mock_repo.create.side_effect = lambda s: s
+    service = provide_sale_service(repository=mock_repo)
+    before = (None, sale["date_time"] - timedelta(days=1))
+    around = [sale["date_time"] - timedelta(days=1), None]
+    assert service.count({"date_time": before}, exact=True) == 5
+    assert service.count({"date_time": around}, exact=True) == 7
+    service.create(srv.SaleModel(**sale))
+    assert service.count({"date_time": before}, exact=True) == 5
+    assert service.count({"date_time": around}, exact=True) == 8
+
+
+def test_find_by_id_default_timeout(mocker, sale):
+    """Run repository call within the operation's configured budget."""
+    budgets = []
+
+    def find_by_id(id, fields):
+        budgets.append(deadline.remaining())
+        return rp.SaleModel(**sale)
+
+    mock_repo = mocker.Mock()
+    mock_repo.find_by_id.side_effect = find_by_id
+    service = provide_sale_service(
+        repository=mock_repo, timeouts={"find_by_id": 0.5}
+    )
+    service.find_by_id(sale["id"])
+    service.find_by_id(sale["id"], timeout=5)
+    assert 0.4 < budgets[0] <= 0.5
+    assert 4.9 < budgets[1] <= 5
+    assert deadline.remaining() is None
+
+
+def test_find_by_id_without_timeout(mocker, sale):
+    """Run repository call without deadline when none configured."""
+    mock_repo = mocker.Mock()
+    mock_repo.find_by_id.side_effect = lambda id, fields: deadline.remaining()
+    service = provide_sale_service(repository=mock_repo)
+    mocker.patch.object(srv_sale_service.mapper, "to_sale_service_model")
+    service.find_by_id(sale["id"])
+    srv_sale_service.mapper.to_sale_service_model.assert_called_with(None)
+
+
+def test_nested_budget_keeps_earlier_deadline():
+    """Inner budget cannot extend enclosing deadline."""
+    with deadline.budget(1):
+        with deadline.budget(10):
+            assert deadline.remaining() <= 1
+
+
+@pytest.mark.parametrize(
+    "method,args",
+    [
+        ("find_by_id", ("foo",)),
+        (
+            "create",
+            (
+                srv.SaleModel(
+                    date_time=datetime(2021, 1, 1),
+                    order_id="foo",
+                    sku="bar",
+                    quantity=1,
+                    subtotal=100,
+                    fee=1,
+                    tax=10,
+                ),
+            ),
+        ),
+        ("delete_by_id", ("foo",)),
+        ("update", (srv.SaleModel(id="foo", sku="bar"), ["sku"])),
+        ("find", ("foo",)),
+        ("find_version", ("foo",)),
+        ("count", ({}, True)),
+        ("search", ("foo",)),
+    ],
+)
+def test_timeout_error(mocker, method, args):
+    """Raises 'TimeoutErr' exception when repository call times out."""
+    mock_repo = mocker.Mock()
+    getattr(mock_repo, method).side_effect = [rp.TimeoutErr()]
+    service = provide_sale_service(repository=mock_repo)
+    with pytest.raises(srv.TimeoutErr) as excinfo:
+        getattr(service, method)(*args)
+    assert isinstance(excinfo.value, srv.ServiceErr)
+
+
+def test_execute_batch(mocker, sale):
+    """Execute batch, generating ids and timestamps of created sales."""
+    mock_repo = mocker.Mock()
+    mock_repo.execute_batch.return_value = [
+        rp.OperationResultModel(applied=True),
+        rp.OperationResultModel(applied=True),
+        rp.OperationResultModel(applied=True),
+    ]
+    count_cache = mocker.Mock()
+    service = provide_sale_service(
+        repository=mock_repo, count_cache=count_cache
+    )
+    new_sale = srv.SaleModel(**{**sale, "id": None})
+    results = service.execute_batch(
+        [
+            srv.OperationModel("create", new_sale),
+            srv.OperationModel(
+                "update", srv.SaleModel(id="b", sku="x"), ["sku"]
+            ),
+            srv.OperationModel("delete", srv.SaleModel(id="c")),
+        ],
+        atomic=False,
+    )
+    operations, atomic = mock_repo.execute_batch.call_args[0]
+    assert atomic is False
+    assert [o.kind for o in operations] == ["create", "update", "delete"]
+    assert operations[0].sale.id is not None
+    assert operations[1].fields == ["sku", "updated_at"]
+    assert operations[1].sale.updated_at is not None
+    assert results[0].sale.id == operations[0].sale.id
+    assert results[0].sale.created_at is not None
+    assert new_sale.id is None
+    assert [r.sale for r in results[1:]] == [None, None]
+    assert all(r.applied and r.error is None for r in results)
+    count_cache.created.assert_called_once_with(results[0].sale)
+    count_cache.deleted.assert_called_once()
+
+
+@pytest.mark.parametrize(
+    "error,expected",
+    [
+        (rp.RecordNotFoundErr(), srv.ResourceNotFoundErr),
+        (rp.RecordArchivedErr(), srv.ResourceArchivedErr),
+        (rp.RecordFieldNullErr(field="sku"), srv.ResourceFieldNullErr),
+        (ValueError(), srv.InvalidArgsErr),
+        (
+            rp.RecordFieldDuplicateErr(field="id"),
+            srv.ResourceFieldDuplicateErr,
+        ),
+        (rp.RepositoryErr(), srv.ServiceErr),
+    ],
+)
+def test_execute_batch_operation_error(mocker, sale, error, expected):
+    """Map repository errors of operations to service errors."""
+    mock_repo = mocker.Mock()
+    mock_repo.execute_batch.return_value = [
+        rp.OperationResultModel(error=error),
+        rp.OperationResultModel(),
+    ]
+    count_cache = mocker.Mock()
+    service = provide_sale_service(
+        repository=mock_repo, count_cache=count_cache
+    )
+    results = service.execute_batch(
+        [
+            srv.OperationModel("delete", srv.SaleModel(id="a")),
+            srv.OperationModel("create", srv.SaleModel(**sale)),
+        ]
+    )
+    assert type(results[0].error) is expected
+    assert results[1].error is None
+    assert not results[1].applied
+    count_cache.created.assert_not_called()
+
+
+def test_execute_batch_invalid(mocker, sale):
+    """
+    Execute only valid operations, failing the others with all their
+    invalid fields.
+    """
+    mock_repo = mocker.Mock()
+    mock_repo.execute_batch.return_value = [
+        rp.OperationResultModel(applied=True),
+        rp.OperationResultModel(applied=True),
+    ]
+    service = provide_sale_service(repository=mock_repo)
+    invalid = srv.SaleModel(**{**sale, "sku": None, "fee": -1})
+    results = service.execute_batch(
+        [
+            srv.OperationModel("create", srv.SaleModel(**sale)),
+            srv.OperationModel("create", invalid),
+            srv.OperationModel("delete", srv.SaleModel(id="c")),
+        ],
+        atomic=False,
+    )
+    operations, _ = mock_repo.execute_batch.call_args[0]
+    assert [o.kind for o in operations] == ["create", "delete"]
+    assert [r.applied for r in results] == [True, False, True]
+    assert results[1].error.errors == {
+        "sku": "cannot be null",
+        "fee": "cannot be negative",
+    }
+    assert results[2].error is None
+
+
+def test_execute_batch_invalid_atomic(mocker, sale):
+    """Fail atomic batch with invalid operations without executing it."""
+    mock_repo = mocker.Mock()
+    service = provide_sale_service(repository=mock_repo)
+    results = service.execute_batch(
+        [
+            srv.OperationModel("create", srv.SaleModel(**sale)),
+            srv.OperationModel("update", srv.SaleModel(id="b"), ["tax"]),
+        ]
+    )
+    mock_repo.execute_batch.assert_not_called()
+    assert results[0].error is None and not results[0].applied
+    assert isinstance(results[1].error, srv.ResourceFieldsInvalidErr)
+
+
+def test_create_invalid(mocker, sale):
+    """Raise 'ResourceFieldsInvalidErr' without creating invalid sale."""
+    mock_repo = mocker.Mock()
+    service = provide_sale_service(repository=mock_repo)
+    with pytest.raises(srv.ResourceFieldsInvalidErr) as excinfo:
+        service.create(srv.SaleModel(**{**sale, "quantity": -1}))
+    assert excinfo.value.errors == {"quantity": "cannot be negative"}
+    with pytest.raises(srv.ResourceFieldNullErr):
+        service.create(srv.SaleModel(**{**sale, "sku": None}))
+    mock_repo.create.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "error,expected",
+    [
+        (ValueError(), srv.InvalidArgsErr),
+        (rp.TimeoutErr(), srv.TimeoutErr),
+        (rp.RepositoryErr(), srv.ServiceErr),
+    ],
+)
+def test_execute_batch_error(mocker, error, expected):
+    """Raise service error when batch fails as a whole."""
+    mock_repo = mocker.Mock()
+    mock_repo.execute_batch.side_effect = [error]
+    service = provide_sale_service(repository=mock_repo)
+    with pytest.raises(expected):
+        service.execute_batch([])
+
+
+def test_update_returns_updated(mocker, sale):
+    """Return sale as updated, with its update time set."""
+    expected = datetime(2020, 1, 1)
+    mock_repo = mocker.Mock()
+    mock_repo.update.side_effect = lambda s, fields, expected: s
+    service = provide_sale_service(repository=mock_repo)
+    service_sale = srv.SaleModel(**sale)
+    updated = service.update(service_sale, ["sku"], expected)
+    repo_sale, fields, expected_updated_at = mock_repo.update.call_args[0]
+    assert fields == ["sku", "updated_at"]
+    assert expected_updated_at == expected
+    assert updated.updated_at == repo_sale.updated_at
+    assert updated.updated_at > sale["updated_at"]
+    assert service_sale.updated_at == sale["updated_at"]
+
+
+def test_update_conflict(mocker, sale):
+    """Raise 'ResourceConflictErr' when sale was modified since."""
+    mock_repo = mocker.Mock()
+    mock_repo.update.side_effect = [rp.RecordConflictErr()]
+    service = provide_sale_service(repository=mock_repo)
+    with pytest.raises(srv.ResourceConflictErr):
+        service.update(srv.SaleModel(**sale), ["sku"], datetime(2020, 1, 1))
+
+
+def test_update_empty_fields(mocker, sale):
+    """Raise 'InvalidArgsErr' when no fields to update."""
+    mock_repo = mocker.Mock()
+    service = provide_sale_service(repository=mock_repo)
+    with pytest.raises(srv.InvalidArgsErr):
+        service.update(srv.SaleModel(**sale), [])
+    mock_repo.update.assert_not_called()
+
+
+def test_find_by_id_projected(mocker, sale):
+    """Pass requested fields to repository."""
+    mock_repo = mocker.Mock()
+    mock_repo.find_by_id.return_value = rp.SaleModel(id=sale["id"], sku="x")
+    service = provide_sale_service(repository=mock_repo)
+    service_sale = service.find_by_id(sale["id"], ["sku"])
+    assert (service_sale.id, service_sale.sku) == (sale["id"], "x")
+    assert service_sale.date_time is None
+    mock_repo.find_by_id.assert_called_with(sale["id"], ["sku"])
+
+
+def test_find_by_id_invalid_fields(mocker, sale):
+    """Raise 'InvalidArgsErr' when repository rejects fields."""
+    mock_repo = mocker.Mock()
+    mock_repo.find_by_id.side_effect = [ValueError()]
+    service = provide_sale_service(repository=mock_repo)
+    with pytest.raises(srv.InvalidArgsErr):
+        service.find_by_id(sale["id"], ["password"])
+
+
+@pytest.mark.parametrize("count", [3])
+def test_stream(mocker, sales):
+    """Stream service models of sales, closing the repository's stream."""
+    closed = []
+
+    def stream(filters, fields, batch_size):
+        try:
+            yield from (rp.SaleModel(**s) for s in sales)
+        finally:
+            closed.append(True)
+
+    mock_repo = mocker.Mock()
+    mock_repo.stream.side_effect = stream
+    service = provide_sale_service(repository=mock_repo)
+    streamed = service.stream({"sku": "a"}, ["sku"], 100)
+    mock_repo.stream.assert_called_once_with({"sku": "a"}, ["sku"], 100)
+    first = next(streamed)
+    assert isinstance(first, srv.SaleModel) and first.id == "0"
+    streamed.close()
+    assert closed == [True]
+
+
+@pytest.mark.parametrize(
+    "error,expected",
+    [
+        (rp.TimeoutErr(), srv.TimeoutErr),
+        (rp.RepositoryErr(), srv.ServiceErr),
+    ],
+)
+def test_stream_error(mocker, error, expected):
+    """Raise service errors of arguments up front and of reads midway."""
+
+    def stream(filters, fields, batch_size):
+        yield rp.SaleModel(id="a")
+        raise error
+
+    mock_repo = mocker.Mock()
+    mock_repo.stream.side_effect = [ValueError()]
+    service = provide_sale_service(repository=mock_repo)
+    with pytest.raises(srv.InvalidArgsErr):
+        service.stream({"color": "red"})
+    mock_repo.stream.side_effect = stream
+    streamed = service.stream()
+    assert next(streamed).id == "a"
+    with pytest.raises(expected):
+        next(streamed)
+
+
+def test_upsert(mocker, sale):
+    """
+    Upsert sales with ids derived from their key, counting what was
+    inserted, updated and left unchanged.
+    """
+    mock_repo = mocker.Mock()
+    mock_repo.upsert.side_effect = lambda sales, key: rp.UpsertResultModel(
+        inserted=sales[:1], updated=sales[1:2], unchanged=1, duplicates=2
+    )
+    count_cache = mocker.Mock()
+    feed_cache = mocker.Mock()
+    service = provide_sale_service(
+        repository=mock_repo, count_cache=count_cache, feed_cache=feed_cache
+    )
+    sales = [
+        srv.SaleModel(**{**sale, "id": None, "sku": sku})
+        for sku in ("a", "b", "c")
+    ]
+    result = service.upsert(sales)
+    assert result.to_json_dict() == {
+        "inserted": 1,
+        "updated": 1,
+        "unchanged": 1,
+        "duplicates": 2,
+    }
+    upserted, key = mock_repo.upsert.call_args[0]
+    assert key == ("order_id", "sku", "date_time")
+    assert len({s.id for s in upserted}) == 3
+    assert sales[0].id is None
+    service.upsert(sales)
+    again, _ = mock_repo.upsert.call_args[0]
+    assert [s.id for s in again] == [s.id for s in upserted]
+    count_cache.created.assert_called_with(mocker.ANY)
+    assert count_cache.created.call_count == 2
+    assert feed_cache.updated.call_args[0][1] == [
+        "quantity",
+        "subtotal",
+        "fee",
+        "tax",
+        "updated_at",
+    ]
+
+
+def test_write_committed_despite_cache_error(mocker, sale):
+    """
+    Report committed writes as applied when caches fail to follow them,
+    dropping the caches instead.
+    """
+    mock_repo = mocker.Mock()
+    mock_repo.create.side_effect = lambda s: s
+    mock_repo.count.side_effect = [100, 100]
+    mock_repo.execute_batch.return_value = [
+        rp.OperationResultModel(applied=True)
+    ]
+    feed_cache = mocker.Mock()
+    service = provide_sale_service(repository=mock_repo, feed_cache=feed_cache)
+    feed_cache.created.side_effect = TypeError()
+    feed_cache.deleted.side_effect = TypeError()
+    assert service.count(exact=True) == 100
+    assert service.create(srv.SaleModel(**sale)).id is not None
+    assert service.count(exact=True) == 100
+    assert mock_repo.count.call_count == 2
+    service.delete_by_id(sale["id"])
+    [result] = service.execute_batch(
+        [srv.OperationModel("delete", srv.SaleModel(id=sale["id"]))]
+    )
+    assert result.applied and result.error is None
+    assert feed_cache.clear.call_count == 3
+
+
+def test_upsert_timeout(mocker, sale):
+    """Run upsert within its configured budget."""
+    budgets = []
+
+    def upsert(sales, key):
+        budgets.append(deadline.remaining())
+        return rp.UpsertResultModel(unchanged=len(sales))
+
+    mock_repo = mocker.Mock()
+    mock_repo.upsert.side_effect = upsert
+    service = provide_sale_service(
+        repository=mock_repo, timeouts={"upsert": 5}
+    )
+    service.upsert([srv.SaleModel(**{**sale, "id": None})])
+    assert 4.9 < budgets[0] <= 5
+
+
+def test_upsert_invalid(mocker, sale):
+    """Report invalid fields of all sales without upserting any."""
+    mock_repo = mocker.Mock()
+    service = provide_sale_service(repository=mock_repo)
+    with pytest.raises(srv.ResourceFieldsInvalidErr) as excinfo:
+        service.upsert(
+            [
+                srv.SaleModel(**sale),
+                srv.SaleModel(**{**sale, "sku": None, "tax": -1}),
+                srv.SaleModel(**{**sale, "fee": "1"}),
+            ]
+        )
+    assert excinfo.value.errors == {
+        "1.sku": "cannot be null",
+        "1.tax": "cannot be negative",
+        "2.fee": "must be integer",
+    }
+    mock_repo.upsert.assert_not_called()
+    mock_repo.upsert.side_effect = [ValueError()]
+    with pytest.raises(srv.InvalidArgsErr):
+        service.upsert([srv.SaleModel(**sale)], key=("order_id",))
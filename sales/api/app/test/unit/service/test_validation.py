@@ -0,0 +1,98 @@
+"""Sale validation tests."""
+from datetime import datetime, timezone
+
+import pytest
+
+from app.main import service as srv
+from app.main.service.validation import SaleValidator
+
+
+@pytest.fixture
+def validator():
+    return SaleValidator()
+
+
+def new_sale(**values):
+    return srv.SaleModel(
+        **{
+            "date_time": datetime(2021, 1, 1),
+            "order_id": "ORD-1",
+            "sku": "SKU-1",
+            "quantity": 1,
+            "subtotal": 1999,
+            "fee": 58,
+            "tax": 160,
+            **values,
+        }
+    )
+
+
+def test_valid(validator):
+    """Accept complete creates, updates and deletes."""
+    assert validator.validate_batch(
+        [
+            srv.OperationModel("create", new_sale()),
+            srv.OperationModel("create", new_sale(id=None, fee=0)),
+            srv.OperationModel(
+                "update", srv.SaleModel(id="a", sku="b"), ["sku"]
+            ),
+            srv.OperationModel("delete", srv.SaleModel(id="a")),
+        ]
+    ) == [{}, {}, {}, {}]
+
+
+@pytest.mark.parametrize(
+    "values,errors",
+    [
+        ({"sku": None}, {"sku": "cannot be null"}),
+        ({"quantity": "1"}, {"quantity": "must be integer"}),
+        ({"quantity": True}, {"quantity": "must be integer"}),
+        ({"subtotal": -1}, {"subtotal": "cannot be negative"}),
+        ({"tax": 2**31}, {"tax": "out of range"}),
+        ({"order_id": 1}, {"order_id": "must be string"}),
+        ({"order_id": "ORD-" + "1" * 1000}, {}),
+        ({"date_time": "2021-01-01"}, {"date_time": "must be date and time"}),
+        (
+            {"date_time": datetime(2021, 1, 1, tzinfo=timezone.utc)},
+            {"date_time": "cannot have time zone"},
+        ),
+        (
+            {"sku": None, "fee": -1, "tax": None},
+            {
+                "sku": "cannot be null",
+                "fee": "cannot be negative",
+                "tax": "cannot be null",
+            },
+        ),
+    ],
+)
+def test_invalid_create(validator, values, errors):
+    """Report every invalid field of created sale."""
+    operation = srv.OperationModel("create", new_sale(**values))
+    assert validator.validate(operation) == errors
+
+
+@pytest.mark.parametrize(
+    "sale,fields,errors",
+    [
+        (srv.SaleModel(sku="a"), ["sku"], {"id": "cannot be null"}),
+        (srv.SaleModel(id="a"), ["sku"], {"sku": "cannot be null"}),
+        (srv.SaleModel(id="a"), ["updated_at"], {}),
+        (srv.SaleModel(id="a"), ["id"], {"id": "cannot be changed"}),
+        (
+            srv.SaleModel(id="a", fee=-1),
+            ["color", "fee"],
+            {"color": "not valid field", "fee": "cannot be negative"},
+        ),
+    ],
+)
+def test_invalid_update(validator, sale, fields, errors):
+    """Check only fields updated, which must be known and not "id"."""
+    operation = srv.OperationModel("update", sale, fields)
+    assert validator.validate(operation) == errors
+
+
+def test_invalid_delete(validator):
+    """Require id of deleted sale."""
+    operation = srv.OperationModel("delete", srv.SaleModel())
+    assert validator.validate(operation) == {"id": "cannot be null"}
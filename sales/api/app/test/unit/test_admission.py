@@ -0,0 +1,186 @@
+"""Admission control tests."""
+import importlib
+import threading
+import time
+
+import pytest
+
+from app.main import config as app_config
+from app.main import service as srv
+from app.main.helper.admission import AdmissionController, Lane, OverloadedErr
+
+
+def controller(capacity=1, queue_size=1, max_wait=0.05):
+    return AdmissionController(
+        capacity=capacity,
+        lanes=[
+            Lane("cheap", queue_size=queue_size, max_wait=max_wait),
+            Lane("expensive", queue_size=queue_size, max_wait=max_wait),
+        ],
+    )
+
+
+def wait_until(predicate, timeout=1.0):
+    end = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < end
+        time.sleep(0.001)
+
+
+def test_admit_up_to_capacity():
+    """Admit requests without waiting while under capacity."""
+    admission = controller(capacity=2)
+    admission.acquire("cheap")
+    admission.acquire("expensive")
+    metrics = admission.metrics()
+    assert metrics["active"] == 2
+    assert metrics["lanes"]["cheap"]["admitted"] == 1
+    assert metrics["lanes"]["expensive"]["admitted"] == 1
+    admission.release("cheap")
+    admission.release("expensive")
+    assert admission.metrics()["active"] == 0
+
+
+def test_shed_after_max_wait():
+    """Shed queued request once its wait exceeds lane's maximum."""
+    admission = controller(max_wait=0.01)
+    admission.acquire("cheap")
+    with pytest.raises(OverloadedErr) as excinfo:
+        admission.acquire("cheap")
+    assert excinfo.value.lane == "cheap"
+    assert excinfo.value.retry_after == 1
+    lanes = admission.metrics()["lanes"]
+    assert lanes["cheap"]["shed"] == 1
+    assert lanes["cheap"]["queued"] == 0
+
+
+def test_shed_when_queue_full():
+    """Shed request immediately when lane's queue is full."""
+    admission = controller(queue_size=0, max_wait=10)
+    admission.acquire("expensive")
+    start = time.monotonic()
+    with pytest.raises(OverloadedErr):
+        admission.acquire("expensive")
+    assert time.monotonic() - start < 1
+    assert admission.metrics()["lanes"]["expensive"]["shed"] == 1
+
+
+def test_cheap_lane_admitted_first():
+    """Admit queued cheap request before queued expensive request."""
+    admission = controller(queue_size=2, max_wait=5)
+    admission.acquire("cheap")
+    order = []
+
+    def request(lane):
+        admission.acquire(lane)
+        order.append(lane)
+        admission.release(lane)
+
+    expensive = threading.Thread(target=request, args=("expensive",))
+    expensive.start()
+    wait_until(lambda: admission.metrics()["lanes"]["expensive"]["queued"])
+    cheap = threading.Thread(target=request, args=("cheap",))
+    cheap.start()
+    wait_until(lambda: admission.metrics()["lanes"]["cheap"]["queued"])
+    admission.release("cheap")
+    expensive.join()
+    cheap.join()
+    assert order == ["cheap", "expensive"]
+
+
+def test_invalid_capacity():
+    """Raise 'ValueError' when capacity is not positive."""
+    with pytest.raises(ValueError):
+        controller(capacity=0)
+
+
+@pytest.mark.parametrize("env", ["testing"])
+def test_overloaded_response(client, service):
+    """Respond "503 Service Unavailable" with Retry-After when shed."""
+    admission = client.application.extensions["admission"]
+    for _ in range(admission.metrics()["capacity"]):
+        admission.acquire("expensive")
+    response = client.get("/sales:count")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    service.count.assert_not_called()
+
+
+@pytest.mark.parametrize("env", ["testing"])
+def test_stream_overloaded(client, service):
+    """Shed streams once the expensive lane is full."""
+    admission = client.application.extensions["admission"]
+    for _ in range(admission.metrics()["capacity"]):
+        admission.acquire("expensive")
+    response = client.get("/sales:stream")
+    assert response.status_code == 503
+    service.stream.assert_not_called()
+
+
+@pytest.mark.parametrize("env", ["testing"])
+def test_stream_holds_slot(client, service):
+    """Hold admission slot of a stream until it is closed."""
+    service.stream.return_value = (srv.SaleModel(id=id) for id in "abc")
+    admission = client.application.extensions["admission"]
+    response = client.get("/sales:stream", buffered=False)
+    next(iter(response.response))
+    assert admission.metrics()["lanes"]["expensive"]["active"] == 1
+    response.close()
+    assert admission.metrics()["lanes"]["expensive"]["active"] == 0
+
+
+@pytest.mark.parametrize("env", ["testing"])
+def test_upsert_overloaded(client, service):
+    """Shed upserts once the expensive lane is full."""
+    admission = client.application.extensions["admission"]
+    for _ in range(admission.metrics()["capacity"]):
+        admission.acquire("expensive")
+    response = client.post("/sales:upsert", json={"sales": []})
+    assert response.status_code == 503
+    service.upsert.assert_not_called()
+
+
+@pytest.mark.parametrize("env", ["testing"])
+def test_sale_endpoints_admitted(client):
+    """Admit every sale endpoint through a lane, within a time budget."""
+    config = client.application.config
+    lanes = {lane["name"] for lane in config["ADMISSION_LANES"]}
+    for rule in client.application.url_map.iter_rules():
+        if rule.endpoint.startswith("sales."):
+            assert config["ADMISSION_ENDPOINTS"].get(rule.endpoint) in lanes
+    assert config["OPERATION_TIMEOUTS"]["upsert"] > 0
+
+
+def test_capacity_of_connections(monkeypatch):
+    """Admit no more requests than there are database connections."""
+    monkeypatch.delenv("ADMISSION_CAPACITY", raising=False)
+    monkeypatch.setenv("DB_POOL_SIZE", "3")
+    monkeypatch.setenv("DB_REPLICA_DSNS", "replica-1,replica-2")
+    config = importlib.reload(app_config)
+    try:
+        assert config.BaseConfig.ADMISSION_CAPACITY == 9
+    finally:
+        monkeypatch.undo()
+        importlib.reload(app_config)
+
+
+@pytest.mark.parametrize("env", ["testing"])
+def test_release_after_request(client, service):
+    """Free admission slot once request completes."""
+    service.count.return_value = 3
+    service.metrics.return_value = {}
+    response = client.get("/sales:count")
+    assert response.status_code == 200
+    metrics = client.get("/metrics").get_json()["admission"]
+    assert metrics["active"] == 0
+    assert metrics["lanes"]["expensive"]["admitted"] == 1
+    assert metrics["lanes"]["cheap"]["admitted"] == 0
+
+
+@pytest.mark.parametrize("env", ["testing"])
+def test_metrics_include_service(client, service):
+    """Include sale service cache metrics once service is in use."""
+    service.metrics.return_value = {"feed_cache": {"hits": 3}}
+    metrics = client.get("/metrics").get_json()
+    assert metrics["feed_cache"] == {"hits": 3}
+    assert "admission" in metrics
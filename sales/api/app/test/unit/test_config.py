@@ -1,8 +1,10 @@
 """Configuration tests."""
+import importlib
 import os
 
 import pytest
 
+from app.main import config as app_config
 from app.main import create_app
 
 
@@ -36,3 +38,17 @@ def test_testing_config(config):
     assert app.config["DB_HOST"] == os.getenv("DB_HOST")
     assert app.config["DB_PORT"] is not None
     assert app.config["DB_PORT"] == os.getenv("DB_PORT")
+
+
+@pytest.mark.parametrize("env", ["testing"])
+def test_shared_cache_opt_in(config, monkeypatch):
+    """Read sales through the shared cache only once enabled."""
+    assert "sale_cache" not in create_app().extensions
+    monkeypatch.setenv("SHARED_CACHE_ENABLED", "true")
+    monkeypatch.setenv("SHARED_CACHE_SLOTS", "16")
+    importlib.reload(app_config)
+    try:
+        assert "sale_cache" in create_app().extensions
+    finally:
+        monkeypatch.undo()
+        importlib.reload(app_config)
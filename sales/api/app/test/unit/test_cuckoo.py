@@ -0,0 +1,61 @@
+"""Cuckoo filter tests."""
+import pytest
+
+from app.main.helper.cuckoo import CuckooFilter
+
+
+def test_no_false_negatives():
+    """Report every added item as present."""
+    ids = CuckooFilter(memory_bytes=64 * 1024)
+    items = [f"id-{i}" for i in range(20000)]
+    assert all(ids.add(item) for item in items)
+    assert all(item in ids for item in items)
+    assert ids.count == len(items)
+    assert not ids.saturated
+
+
+@pytest.mark.parametrize("fp_rate", [0.05, 0.01, 0.001])
+def test_false_positive_rate(fp_rate):
+    """Keep false positive rate near the configured rate."""
+    ids = CuckooFilter(memory_bytes=64 * 1024, fp_rate=fp_rate)
+    for i in range(int(ids.capacity * 0.9)):
+        ids.add(f"id-{i}")
+    misses = [f"other-{i}" for i in range(20000)]
+    rate = sum(item in ids for item in misses) / len(misses)
+    assert rate < fp_rate * 1.5
+
+
+def test_remove():
+    """Remove added items only."""
+    ids = CuckooFilter(memory_bytes=4096)
+    ids.add("a")
+    ids.add("b")
+    assert ids.remove("a")
+    assert "a" not in ids
+    assert "b" in ids
+    assert ids.count == 1
+
+
+def test_memory_budget():
+    """Size table within memory budget."""
+    ids = CuckooFilter(memory_bytes=10000, fp_rate=0.01)
+    assert ids.memory_bytes == 8192
+    assert ids.capacity == 4096
+    small = CuckooFilter(memory_bytes=10000, fp_rate=0.05)
+    assert small.capacity == 8192
+
+
+def test_saturated():
+    """Report every item as present once an insert fails."""
+    ids = CuckooFilter(memory_bytes=8)
+    added = [ids.add(f"id-{i}") for i in range(64)]
+    assert not all(added)
+    assert ids.saturated
+    assert "missing" in ids
+
+
+@pytest.mark.parametrize("memory_bytes,fp_rate", [(1, 0.01), (4096, 0.00001)])
+def test_invalid_arguments(memory_bytes, fp_rate):
+    """Raise 'ValueError' when budget or rate cannot be met."""
+    with pytest.raises(ValueError):
+        CuckooFilter(memory_bytes=memory_bytes, fp_rate=fp_rate)
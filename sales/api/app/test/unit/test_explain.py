@@ -0,0 +1,208 @@
+"""Query plan regression guard tests."""
+import inspect
+import json
+from datetime import datetime
+
+import pytest
+
+from app.main.repository.postgres import sale_sql as sql
+from app.tools import explain, plans
+
+ANCHOR = ("a" * 32, datetime(2021, 5, 1), "ORD-1", "SKU-000042")
+
+
+def plan(node_type="Index Scan", index="sale_pkey", relation="sale", hit=4):
+    node = {"Node Type": node_type, "Relation Name": relation}
+    if index:
+        node["Index Name"] = index
+    return {
+        "Plan": {
+            "Node Type": "Limit",
+            "Shared Hit Blocks": hit,
+            "Shared Read Blocks": 1,
+            "Plans": [node],
+        },
+        "Execution Time": 0.5,
+    }
+
+
+class FakeCursor:
+    def __init__(self, plans):
+        self.plans = plans
+        self.executed = []
+        self.description = None
+        self._row = None
+
+    def execute(self, stmt, params=None):
+        self.executed.append((stmt, params))
+        if stmt == sql.COUNT_SALES_STATEMENT:
+            self._row = (self.plans["count"],)
+        elif stmt == explain.SELECT_ANCHOR_STATEMENT:
+            self.description = [
+                (c,) for c in ("id", "date_time", "order_id", "sku")
+            ] + [("created_at",), ("updated_at",)]
+            self._row = ANCHOR + (ANCHOR[1], ANCHOR[1])
+        elif stmt.startswith("EXPLAIN"):
+            self._row = (json.dumps([self.plans["plan"]]),)
+
+    def fetchone(self):
+        return self._row
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, **plans):
+        self.cur = FakeCursor(plans)
+        self.rolled_back = False
+        self.autocommit = False
+
+    def cursor(self):
+        return self.cur
+
+    def rollback(self):
+        self.rolled_back = True
+
+
+def test_cases_cover_statements():
+    """Check every statement, or list it as unchecked."""
+    checked = {c.statement for c in explain.CASES}
+    for name in dir(sql):
+        if name.endswith("_STATEMENT"):
+            assert (
+                getattr(sql, name) in checked
+                or name in explain.UNCHECKED_STATEMENTS
+            ), name
+    assert len({c.name for c in explain.CASES}) == len(explain.CASES)
+    assert any(c.statement.startswith("UPDATE") for c in explain.CASES)
+
+
+def test_cases_cover_generated_statements():
+    """Check statements of every generator, or list it as unchecked."""
+    source = inspect.getsource(explain)
+    for name in dir(sql):
+        if name.startswith("generate_"):
+            assert (
+                f"sql.{name}(" in source
+                or name in explain.UNCHECKED_GENERATORS
+            ), name
+
+
+def test_cases_have_snapshots():
+    """Commit a snapshot of every checked statement."""
+    snapshots = explain.load_snapshots()
+    assert set(snapshots) == {c.name for c in explain.CASES}
+
+
+def test_case_params():
+    """Bind every parameter of statements from anchor."""
+    anchor = dict(
+        zip(
+            ("id", "date_time", "order_id", "sku", "created_at"),
+            ANCHOR + (ANCHOR[1],),
+        ),
+        updated_at=ANCHOR[1],
+    )
+    for case in explain.CASES:
+        params = case.params(anchor)
+        if isinstance(params, dict):
+            # Raises KeyError for parameters missing from params.
+            case.statement % {k: "x" for k in params}
+        else:
+            assert case.statement.count("%s") == len(params), case.name
+
+
+def test_signature():
+    """Describe nodes, collapsing partitions of sale."""
+    p = plan(relation="sale_y2021m05", index="sale_y2021m05_created_at_idx")
+    assert plans.signature(p) == [
+        "Index Scan sale_* sale_*_created_at_idx",
+        "Limit",
+    ]
+    assert plans.signature(p) == plans.signature(
+        plan(relation="sale_default", index="sale_default_created_at_idx")
+    )
+    assert plans.shared_buffers(p) == 5
+
+
+def test_check_plans():
+    """Run cases in rolled back transaction, behind savepoints."""
+    conn = FakeConnection(count=10, plan=plan())
+    cases = explain.CASES[:2]
+    results = explain.check_plans(conn, cases=cases)
+    assert [r.name for r in results] == [c.name for c in cases]
+    assert all(not r.failures for r in results)
+    assert conn.rolled_back
+    stmts = [stmt for stmt, _ in conn.cur.executed]
+    assert tuple(stmts[:3]) == explain.VACUUM_STATEMENTS
+    assert not conn.autocommit
+    assert stmts[5:8] == [
+        "SAVEPOINT explain_check",
+        "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + cases[0].statement,
+        "ROLLBACK TO SAVEPOINT explain_check",
+    ]
+    assert conn.cur.executed[4][1] == {"offset": 5}
+    assert conn.cur.executed[6][1] == (ANCHOR[0],)
+
+
+def test_check_plans_empty():
+    """Refuse to explain statements without sales."""
+    conn = FakeConnection(count=0)
+    with pytest.raises(ValueError):
+        explain.check_plans(conn)
+    assert conn.rolled_back
+
+
+@pytest.mark.parametrize(
+    "explained,failure",
+    [
+        (plan("Seq Scan", index=None), 'sequential scan of "sale"'),
+        (plan("Bitmap Heap Scan", index=None), "no index used"),
+        (plan(hit=2000), "2001 buffers over 1000"),
+    ],
+)
+def test_check_properties(explained, failure):
+    """Fail on sequential scans, missing indexes and buffers."""
+    conn = FakeConnection(count=1, plan=explained)
+    (result,) = explain.check_plans(conn, cases=explain.CASES[:1])
+    assert failure in result.failures
+
+
+def test_check_snapshots(tmp_path):
+    """Fail on plans or buffers diverging from snapshots."""
+    path = str(tmp_path / "snapshots.json")
+    assert explain.load_snapshots(path) == {}
+    cases = explain.CASES[:1]
+    conn = FakeConnection(count=1, plan=plan())
+    explain.save_snapshots(explain.check_plans(conn, cases=cases), path)
+    snapshots = explain.load_snapshots(path)
+    assert snapshots == {
+        cases[0].name: {
+            "signature": ["Index Scan sale sale_pkey", "Limit"],
+            "buffers": 5,
+        }
+    }
+    conn = FakeConnection(count=1, plan=plan(hit=50))
+    (result,) = explain.check_plans(conn, snapshots, cases)
+    assert not result.failures
+    conn = FakeConnection(count=1, plan=plan(index="sale_created_at_idx"))
+    (result,) = explain.check_plans(conn, snapshots, cases)
+    assert result.failures == [
+        "plan changed, added ['Index Scan sale sale_created_at_idx'], "
+        "removed ['Index Scan sale sale_pkey']"
+    ]
+    conn = FakeConnection(count=1, plan=plan(hit=80))
+    (result,) = explain.check_plans(conn, snapshots, cases)
+    assert result.failures == ["81 buffers, snapshot had 5"]
+
+
+def test_check_strict():
+    """Fail statements without a snapshot when strict."""
+    cases = explain.CASES[:1]
+    conn = FakeConnection(count=1, plan=plan())
+    (result,) = explain.check_plans(conn, {}, cases)
+    assert not result.failures
+    conn = FakeConnection(count=1, plan=plan())
+    (result,) = explain.check_plans(conn, {}, cases, strict=True)
+    assert result.failures == ["no snapshot"]
@@ -0,0 +1,118 @@
+"""Load-testing harness tests."""
+import threading
+import time
+
+import pytest
+
+from app.main import service as srv
+from app.tools import loadtest
+from app.tools.loadtest import FlaskTarget, Histogram, LoadTest
+
+
+def test_histogram_percentiles():
+    """Keep percentiles within relative error of significant digits."""
+    histogram = Histogram(significant_digits=2)
+    for value in range(1, 100_001):
+        histogram.record(value)
+    for percentile in (50, 90, 99, 99.9):
+        expected = percentile / 100 * 100_000
+        assert abs(histogram.percentile(percentile) - expected) <= (
+            expected * 0.01
+        )
+    assert histogram.percentile(100) == histogram.max == 100_000
+    assert histogram.min == 1
+    assert histogram.mean == pytest.approx(50_000.5)
+
+
+def test_histogram_merge():
+    """Merge counts of histograms."""
+    first, second = Histogram(), Histogram()
+    first.record(10)
+    second.record(1_000_000)
+    first.merge(second)
+    assert first.count == 2
+    assert first.percentile(50) == 10
+    assert first.max == 1_000_000
+    with pytest.raises(ValueError):
+        first.merge(Histogram(significant_digits=3))
+
+
+def test_parse_mix():
+    """Parse weights of request kinds."""
+    assert loadtest.parse_mix("read=3, write=1") == {"read": 3, "write": 1}
+    with pytest.raises(ValueError):
+        loadtest.parse_mix("read")
+
+
+def test_invalid_arguments():
+    """Reject unknown request kinds and unpaced open loops."""
+    with pytest.raises(ValueError):
+        LoadTest(None, mix={"delete": 1})
+    with pytest.raises(ValueError):
+        LoadTest(None, open_loop=True)
+
+
+class StallingTarget:
+    """Target answering at once, except for stalling its first read."""
+
+    def __init__(self, stall):
+        self.stall = stall
+        self.reads = 0
+        self.lock = threading.Lock()
+
+    def request(self, method, path, body=None):
+        if method == "POST":
+            return 200, {"results": [{"status": 201, "sale": {"id": "1"}}]}
+        with self.lock:
+            self.reads += 1
+            first = self.reads == 1
+        if first:
+            time.sleep(self.stall)
+        return 200, {}
+
+
+def run(open_loop):
+    test = LoadTest(
+        StallingTarget(stall=0.2),
+        mix={"read": 1},
+        concurrency=1,
+        rate=100,
+        duration=0.5,
+        open_loop=open_loop,
+    )
+    test.prepare(1)
+    return test.run()
+
+
+def test_open_loop_counts_held_back_requests():
+    """Charge a stall to every request it delayed in open-loop mode."""
+    closed = run(open_loop=False).results["read"].latency
+    opened = run(open_loop=True).results["read"].latency
+    assert opened.count >= 45
+    assert closed.percentile(90) < 50_000
+    assert opened.percentile(90) > 50_000
+
+
+@pytest.mark.parametrize("env", ["testing"])
+def test_flask_target(client, service, sale):
+    """Drive application in-process with a request mix."""
+    created = srv.SaleModel(**sale)
+    service.execute_batch.return_value = [
+        srv.OperationResultModel(applied=True, sale=created)
+    ]
+    service.find_by_id.return_value = created
+    service.find_version.return_value = srv.VersionModel(etag="abc")
+    service.find_with_version.return_value = (
+        [created],
+        srv.VersionModel(etag="abc"),
+    )
+    test = LoadTest(
+        FlaskTarget(client.application), concurrency=2, duration=0.2
+    )
+    test.prepare(2)
+    report = test.run().to_json_dict()
+    total = report["requests"]["total"]
+    assert total["requests"] > 0
+    assert total["errors"] == 0
+    assert set(report["requests"]) == {"read", "list", "write", "total"}
+    assert total["latency_ms"]["p99"] >= total["latency_ms"]["p50"]
@@ -0,0 +1,68 @@
+"""Synthetic sales data generator tests."""
+import collections
+from datetime import datetime, timedelta
+
+from app.main.repository.postgres import sale_sql as sql
+from app.tools import seed
+
+ROWS = 20_000
+
+
+def generate(**options):
+    return list(seed.generate_sales(ROWS, chunk_rows=5_000, **options))
+
+
+def test_deterministic():
+    """Generate the same sales for the same seed, chunk by chunk."""
+    sales = generate()
+    assert len(sales) == ROWS
+    assert sales == generate()
+    assert sales != generate(seed=1)
+    assert sales[5_000:10_000] == list(
+        seed.generate_chunk(1, ROWS, chunk_rows=5_000)
+    )
+    assert len({s[0] for s in sales}) == ROWS
+    assert len({(s[1], s[2], s[3]) for s in sales}) == ROWS
+
+
+def test_distributions():
+    """Skew skus, share order ids, and tie creation times."""
+    sales = generate()
+    skus = collections.Counter(s[3] for s in sales)
+    top = sum(count for _, count in skus.most_common(100))
+    assert top > ROWS / 2
+    orders = collections.Counter(s[2] for s in sales)
+    assert 1 < max(orders.values())
+    assert len(orders) < ROWS * 0.8
+    created = collections.Counter(s[8] for s in sales)
+    assert len(created) < ROWS / 2
+
+
+def test_values():
+    """Generate consistent times and money values in cents."""
+    start = datetime(2021, 1, 1)
+    prices = {}
+    for row in generate(start=start, days=30):
+        s = dict(zip(sql.COLUMNS, row))
+        assert start <= s["created_at"] < start + timedelta(days=30)
+        assert s["date_time"] <= s["created_at"] <= s["updated_at"]
+        price, rest = divmod(s["subtotal"], s["quantity"])
+        assert rest == 0 and price % 100 == 99
+        assert prices.setdefault(s["sku"], price) == price
+        assert 0 <= s["tax"] <= s["subtotal"] * 0.1 + 1
+        assert s["fee"] == round(s["subtotal"] * seed.CARD_FEE_RATE)
+
+
+def test_copy_chunk(mocker):
+    """Load chunk through COPY as tab separated rows."""
+    conn = mocker.Mock()
+    cur = conn.cursor.return_value
+    loaded = seed.copy_chunk(conn, 1, 250, chunk_rows=100)
+    assert loaded == 100
+    stmt, buffer = cur.copy_expert.call_args[0]
+    assert stmt == seed.COPY_SALES_STATEMENT
+    lines = buffer.getvalue().splitlines()
+    assert len(lines) == 100
+    assert all(len(line.split("\t")) == 10 for line in lines)
+    conn.commit.assert_called_once()
+    cur.close.assert_called_once()
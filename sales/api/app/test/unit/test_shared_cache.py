@@ -0,0 +1,108 @@
+"""Shared memory cache tests."""
+import multiprocessing
+
+import pytest
+
+from app.main.helper.shared_cache import WAYS, SharedCache
+
+fork = multiprocessing.get_context("fork")
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_get_put_delete():
+    """Get values put, until deleted."""
+    cache = SharedCache(slots=64)
+    assert cache.get(b"a") is None
+    assert cache.put(b"a", b"1", ttl=60)
+    assert cache.put(b"b", b"2", ttl=60)
+    assert cache.get(b"a") == b"1"
+    assert cache.put(b"a", b"3", ttl=60)
+    assert cache.get(b"a") == b"3"
+    cache.delete(b"a")
+    assert cache.get(b"a") is None
+    assert cache.get(b"b") == b"2"
+    cache.clear()
+    assert cache.get(b"b") is None
+    metrics = cache.metrics()
+    assert metrics["hits"] == 3
+    assert metrics["misses"] == 3
+
+
+def test_add():
+    """Only add values of keys without a live value."""
+    clock = Clock()
+    cache = SharedCache(slots=64, clock=clock)
+    assert cache.add(b"a", b"1", ttl=10)
+    assert not cache.add(b"a", b"2", ttl=10)
+    assert cache.get(b"a") == b"1"
+    clock.now = 10
+    assert cache.get(b"a") is None
+    assert cache.add(b"a", b"2", ttl=10)
+    assert cache.get(b"a") == b"2"
+
+
+def test_oversized():
+    """Reject values that do not fit a slot."""
+    cache = SharedCache(slots=64, slot_size=64)
+    assert not cache.put(b"a", b"x" * 64, ttl=60)
+    assert cache.get(b"a") is None
+    assert cache.metrics()["rejected"] == 1
+    with pytest.raises(ValueError):
+        SharedCache(slots=64, slot_size=8)
+
+
+def test_clock_eviction():
+    """Evict unreferenced entries before recently read ones."""
+    cache = SharedCache(slots=WAYS)
+    keys = [str(i).encode() for i in range(WAYS)]
+    for key in keys:
+        cache.put(key, key, ttl=60)
+    assert all(cache.get(key) == key for key in keys[1:])
+    cache.put(b"new", b"new", ttl=60)
+    assert cache.get(keys[0]) is None
+    assert all(cache.get(key) == key for key in keys[1:])
+    assert cache.get(b"new") == b"new"
+    assert cache.metrics()["evictions"] == 1
+
+
+def _put_range(cache, start, count):
+    for i in range(start, start + count):
+        cache.put(f"key-{i}".encode(), f"value-{i}".encode(), ttl=60)
+
+
+def _read_range(cache, start, count, results):
+    results.put(
+        [cache.get(f"key-{i}".encode()) for i in range(start, start + count)]
+    )
+
+
+def test_shared_across_processes():
+    """Share entries between processes forked after creation."""
+    cache = SharedCache(slots=4096)
+    writers = [
+        fork.Process(target=_put_range, args=(cache, n * 100, 100))
+        for n in range(4)
+    ]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+        assert writer.exitcode == 0
+    assert all(
+        cache.get(f"key-{i}".encode()) == f"value-{i}".encode()
+        for i in range(400)
+    )
+    cache.delete(b"key-0")
+    results = fork.Queue()
+    reader = fork.Process(target=_read_range, args=(cache, 0, 3, results))
+    reader.start()
+    values = results.get(timeout=10)
+    reader.join()
+    assert values == [None, b"value-1", b"value-2"]
@@ -0,0 +1,22 @@
+"""Startup tests."""
+from app.tools import startup
+
+
+def test_cold_start_budget():
+    """Application starts within budget without loading heavy modules."""
+    profile = startup.profile_startup()
+    assert profile.heavy_modules() == []
+    assert profile.total < startup.BUDGET_SECONDS
+
+
+def test_parse_import_times():
+    """Parse import time output into module timings."""
+    output = (
+        "import time: self [us] | cumulative | imported package\n"
+        "import time:       817 |      60377 |     flask.app\n"
+        "import time:      1413 |     155311 | app.main\n"
+    )
+    assert startup.parse_import_times(output) == [
+        ("flask.app", 817, 60377),
+        ("app.main", 1413, 155311),
+    ]
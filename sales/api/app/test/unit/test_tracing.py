@@ -0,0 +1,117 @@
+"""Tracing tests."""
+import json
+import logging
+import time
+
+from app.main.helper import tracing
+from app.main.helper.tracing import FileExporter, Tracer
+
+
+def test_span_outside_trace():
+    """Record nothing outside a trace."""
+    with tracing.span("service.find") as span:
+        assert span is None
+
+
+def test_span_tree():
+    """Nest spans under the span current when they start."""
+    tracer = Tracer(sample_rate=1)
+    with tracer.trace("request", path="/sales"):
+        with tracing.span("service.find"):
+            with tracing.span(tracing.STATEMENT_SPAN, statement="select"):
+                time.sleep(0.002)
+        with tracing.span("serialize"):
+            pass
+    (trace,) = tracer.traces()
+    assert trace["name"] == "request"
+    assert trace["attributes"] == {"path": "/sales"}
+    service, serialize = trace["children"]
+    assert service["name"] == "service.find"
+    assert service["children"][0]["attributes"] == {"statement": "select"}
+    assert service["children"][0]["duration_ms"] >= 2
+    assert service["self_ms"] < service["duration_ms"]
+    assert serialize["start_ms"] >= service["duration_ms"]
+    assert not trace["slow"]
+
+
+def test_traced():
+    """Record calls of decorated function."""
+    tracer = Tracer(sample_rate=1)
+
+    @tracing.traced("service.count")
+    def count():
+        return 5
+
+    with tracer.trace("request"):
+        assert count() == 5
+    assert tracer.traces()[0]["children"][0]["name"] == "service.count"
+
+
+def test_sampling():
+    """Keep only sampled fast traces, but record all of them."""
+    samples = iter([0.5, 0.001])
+    tracer = Tracer(sample_rate=0.01, sample=lambda: next(samples))
+    for _ in range(2):
+        with tracer.trace("request"):
+            pass
+    assert len(tracer.traces()) == 1
+    assert tracer.metrics() == {
+        "traces": 2,
+        "kept": 1,
+        "slow": 0,
+        "buffered": 1,
+    }
+
+
+def test_slow_request_logged(caplog):
+    """Always keep and log slow traces with their span tree."""
+    tracer = Tracer(sample_rate=0, slow_threshold=0.001)
+    with caplog.at_level(logging.WARNING, logger=tracing.__name__):
+        with tracer.trace("request"):
+            with tracing.span("service.find"):
+                time.sleep(0.002)
+    (trace,) = tracer.traces()
+    assert trace["slow"]
+    (record,) = caplog.records
+    logged = json.loads(record.getMessage().split(": ", 1)[1])
+    assert logged["children"][0]["name"] == "service.find"
+
+
+def test_slow_statement_logged(caplog):
+    """Keep trace with a statement over the statement threshold."""
+    tracer = Tracer(
+        sample_rate=0, slow_threshold=10, slow_statement_threshold=0.001
+    )
+    with caplog.at_level(logging.WARNING, logger=tracing.__name__):
+        with tracer.trace("request"):
+            with tracing.span("service.find"):
+                pass
+        with tracer.trace("request"):
+            with tracing.span(tracing.STATEMENT_SPAN):
+                time.sleep(0.002)
+    assert len(tracer.traces()) == 1
+    assert len(caplog.records) == 1
+    assert tracer.metrics()["slow"] == 1
+
+
+def test_ring_buffer():
+    """Keep only the newest traces."""
+    tracer = Tracer(sample_rate=1, buffer_size=2)
+    for i in range(3):
+        with tracer.trace("request", number=i):
+            pass
+    assert [t["attributes"]["number"] for t in tracer.traces()] == [1, 2]
+
+
+def test_file_exporter(tmp_path):
+    """Append kept traces to JSON lines file."""
+    path = tmp_path / "traces.jsonl"
+    tracer = Tracer(sample_rate=1, exporters=[FileExporter(str(path))])
+    for i in range(2):
+        with tracer.trace("request", number=i):
+            pass
+    lines = path.read_text().splitlines()
+    assert [json.loads(line)["attributes"] for line in lines] == [
+        {"number": 0},
+        {"number": 1},
+    ]
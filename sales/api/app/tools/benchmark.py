@@ -0,0 +1,161 @@
+"""Query benchmarks."""
+import time
+from typing import Dict, List, Optional, Sequence
+
+from app.main.repository.postgres import sale_sql as sql
+from app.main.repository import utils
+from app.tools import plans
+
+INSERT_SYNTHETIC_SALES_STATEMENT = (
+    'INSERT INTO "sale" (id, date_time, order_id, sku, quantity, subtotal, '
+    "fee, tax, created_at, updated_at) SELECT md5('bench' || i), "
+    "now() - (i || ' seconds')::interval, "
+    "'ORD-' || lpad((i / 3)::text, 9, '0'), "
+    "'SKU-' || lpad((i % 50000)::text, 6, '0'), 1 + i % 5, "
+    "100 + i % 90000, i % 300, i % 800, now(), now() "
+    "FROM generate_series(1, %(rows)s) AS i"
+)
+
+QUERIES = ("SKU-0123", "SKU-04", "ORD-00012345", "ORD-0001234", "KU-01234")
+
+PROJECTIONS = {"full": None, "narrow": ("sku", "subtotal")}
+
+ROWS_SIZE_STATEMENT = (
+    "SELECT COALESCE(SUM(octet_length(page::text)), 0) FROM ({}) AS page"
+)
+
+
+class SearchBenchmark:
+    """Plan and timing of a search query."""
+
+    def __init__(
+        self,
+        query: str,
+        execution_time: float,
+        indexes: List[str],
+        seq_scan: bool,
+    ):
+        self.query = query
+        self.execution_time = execution_time
+        self.indexes = indexes
+        self.seq_scan = seq_scan
+
+
+def benchmark_search(conn, rows: int, queries=QUERIES, limit: int = 10):
+    """
+    Insert synthetic sales, then explain and time search queries. Runs
+    in a single transaction that is rolled back, leaving no data behind.
+    """
+    stmt = "EXPLAIN (ANALYZE, FORMAT JSON) " + sql.generate_search_statement(
+        sql.SEARCH_FIELDS, paginated=False
+    )
+    results = []
+    cur = conn.cursor()
+    try:
+        cur.execute(INSERT_SYNTHETIC_SALES_STATEMENT, {"rows": rows})
+        cur.execute('ANALYZE "sale"')
+        for query in queries:
+            cur.execute(
+                stmt,
+                {
+                    "query": query,
+                    "prefix": utils.escape_like(query) + "%",
+                    "limit": limit,
+                },
+            )
+            plan = plans.load_plan(cur.fetchone()[0])
+            results.append(
+                SearchBenchmark(
+                    query=query,
+                    execution_time=plan["Execution Time"],
+                    indexes=plans.indexes_used(plan),
+                    seq_scan=plans.seq_scanned(plan),
+                )
+            )
+    finally:
+        conn.rollback()
+        cur.close()
+    return results
+
+
+class ProjectionBenchmark:
+    """Transfer size and throughput of a scan selecting columns."""
+
+    def __init__(
+        self,
+        projection: str,
+        columns: Sequence[str],
+        rows: int,
+        size: int,
+        rows_per_second: float,
+        index_only: bool,
+    ):
+        self.projection = projection
+        self.columns = columns
+        self.rows = rows
+        self.size = size
+        self.rows_per_second = rows_per_second
+        self.index_only = index_only
+
+
+def benchmark_projection(
+    conn,
+    rows: int,
+    projections: Dict[str, Optional[Sequence[str]]] = PROJECTIONS,
+    batch_size: int = 10000,
+):
+    """
+    Insert synthetic sales, then read all sales in id order, in batches
+    as "SaleRepository.scan" does, once per projection. Size is the
+    number of bytes of the rows in text format, as sent to the client.
+    Runs in a single transaction that is rolled back, leaving no data
+    behind.
+    """
+    results = []
+    cur = conn.cursor()
+    try:
+        cur.execute(INSERT_SYNTHETIC_SALES_STATEMENT, {"rows": rows})
+        cur.execute('ANALYZE "sale"')
+        for name, fields in projections.items():
+            columns = sql.generate_projection(fields)
+            first = sql.generate_scan_sales_statement(columns)
+            following = sql.generate_scan_sales_statement(columns, True)
+            cur.execute(
+                "EXPLAIN (FORMAT JSON) " + following,
+                {"id": "", "limit": batch_size},
+            )
+            plan = plans.load_plan(cur.fetchone()[0])
+            cur.execute(
+                ROWS_SIZE_STATEMENT.format(
+                    f'SELECT {", ".join(columns)} FROM "sale"'
+                )
+            )
+            size = cur.fetchone()[0]
+            count = 0
+            after = None
+            start = time.perf_counter()
+            while True:
+                cur.execute(
+                    first if after is None else following,
+                    {"id": after, "limit": batch_size},
+                )
+                batch = cur.fetchall()
+                count += len(batch)
+                if len(batch) < batch_size:
+                    break
+                after = batch[-1][0]
+            elapsed = time.perf_counter() - start
+            results.append(
+                ProjectionBenchmark(
+                    projection=name,
+                    columns=columns,
+                    rows=count,
+                    size=size,
+                    rows_per_second=count / elapsed if elapsed else 0.0,
+                    index_only=plans.index_only_scanned(plan),
+                )
+            )
+    finally:
+        conn.rollback()
+        cur.close()
+    return results
@@ -0,0 +1,554 @@
+"""Query plan regression guard."""
+import json
+import os
+from datetime import timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from app.main import repository as repo
+from app.main.repository.postgres import archive
+from app.main.repository.postgres import sale_sql as sql
+from app.main.repository import utils
+from app.tools import plans
+
+# Snapshots are taken from a database initialized and seeded with
+# "manage.py seed --rows 200000 --workers 1", which loads the same sales
+# in the same order on every run.
+SNAPSHOT_PATH = os.path.join(os.path.dirname(__file__), "plan_snapshots.json")
+
+# Statements that are not queries of sales: session settings, batch
+# savepoints and planner statistics, and indexing of archived ids, which
+# references an archived batch.
+UNCHECKED_STATEMENTS = (
+    "INSERT_ARCHIVED_IDS_STATEMENT",
+    "SET_STATEMENT_TIMEOUT_STATEMENT",
+    "BATCH_SAVEPOINT_STATEMENT",
+    "BATCH_NEXT_SAVEPOINT_STATEMENT",
+    "BATCH_ROLLBACK_STATEMENT",
+    "ESTIMATE_SALES_STATEMENT",
+    "EXPLAIN_SALES_STATEMENT",
+)
+
+# Helpers building parts of statements rather than statements.
+UNCHECKED_GENERATORS = (
+    "generate_projection",
+    "generate_filter_conditions",
+    "generate_filter_clause",
+)
+
+# Plans depend on planner statistics, and index-only scans on the
+# visibility map, which are refreshed before checks so that plans do not
+# depend on whether autovacuum ran since seeding. Statistics sample up to
+# 300 rows per unit of target, so every row of the seeded database is
+# read, and the same sales always give the same statistics.
+VACUUM_STATEMENTS = (
+    "SET default_statistics_target = 1000",
+    'VACUUM ANALYZE "sale", "archived_sale_batch"',
+    "RESET default_statistics_target",
+)
+
+SELECT_ANCHOR_STATEMENT = (
+    'SELECT id, date_time, order_id, sku, created_at, updated_at FROM "sale" '
+    "ORDER BY created_at DESC, id DESC OFFSET %(offset)s LIMIT 1"
+)
+
+# Buffers grow with the buffer ceiling of the snapshot by this factor,
+# plus slack, before counting as a regression.
+BUFFER_TOLERANCE = 2
+
+BUFFER_SLACK = 50
+
+
+class PlanCase:
+    """Statement explained with parameters, and the plan it must have."""
+
+    def __init__(
+        self,
+        name: str,
+        statement: str,
+        params: Callable[[Dict[str, Any]], Any],
+        max_buffers: Optional[int] = 1000,
+        index: bool = True,
+        seq_scan: bool = False,
+    ):
+        self.name = name
+        self.statement = statement
+        self.params = params
+        self.max_buffers = max_buffers
+        self.index = index
+        self.seq_scan = seq_scan
+
+
+class PlanCheck:
+    """Plan properties of a statement and the checks it failed."""
+
+    def __init__(
+        self,
+        name: str,
+        signature: List[str],
+        indexes: List[str],
+        seq_scan: bool,
+        buffers: int,
+        execution_time: float,
+        failures: List[str],
+    ):
+        self.name = name
+        self.signature = signature
+        self.indexes = indexes
+        self.seq_scan = seq_scan
+        self.buffers = buffers
+        self.execution_time = execution_time
+        self.failures = failures
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Plan properties compared by later checks."""
+        return {"signature": self.signature, "buffers": self.buffers}
+
+
+def _page(filters=None, after=True):
+    stmt, _ = sql.generate_select_sales_statement(filters or {}, after)
+    return stmt
+
+
+def _version(filters=None, after=True):
+    stmt, _ = sql.generate_select_sales_version_statement(filters or {}, after)
+    return stmt
+
+
+def _page_params(filters):
+    def params(anchor):
+        _, values = sql.generate_filter_conditions(filters(anchor))
+        return {**values, "id": anchor["id"], "limit": 10}
+
+    return params
+
+
+def _day_around(anchor):
+    day = timedelta(days=1)
+    return {"date_time": (anchor["date_time"] - day, anchor["date_time"])}
+
+
+def _sale_values(anchor, order_id="explain-check"):
+    """
+    Values of a sale inserted next to anchor, under a natural key of its
+    own unless given the anchor's order id.
+    """
+    return (
+        "explain-check",
+        anchor["date_time"],
+        order_id,
+        anchor["sku"],
+        1,
+        100,
+        3,
+        8,
+        anchor["created_at"],
+        anchor["updated_at"],
+    )
+
+
+def _search_params(anchor, **extra):
+    # Seeded skus share most of their trigrams, so searches for a sku
+    # match nearly every sale. The random part of an order id is rare.
+    query = anchor["order_id"][4:-1]
+    return {
+        "query": query,
+        "prefix": utils.escape_like(query) + "%",
+        "limit": 10,
+        **extra,
+    }
+
+
+def _cases():
+    """Checked statements, with writes last so they see seeded data."""
+    by_sku = _page_params(lambda a: {"sku": a["sku"]})
+    by_order = _page_params(lambda a: {"order_id": a["order_id"]})
+    by_day = _page_params(_day_around)
+    unfiltered = _page_params(lambda a: {})
+    key = lambda a: {  # noqa: E731
+        "created_at": a["created_at"],
+        "id": a["id"],
+        "limit": 10,
+    }
+    projection = sql.generate_projection(["sku", "subtotal"])
+    return [
+        PlanCase(
+            "select_sale_by_id",
+            sql.SELECT_SALE_BY_ID_STATEMENT,
+            lambda a: (a["id"],),
+        ),
+        PlanCase(
+            "select_sale_by_id_projected",
+            sql.generate_select_sale_by_id_statement(projection),
+            lambda a: (a["id"],),
+        ),
+        PlanCase(
+            "sale_exists", sql.SALE_EXISTS_STATEMENT, lambda a: (a["id"],)
+        ),
+        PlanCase("select_sales_after", _page(), unfiltered),
+        PlanCase("select_sales_before", _page(after=False), unfiltered),
+        PlanCase("select_sales_after_sku", _page({"sku": ""}), by_sku),
+        PlanCase("select_sales_before_sku", _page({"sku": ""}, False), by_sku),
+        PlanCase(
+            "select_sales_after_order_id", _page({"order_id": ""}), by_order
+        ),
+        PlanCase(
+            "select_sales_after_date_time",
+            _page({"date_time": (0, 0)}),
+            by_day,
+        ),
+        PlanCase("select_sales_after_version", _version(), unfiltered),
+        PlanCase(
+            "select_sales_before_version", _version(after=False), unfiltered
+        ),
+        PlanCase(
+            "select_sales_after_version_sku", _version({"sku": ""}), by_sku
+        ),
+        PlanCase(
+            "select_sales_from_key_after",
+            sql.generate_select_sales_from_key_statement({})[0],
+            key,
+        ),
+        PlanCase(
+            "select_sales_from_key_before",
+            sql.generate_select_sales_from_key_statement({}, False)[0],
+            key,
+        ),
+        PlanCase(
+            "select_sale_keys_from_key",
+            sql.generate_select_sales_from_key_statement(
+                {}, True, sql.generate_projection(["created_at"])
+            )[0],
+            key,
+        ),
+        PlanCase(
+            "select_sales_version_from_key",
+            sql.generate_select_sales_version_from_key_statement({})[0],
+            lambda a: {
+                "created_at": a["created_at"],
+                "id": a["id"],
+                "end_created_at": a["created_at"] - timedelta(minutes=10),
+                "end_id": "",
+            },
+        ),
+        PlanCase(
+            "select_latest_sales",
+            sql.SELECT_LATEST_SALES_STATEMENT,
+            lambda a: {"limit": 100},
+        ),
+        PlanCase(
+            "scan_sales",
+            sql.SCAN_SALES_STATEMENT,
+            lambda a: {"limit": 1000},
+            max_buffers=5000,
+        ),
+        PlanCase(
+            "scan_sales_after",
+            sql.SCAN_SALES_AFTER_STATEMENT,
+            lambda a: {"id": a["id"], "limit": 1000},
+            max_buffers=5000,
+        ),
+        PlanCase(
+            "scan_sales_after_projected",
+            sql.generate_scan_sales_statement(projection, paginated=True),
+            lambda a: {"id": a["id"], "limit": 1000},
+            max_buffers=5000,
+        ),
+        # Streams read every matching sale, however many there are.
+        PlanCase(
+            "stream_sales",
+            sql.generate_stream_sales_statement({})[0],
+            lambda a: {},
+            max_buffers=None,
+            index=False,
+            seq_scan=True,
+        ),
+        PlanCase(
+            "stream_sales_sku_projected",
+            sql.generate_stream_sales_statement({"sku": ""}, projection)[0],
+            lambda a: sql.generate_filter_clause({"sku": a["sku"]})[1],
+            max_buffers=None,
+        ),
+        PlanCase(
+            "scan_sale_ids",
+            sql.SCAN_SALE_IDS_STATEMENT,
+            lambda a: {"limit": 10000},
+            max_buffers=5000,
+        ),
+        PlanCase(
+            "scan_sale_ids_after",
+            sql.SCAN_SALE_IDS_AFTER_STATEMENT,
+            lambda a: {"id": a["id"], "limit": 10000},
+            max_buffers=5000,
+        ),
+        PlanCase(
+            "scan_archived_sale_ids",
+            sql.SCAN_ARCHIVED_SALE_IDS_STATEMENT,
+            lambda a: {"limit": 10000},
+            max_buffers=5000,
+        ),
+        PlanCase(
+            "scan_archived_sale_ids_after",
+            sql.SCAN_ARCHIVED_SALE_IDS_AFTER_STATEMENT,
+            lambda a: {"id": a["id"], "limit": 10000},
+            max_buffers=5000,
+        ),
+        # Exact counts read every matching row, unfiltered ones all rows.
+        PlanCase(
+            "count_sales",
+            sql.COUNT_SALES_STATEMENT,
+            lambda a: {},
+            max_buffers=None,
+            index=False,
+            seq_scan=True,
+        ),
+        PlanCase(
+            "count_sales_sku",
+            sql.COUNT_SALES_STATEMENT
+            + sql.generate_filter_clause({"sku": ""})[0],
+            lambda a: {"sku": a["sku"]},
+            max_buffers=None,
+        ),
+        PlanCase(
+            "search_sales",
+            sql.generate_search_statement(sql.SEARCH_FIELDS, False),
+            _search_params,
+        ),
+        PlanCase(
+            "search_sales_paginated",
+            sql.generate_search_statement(sql.SEARCH_FIELDS, True),
+            lambda a: _search_params(a, score=1, id=a["id"]),
+        ),
+        PlanCase(
+            "insert_sale",
+            sql.INSERT_SALE_STATEMENT,
+            _sale_values,
+            index=False,
+        ),
+        PlanCase(
+            "insert_sale_returning",
+            sql.INSERT_SALE_RETURNING_STATEMENT,
+            _sale_values,
+            index=False,
+        ),
+        PlanCase(
+            "insert_sales",
+            sql.generate_insert_sales_statement(1),
+            _sale_values,
+            index=False,
+        ),
+        # The anchor's key conflicts, so the upsert takes its update path.
+        PlanCase(
+            "upsert_sales",
+            sql.generate_upsert_sales_statement(1, repo.NATURAL_KEY),
+            lambda a: _sale_values(a, a["order_id"]),
+            index=False,
+        ),
+        PlanCase(
+            "update_sale",
+            sql.generate_update_sale_statement(["sku"]),
+            lambda a: (a["sku"], a["id"]),
+        ),
+        PlanCase(
+            "update_sale_fields",
+            sql.generate_update_sale_statement(["quantity", "updated_at"]),
+            lambda a: (1, a["updated_at"], a["id"]),
+        ),
+        PlanCase(
+            "update_sale_versioned",
+            sql.generate_update_sale_statement(["sku"], versioned=True),
+            lambda a: (a["sku"], a["id"], a["updated_at"]),
+        ),
+        PlanCase(
+            "select_archivable_sales",
+            sql.SELECT_ARCHIVABLE_SALES_STATEMENT,
+            lambda a: {"cutoff": a["date_time"], "limit": 1000},
+            max_buffers=5000,
+        ),
+        PlanCase(
+            "insert_archived_batch",
+            sql.INSERT_ARCHIVED_BATCH_STATEMENT,
+            lambda a: {
+                "month": a["date_time"].date().replace(day=1),
+                "first_date_time": a["date_time"],
+                "last_date_time": a["date_time"],
+                "first_created_at": a["created_at"],
+                "last_created_at": a["created_at"],
+                "row_count": 1,
+                "skus": [a["sku"]],
+                "order_ids": [a["order_id"]],
+                "data": archive.encode_batch([]),
+            },
+            index=False,
+        ),
+        PlanCase(
+            "select_archived_batch_by_sale_id",
+            sql.SELECT_ARCHIVED_BATCH_BY_SALE_ID_STATEMENT,
+            lambda a: (a["id"],),
+        ),
+        # Seeded databases have no archive, so batches are not indexed.
+        PlanCase(
+            "select_archived_batch",
+            sql.SELECT_ARCHIVED_BATCH_STATEMENT,
+            lambda a: (1,),
+            index=False,
+        ),
+        # Batch bounds are small, one row per batch, and read in full.
+        PlanCase(
+            "select_archived_batches_before",
+            sql.SELECT_ARCHIVED_BATCHES_BEFORE_STATEMENT,
+            lambda a: {
+                "created_at": a["created_at"],
+                "max_batches": sql.MAX_ARCHIVED_BATCHES,
+            },
+            index=False,
+        ),
+        PlanCase(
+            "select_archived_batches_after",
+            sql.SELECT_ARCHIVED_BATCHES_AFTER_STATEMENT,
+            lambda a: {
+                "created_at": a["created_at"],
+                "max_batches": sql.MAX_ARCHIVED_BATCHES,
+            },
+            index=False,
+        ),
+        PlanCase(
+            "select_archived_batches_by_sku",
+            sql.generate_select_archived_batches_statement(
+                {"sku": None, "date_time": (None, None)}
+            )[0],
+            lambda a: {
+                "created_at": a["created_at"],
+                "sku": a["sku"],
+                "max_batches": sql.MAX_ARCHIVED_BATCHES,
+            },
+            index=False,
+        ),
+        PlanCase(
+            "select_archive_horizon",
+            sql.SELECT_ARCHIVE_HORIZON_STATEMENT,
+            lambda a: {},
+            index=False,
+        ),
+        PlanCase(
+            "delete_sale_by_id",
+            sql.DELETE_SALE_BY_ID_STATEMENT,
+            lambda a: (a["id"],),
+        ),
+        PlanCase(
+            "delete_sales_by_ids",
+            sql.DELETE_SALES_BY_IDS_STATEMENT,
+            lambda a: ([a["id"]],),
+        ),
+    ]
+
+
+CASES = _cases()
+
+
+def check_plans(
+    conn,
+    snapshots: Optional[Dict[str, Any]] = None,
+    cases: List[PlanCase] = CASES,
+    strict: bool = False,
+) -> List[PlanCheck]:
+    """
+    Explain and run statements against seeded sales, anchored on a sale
+    from the middle of the feed, checking plan properties and comparing
+    plans with snapshots. Tables are vacuumed first. Strict checks fail
+    statements without a snapshot. Each statement runs behind a
+    savepoint, and the transaction is rolled back, leaving no changes
+    behind.
+    """
+    snapshots = snapshots or {}
+    results = []
+    cur = conn.cursor()
+    try:
+        autocommit = conn.autocommit
+        conn.autocommit = True
+        try:
+            for stmt in VACUUM_STATEMENTS:
+                cur.execute(stmt)
+        finally:
+            conn.autocommit = autocommit
+        cur.execute(sql.COUNT_SALES_STATEMENT)
+        (count,) = cur.fetchone()
+        if not count:
+            raise ValueError("No sales to explain, seed the database.")
+        cur.execute(SELECT_ANCHOR_STATEMENT, {"offset": count // 2})
+        columns = [c[0] for c in cur.description]
+        anchor = dict(zip(columns, cur.fetchone()))
+        for case in cases:
+            cur.execute("SAVEPOINT explain_check")
+            cur.execute(
+                "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + case.statement,
+                case.params(anchor),
+            )
+            plan = plans.load_plan(cur.fetchone()[0])
+            cur.execute("ROLLBACK TO SAVEPOINT explain_check")
+            results.append(
+                _check(case, plan, snapshots.get(case.name), strict)
+            )
+    finally:
+        conn.rollback()
+        cur.close()
+    return results
+
+
+def _check(case, plan, snapshot, strict=False):
+    indexes = plans.indexes_used(plan)
+    seq_scan = plans.seq_scanned(plan)
+    buffers = plans.shared_buffers(plan)
+    signature = plans.signature(plan)
+    failures = []
+    if seq_scan and not case.seq_scan:
+        failures.append('sequential scan of "sale"')
+    if case.index and not indexes:
+        failures.append("no index used")
+    if case.max_buffers is not None and buffers > case.max_buffers:
+        failures.append(f"{buffers} buffers over {case.max_buffers}")
+    if snapshot is not None:
+        if signature != snapshot["signature"]:
+            added = sorted(set(signature) - set(snapshot["signature"]))
+            removed = sorted(set(snapshot["signature"]) - set(signature))
+            failures.append(
+                f"plan changed, added {added or '[]'}, "
+                f"removed {removed or '[]'}"
+            )
+        ceiling = snapshot["buffers"] * BUFFER_TOLERANCE + BUFFER_SLACK
+        if buffers > ceiling:
+            failures.append(
+                f"{buffers} buffers, snapshot had {snapshot['buffers']}"
+            )
+    elif strict:
+        failures.append("no snapshot")
+    return PlanCheck(
+        name=case.name,
+        signature=signature,
+        indexes=indexes,
+        seq_scan=seq_scan,
+        buffers=buffers,
+        execution_time=plan["Execution Time"],
+        failures=failures,
+    )
+
+
+def load_snapshots(path: str = SNAPSHOT_PATH) -> Dict[str, Any]:
+    """Load plan snapshots, none when no snapshot file exists."""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+
+def save_snapshots(
+    results: List[PlanCheck], path: str = SNAPSHOT_PATH
+) -> None:
+    """Save plans of checked statements as snapshots."""
+    with open(path, "w") as file:
+        json.dump(
+            {r.name: r.snapshot() for r in results},
+            file,
+            indent=2,
+            sort_keys=True,
+        )
+        file.write("\n")
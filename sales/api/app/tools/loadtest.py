@@ -0,0 +1,426 @@
+"""HTTP load-testing harness."""
+import collections
+import json
+import math
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional, Tuple
+
+DEFAULT_MIX = {"read": 70, "list": 20, "write": 10}
+
+PERCENTILES = (50, 90, 99, 99.9, 99.99)
+
+
+class Histogram:
+    """
+    Latency histogram in the style of HdrHistogram. Values are counted
+    in buckets whose width grows with the value, so every value is kept
+    within a relative error set by significant digits, in memory that
+    only grows with the logarithm of the range.
+    """
+
+    def __init__(self, significant_digits: int = 2):
+        if not 1 <= significant_digits <= 5:
+            raise ValueError(
+                '"significant_digits" argument must be between 1 and 5.'
+            )
+        self._sub_bits = math.ceil(math.log2(2 * 10**significant_digits))
+        self._half = 1 << (self._sub_bits - 1)
+        self._counts = collections.Counter()
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value: int) -> None:
+        """Count non-negative integer value."""
+        value = max(int(value), 0)
+        self._counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other: "Histogram") -> None:
+        """Add counts of histogram with the same significant digits."""
+        if other._sub_bits != self._sub_bits:
+            raise ValueError("Histograms differ in precision.")
+        self._counts.update(other._counts)
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, percentile: float) -> Optional[int]:
+        """
+        Highest value equivalent to the value at percentile, or None
+        without values.
+        """
+        if not self.count:
+            return None
+        rank = max(math.ceil(percentile / 100 * self.count), 1)
+        seen = 0
+        for index in sorted(self._counts):
+            seen += self._counts[index]
+            if seen >= rank:
+                return min(self._highest(index), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+    def _index(self, value):
+        base = 1 << self._sub_bits
+        if value < base:
+            return value
+        shift = value.bit_length() - self._sub_bits
+        return base + (shift - 1) * self._half + (value >> shift) - self._half
+
+    def _highest(self, index):
+        base = 1 << self._sub_bits
+        if index < base:
+            return index
+        shift, offset = divmod(index - base, self._half)
+        shift += 1
+        return ((offset + self._half + 1) << shift) - 1
+
+
+class FlaskTarget:
+    """Application called in-process through its test client."""
+
+    def __init__(self, app):
+        self._app = app
+        self._local = threading.local()
+
+    def request(
+        self, method: str, path: str, body: Optional[Dict] = None
+    ) -> Tuple[int, Any]:
+        """Send request, returning status and JSON body, if any."""
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self._app.test_client()
+        response = client.open(path, method=method, json=body)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HttpTarget:
+    """Running server called over HTTP."""
+
+    def __init__(self, url: str, timeout: float = 10):
+        self._url = url.rstrip("/")
+        self._timeout = timeout
+
+    def request(
+        self, method: str, path: str, body: Optional[Dict] = None
+    ) -> Tuple[int, Any]:
+        """Send request, returning status and JSON body, if any."""
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(
+            self._url + path,
+            data=data,
+            method=method,
+            headers={"Content-Type": "application/json"} if data else {},
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=self._timeout) as res:
+                status, payload = res.status, res.read()
+        except urllib.error.HTTPError as error:
+            status, payload = error.code, error.read()
+        try:
+            return status, json.loads(payload) if payload else None
+        except ValueError:
+            return status, None
+
+
+class Result:
+    """Latencies and outcomes of requests of a kind."""
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.errors = 0
+        self.statuses = collections.Counter()
+
+    def merge(self, other: "Result") -> None:
+        self.latency.merge(other.latency)
+        self.errors += other.errors
+        self.statuses.update(other.statuses)
+
+
+class Report:
+    """Outcome of a load test."""
+
+    def __init__(
+        self,
+        results: Dict[str, Result],
+        elapsed: float,
+        open_loop: bool,
+        max_lag: float,
+    ):
+        self.results = results
+        self.elapsed = elapsed
+        self.open_loop = open_loop
+        self.max_lag = max_lag
+
+    @property
+    def total(self) -> Result:
+        total = Result()
+        for result in self.results.values():
+            total.merge(result)
+        return total
+
+    def to_json_dict(self) -> Dict[str, Any]:
+        """Convert to JSON serializable dict, latencies in milliseconds."""
+        rows = {**self.results, "total": self.total}
+        return {
+            "elapsed_s": round(self.elapsed, 3),
+            "open_loop": self.open_loop,
+            "max_lag_ms": round(self.max_lag * 1000, 3),
+            "requests": {
+                kind: _result_summary(result, self.elapsed)
+                for kind, result in rows.items()
+            },
+        }
+
+    def to_table(self) -> str:
+        """Format as text table, latencies in milliseconds."""
+        columns = [f"p{p:g}" for p in PERCENTILES]
+        lines = [
+            f"{'kind':<8} {'requests':>9} {'rps':>9} {'errors':>8} "
+            f"{'mean':>9} "
+            + " ".join(f"{c:>9}" for c in columns)
+            + f" {'max':>9}"
+        ]
+        for kind, s in self.to_json_dict()["requests"].items():
+            latency = s["latency_ms"]
+            lines.append(
+                f"{kind:<8} {s['requests']:>9} {s['rps']:>9.1f} "
+                f"{s['error_rate']:>8.2%} {_ms(latency['mean']):>9} "
+                + " ".join(f"{_ms(latency[c]):>9}" for c in columns)
+                + f" {_ms(latency['max']):>9}"
+            )
+        return "\n".join(lines)
+
+
+def _result_summary(result, elapsed):
+    latency = result.latency
+    count = latency.count
+    return {
+        "requests": count,
+        "rps": count / elapsed if elapsed else 0.0,
+        "errors": result.errors,
+        "error_rate": result.errors / count if count else 0.0,
+        "statuses": {
+            str(s): n
+            for s, n in sorted(
+                result.statuses.items(), key=lambda i: str(i[0])
+            )
+        },
+        "latency_ms": {
+            "mean": _us_to_ms(latency.mean),
+            **{
+                f"p{p:g}": _us_to_ms(latency.percentile(p))
+                for p in PERCENTILES
+            },
+            "max": _us_to_ms(latency.max),
+        },
+    }
+
+
+def _us_to_ms(value):
+    return None if value is None else round(value / 1000, 3)
+
+
+def _ms(value):
+    return "-" if value is None else f"{value:.2f}"
+
+
+class LoadTest:
+    """
+    Drive sales routes with a mix of reads, listings and writes from
+    concurrent workers for a duration.
+
+    In open-loop mode requests are scheduled at the target rate, and
+    latency is measured from when each request was due, not from when
+    a worker got to send it. A stalled service then shows up as
+    latency of every request it held back, instead of as fewer
+    requests, which avoids coordinated omission. In closed-loop mode
+    each worker sends its next request once the previous one returned,
+    at most at the target rate if given.
+    """
+
+    def __init__(
+        self,
+        target,
+        mix: Dict[str, float] = DEFAULT_MIX,
+        concurrency: int = 8,
+        rate: Optional[float] = None,
+        duration: float = 10,
+        open_loop: bool = False,
+        seed: int = 0,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        if concurrency < 1:
+            raise ValueError('"concurrency" argument must be positive.')
+        if open_loop and not rate:
+            raise ValueError("Open-loop mode requires a target rate.")
+        if not mix or set(mix) - set(DEFAULT_MIX) or min(mix.values()) < 0:
+            raise ValueError(f'"mix" must weigh {", ".join(DEFAULT_MIX)}.')
+        self._target = target
+        self._kinds = list(mix)
+        self._weights = [mix[k] for k in self._kinds]
+        self._concurrency = concurrency
+        self._rate = rate
+        self._duration = duration
+        self._open_loop = open_loop
+        self._seed = seed
+        self._clock = clock
+        self._sleep = sleep
+        self._ids = []
+        self._lock = threading.Lock()
+        self._scheduled = 0
+
+    def prepare(self, count: int) -> None:
+        """Create sales for reads and listings to target."""
+        for i in range(count):
+            status, body = self._target.request(
+                "POST", "/sales:batch", _create_body(i)
+            )
+            created = _created_id(status, body)
+            if created is None:
+                raise RuntimeError(f"Failed to create sale: {status}.")
+            self._ids.append(created)
+
+    def run(self) -> Report:
+        """Run load test, returning its report."""
+        start = self._clock()
+        end = start + self._duration
+        results = [
+            collections.defaultdict(Result) for _ in range(self._concurrency)
+        ]
+        lags = [0.0] * self._concurrency
+        workers = [
+            threading.Thread(
+                target=self._work,
+                args=(n, start, end, results[n], lags),
+                daemon=True,
+            )
+            for n in range(self._concurrency)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        merged = {}
+        for worker_results in results:
+            for kind, result in worker_results.items():
+                merged.setdefault(kind, Result()).merge(result)
+        return Report(
+            results=merged,
+            elapsed=self._clock() - start,
+            open_loop=self._open_loop,
+            max_lag=max(lags),
+        )
+
+    def _work(self, n, start, end, results, lags):
+        rng = random.Random(f"{self._seed}:{n}")
+        while True:
+            due = self._next_due(start)
+            now = self._clock()
+            if due is None:
+                due = now
+            elif due > now:
+                self._sleep(due - now)
+                now = self._clock()
+            # Requests falling due are sent even when running late, so
+            # that the ones held back are not omitted from the results.
+            if due >= end:
+                return
+            lags[n] = max(lags[n], now - due)
+            kind = rng.choices(self._kinds, self._weights)[0]
+            sent = due if self._open_loop else now
+            try:
+                ok, status = self._send(kind, rng)
+            except Exception:
+                ok, status = False, "exception"
+            result = results[kind]
+            result.latency.record((self._clock() - sent) * 1_000_000)
+            result.statuses[status] += 1
+            if not ok:
+                result.errors += 1
+
+    def _next_due(self, start):
+        """Time next request is due at the target rate, None unpaced."""
+        if not self._rate:
+            return None
+        with self._lock:
+            index = self._scheduled
+            self._scheduled += 1
+        return start + index / self._rate
+
+    def _send(self, kind, rng):
+        with self._lock:
+            ids = list(self._ids[-1000:])
+        if kind == "write" or not ids:
+            status, body = self._target.request(
+                "POST", "/sales:batch", _create_body(rng.randrange(1 << 30))
+            )
+            created = _created_id(status, body)
+            if created is not None:
+                with self._lock:
+                    self._ids.append(created)
+            return created is not None, status
+        id = rng.choice(ids)
+        if kind == "read":
+            status, _ = self._target.request("GET", f"/sales/{id}")
+        else:
+            status, _ = self._target.request("GET", f"/sales?id={id}&limit=10")
+        return status < 400, status
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """Parse request mix such as "read=70,list=20,write=10"."""
+    mix = {}
+    try:
+        for part in value.split(","):
+            kind, weight = part.split("=")
+            mix[kind.strip()] = float(weight)
+    except ValueError:
+        raise ValueError(f'Malformed mix "{value}".')
+    return mix
+
+
+def _create_body(n):
+    return {
+        "operations": [
+            {
+                "op": "create",
+                "sale": {
+                    "date_time": datetime.utcnow().isoformat(),
+                    "order_id": f"LOAD-{n:010d}",
+                    "sku": f"SKU-{n % 50000:06d}",
+                    "quantity": 1,
+                    "subtotal": 1999,
+                    "fee": 58,
+                    "tax": 160,
+                },
+            }
+        ]
+    }
+
+
+def _created_id(status, body):
+    try:
+        (result,) = body["results"]
+        if status == 200 and result["status"] == 201:
+            return result["sale"]["id"]
+    except (KeyError, TypeError, ValueError):
+        pass
+    return None
@@ -0,0 +1,80 @@
+"""Query plan helpers."""
+import json
+import re
+
+_PARTITION = re.compile(r"^sale_(y\d{4}m\d{2}|default)(?=_|$)")
+
+
+def load_plan(value):
+    """Load plan from "EXPLAIN (FORMAT JSON)" output."""
+    if isinstance(value, str):
+        value = json.loads(value)
+    return value[0]
+
+
+def iter_nodes(node):
+    """Iterate over plan node and all of its descendants."""
+    yield node
+    for child in node.get("Plans", []):
+        yield from iter_nodes(child)
+
+
+def seq_scanned(plan, relation="sale"):
+    """Check whether plan sequentially scans relation or its partitions."""
+    return any(
+        n["Node Type"] == "Seq Scan"
+        and (
+            n.get("Relation Name") == relation
+            or n.get("Relation Name", "").startswith(relation + "_")
+        )
+        for n in iter_nodes(plan["Plan"])
+    )
+
+
+def index_only_scanned(plan, relation="sale"):
+    """
+    Check whether plan reads relation or its partitions only through
+    index-only scans.
+    """
+    scans = [
+        n
+        for n in iter_nodes(plan["Plan"])
+        if n.get("Relation Name") == relation
+        or n.get("Relation Name", "").startswith(relation + "_")
+    ]
+    return bool(scans) and all(
+        n["Node Type"] == "Index Only Scan" for n in scans
+    )
+
+
+def indexes_used(plan):
+    """Names of indexes used by plan."""
+    return sorted(
+        {
+            n["Index Name"]
+            for n in iter_nodes(plan["Plan"])
+            if "Index Name" in n
+        }
+    )
+
+
+def shared_buffers(plan):
+    """Shared buffers hit or read by plan, from "EXPLAIN (BUFFERS)"."""
+    node = plan["Plan"]
+    return node.get("Shared Hit Blocks", 0) + node.get("Shared Read Blocks", 0)
+
+
+def signature(plan):
+    """
+    Scan and join strategy of plan as sorted node descriptions, with
+    partitions of "sale" collapsed, so plans over different months of
+    data compare equal.
+    """
+    nodes = set()
+    for n in iter_nodes(plan["Plan"]):
+        parts = [n["Node Type"]]
+        for key in ("Relation Name", "Index Name"):
+            if key in n:
+                parts.append(_PARTITION.sub("sale_*", n[key]))
+        nodes.add(" ".join(parts))
+    return sorted(nodes)
@@ -0,0 +1,197 @@
+"""Synthetic sales data generator."""
+import bisect
+import io
+import itertools
+import random
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Tuple
+
+from app.main.repository.postgres import sale_sql as sql
+
+COPY_SALES_STATEMENT = f'COPY "sale" ({sql.FIELDS}) FROM STDIN'
+
+CHUNK_ROWS = 100_000
+
+SKU_COUNT = 50_000
+
+# Zipf exponent of sku popularity, a few skus sell most of the units.
+SKU_SKEW = 1.1
+
+# Chance that an order is placed in the same second as the previous one.
+BURST_CONTINUE = 0.75
+
+# Mean number of lines of an order above one.
+EXTRA_LINES_MEAN = 0.8
+
+TAX_RATES = (0.0, 0.05, 0.0625, 0.0725, 0.0825, 0.1)
+
+CARD_FEE_RATE = 0.029
+
+UPDATED_RATE = 0.05
+
+
+def generate_sales(
+    rows: int,
+    seed: int = 0,
+    start: datetime = datetime(2021, 1, 1),
+    days: int = 365,
+    chunk_rows: int = CHUNK_ROWS,
+) -> Iterator[Tuple]:
+    """
+    Generate rows of sales, in "sale_sql.FIELDS" order, created over
+    days from start. Rows are generated in chunks that only depend on
+    seed and their index, so chunks can be generated in any order, or in
+    parallel, with the same result.
+    """
+    for index in range(chunk_count(rows, chunk_rows)):
+        yield from generate_chunk(index, rows, seed, start, days, chunk_rows)
+
+
+def chunk_count(rows: int, chunk_rows: int = CHUNK_ROWS) -> int:
+    """Number of chunks of rows."""
+    return -(-rows // chunk_rows)
+
+
+def generate_chunk(
+    index: int,
+    rows: int,
+    seed: int = 0,
+    start: datetime = datetime(2021, 1, 1),
+    days: int = 365,
+    chunk_rows: int = CHUNK_ROWS,
+) -> Iterator[Tuple]:
+    """
+    Generate rows of chunk with index. Each chunk covers its share of
+    the days, and its orders arrive in bursts of orders placed in the
+    same second. Orders have one or more lines, sharing order id, times
+    and tax rate, with distinct skus drawn by popularity.
+    """
+    cumulative, prices = _catalog(seed)
+    total = cumulative[-1]
+    rng = random.Random(f"{seed}:{index}")
+    first = index * chunk_rows
+    count = min(chunk_rows, rows - first)
+    seconds = days * 86400
+    window_start = first * seconds // rows
+    window = max(count * seconds // rows, 1)
+    produced = 0
+    created_at = None
+    while produced < count:
+        if created_at is None or rng.random() >= BURST_CONTINUE:
+            created_at = start + timedelta(
+                seconds=window_start + rng.randrange(window)
+            )
+        date_time = created_at - timedelta(
+            seconds=int(rng.expovariate(1 / 3600))
+        )
+        order_id = f"ORD-{rng.getrandbits(48):012X}"
+        tax_rate = rng.choice(TAX_RATES)
+        lines = min(
+            1 + int(rng.expovariate(1 / EXTRA_LINES_MEAN)), count - produced
+        )
+        skus = set()
+        for _ in range(lines):
+            # Lines of an order have distinct skus, which with the order
+            # id and date and time make up the natural key of sales.
+            sku = bisect.bisect(cumulative, rng.random() * total)
+            while sku in skus:
+                sku = bisect.bisect(cumulative, rng.random() * total)
+            skus.add(sku)
+            quantity = 1 if rng.random() < 0.7 else rng.randint(2, 6)
+            subtotal = quantity * prices[sku]
+            updated_at = created_at
+            if rng.random() < UPDATED_RATE:
+                updated_at += timedelta(
+                    seconds=int(rng.expovariate(1 / 86400))
+                )
+            yield (
+                f"{rng.getrandbits(128):032x}",
+                date_time,
+                order_id,
+                f"SKU-{sku:06d}",
+                quantity,
+                subtotal,
+                round(subtotal * CARD_FEE_RATE),
+                round(subtotal * tax_rate),
+                created_at,
+                updated_at,
+            )
+        produced += lines
+
+
+_catalogs = {}
+
+
+def _catalog(seed):
+    """
+    Cumulative popularity and unit price in cents of skus. Prices are
+    log-normal, ending in 99 cents.
+    """
+    if seed not in _catalogs:
+        rng = random.Random(f"{seed}:catalog")
+        cumulative = list(
+            itertools.accumulate(
+                1 / (rank**SKU_SKEW) for rank in range(1, SKU_COUNT + 1)
+            )
+        )
+        prices = [
+            int(rng.lognormvariate(7.5, 1.0)) // 100 * 100 + 99
+            for _ in range(SKU_COUNT)
+        ]
+        _catalogs[seed] = (cumulative, prices)
+    return _catalogs[seed]
+
+
+def copy_chunk(conn, index: int, rows: int, **options) -> int:
+    """Load chunk with index through COPY, returning rows loaded."""
+    buffer = io.StringIO()
+    count = 0
+    for row in generate_chunk(index, rows, **options):
+        buffer.write("\t".join(map(str, row)) + "\n")
+        count += 1
+    buffer.seek(0)
+    cur = conn.cursor()
+    try:
+        cur.copy_expert(COPY_SALES_STATEMENT, buffer)
+        conn.commit()
+    finally:
+        cur.close()
+    return count
+
+
+def seed_sales(
+    config: Dict[str, Any], rows: int, workers: int = 4, **options
+) -> int:
+    """
+    Load rows of generated sales with parallel workers, each on its own
+    connection, committing chunk by chunk. Returns rows loaded.
+    """
+    chunk_rows = options.get("chunk_rows", CHUNK_ROWS)
+    chunks = list(range(chunk_count(rows, chunk_rows)))
+    if not chunks:
+        return 0
+    workers = max(min(workers, len(chunks)), 1)
+    db_config = {
+        k: v
+        for k, v in config.items()
+        if k.startswith("DB_") or k == "TESTING"
+    }
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                _copy_chunks, db_config, chunks[w::workers], rows, options
+            )
+            for w in range(workers)
+        ]
+        return sum(f.result() for f in futures)
+
+
+def _copy_chunks(config, indexes: List[int], rows, options):
+    from app.main import database
+
+    conn = database.get_connection(config)
+    try:
+        return sum(copy_chunk(conn, i, rows, **options) for i in indexes)
+    finally:
+        conn.close()
@@ -0,0 +1,80 @@
+"""Startup profiling."""
+import json
+import os
+import subprocess
+import sys
+from typing import List, Tuple
+
+BUDGET_SECONDS = 1.0
+
+HEAVY_MODULES = ("psycopg2", "pytest")
+
+PROBE = (
+    "import json, sys, time\n"
+    "start = time.perf_counter()\n"
+    "from app.main import create_app\n"
+    "create_app()\n"
+    "print(json.dumps({'total': time.perf_counter() - start, "
+    "'modules': sorted(sys.modules)}))\n"
+)
+
+
+class StartupProfile:
+    """Result of profiling a cold start of the application."""
+
+    def __init__(
+        self,
+        total: float,
+        imports: List[Tuple[str, int, int]],
+        modules: List[str],
+    ):
+        self.total = total
+        self.imports = imports
+        self.modules = modules
+
+    def heavy_modules(self) -> List[str]:
+        """Heavy modules loaded during startup."""
+        return [m for m in HEAVY_MODULES if m in self.modules]
+
+    def slowest(self, count: int = 20) -> List[Tuple[str, int, int]]:
+        """Top level imports ordered by cumulative import time."""
+        return sorted(self.imports, key=lambda i: i[2], reverse=True)[:count]
+
+
+def profile_startup() -> StartupProfile:
+    """
+    Start the application in a fresh interpreter and record import
+    time per module and total time until the app factory returns.
+    Development configuration is used unless APP_CONFIG is set.
+    """
+    env = dict(os.environ)
+    env.setdefault("APP_CONFIG", "app.main.config.DevelopmentConfig")
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE],
+        capture_output=True,
+        text=True,
+        check=True,
+        env=env,
+    )
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    return StartupProfile(
+        total=result["total"],
+        imports=parse_import_times(process.stderr),
+        modules=result["modules"],
+    )
+
+
+def parse_import_times(output: str) -> List[Tuple[str, int, int]]:
+    """
+    Parse "-X importtime" output into (module, self, cumulative) tuples,
+    with times in microseconds.
+    """
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line.split(":", 1)[1].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        imports.append((fields[2].strip(), int(fields[0]), int(fields[1])))
+    return imports
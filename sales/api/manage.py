@@ -1,9 +1,9 @@
 """Flask CLI commands."""
 import sys
 
-import pytest
 import click
-from flask.cli import FlaskGroup
+from flask import current_app
+from flask.cli import FlaskGroup, with_appcontext
 
 from app.main import create_app
 
@@ -14,6 +14,8 @@ cli = FlaskGroup(create_app=create_app)
 @click.option("--verbose", "-v", is_flag=True)
 @click.option("--base")
 def run_tests(verbose, base):
+    import pytest
+
     directory = f"app/test/{base}" if base is not None else "app/test"
     options = ["-x", directory]
     if verbose:
@@ -24,5 +26,280 @@ def run_tests(verbose, base):
     sys.exit(result.value)
 
 
+@cli.command("startup-profile")
+@click.option("--count", "-n", default=20, show_default=True)
+@click.option("--budget", default=None, type=float)
+def startup_profile(count, budget):
+    from app.tools import startup
+
+    profile = startup.profile_startup()
+    click.echo(f"{'module':<50} {'self [us]':>10} {'cumul [us]':>12}")
+    for module, self_time, cumulative in profile.slowest(count):
+        click.echo(f"{module:<50} {self_time:>10} {cumulative:>12}")
+    click.echo(f"\ntotal until app factory returned: {profile.total:.3f}s")
+    heavy = profile.heavy_modules()
+    if heavy:
+        click.echo(f"heavy modules loaded: {', '.join(heavy)}")
+    budget = budget if budget is not None else startup.BUDGET_SECONDS
+    if heavy or profile.total > budget:
+        sys.exit(1)
+
+
+@cli.command("init-db")
+@with_appcontext
+def init_db():
+    from app.main import database
+    from app.main.repository.postgres import sale_ddl
+
+    conn = database.get_connection(current_app.config)
+    try:
+        with conn.cursor() as cur:
+            for stmt in sale_ddl.SCHEMA_STATEMENTS:
+                cur.execute(stmt)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+@cli.command("maintain-partitions")
+@with_appcontext
+def maintain_partitions():
+    from datetime import date
+
+    from app.main import database
+    from app.main.repository.postgres import partitions
+
+    conn = database.get_connection(current_app.config)
+    try:
+        created, dropped = partitions.maintain_partitions(
+            conn,
+            today=date.today(),
+            ahead=current_app.config["PARTITION_MONTHS_AHEAD"],
+            retention=current_app.config["PARTITION_RETENTION_MONTHS"],
+        )
+    finally:
+        conn.close()
+    for name in created:
+        click.echo(f"created {name}")
+    for name in dropped:
+        click.echo(f"dropped {name}")
+
+
+@cli.command("archive")
+@click.option(
+    "--older-than",
+    "days",
+    default=None,
+    type=int,
+    help="Age in days of sales to archive.  [default: ARCHIVE_AFTER_DAYS]",
+)
+@click.option("--batch-size", default=None, type=int)
+@with_appcontext
+def archive(days, batch_size):
+    from datetime import datetime, timedelta
+
+    from app.main import database
+    from app.main.repository.postgres import archive as archiving
+
+    config = current_app.config
+    days = days if days is not None else config["ARCHIVE_AFTER_DAYS"]
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    conn = database.get_connection(config)
+    try:
+        archived = archiving.archive_sales(
+            conn, cutoff, batch_size or config["ARCHIVE_BATCH_SIZE"]
+        )
+    finally:
+        conn.close()
+    click.echo(f"archived {archived} sales before {cutoff:%Y-%m-%d}")
+
+
+@cli.command("rebalance-shards")
+@click.option("--batch-size", default=1000, show_default=True)
+@with_appcontext
+def rebalance_shards(batch_size):
+    from app.main import provider
+    from app.main.repository.sharded import sale_repository as sharded
+
+    shards = provider.create_shard_repositories(current_app.config)
+    try:
+        moved = sharded.rebalance(shards, batch_size)
+    finally:
+        for shard in shards.values():
+            shard.close()
+    click.echo(f"moved {moved} sales")
+
+
+@cli.command("seed")
+@click.option("--rows", default=1_000_000, show_default=True)
+@click.option("--workers", default=4, show_default=True)
+@click.option("--seed", "seed_value", default=0, show_default=True)
+@click.option(
+    "--start",
+    default="2021-01-01",
+    show_default=True,
+    type=click.DateTime(["%Y-%m-%d"]),
+)
+@click.option("--days", default=365, show_default=True)
+@with_appcontext
+def seed(rows, workers, seed_value, start, days):
+    import time
+
+    from app.tools import seed as seeding
+
+    began = time.perf_counter()
+    loaded = seeding.seed_sales(
+        current_app.config,
+        rows,
+        workers,
+        seed=seed_value,
+        start=start,
+        days=days,
+    )
+    elapsed = time.perf_counter() - began
+    click.echo(
+        f"loaded {loaded} sales in {elapsed:.1f}s "
+        f"({loaded / elapsed * 60:,.0f} rows/min)"
+    )
+
+
+@cli.command("loadtest")
+@click.option("--url", default=None, help="Server to test, else in-process.")
+@click.option("--concurrency", "-c", default=8, show_default=True)
+@click.option("--rate", default=None, type=float, help="Requests/s.")
+@click.option("--duration", "-d", default=10.0, show_default=True)
+@click.option("--mix", default="read=70,list=20,write=10", show_default=True)
+@click.option("--open-loop", is_flag=True)
+@click.option("--prepare", default=100, show_default=True)
+@click.option("--seed", default=0, show_default=True)
+@click.option(
+    "--json", "json_path", default=None, help="Report file, - for stdout."
+)
+@with_appcontext
+def loadtest(
+    url, concurrency, rate, duration, mix, open_loop, prepare, seed, json_path
+):
+    import json
+
+    from app.tools import loadtest as lt
+
+    target = (
+        lt.HttpTarget(url)
+        if url
+        else lt.FlaskTarget(current_app._get_current_object())
+    )
+    try:
+        test = lt.LoadTest(
+            target,
+            mix=lt.parse_mix(mix),
+            concurrency=concurrency,
+            rate=rate,
+            duration=duration,
+            open_loop=open_loop,
+            seed=seed,
+        )
+    except ValueError as error:
+        raise click.BadParameter(str(error))
+    test.prepare(prepare)
+    report = test.run()
+    if json_path == "-":
+        click.echo(json.dumps(report.to_json_dict(), indent=2))
+        return
+    click.echo(report.to_table())
+    if json_path:
+        with open(json_path, "w") as file:
+            json.dump(report.to_json_dict(), file, indent=2)
+
+
+@cli.command("benchmark-search")
+@click.option("--rows", default=3_000_000, show_default=True)
+@with_appcontext
+def benchmark_search(rows):
+    from app.main import database
+    from app.tools import benchmark
+
+    conn = database.get_connection(current_app.config)
+    try:
+        results = benchmark.benchmark_search(conn, rows)
+    finally:
+        conn.close()
+    click.echo(f"{'query':<16} {'time [ms]':>10} {'seq scan':>9}  indexes")
+    for r in results:
+        click.echo(
+            f"{r.query:<16} {r.execution_time:>10.2f} "
+            f"{'yes' if r.seq_scan else 'no':>9}  {', '.join(r.indexes)}"
+        )
+    if any(r.seq_scan for r in results):
+        sys.exit(1)
+
+
+@cli.command("benchmark-projection")
+@click.option("--rows", default=1_000_000, show_default=True)
+@click.option("--batch-size", default=10000, show_default=True)
+@with_appcontext
+def benchmark_projection(rows, batch_size):
+    from app.main import database
+    from app.tools import benchmark
+
+    conn = database.get_connection(current_app.config)
+    try:
+        results = benchmark.benchmark_projection(
+            conn, rows, batch_size=batch_size
+        )
+    finally:
+        conn.close()
+    click.echo(
+        f"{'projection':<12} {'rows':>10} {'size [MiB]':>11} "
+        f"{'rows/s':>12} {'index only':>11}  columns"
+    )
+    for r in results:
+        click.echo(
+            f"{r.projection:<12} {r.rows:>10} {r.size / 2**20:>11.1f} "
+            f"{r.rows_per_second:>12.0f} "
+            f"{'yes' if r.index_only else 'no':>11}  {', '.join(r.columns)}"
+        )
+
+
+@cli.command("explain-check")
+@click.option("--update", is_flag=True, help="Rewrite plan snapshots.")
+@click.option("--snapshots", "snapshot_path", default=None)
+@click.option(
+    "--strict", is_flag=True, help="Fail statements without a snapshot."
+)
+@with_appcontext
+def explain_check(update, snapshot_path, strict):
+    from app.main import database
+    from app.tools import explain
+
+    path = snapshot_path or explain.SNAPSHOT_PATH
+    snapshots = {} if update else explain.load_snapshots(path)
+    conn = database.get_connection(current_app.config)
+    try:
+        results = explain.check_plans(
+            conn, snapshots, strict=strict and not update
+        )
+    except ValueError as error:
+        raise click.ClickException(str(error))
+    finally:
+        conn.close()
+    click.echo(
+        f"{'statement':<32} {'time [ms]':>10} {'buffers':>8}  "
+        "indexes / failures"
+    )
+    for r in results:
+        click.echo(
+            f"{r.name:<32} {r.execution_time:>10.2f} {r.buffers:>8}  "
+            + ("; ".join(r.failures) or ", ".join(r.indexes))
+        )
+    missing = [r.name for r in results if r.name not in snapshots]
+    if update:
+        explain.save_snapshots(results, path)
+        click.echo(f"\nsaved {len(results)} plan snapshots to {path}")
+    elif missing and not strict:
+        click.echo(f"\nno snapshots of: {', '.join(missing)}")
+    if any(r.failures for r in results):
+        sys.exit(1)
+
+
 if __name__ == "__main__":
     cli()